@@ -41,9 +41,30 @@ app.conf.beat_schedule = {
         "task": "goods.tasks.assign_product_managers",
         "schedule": crontab(hour=0, minute=45),  # Every day at 00:45
     },
-    "reindex-smart-daily": {
+    "sync-products-search-index": {
+        "task": "goods.tasks.sync_products_search_index",
+        "schedule": crontab(minute="*/10"),  # Every 10 minutes
+    },
+    "refresh-product-analogs-daily": {
+        "task": "goods.tasks.refresh_product_analogs",
+        "schedule": crontab(hour=1, minute=30),  # Every day at 01:30
+    },
+    "rebuild-product-analogs-weekly": {
+        "task": "goods.tasks.refresh_product_analogs",
+        "schedule": crontab(hour=4, minute=30, day_of_week=0),  # Every Sunday at 04:30
+        "kwargs": {"full": True},
+    },
+    "reindex-smart-weekly": {
         "task": "goods.tasks.reindex_products_smart",
-        "schedule": crontab(hour=4, minute=0),  # Every day at 04:00
+        "schedule": crontab(hour=4, minute=0, day_of_week=0),  # Every Sunday at 04:00
+    },
+    "refresh-sales-facts-daily": {
+        "task": "sales.tasks.refresh_sales_facts_task",
+        "schedule": crontab(hour=1, minute=0),  # Every day at 01:00
+    },
+    "repair-sales-rollups-daily": {
+        "task": "sales.tasks.repair_sales_rollups_task",
+        "schedule": crontab(hour=1, minute=15),  # Every day at 01:15
     },
     "import-histprice-daily": {
         "task": "stock.tasks.import_histprice_from_mysql",
@@ -53,6 +74,18 @@ app.conf.beat_schedule = {
             "from_date": "2025-01-01 00:00:00",
         },
     },
+    "auto-match-competitor-products-daily": {
+        "task": "stock.tasks.auto_match_competitor_products",
+        "schedule": crontab(hour=3, minute=0),  # Every day at 03:00
+    },
+    "refresh-customer-metrics-daily": {
+        "task": "sales.tasks.refresh_customer_metrics_snapshot_task",
+        "schedule": crontab(hour=5, minute=0),  # Every day at 05:00
+    },
+    "cleanup-export-artifacts-hourly": {
+        "task": "core.tasks.cleanup_expired_export_artifacts",
+        "schedule": crontab(minute=30),  # Every hour at :30
+    },
     #"check-every-day-to-delete-hard-delete": {
     #    "task": "plane.bgtasks.deletion_task.hard_delete",
     #    "schedule": crontab(hour=0, minute=0),  # UTC 00:00
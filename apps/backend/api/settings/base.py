@@ -35,6 +35,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     # 3rd party
     "corsheaders",
     "rest_framework",
@@ -161,6 +162,47 @@ WHITENOISE_AUTOREFRESH = True  # Автообновление в DEBUG режи
 ######################################################################
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+
+######################################################################
+# Export artifacts
+######################################################################
+# Хранилище готовых выгрузок и отчетов. По умолчанию - MEDIA_ROOT/exports.
+# Для MinIO/S3 укажите EXPORT_ARTIFACTS_STORAGE_BACKEND=storages.backends.s3.S3Storage
+# (django-storages[s3]), параметры подключения берутся из AWS_* переменных.
+if environ.get("EXPORT_ARTIFACTS_STORAGE_BACKEND"):
+    EXPORT_ARTIFACTS_STORAGE = {
+        "BACKEND": environ.get("EXPORT_ARTIFACTS_STORAGE_BACKEND"),
+        "OPTIONS": {
+            "bucket_name": environ.get("AWS_S3_BUCKET_NAME"),
+            "endpoint_url": environ.get("AWS_S3_ENDPOINT_URL"),
+            "access_key": environ.get("AWS_ACCESS_KEY_ID"),
+            "secret_key": environ.get("AWS_SECRET_ACCESS_KEY"),
+            "region_name": environ.get("AWS_REGION"),
+            "location": "exports",
+        },
+    }
+else:
+    EXPORT_ARTIFACTS_STORAGE = {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {
+            "location": MEDIA_ROOT / "exports",
+            "base_url": f"{MEDIA_URL}exports/",
+        },
+    }
+# Сколько часов хранится выгрузка до удаления задачей очистки
+EXPORT_ARTIFACT_TTL_HOURS = int(environ.get("EXPORT_ARTIFACT_TTL_HOURS", 72))
+# Кэш отчетов (core.report_cache): лимиты на количество и суммарный размер файлов
+REPORT_CACHE_MAX_ENTRIES = int(environ.get("REPORT_CACHE_MAX_ENTRIES", 200))
+REPORT_CACHE_MAX_BYTES = int(environ.get("REPORT_CACHE_MAX_MB", 2048)) * 1024 * 1024
+# Через сколько секунд после последнего (пере)запуска задачи строящийся отчет
+# считается зависшим и запускается заново; должно быть больше REPORT_SOFT_TIME_LIMIT
+REPORT_CACHE_RUNNING_TIMEOUT = int(environ.get("REPORT_CACHE_RUNNING_TIMEOUT", 3600))
+# Контрольные точки долгих отчетов (core.checkpoints): мягкий лимит времени
+# задач отчетов (меньше CELERY_TASK_TIME_LIMIT, чтобы успеть перезапуститься),
+# сколько раз задача продолжает работу после него и сколько часов хранятся точки
+REPORT_SOFT_TIME_LIMIT = int(environ.get("REPORT_SOFT_TIME_LIMIT", 28 * 60))
+REPORT_MAX_RESUMES = int(environ.get("REPORT_MAX_RESUMES", 3))
+REPORT_CHECKPOINT_TTL_HOURS = int(environ.get("REPORT_CHECKPOINT_TTL_HOURS", 24))
 ######################################################################
 # Rest Framework
 ######################################################################
@@ -375,10 +417,30 @@ else:
         }
     }
 
+# Время жизни кэша пакетного сравнения цен, секунд
+PRICE_COMPARISON_CACHE_TTL = int(environ.get("PRICE_COMPARISON_CACHE_TTL", 120))
+
+# Адрес загрузки даташитов и чертежей товаров (goods.file_downloads)
+ZIP2002_DOWNLOAD_URL = environ.get("ZIP2002_DOWNLOAD_URL", "https://www.zip-2002.ru/zip-download.php/")
+
 
 ######################################################################
 # MeiliSearch
 ######################################################################
 MEILISEARCH_HOST = environ.get("MEILISEARCH_HOST", "http://meilisearch:7700")
 MEILISEARCH_API_KEY = environ.get("MEILISEARCH_API_KEY", "meilisearch")
-#MEILISEARCH_INDEX_NAME = environ.get("MEILISEARCH_INDEX_NAME", "products")
\ No newline at end of file
+# Таймаут поискового запроса API, секунд: дольше - поиск уходит в PostgreSQL (goods.search)
+MEILISEARCH_SEARCH_TIMEOUT = int(environ.get("MEILISEARCH_SEARCH_TIMEOUT", 2))
+# Время жизни записей общего кэша поиска товаров (goods.search_cache), секунд
+SEARCH_CACHE_TTL = int(environ.get("SEARCH_CACHE_TTL", 60))
+#MEILISEARCH_INDEX_NAME = environ.get("MEILISEARCH_INDEX_NAME", "products")
+# Инкрементальная синхронизация индекса товаров (goods.search_sync): размер
+# пакета документов и ожидание обработки задачи MeiliSearch, мс
+MEILISEARCH_SYNC_BATCH_SIZE = int(environ.get("MEILISEARCH_SYNC_BATCH_SIZE", 500))
+MEILISEARCH_TASK_TIMEOUT_MS = int(environ.get("MEILISEARCH_TASK_TIMEOUT_MS", 120000))
+# Полная индексация (ProductIndexer.upload_batches): документов в пакете NDJSON
+# и параллельных потоков загрузки
+MEILISEARCH_UPLOAD_BATCH_SIZE = int(environ.get("MEILISEARCH_UPLOAD_BATCH_SIZE", 5000))
+MEILISEARCH_UPLOAD_WORKERS = int(environ.get("MEILISEARCH_UPLOAD_WORKERS", 4))
+# Максимальная длительность полной перестройки индекса (блокировка от параллельного запуска), секунд
+MEILISEARCH_REBUILD_LOCK_TIMEOUT = int(environ.get("MEILISEARCH_REBUILD_LOCK_TIMEOUT", 6 * 3600))
\ No newline at end of file
@@ -0,0 +1,106 @@
+from datetime import timedelta
+
+import pytest
+from django.core.files.storage import FileSystemStorage
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+
+from core import views as core_views
+from core.artifacts import CHUNK_SIZE, artifact_response
+from core.models import ExportArtifact, ReportCacheEntry
+
+
+@pytest.fixture
+def owner(django_user_model):
+    return django_user_model.objects.create_user(username="owner@example.com", password="secret")
+
+
+@pytest.fixture
+def artifact(owner):
+    return ExportArtifact.objects.create(
+        kind="price_comparison",
+        filename="price_comparison.xlsx",
+        created_by=owner,
+        expires_at=timezone.now() + timedelta(hours=1),
+    )
+
+
+@pytest.fixture(autouse=True)
+def file_response(monkeypatch):
+    # Содержимое файла не проверяется - только доступ к нему
+    monkeypatch.setattr(core_views, "artifact_response", lambda request, artifact: HttpResponse(b"file"))
+
+
+def _download(api_client, user, artifact):
+    api_client.force_authenticate(user=user)
+    return api_client.get(reverse("download-export-artifact", args=[artifact.pk]))
+
+
+@pytest.mark.django_db
+def test_download_export_artifact_by_owner(api_client, owner, artifact):
+    assert _download(api_client, owner, artifact).status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_download_export_artifact_by_other_user(api_client, django_user_model, artifact):
+    other = django_user_model.objects.create_user(username="other@example.com", password="secret")
+    assert _download(api_client, other, artifact).status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+def test_download_export_artifact_by_staff(api_client, django_user_model, artifact):
+    staff = django_user_model.objects.create_user(username="staff@example.com", password="secret", is_staff=True)
+    assert _download(api_client, staff, artifact).status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_download_cached_report_by_other_user(api_client, django_user_model, artifact):
+    ReportCacheEntry.objects.create(
+        report_type="rfm_segmentation",
+        params_hash="0" * 64,
+        data_version=1,
+        task_id="task",
+        status=ReportCacheEntry.Status.DONE,
+        artifact=artifact,
+    )
+    other = django_user_model.objects.create_user(username="other@example.com", password="secret")
+    assert _download(api_client, other, artifact).status_code == status.HTTP_200_OK
+
+
+@pytest.fixture
+def stored_artifact(tmp_path):
+    # Файл на диске без записи в БД: проверяется только отдача содержимого
+    content = bytes(range(256)) * (CHUNK_SIZE // 64)
+    (tmp_path / "report.csv").write_bytes(content)
+    artifact = ExportArtifact(
+        filename="report.csv", content_type="text/csv", size=len(content), sha256="0" * 64
+    )
+    artifact.file.name = "report.csv"
+    artifact.file.storage = FileSystemStorage(location=tmp_path)
+    return artifact, content
+
+
+@pytest.mark.asyncio
+async def test_artifact_response_streams_file_in_chunks(stored_artifact):
+    artifact, content = stored_artifact
+    response = artifact_response(RequestFactory().get("/"), artifact)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.is_async
+    chunks = [chunk async for chunk in response]
+    assert len(chunks) == 4
+    assert max(len(chunk) for chunk in chunks) == CHUNK_SIZE
+    assert b"".join(chunks) == content
+
+
+@pytest.mark.asyncio
+async def test_artifact_response_streams_range(stored_artifact):
+    artifact, content = stored_artifact
+    response = artifact_response(RequestFactory().get("/", HTTP_RANGE="bytes=100-"), artifact)
+
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert response["Content-Range"] == f"bytes 100-{len(content) - 1}/{len(content)}"
+    assert b"".join([chunk async for chunk in response]) == content[100:]
@@ -0,0 +1,224 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from django.core.cache import cache
+
+from goods import file_downloads
+from goods.file_downloads import (
+    MISSING_KEY,
+    SPOOL_MAX_SIZE,
+    FileFetcher,
+    download_missing_files,
+    file_url,
+)
+from goods.models import Product, ProductFile, ProductGroup, ProductSubgroup
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def big_content(ext_id):
+    return ext_id.encode() * (SPOOL_MAX_SIZE // len(ext_id) * 3)
+
+
+class FileServer(ThreadingHTTPServer):
+    """
+    Сайт с файлами по id из запроса:
+    ok-* - 200, missing-* - 404, flaky-* - 503 на первый запрос, down-* - всегда 500,
+    slow-* - 200 с задержкой (для проверки одновременных запросов),
+    big-* - 200 с файлом больше SPOOL_MAX_SIZE.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FileHandler)
+        self.hits = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/zip-download.php/"
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        ext_id = parse_qs(urlsplit(self.path).query)["id"][0]
+        server = self.server
+        with server.lock:
+            server.hits[ext_id] += 1
+            attempt = server.hits[ext_id]
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            if ext_id.startswith("slow-"):
+                time.sleep(0.1)
+            if ext_id.startswith("missing-"):
+                self._respond(404)
+            elif ext_id.startswith("down-") or (ext_id.startswith("flaky-") and attempt == 1):
+                self._respond(500 if ext_id.startswith("down-") else 503)
+            elif ext_id.startswith("big-"):
+                self._respond(200, big_content(ext_id))
+            else:
+                self._respond(200, f"file {ext_id}".encode())
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _respond(self, status, body=b""):
+        self.send_response(status)
+        if status == 200:
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Disposition", 'attachment; filename="datasheet.pdf"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def file_server():
+    server = FileServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _items(server, *ext_ids):
+    return [
+        (index, file_url(ext_id, ProductFile.FileType.DATASHEET, server.url))
+        for index, ext_id in enumerate(ext_ids)
+    ]
+
+
+def test_file_url_reads_setting_at_call_time(settings):
+    settings.ZIP2002_DOWNLOAD_URL = "http://files.test/download/"
+    assert file_url("42", ProductFile.FileType.DRAWING) == "http://files.test/download/?type=file_i&id=42"
+
+
+def test_fetch_many_returns_results_in_order(file_server):
+    with FileFetcher(concurrency=4, backoff=0) as fetcher:
+        results = fetcher.fetch_many(_items(file_server, "ok-1", "missing-2", "ok-3"))
+
+    assert [result.product_id for result in results] == [0, 1, 2]
+    assert [result.status for result in results] == [200, 404, 200]
+    assert results[0].file.read() == b"file ok-1"
+    assert results[0].size == len(b"file ok-1")
+    assert results[0].sha256 == hashlib.sha256(b"file ok-1").hexdigest()
+    assert results[0].headers["Content-Type"] == "application/pdf"
+    assert results[1].file is None
+    # 404 не повторяется
+    assert file_server.hits["missing-2"] == 1
+
+
+def test_fetch_many_retries_server_errors(file_server):
+    with FileFetcher(retries=2, backoff=0) as fetcher:
+        flaky, down = fetcher.fetch_many(_items(file_server, "flaky-1", "down-2"))
+
+    assert flaky.status == 200
+    assert flaky.file.read() == b"file flaky-1"
+    assert file_server.hits["flaky-1"] == 2
+    assert down.status == 500
+    assert down.error == "HTTP 500"
+    assert file_server.hits["down-2"] == 3
+
+
+def test_fetch_many_reports_connection_errors(file_server):
+    url = file_server.url
+    file_server.shutdown()
+    file_server.server_close()
+
+    with FileFetcher(retries=1, backoff=0, timeout=2) as fetcher:
+        (result,) = fetcher.fetch_many([(1, file_url("ok-1", ProductFile.FileType.DATASHEET, url))])
+
+    assert result.status is None
+    assert result.error
+
+
+def test_fetch_many_spools_large_files(file_server):
+    with FileFetcher(backoff=0) as fetcher:
+        (result,) = fetcher.fetch_many(_items(file_server, "big-1"))
+
+    content = big_content("big-1")
+    assert result.size == len(content) > SPOOL_MAX_SIZE
+    assert result.sha256 == hashlib.sha256(content).hexdigest()
+    # Большой файл лежит на диске, а не в памяти процесса
+    assert result.file._rolled
+    assert result.file.read() == content
+    result.close()
+    assert result.file.closed
+
+
+def test_fetch_many_limits_requests_per_host(file_server):
+    ext_ids = [f"slow-{index}" for index in range(8)]
+    with FileFetcher(concurrency=2, backoff=0) as fetcher:
+        results = fetcher.fetch_many(_items(file_server, *ext_ids))
+
+    assert all(result.status == 200 for result in results)
+    assert file_server.max_in_flight == 2
+
+
+@pytest.fixture
+def subgroup():
+    group = ProductGroup.objects.create(ext_id="g-1", name="Микросхемы")
+    return ProductSubgroup.objects.create(ext_id="s-1", group=group, name="Микроконтроллеры")
+
+
+@pytest.mark.django_db
+def test_download_missing_files(file_server, subgroup, settings, tmp_path):
+    settings.ZIP2002_DOWNLOAD_URL = file_server.url
+    settings.CACHES = LOCMEM_CACHES
+    settings.MEDIA_ROOT = tmp_path
+    cache.clear()
+    ok = Product.objects.create(ext_id="ok-1", name="STM32F103C8T6", subgroup=subgroup)
+    flaky = Product.objects.create(ext_id="flaky-2", name="ATMEGA328P-AU", subgroup=subgroup)
+    Product.objects.create(ext_id="missing-3", name="LM358DR", subgroup=subgroup)
+
+    stats = download_missing_files(ProductFile.FileType.DATASHEET, batch_size=2, concurrency=2)
+
+    assert stats == {"processed": 3, "created": 2, "missing": 1, "failed": 0, "skipped": 0}
+    files = ProductFile.objects.filter(file_type=ProductFile.FileType.DATASHEET)
+    assert set(files.values_list("product_id", flat=True)) == {ok.pk, flaky.pk}
+    assert files.get(product=ok).blob.file.read() == b"file ok-1"
+    assert cache.get(MISSING_KEY.format(file_type=ProductFile.FileType.DATASHEET, ext_id="missing-3"))
+
+    # Повторный проход: файлы уже есть, 404 пропускается по отрицательному кэшу
+    stats = download_missing_files(ProductFile.FileType.DATASHEET)
+    assert stats == {"processed": 0, "created": 0, "missing": 0, "failed": 0, "skipped": 1}
+    assert file_server.hits["missing-3"] == 1
+
+
+@pytest.mark.django_db
+def test_download_missing_files_counts_save_errors(file_server, subgroup, settings, tmp_path, monkeypatch):
+    settings.ZIP2002_DOWNLOAD_URL = file_server.url
+    settings.CACHES = LOCMEM_CACHES
+    settings.MEDIA_ROOT = tmp_path
+    cache.clear()
+    broken = Product.objects.create(ext_id="ok-1", name="STM32F103C8T6", subgroup=subgroup)
+    ok = Product.objects.create(ext_id="ok-2", name="ATMEGA328P-AU", subgroup=subgroup)
+
+    save_blob = file_downloads.save_blob
+
+    def failing_save_blob(result):
+        if result.product_id == broken.pk:
+            raise OSError("хранилище недоступно")
+        return save_blob(result)
+
+    monkeypatch.setattr(file_downloads, "save_blob", failing_save_blob)
+
+    stats = download_missing_files(ProductFile.FileType.DATASHEET)
+
+    assert stats["failed"] == 1
+    assert stats["created"] == 1
+    assert not ProductFile.objects.filter(product=broken).exists()
+    assert ProductFile.objects.filter(product=ok).exists()
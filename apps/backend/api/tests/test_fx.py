@@ -0,0 +1,67 @@
+import logging
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from customers.models import Company
+from goods.models import Product, ProductGroup, ProductSubgroup
+from sales.fx import RateTable, recalculate_amounts_rub, save_exchange_rates
+from sales.models import ExchangeRate, Invoice, InvoiceLine, SalesDailyCompany
+
+
+@pytest.fixture
+def usd_line():
+    company = Company.objects.create(name="ООО Ромашка")
+    group = ProductGroup.objects.create(ext_id="g-1", name="Микросхемы")
+    subgroup = ProductSubgroup.objects.create(ext_id="s-1", group=group, name="Микроконтроллеры")
+    product = Product.objects.create(name="STM32F103C8T6", subgroup=subgroup)
+    invoice = Invoice.objects.create(
+        invoice_number="S-1",
+        invoice_date=date(2025, 3, 1),
+        company=company,
+        invoice_type=Invoice.InvoiceType.SALE,
+        sale_type=Invoice.SaleType.STOCK,
+        currency=Invoice.Currency.USD,
+    )
+    return InvoiceLine.objects.create(invoice=invoice, product=product, quantity=4, price="2.50")
+
+
+@pytest.mark.django_db
+def test_rate_table_without_rates_keeps_invoice_currency(caplog):
+    rates = RateTable(["USD"])
+
+    with caplog.at_level(logging.WARNING, logger="sales.fx"):
+        assert rates.to_rub(Decimal("10"), "USD", date(2025, 3, 1)) == Decimal("10.00")
+        assert rates.to_rub(Decimal("5"), "USD", date(2025, 3, 2)) == Decimal("5.00")
+
+    assert rates.unconverted == {"USD": 2}
+    assert len(caplog.records) == 1
+    assert rates.to_rub(None, "USD", date(2025, 3, 1)) is None
+
+
+@pytest.mark.django_db
+def test_line_without_rates_stays_in_revenue(usd_line):
+    usd_line.refresh_from_db()
+    assert usd_line.amount_rub == Decimal("10.00")
+    assert SalesDailyCompany.objects.get(day=date(2025, 3, 1)).revenue == Decimal("10.00")
+
+
+@pytest.mark.django_db
+def test_recalculate_without_rates_logs_unconverted_lines(usd_line, caplog):
+    with caplog.at_level(logging.WARNING, logger="sales.fx"):
+        recalculate_amounts_rub(["USD"])
+
+    usd_line.refresh_from_db()
+    assert usd_line.amount_rub == Decimal("10.00")
+    assert "USD - 1" in caplog.text
+
+
+@pytest.mark.django_db
+def test_loaded_rates_replace_fallback(usd_line):
+    save_exchange_rates([("USD", date(2025, 2, 1), Decimal("90"))])
+
+    assert ExchangeRate.objects.filter(currency="USD").count() == 1
+    usd_line.refresh_from_db()
+    assert usd_line.amount_rub == Decimal("900.00")
+    assert SalesDailyCompany.objects.get(day=date(2025, 3, 1)).revenue == Decimal("900.00")
@@ -0,0 +1,83 @@
+import math
+import random
+from itertools import combinations
+
+import pytest
+
+from sales.market_basket import BasketMatrix, association_rules, frequent_itemsets
+
+
+@pytest.fixture
+def baskets():
+    # Счета с 1-5 позициями, часть позиций покупают заметно чаще остальных
+    rng = random.Random(7)
+    items = [10, 11, 12, 13, 14, 15, 16, 17]
+    weights = [8, 6, 5, 4, 3, 2, 1, 1]
+    result = []
+    for _ in range(80):
+        size = rng.randint(1, 5)
+        result.append(set(rng.choices(items, weights=weights, k=size)))
+    return result
+
+
+def _matrix(baskets):
+    # Номера счетов не подряд и с повторами пар - как в выборке из фактов
+    pairs = [(1000 + 3 * index, item) for index, basket in enumerate(baskets) for item in basket]
+    return BasketMatrix.from_pairs(pairs + pairs[:10])
+
+
+def _brute_itemsets(baskets, min_support, max_len):
+    min_count = max(math.ceil(min_support * len(baskets)), 1)
+    items = sorted(set().union(*baskets))
+    result = {}
+    for size in range(1, max_len + 1):
+        for itemset in combinations(items, size):
+            count = sum(1 for basket in baskets if basket.issuperset(itemset))
+            if count >= min_count:
+                result[itemset] = count
+    return result
+
+
+def _brute_rules(itemsets, n_baskets):
+    rules = {}
+    for itemset, count in itemsets.items():
+        for size in range(1, len(itemset)):
+            for antecedent in combinations(itemset, size):
+                consequent = tuple(item for item in itemset if item not in antecedent)
+                confidence = count / itemsets[antecedent]
+                rules[(frozenset(antecedent), frozenset(consequent))] = (
+                    confidence, confidence / (itemsets[consequent] / n_baskets)
+                )
+    return rules
+
+
+@pytest.mark.parametrize("max_len", [1, 2, 3, 4])
+@pytest.mark.parametrize("min_support", [0.02, 0.1, 0.25])
+def test_frequent_itemsets_match_brute_force(baskets, min_support, max_len):
+    itemsets = frequent_itemsets(_matrix(baskets), min_support, max_len=max_len)
+
+    assert {tuple(sorted(itemset)): count for itemset, count in itemsets.items()} == _brute_itemsets(
+        baskets, min_support, max_len
+    )
+
+
+@pytest.mark.parametrize("max_len", [2, 3])
+def test_association_rules_match_brute_force(baskets, max_len):
+    itemsets = frequent_itemsets(_matrix(baskets), 0.05, max_len=max_len)
+    rules = association_rules(itemsets, len(baskets))
+
+    expected = _brute_rules(_brute_itemsets(baskets, 0.05, max_len), len(baskets))
+    found = {(frozenset(rule['antecedent']), frozenset(rule['consequent'])): rule for rule in rules}
+    assert found.keys() == expected.keys()
+    for key, (confidence, lift) in expected.items():
+        assert found[key]['confidence'] == pytest.approx(confidence)
+        assert found[key]['lift'] == pytest.approx(lift)
+    assert [rule['lift'] for rule in rules] == sorted((rule['lift'] for rule in rules), reverse=True)
+
+
+def test_association_rules_thresholds(baskets):
+    itemsets = frequent_itemsets(_matrix(baskets), 0.05, max_len=3)
+    rules = association_rules(itemsets, len(baskets), min_confidence=0.3, min_lift=1.1)
+
+    assert rules
+    assert all(rule['confidence'] >= 0.3 and rule['lift'] >= 1.1 for rule in rules)
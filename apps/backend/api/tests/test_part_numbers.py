@@ -0,0 +1,37 @@
+import pytest
+
+from goods.utils import normalize_part_number
+
+
+@pytest.mark.parametrize("value, expected", [
+    # Кириллические двойники латинских букв
+    ("КР142ЕН5А", "KP142EH5A"),
+    ("МАХ232", "MAX232"),
+    ("ВС547В.215", "BC547B"),
+    # Суффиксы упаковки
+    ("LM317T/NOPB", "LM317T"),
+    ("BAV99-TR", "BAV99"),
+    ("LT1086CM#PBF", "LT1086CM"),
+    ("BZX84C5V1,215", "BZX84C5V1"),
+    ("NE555DR-TR/NOPB", "NE555DR"),
+    ("SN74HC595N TUBE", "SN74HC595N"),
+    # Регистр, пробелы и знаки препинания
+    ("lm 317-t", "LM317T"),
+    ("lm317t/nopb", "LM317T"),
+])
+def test_normalize_part_number(value, expected):
+    assert normalize_part_number(value) == expected
+
+
+def test_normalize_part_number_keeps_suffix_without_separator():
+    # PBF без разделителя - часть самого part number
+    assert normalize_part_number("IRF540NPBF") == "IRF540NPBF"
+
+
+def test_normalize_part_number_whole_value_is_suffix():
+    assert normalize_part_number("TR") == "TR"
+
+
+@pytest.mark.parametrize("value", ["", None])
+def test_normalize_part_number_empty(value):
+    assert normalize_part_number(value) == ""
@@ -0,0 +1,94 @@
+import csv
+import io
+from datetime import date
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+
+from core.reports import aiter_chunks, iter_rows
+from customers.models import Company
+from goods.models import Product, ProductGroup, ProductSubgroup
+from sales.models import Invoice, InvoiceLine
+
+
+async def _read(response):
+    return b"".join([chunk async for chunk in response])
+
+
+class Rows:
+    """Строки выгрузки с подсчетом того, сколько из них уже прочитано."""
+
+    def __init__(self, count):
+        self.count = count
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        try:
+            for index in range(self.count):
+                self.read += 1
+                yield (index, f"строка {index}")
+        finally:
+            self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_streaming_response_reads_rows_chunk_by_chunk():
+    rows = Rows(5000)
+    response = StreamingHttpResponse(aiter_chunks(iter_rows("csv", ["id", "name"], iter(rows))))
+    assert response.is_async
+
+    chunks = []
+    async for chunk in response:
+        chunks.append(chunk)
+        # Блок отдается до того, как прочитаны все строки
+        if len(chunks) == 2:
+            assert rows.read < rows.count
+
+    lines = b"".join(chunks).decode("utf-8-sig").splitlines()
+    assert len(lines) == 5001
+    assert lines[1] == "0;строка 0"
+    assert rows.closed
+
+
+@pytest.mark.asyncio
+async def test_aiter_chunks_closes_source_on_disconnect():
+    rows = Rows(5000)
+    chunks = aiter_chunks(iter(rows))
+
+    async for _ in chunks:
+        break
+    await chunks.aclose()
+
+    assert rows.closed
+    assert rows.read == 1
+
+
+@pytest.mark.django_db
+def test_export_sales_lines_streams_asynchronously(api_client, user_factory):
+    company = Company.objects.create(name="ООО Ромашка")
+    group = ProductGroup.objects.create(ext_id="g-1", name="Микросхемы")
+    subgroup = ProductSubgroup.objects.create(ext_id="s-1", group=group, name="Микроконтроллеры")
+    product = Product.objects.create(name="STM32F103C8T6", subgroup=subgroup)
+    invoice = Invoice.objects.create(
+        invoice_number="S-1",
+        invoice_date=date(2025, 3, 1),
+        company=company,
+        invoice_type=Invoice.InvoiceType.SALE,
+        sale_type=Invoice.SaleType.STOCK,
+    )
+    InvoiceLine.objects.create(invoice=invoice, product=product, quantity=3, price="10.50")
+
+    api_client.force_authenticate(user=user_factory.create())
+    response = api_client.get(reverse("export-sales-lines"), {"file_format": "csv"})
+
+    assert response.status_code == 200
+    assert response.is_async
+    # async_to_sync: чтение курсора идет в этом же потоке, в тестовой транзакции
+    content = async_to_sync(_read)(response)
+    rows = list(csv.reader(io.StringIO(content.decode("utf-8-sig")), delimiter=";"))
+    assert rows[0][:2] == ["invoice_number", "invoice_date"]
+    assert rows[1][0] == "S-1"
+    assert rows[1][9:12] == ["3", "10.50", "31.50"]
@@ -0,0 +1,57 @@
+import pytest
+from django.core.cache import cache
+
+from goods import search
+from goods.search import canonical_query, index_search
+
+
+class FakeIndex:
+    def __init__(self):
+        self.queries = []
+
+    def search(self, query, options):
+        self.queries.append(query)
+        return {"hits": [{"id": 1}], "limit": options["limit"], "offset": options["offset"], "query": query}
+
+
+class FakeClient:
+    def __init__(self):
+        self.products = FakeIndex()
+
+    def index(self, name):
+        return self.products
+
+
+@pytest.fixture
+def meilisearch(settings, monkeypatch):
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    cache.clear()
+    client = FakeClient()
+    monkeypatch.setattr(search, "_meilisearch_client", lambda: client)
+    return client.products
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("стм32", "stm32"),
+    ("  STM32F103 ", "stm32f103"),
+    ("Резистор  10К", "резистор 10k"),
+    ("резистор", "резистор"),
+    ("", ""),
+])
+def test_canonical_query(query, expected):
+    assert canonical_query(query) == expected
+
+
+def test_index_search_shares_cache_entry_between_transliterations(meilisearch):
+    first = index_search("стм32", highlight=False)
+    second = index_search("STM32", highlight=False)
+
+    assert meilisearch.queries == ["stm32"]
+    assert first == second
+
+
+def test_index_search_keys_on_options(meilisearch):
+    index_search("stm32", limit=10, highlight=False)
+    index_search("stm32", limit=20, highlight=False)
+
+    assert meilisearch.queries == ["stm32", "stm32"]
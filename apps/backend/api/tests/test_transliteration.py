@@ -0,0 +1,110 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from goods.utils import TransliterationUtils, prepare_search_query
+
+
+@pytest.mark.parametrize("word, latin", [
+    ("жук", "zhuk"),
+    ("Жук", "ZHuk"),
+    ("ЖУК", "ZHUK"),
+    ("щука", "schuka"),
+    ("Щука", "SCHuka"),
+    ("ёлка", "yolka"),
+    ("Ёлка", "YOlka"),
+    ("чайник", "chaynik"),
+    ("шея", "sheya"),
+    ("юла", "yula"),
+])
+def test_semantic_round_trip(word, latin):
+    assert TransliterationUtils.ru_to_en_semantic(word) == latin
+    assert TransliterationUtils.en_to_ru_semantic(latin) == word
+
+
+def test_semantic_sequences_take_longest_match():
+    # "sch" - щ, а не "s" + "ch"
+    assert TransliterationUtils.en_to_ru_semantic("sch") == "щ"
+    assert TransliterationUtils.en_to_ru_semantic("shch") == "шч"
+
+
+@pytest.mark.parametrize("convert, convert_many", [
+    (TransliterationUtils.ru_to_en, TransliterationUtils.ru_to_en_many),
+    (TransliterationUtils.en_to_ru, TransliterationUtils.en_to_ru_many),
+    (TransliterationUtils.ru_to_en_semantic, TransliterationUtils.ru_to_en_semantic_many),
+    (TransliterationUtils.en_to_ru_semantic, TransliterationUtils.en_to_ru_semantic_many),
+])
+def test_convert_many_matches_single_conversions(convert, convert_many):
+    texts = ["жук", "zhuk", "STM32", "", "щ", "sch", "ёлка yolka"]
+    assert convert_many(texts) == [convert(text) for text in texts]
+
+
+def test_convert_many_keeps_sequences_inside_one_string():
+    # Буквосочетание не склеивается через границу соседних строк
+    assert TransliterationUtils.en_to_ru_semantic_many(["z", "h", "zh"]) == ["з", "х", "ж"]
+
+
+def test_convert_many_with_separator_in_text():
+    # Строка с символом-разделителем преобразуется по одной, без склейки
+    assert TransliterationUtils.ru_to_en_many(["а\x00м", "м"]) == ["f\x00v", "v"]
+
+
+def test_convert_many_empty_and_none():
+    assert TransliterationUtils.ru_to_en_many([]) == []
+    assert TransliterationUtils.ru_to_en_many([None, "", "р"]) == ["", "", "h"]
+
+
+def test_create_search_text_order():
+    # Порядок вариантов входит в документ индекса и его хэш (goods.search_sync)
+    assert TransliterationUtils.create_search_text("Жук", "stm32") == "Жук :er ZHuk stm32 ыеь32 стм32"
+    assert TransliterationUtils.create_search_texts(["Жук", None, "stm32"]) == [
+        "Жук :er ZHuk", "", "stm32 ыеь32 стм32",
+    ]
+
+
+def test_prepare_search_query_order():
+    prepared = prepare_search_query("резистор конденсатор")
+
+    assert prepared["priority_variants"] == [
+        "резистор конденсатор", "rezistor конденсатор", "резистор kondensator",
+    ]
+    assert prepared["fallback_variants"] == ["htpbcnjh конденсатор", "резистор rjyltycfnjh"]
+    assert prepared["all_variants"] == prepared["priority_variants"] + prepared["fallback_variants"]
+
+
+def test_prepare_search_query_is_stable_across_processes():
+    # Порядок не должен зависеть от PYTHONHASHSEED: воркеры должны считать одинаковые хэши
+    script = (
+        "import json; from goods.utils import TransliterationUtils, prepare_search_query; "
+        "print(json.dumps([prepare_search_query('стм32 резистор конденсатор резистор'), "
+        "TransliterationUtils.create_search_text('Жук', 'КР142ЕН5А')], ensure_ascii=False))"
+    )
+    outputs = {
+        subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=Path(__file__).resolve().parents[2],
+            env={**os.environ, "PYTHONHASHSEED": seed},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        for seed in ("1", "2", "3")
+    }
+    assert len(outputs) == 1
+
+
+def test_prepare_search_query_part_number():
+    # Для part number раскладочных вариантов нет, повторы слова дают один вариант
+    prepared = prepare_search_query("стм32 резистор стм32")
+
+    assert prepared["priority_variants"] == [
+        "стм32 резистор стм32", "stm32 резистор stm32", "стм32 rezistor стм32",
+    ]
+    assert prepared["fallback_variants"] == []
+
+
+def test_prepare_search_query_empty():
+    assert prepare_search_query("") == {"priority_variants": [""], "fallback_variants": [], "all_variants": [""]}
@@ -20,24 +20,29 @@ from goods.views import (
     ProductViewSet, ProductGroupViewSet, 
     ProductSubgroupViewSet, BrandViewSet,
     export_products_descriptions, check_export_task,
+    index_search_products, search_cache_statistics,
 )
 from rfqs.views import RFQViewSet, RFQItemViewSet, RFQItemFileViewSet, get_rfq_item_quotations, debug_rfq_items, upload_rfq_item_files, get_rfq_item_last_prices, create_quotation_for_rfq_item, QuotationItemFileViewSet, upload_quotation_item_files
+from core.views import download_export_artifact
 from customers.views import CompanyViewSet
 from persons.views import PersonViewSet
 from stock.views import (
     CompetitorViewSet, CompetitorProductViewSet, CompetitorProductMatchViewSet,
     CompetitorPriceStockSnapshotViewSet, OurPriceHistoryViewSet,
-    import_histprice, get_price_comparison, export_competitor_price_comparison,
+    import_histprice, get_price_comparison, get_bulk_price_comparison, export_competitor_price_comparison,
     check_price_comparison_export_task, export_competitor_sales,
     check_competitor_sales_export_task
 )
 from sales.views import (
     InvoiceViewSet,
+    CustomerMetricsSnapshotViewSet,
     sales_summary,
     customer_sales_timeseries,
     customer_sales_top,
     product_sales_top,
     product_sales_timeseries,
+    often_bought_together_view,
+    export_sales_lines,
     generate_customer_sales_dynamics_report_view,
     generate_product_sales_dynamics_report_view,
     generate_customer_cohort_analysis_report_view,
@@ -65,6 +70,7 @@ router.register("competitor-matches", CompetitorProductMatchViewSet, basename="a
 router.register("competitor-snapshots", CompetitorPriceStockSnapshotViewSet, basename="api-competitor-snapshots")
 router.register("our-price-history", OurPriceHistoryViewSet, basename="api-our-price-history")
 router.register("sales/invoices", InvoiceViewSet, basename="api-invoices")
+router.register("sales/customer-metrics", CustomerMetricsSnapshotViewSet, basename="api-customer-metrics")
 
 urlpatterns = [
     path(
@@ -76,6 +82,8 @@ urlpatterns = [
     path("api/debug/ping/", ping_post),
     path("api/products/export-descriptions/", export_products_descriptions, name="export-products-descriptions"),
     path("api/products/export-status/<str:task_id>/", check_export_task, name="check-export-task"),
+    path("api/products/index-search/", index_search_products, name="products-index-search"),
+    path("api/products/search-cache-stats/", search_cache_statistics, name="products-search-cache-stats"),
     path("api/rfq-items/<int:rfq_item_id>/quotations/", get_rfq_item_quotations, name="rfq-item-quotations"),
     path("api/rfq-items/<int:rfq_item_id>/last-prices/", get_rfq_item_last_prices, name="rfq-item-last-prices"),
     path("api/rfq-items/<int:rfq_item_id>/create-quotation/", create_quotation_for_rfq_item, name="rfq-item-create-quotation"),
@@ -84,16 +92,19 @@ urlpatterns = [
     path("api/debug/rfq-items/", debug_rfq_items, name="debug-rfq-items"),
     path("api/stock/import-histprice/", import_histprice, name="import-histprice"),
     path("api/stock/price-comparison/<int:product_id>/", get_price_comparison, name="price-comparison"),
+    path("api/stock/price-comparison/bulk/", get_bulk_price_comparison, name="bulk-price-comparison"),
     path("api/stock/export-price-comparison/", export_competitor_price_comparison, name="export-price-comparison"),
     path("api/stock/export-price-comparison-status/<str:task_id>/", check_price_comparison_export_task, name="check-price-comparison-export-task"),
     path("api/stock/export-competitor-sales/", export_competitor_sales, name="export-competitor-sales"),
     path("api/stock/export-competitor-sales-status/<str:task_id>/", check_competitor_sales_export_task, name="check-competitor-sales-export-task"),
     # Sales analytics endpoints
     path("api/sales/summary/", sales_summary, name="sales-summary"),
+    path("api/sales/export/lines/", export_sales_lines, name="export-sales-lines"),
     path("api/sales/analytics/customers/timeseries/", customer_sales_timeseries, name="customer-sales-timeseries"),
     path("api/sales/analytics/customers/top/", customer_sales_top, name="customer-sales-top"),
     path("api/sales/analytics/products/top/", product_sales_top, name="product-sales-top"),
     path("api/sales/analytics/products/timeseries/", product_sales_timeseries, name="product-sales-timeseries"),
+    path("api/sales/analytics/products/<int:product_id>/bought-together/", often_bought_together_view, name="often-bought-together"),
     # Customer sales dynamics report endpoints
     path("api/sales/reports/customer-dynamics/", generate_customer_sales_dynamics_report_view, name="generate-customer-dynamics-report"),
     path("api/sales/reports/product-dynamics/", generate_product_sales_dynamics_report_view, name="generate-product-dynamics-report"),
@@ -102,6 +113,8 @@ urlpatterns = [
     path("api/sales/reports/ltv-analysis/", generate_ltv_analysis_report_view, name="generate-ltv-analysis-report"),
     path("api/sales/reports/market-basket-analysis/", generate_market_basket_analysis_report_view, name="generate-market-basket-analysis-report"),
     path("api/sales/report-status/<str:task_id>/", check_report_task_status, name="check-report-status"),
+    # Готовые файлы выгрузок и отчетов
+    path("api/exports/<uuid:artifact_id>/download/", download_export_artifact, name="download-export-artifact"),
     # Dashboard redirects for stock management
     path("dashboard/stock/", lambda request: redirect("http://localhost:3000/dashboard/stock/"), name="dashboard-stock"),
     path("dashboard/stock/competitors/", lambda request: redirect("http://localhost:3000/dashboard/stock/competitors/"), name="dashboard-competitors"),
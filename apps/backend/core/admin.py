@@ -1,3 +1,29 @@
 from django.contrib import admin
+from unfold.admin import ModelAdmin
 
-# Register your models here.
+from core.models import ExportArtifact, ReportCacheEntry, ReportCheckpoint
+
+
+@admin.register(ExportArtifact)
+class ExportArtifactAdmin(ModelAdmin):
+    list_display = ("filename", "kind", "size", "created_by", "created_at", "expires_at")
+    list_filter = ("kind",)
+    search_fields = ("filename", "task_id")
+    readonly_fields = ("id", "sha256", "size", "task_id", "created_at", "updated_at")
+    date_hierarchy = "created_at"
+
+
+@admin.register(ReportCacheEntry)
+class ReportCacheEntryAdmin(ModelAdmin):
+    list_display = ("report_type", "status", "data_version", "size", "hits", "last_used_at", "created_at")
+    list_filter = ("report_type", "status")
+    search_fields = ("task_id", "params_hash")
+    readonly_fields = ("params_hash", "task_id", "artifact", "result", "created_at", "updated_at")
+
+
+@admin.register(ReportCheckpoint)
+class ReportCheckpointAdmin(ModelAdmin):
+    list_display = ("report_type", "step", "run_key", "size", "created_at")
+    list_filter = ("report_type",)
+    search_fields = ("run_key",)
+    readonly_fields = ("run_key", "step", "size", "created_at", "updated_at")
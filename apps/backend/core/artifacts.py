@@ -0,0 +1,198 @@
+"""
+Файлы выгрузок и отчетов: сохранение в хранилище и отдача по HTTP.
+
+Задачи Celery пишут файл во временный файл на диске, затем он переносится
+в хранилище выгрузок (MEDIA_ROOT или S3/MinIO), а в результат задачи
+попадает только id записи ExportArtifact - без base64 в Redis.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from datetime import timedelta
+
+from celery import current_task
+from django.conf import settings
+from django.core.files import File
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from core.models import ExportArtifact
+from core.reports import CONTENT_TYPES, aiter_chunks
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class ExportArtifactWriter:
+    """
+    Контекстный менеджер для записи файла выгрузки.
+
+        with ExportArtifactWriter('rfm_report', filename) as output:
+            with ReportWorkbook(output.file) as workbook:
+                ...
+        artifact = output.artifact
+
+    При выходе без исключения файл сохраняется в хранилище выгрузок
+    с размером, SHA-256 и сроком хранения; при ошибке временный файл удаляется.
+    """
+
+    def __init__(self, kind, filename, *, content_type=None, ttl_hours=None, created_by_id=None, meta=None):
+        self.kind = kind
+        self.filename = filename
+        self.content_type = content_type
+        self.ttl_hours = ttl_hours or settings.EXPORT_ARTIFACT_TTL_HOURS
+        self.created_by_id = created_by_id
+        self.meta = meta or {}
+        self.file = None
+        self.artifact = None
+
+    def __enter__(self):
+        self.file = tempfile.TemporaryFile()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.artifact = self._save()
+        finally:
+            self.file.close()
+        return False
+
+    def _save(self):
+        self.file.flush()
+        self.file.seek(0)
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in iter(lambda: self.file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+        self.file.seek(0)
+
+        artifact = ExportArtifact(
+            kind=self.kind,
+            filename=self.filename,
+            content_type=self.content_type or guess_content_type(self.filename),
+            size=size,
+            sha256=digest.hexdigest(),
+            task_id=_current_task_id(),
+            created_by_id=self.created_by_id,
+            meta=self.meta,
+            expires_at=timezone.now() + timedelta(hours=self.ttl_hours),
+        )
+        artifact.file.save(self.filename, File(self.file), save=False)
+        artifact.save()
+        return artifact
+
+
+def _current_task_id():
+    request = getattr(current_task, 'request', None)
+    return (getattr(request, 'id', None) or '') if request else ''
+
+
+def guess_content_type(filename):
+    extension = os.path.splitext(filename)[1].lstrip('.').lower()
+    if extension in CONTENT_TYPES:
+        return CONTENT_TYPES[extension]
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def artifact_local_path(artifact):
+    """Путь к файлу на диске, если хранилище локальное (иначе None)."""
+    try:
+        return artifact.file.path
+    except NotImplementedError:
+        return None
+
+
+def can_download(user, artifact) -> bool:
+    """
+    Скачать файл может сотрудник (is_staff), тот, кто запросил выгрузку,
+    и любой пользователь - отчет из кэша отчетов: его получает каждый,
+    кто запросит те же параметры.
+    """
+    if user.is_staff or (artifact.created_by_id is not None and artifact.created_by_id == user.id):
+        return True
+    return artifact.cache_entries.exists()
+
+
+def artifact_result(artifact, **extra):
+    """Результат задачи экспорта: ссылка на файл вместо его содержимого."""
+    return {
+        'success': True,
+        'artifact_id': str(artifact.id),
+        'filename': artifact.filename,
+        'size': artifact.size,
+        'download_url': reverse('download-export-artifact', args=[artifact.id]),
+        'expires_at': artifact.expires_at.isoformat(),
+        **extra,
+    }
+
+
+def _iter_file(file, length):
+    try:
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def artifact_response(request, artifact):
+    """
+    Потоковая отдача файла выгрузки с поддержкой Range (докачка, 206 Partial Content).
+
+    Файл читается блоками по CHUNK_SIZE через асинхронный итератор - под ASGI
+    ответ не собирается в памяти целиком.
+    """
+    size = artifact.size
+    start, end = 0, size - 1
+    status_code = 200
+
+    match = RANGE_RE.match(request.META.get('HTTP_RANGE', '').strip())
+    if match and size and any(match.groups()):
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            # bytes=-N - последние N байт
+            start = max(size - int(last), 0)
+        if start > end or start >= size:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        status_code = 206
+
+    file = artifact.file.open('rb')
+    file.seek(start)
+    length = end - start + 1
+
+    response = StreamingHttpResponse(
+        aiter_chunks(_iter_file(file, length)),
+        status=status_code,
+        content_type=artifact.content_type or 'application/octet-stream',
+    )
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = content_disposition_header(True, artifact.filename)
+    if artifact.sha256:
+        response['ETag'] = f'"{artifact.sha256}"'
+    if status_code == 206:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+def task_result_artifact(result):
+    """ExportArtifact из результата задачи экспорта или None."""
+    if not isinstance(result, dict) or not result.get('artifact_id'):
+        return None
+    return ExportArtifact.objects.filter(pk=result['artifact_id']).first()
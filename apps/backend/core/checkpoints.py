@@ -0,0 +1,183 @@
+"""
+Выполнение долгих отчетов по частям с контрольными точками.
+
+Отчет делится на шаги: разбиение на части (месяцы, пакеты компаний или
+товаров) и тяжелые вычисления над собранными данными. Итог каждого шага
+сохраняется в хранилище выгрузок (ReportCheckpoint), прогресс публикуется
+в состояние задачи (PROGRESS, процент выполнения).
+
+    run = CheckpointedRun('customer_cohort', params, version=data_version)
+    frames = run.map('months', month_partitions(first_day, last_day), load_month)
+    ...
+    run.finish()
+
+Задачи отчетов объявляются с soft_time_limit=REPORT_SOFT_TIME_LIMIT: при
+мягком лимите времени задача перезапускается через retry_from_checkpoint
+с тем же task_id и тем же ключом запуска - готовые шаги не пересчитываются.
+"""
+import logging
+import pickle
+from datetime import date, timedelta
+
+from celery import current_app
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from core.models import ReportCheckpoint
+from core.report_cache import normalize_params, params_hash
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_STATE = 'PROGRESS'
+
+
+def publish_progress(current, total, **meta):
+    """Публикует прогресс выполняемой задачи (state=PROGRESS)."""
+    # current_worker_task - задача воркера, даже если отчет вызван внутри
+    # другой задачи (run_cached_report); у вложенного вызова нет task_id
+    task = current_app.current_worker_task
+    task_id = getattr(getattr(task, 'request', None), 'id', None)
+    if not task_id:
+        return
+    percent = round(current * 100 / total, 1) if total else 100.0
+    task.update_state(
+        task_id=task_id,
+        state=PROGRESS_STATE,
+        meta={'current': current, 'total': total, 'percent': percent, **meta},
+    )
+
+
+def month_partitions(date_from, date_to) -> list:
+    """Месяцы [начало, начало следующего) от date_from до date_to включительно."""
+    if not date_from or not date_to:
+        return []
+    start = date(date_from.year, date_from.month, 1)
+    partitions = []
+    while start <= date_to:
+        next_start = (start + timedelta(days=32)).replace(day=1)
+        partitions.append((start, next_start))
+        start = next_start
+    return partitions
+
+
+def chunked(items, size) -> list:
+    """Пакеты по size элементов (например, диапазоны id компаний)."""
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class CheckpointedRun:
+    """
+    Запуск отчета с контрольными точками.
+
+    Ключ запуска - тип отчета, нормализованные параметры и версия данных:
+    повторный запуск с теми же параметрами на тех же данных продолжает
+    с сохраненных шагов, после изменения данных считается заново.
+    """
+
+    def __init__(self, report_type, params, version=None):
+        self.report_type = report_type
+        self.run_key = params_hash({
+            'report_type': report_type,
+            'params': normalize_params(params),
+            'version': version,
+        })
+        self._stored = {
+            checkpoint.step: checkpoint
+            for checkpoint in ReportCheckpoint.objects.filter(run_key=self.run_key)
+        }
+        if self._stored:
+            logger.info(f"Отчет {report_type}: продолжаем с {len(self._stored)} сохраненных шагов")
+
+    def _load(self, step):
+        checkpoint = self._stored.get(step)
+        if checkpoint is None:
+            return False, None
+        try:
+            with checkpoint.file.open('rb') as file:
+                # Файлы пишет только этот модуль в закрытое хранилище выгрузок
+                return True, pickle.load(file)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать контрольную точку {self.report_type}/{step}: {e}")
+            checkpoint.delete()
+            return False, None
+
+    def _save(self, step, value):
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        checkpoint = ReportCheckpoint(
+            run_key=self.run_key, report_type=self.report_type, step=step, size=len(payload)
+        )
+        checkpoint.file.save(f"{step.replace('/', '_').replace(':', '_')}.pkl", ContentFile(payload), save=False)
+        try:
+            with transaction.atomic():
+                checkpoint.save()
+        except IntegrityError:
+            # Тот же шаг сохранил параллельный запуск с теми же параметрами
+            checkpoint.file.delete(save=False)
+            return
+        self._stored[step] = checkpoint
+
+    def step(self, name, compute):
+        """Результат шага из контрольной точки или вычисленный и сохраненный."""
+        found, value = self._load(name)
+        if not found:
+            value = compute()
+            self._save(name, value)
+        return value
+
+    def map(self, name, partitions, compute) -> list:
+        """
+        Обрабатывает части по порядку, сохраняя итог каждой.
+
+        Части должны быть одинаковыми при повторном запуске с тем же ключом
+        (например, месяцы фиксированного диапазона).
+
+        Returns:
+            list: итоги compute(part) в порядке частей
+        """
+        partitions = list(partitions)
+        total = len(partitions)
+        results = []
+        for index, partition in enumerate(partitions):
+            results.append(self.step(f"{name}:{index}/{total}", lambda partition=partition: compute(partition)))
+            publish_progress(index + 1, total, step=name)
+        return results
+
+    def finish(self):
+        """Удаляет контрольные точки после успешного построения отчета."""
+        delete_checkpoints(ReportCheckpoint.objects.filter(run_key=self.run_key))
+        self._stored = {}
+
+
+def delete_checkpoints(queryset) -> int:
+    deleted = 0
+    for checkpoint in queryset:
+        try:
+            checkpoint.file.delete(save=False)
+        except Exception as e:
+            logger.error(f"Не удалось удалить файл контрольной точки {checkpoint.pk}: {e}")
+        checkpoint.delete()
+        deleted += 1
+    return deleted
+
+
+def cleanup_report_checkpoints() -> int:
+    """Удаляет контрольные точки брошенных запусков старше REPORT_CHECKPOINT_TTL_HOURS."""
+    expired = timezone.now() - timedelta(hours=settings.REPORT_CHECKPOINT_TTL_HOURS)
+    return delete_checkpoints(ReportCheckpoint.objects.filter(created_at__lt=expired))
+
+
+def retry_from_checkpoint(task, exc):
+    """
+    Перезапускает задачу после мягкого лимита времени: новый запуск
+    продолжит с последней контрольной точки. После REPORT_MAX_RESUMES
+    перезапусков исключение пробрасывается.
+    """
+    retries = task.request.retries
+    if retries >= settings.REPORT_MAX_RESUMES:
+        logger.error(f"Задача {task.name} не уложилась в {retries + 1} запусков")
+        raise exc
+    logger.warning(f"Задача {task.name} прервана по лимиту времени, перезапуск с контрольной точки")
+    raise task.retry(exc=exc, countdown=5, max_retries=settings.REPORT_MAX_RESUMES)
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.15 on 2026-10-19 08:33
+
+import core.models
+import core.storage
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportArtifact',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(db_index=True, help_text='Например: price_comparison, competitor_sales, rfm_report', max_length=100, verbose_name='Тип выгрузки')),
+                ('filename', models.CharField(max_length=255, verbose_name='Имя файла')),
+                ('file', models.FileField(max_length=500, storage=core.storage.get_export_storage, upload_to=core.models.export_artifact_upload_path, verbose_name='Файл')),
+                ('content_type', models.CharField(blank=True, max_length=255, verbose_name='MIME')),
+                ('size', models.BigIntegerField(default=0, verbose_name='Размер, байт')),
+                ('sha256', models.CharField(blank=True, max_length=64, verbose_name='SHA-256')),
+                ('task_id', models.CharField(blank=True, db_index=True, max_length=255, verbose_name='ID задачи Celery')),
+                ('meta', models.JSONField(blank=True, default=dict, verbose_name='Параметры и итоги выгрузки')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Хранить до')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='export_artifacts', to=settings.AUTH_USER_MODEL, verbose_name='Создал')),
+            ],
+            options={
+                'verbose_name': 'Файл выгрузки',
+                'verbose_name_plural': 'Файлы выгрузок',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
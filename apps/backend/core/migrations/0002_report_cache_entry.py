@@ -0,0 +1,40 @@
+# Generated by Django 5.1.15 on 2026-10-19 08:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('report_type', models.CharField(max_length=100, verbose_name='Тип отчета')),
+                ('params_hash', models.CharField(max_length=64, verbose_name='Хэш параметров')),
+                ('data_version', models.BigIntegerField(verbose_name='Версия данных')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='Параметры')),
+                ('task_id', models.CharField(db_index=True, max_length=255, verbose_name='ID задачи Celery')),
+                ('status', models.CharField(choices=[('running', 'Строится'), ('done', 'Готов')], default='running', max_length=16, verbose_name='Статус')),
+                ('result', models.JSONField(blank=True, default=dict, verbose_name='Итоги отчета')),
+                ('size', models.BigIntegerField(default=0, verbose_name='Размер, байт')),
+                ('hits', models.PositiveIntegerField(default=0, verbose_name='Повторных запросов')),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Последний запрос')),
+                ('artifact', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cache_entries', to='core.exportartifact', verbose_name='Файл отчета')),
+            ],
+            options={
+                'verbose_name': 'Кэш отчета',
+                'verbose_name_plural': 'Кэш отчетов',
+                'ordering': ['-last_used_at'],
+                'constraints': [models.UniqueConstraint(fields=('report_type', 'params_hash', 'data_version'), name='uniq_report_cache_entry')],
+            },
+        ),
+    ]
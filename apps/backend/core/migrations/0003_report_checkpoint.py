@@ -0,0 +1,34 @@
+# Generated by Django 5.1.15 on 2026-10-19 09:04
+
+import core.models
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_report_cache_entry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('run_key', models.CharField(db_index=True, max_length=64, verbose_name='Ключ запуска')),
+                ('report_type', models.CharField(max_length=100, verbose_name='Тип отчета')),
+                ('step', models.CharField(max_length=200, verbose_name='Шаг')),
+                ('file', models.FileField(max_length=500, storage=core.storage.get_export_storage, upload_to=core.models.report_checkpoint_upload_path, verbose_name='Файл')),
+                ('size', models.BigIntegerField(default=0, verbose_name='Размер, байт')),
+            ],
+            options={
+                'verbose_name': 'Контрольная точка отчета',
+                'verbose_name_plural': 'Контрольные точки отчетов',
+                'ordering': ['-created_at'],
+                'constraints': [models.UniqueConstraint(fields=('run_key', 'step'), name='uniq_report_checkpoint_step')],
+            },
+        ),
+    ]
@@ -0,0 +1,141 @@
+import uuid
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from core.mixins import TimestampsMixin
+from core.storage import get_export_storage
+
+
+def export_artifact_upload_path(instance, filename):
+    return f"{instance.kind}/{timezone.now():%Y/%m/%d}/{instance.id}/{filename}"
+
+
+def report_checkpoint_upload_path(instance, filename):
+    return f"checkpoints/{instance.run_key}/{filename}"
+
+
+class ExportArtifact(TimestampsMixin, models.Model):
+    """Готовый файл выгрузки/отчета, который отдается пользователю по id"""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(
+        max_length=100,
+        db_index=True,
+        verbose_name=_("Тип выгрузки"),
+        help_text=_("Например: price_comparison, competitor_sales, rfm_report"),
+    )
+    filename = models.CharField(max_length=255, verbose_name=_("Имя файла"))
+    file = models.FileField(
+        upload_to=export_artifact_upload_path,
+        storage=get_export_storage,
+        max_length=500,
+        verbose_name=_("Файл"),
+    )
+    content_type = models.CharField(max_length=255, blank=True, verbose_name=_("MIME"))
+    size = models.BigIntegerField(default=0, verbose_name=_("Размер, байт"))
+    sha256 = models.CharField(max_length=64, blank=True, verbose_name=_("SHA-256"))
+    task_id = models.CharField(max_length=255, blank=True, db_index=True, verbose_name=_("ID задачи Celery"))
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="export_artifacts",
+        verbose_name=_("Создал"),
+    )
+    meta = models.JSONField(default=dict, blank=True, verbose_name=_("Параметры и итоги выгрузки"))
+    expires_at = models.DateTimeField(db_index=True, verbose_name=_("Хранить до"))
+
+    class Meta:
+        verbose_name = _("Файл выгрузки")
+        verbose_name_plural = _("Файлы выгрузок")
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.kind}: {self.filename}"
+
+    @property
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+
+
+class ReportCacheEntry(TimestampsMixin, models.Model):
+    """
+    Готовый (или строящийся) отчет для набора параметров и версии данных.
+
+    Одинаковые запросы получают тот же файл, пока версия данных не изменится;
+    параллельные одинаковые запросы ждут одну и ту же задачу.
+    """
+
+    class Status(models.TextChoices):
+        RUNNING = "running", _("Строится")
+        DONE = "done", _("Готов")
+
+    report_type = models.CharField(max_length=100, verbose_name=_("Тип отчета"))
+    params_hash = models.CharField(max_length=64, verbose_name=_("Хэш параметров"))
+    data_version = models.BigIntegerField(verbose_name=_("Версия данных"))
+    params = models.JSONField(default=dict, blank=True, verbose_name=_("Параметры"))
+    task_id = models.CharField(max_length=255, db_index=True, verbose_name=_("ID задачи Celery"))
+    status = models.CharField(
+        max_length=16, choices=Status.choices, default=Status.RUNNING, verbose_name=_("Статус")
+    )
+    artifact = models.ForeignKey(
+        ExportArtifact,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="cache_entries",
+        verbose_name=_("Файл отчета"),
+    )
+    result = models.JSONField(default=dict, blank=True, verbose_name=_("Итоги отчета"))
+    size = models.BigIntegerField(default=0, verbose_name=_("Размер, байт"))
+    hits = models.PositiveIntegerField(default=0, verbose_name=_("Повторных запросов"))
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name=_("Последний запрос"))
+
+    class Meta:
+        verbose_name = _("Кэш отчета")
+        verbose_name_plural = _("Кэш отчетов")
+        ordering = ["-last_used_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["report_type", "params_hash", "data_version"],
+                name="uniq_report_cache_entry",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.report_type} v{self.data_version} ({self.get_status_display()})"
+
+
+class ReportCheckpoint(TimestampsMixin, models.Model):
+    """
+    Промежуточный итог шага долгого отчета (см. core.checkpoints).
+
+    Перезапущенная задача с теми же параметрами берет готовые шаги
+    из хранилища и продолжает с первого несохраненного.
+    """
+
+    run_key = models.CharField(max_length=64, db_index=True, verbose_name=_("Ключ запуска"))
+    report_type = models.CharField(max_length=100, verbose_name=_("Тип отчета"))
+    step = models.CharField(max_length=200, verbose_name=_("Шаг"))
+    file = models.FileField(
+        upload_to=report_checkpoint_upload_path,
+        storage=get_export_storage,
+        max_length=500,
+        verbose_name=_("Файл"),
+    )
+    size = models.BigIntegerField(default=0, verbose_name=_("Размер, байт"))
+
+    class Meta:
+        verbose_name = _("Контрольная точка отчета")
+        verbose_name_plural = _("Контрольные точки отчетов")
+        ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(fields=["run_key", "step"], name="uniq_report_checkpoint_step")
+        ]
+
+    def __str__(self):
+        return f"{self.report_type}: {self.step}"
@@ -0,0 +1,190 @@
+"""
+Кэш результатов отчетов.
+
+Ключ записи - (тип отчета, нормализованные параметры, версия данных).
+Версия данных - счетчик в Redis, который увеличивается после импорта
+и пересчета исходных данных, поэтому устаревшие отчеты просто перестают
+находиться. Запись ссылается на готовый ExportArtifact и итоги отчета.
+
+- повторный запрос с теми же параметрами сразу получает готовый файл;
+- параллельные одинаковые запросы получают одну и ту же задачу
+  (уникальный ключ записи в БД);
+- при превышении лимита записей или суммарного размера файлов
+  удаляются давно не запрашивавшиеся отчеты (LRU).
+"""
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from core.models import ExportArtifact, ReportCacheEntry
+
+logger = logging.getLogger(__name__)
+
+DATA_VERSION_KEY = "reports:data-version:{namespace}"
+
+
+def get_data_version(namespace) -> int:
+    """Текущая версия исходных данных отчетов (например, 'sales')."""
+    key = DATA_VERSION_KEY.format(namespace=namespace)
+    version = cache.get(key)
+    if version is None:
+        # Начинаем с текущего времени: после сброса Redis версия не вернется
+        # к уже использованным значениям, и старые записи кэша не оживут
+        cache.add(key, int(time.time()), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_data_version(namespace) -> int:
+    """Делает недействительными закэшированные отчеты по этим данным."""
+    key = DATA_VERSION_KEY.format(namespace=namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time.time()), timeout=None)
+        return cache.get(key)
+
+
+def normalize_params(params: dict) -> dict:
+    """Параметры без пустых значений, списки отсортированы - одинаковые запросы дают один ключ."""
+    normalized = {}
+    for name, value in sorted(params.items()):
+        if value is None or value == '' or value == []:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            value = sorted(value)
+        normalized[name] = value
+    return normalized
+
+
+def params_hash(params: dict) -> str:
+    payload = json.dumps(params, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _is_usable(entry) -> bool:
+    if entry.status == ReportCacheEntry.Status.DONE:
+        return entry.artifact is not None and not entry.artifact.is_expired
+    # Зависшая задача не должна блокировать повторный запуск навсегда; каждый
+    # перезапуск с контрольной точки обновляет updated_at (run_cached_report)
+    timeout = timedelta(seconds=settings.REPORT_CACHE_RUNNING_TIMEOUT)
+    return entry.updated_at > timezone.now() - timeout
+
+
+def start_cached_report(report_type, task, params, namespace, key_extra=None, user_id=None):
+    """
+    Возвращает готовый отчет из кэша или запускает задачу его построения.
+
+    Args:
+        report_type: тип отчета (часть ключа)
+        task: Celery-задача отчета, вызывается с params
+        params: параметры отчета
+        namespace: источник данных, чья версия входит в ключ
+        key_extra: значения, которые входят только в ключ (например, дата расчета)
+        user_id: кто запросил отчет - станет владельцем файла, если отчет
+            строится заново (готовый файл из кэша доступен всем)
+
+    Returns:
+        tuple: (ReportCacheEntry, cached) - cached=True, если отчет уже готов
+    """
+    from core.tasks import run_cached_report
+
+    params = normalize_params(params)
+    lookup = {
+        'report_type': report_type,
+        'params_hash': params_hash({**params, **normalize_params(key_extra or {})}),
+        'data_version': get_data_version(namespace),
+    }
+
+    entry = ReportCacheEntry.objects.filter(**lookup).select_related('artifact').first()
+    if entry is not None:
+        if _is_usable(entry):
+            ReportCacheEntry.objects.filter(pk=entry.pk).update(
+                hits=F('hits') + 1, last_used_at=timezone.now()
+            )
+            return entry, entry.status == ReportCacheEntry.Status.DONE
+        entry.delete()
+
+    task_id = str(uuid.uuid4())
+    try:
+        with transaction.atomic():
+            entry = ReportCacheEntry.objects.create(**lookup, params=params, task_id=task_id)
+    except IntegrityError:
+        # Такой же запрос пришел одновременно - используем его задачу
+        entry = ReportCacheEntry.objects.get(**lookup)
+        return entry, entry.status == ReportCacheEntry.Status.DONE
+
+    transaction.on_commit(
+        lambda: run_cached_report.apply_async(args=[entry.pk, task.name, user_id], task_id=task_id)
+    )
+    return entry, False
+
+
+def store_report_result(entry_id, result):
+    """Сохраняет итог задачи в запись кэша; ошибки не кэшируются."""
+    if isinstance(result, dict) and result.get('artifact_id') and 'error' not in result:
+        updated = ReportCacheEntry.objects.filter(pk=entry_id).update(
+            status=ReportCacheEntry.Status.DONE,
+            artifact_id=result['artifact_id'],
+            result=result,
+            size=result.get('size') or 0,
+            last_used_at=timezone.now(),
+        )
+        if updated:
+            evict_report_cache()
+    else:
+        ReportCacheEntry.objects.filter(pk=entry_id).delete()
+
+
+def cached_report_by_task(task_id):
+    """Готовая запись кэша по id задачи (если результат в Celery уже истек)."""
+    return (
+        ReportCacheEntry.objects.filter(task_id=task_id, status=ReportCacheEntry.Status.DONE)
+        .only('result')
+        .first()
+    )
+
+
+def evict_report_cache() -> int:
+    """
+    Удаляет давно не запрашивавшиеся отчеты, пока записи не уложатся
+    в REPORT_CACHE_MAX_ENTRIES и REPORT_CACHE_MAX_BYTES.
+
+    Returns:
+        int: количество удаленных отчетов
+    """
+    done = ReportCacheEntry.objects.filter(status=ReportCacheEntry.Status.DONE)
+    totals = done.aggregate(count=Count('id'), size=Sum('size'))
+    count, size = totals['count'], totals['size'] or 0
+    max_entries = settings.REPORT_CACHE_MAX_ENTRIES
+    max_bytes = settings.REPORT_CACHE_MAX_BYTES
+    if count <= max_entries and size <= max_bytes:
+        return 0
+
+    artifact_ids = []
+    for artifact_id, entry_size in done.order_by('last_used_at').values_list('artifact_id', 'size').iterator():
+        if count <= max_entries and size <= max_bytes:
+            break
+        artifact_ids.append(artifact_id)
+        count -= 1
+        size -= entry_size
+
+    # Файл удаляется вместе с записью (каскадно), иначе лимит размера не освободится
+    for artifact in ExportArtifact.objects.filter(pk__in=artifact_ids):
+        try:
+            artifact.file.delete(save=False)
+        except Exception as e:
+            logger.error(f"Не удалось удалить файл отчета {artifact.pk}: {e}")
+    ExportArtifact.objects.filter(pk__in=artifact_ids).delete()
+
+    logger.info(f"Из кэша отчетов вытеснено {len(artifact_ids)} отчетов")
+    return len(artifact_ids)
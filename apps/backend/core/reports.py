@@ -0,0 +1,412 @@
+"""
+Потоковая запись отчетов и экспортов: XLSX, CSV и Parquet.
+
+Строки пишутся напрямую из итераторов (queryset.iterator(), курсор MySQL,
+генераторы), без промежуточного DataFrame и без накопления всего файла
+в памяти. XLSX пишется через openpyxl в режиме write_only.
+"""
+import csv
+import io
+import math
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+CONTENT_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# Excel ограничивает название листа 31 символом и запрещает часть символов
+SHEET_TITLE_MAX_LENGTH = 31
+SHEET_TITLE_FORBIDDEN = str.maketrans(dict.fromkeys('[]:*?/\\', ' '))
+
+MAX_COLUMN_WIDTH = 50
+WIDTH_SAMPLE_SIZE = 200
+
+HEADER_FONT = Font(bold=True)
+HEADER_FILL = PatternFill(start_color='D9E1F2', end_color='D9E1F2', fill_type='solid')
+TITLE_FONT = Font(bold=True, size=14)
+
+MONEY_FORMAT = '#,##0.00'
+PERCENT_FORMAT = '0.00'
+INTEGER_FORMAT = '#,##0'
+
+
+def clean_value(value):
+    """Приводит значение к виду, который понимают openpyxl/csv/pyarrow."""
+    if value is None:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, datetime):
+        if value != value:  # pandas.NaT
+            return None
+        # Excel не поддерживает часовые пояса
+        if timezone.is_aware(value):
+            value = timezone.localtime(value).replace(tzinfo=None)
+        return value
+    if isinstance(value, (str, int, float, Decimal, date, bool)):
+        return value
+    # numpy-скаляры, pandas.Timestamp/NaT и прочее
+    if hasattr(value, 'item'):
+        try:
+            return clean_value(value.item())
+        except (ValueError, TypeError):
+            pass
+    if hasattr(value, 'to_pydatetime'):
+        try:
+            return clean_value(value.to_pydatetime())
+        except ValueError:
+            return None
+    return str(value)
+
+
+def _row_values(row, columns):
+    if isinstance(row, dict):
+        return [clean_value(row.get(column)) for column in columns]
+    return [clean_value(value) for value in row]
+
+
+def dataframe_rows(df):
+    """Итератор строк DataFrame в виде кортежей (без копирования всего фрейма)."""
+    return df.itertuples(index=False, name=None)
+
+
+def _text_length(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, datetime):
+        return 16
+    if isinstance(value, float):
+        return len(f"{value:,.2f}")
+    return max((len(line) for line in str(value).split('\n')), default=0)
+
+
+class ReportWorkbook:
+    """
+    Многолистовая XLSX-книга с потоковой записью (openpyxl write_only).
+
+    Память не растёт с количеством строк: openpyxl сбрасывает строки
+    во временный файл по мере записи. Ширина колонок подбирается по первым
+    WIDTH_SAMPLE_SIZE строкам листа.
+
+        with ReportWorkbook(path) as workbook:
+            workbook.add_sheet('Продажи', columns, rows_iterator,
+                               number_formats={'Сумма': MONEY_FORMAT})
+            workbook.add_dataframe('Сводка', summary_df)
+            workbook.add_columns('Параметры отчета', params_data)
+    """
+
+    def __init__(self, target):
+        """
+        Args:
+            target: путь к файлу или бинарный file-like объект
+        """
+        self.target = target
+        self.workbook = Workbook(write_only=True)
+        self.rows_written = {}
+        self._titles = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.save()
+        else:
+            self.workbook.close()
+        return False
+
+    def _sheet_title(self, title: str) -> str:
+        base = str(title).translate(SHEET_TITLE_FORBIDDEN)[:SHEET_TITLE_MAX_LENGTH]
+        candidate = base
+        counter = 1
+        while candidate in self._titles:
+            counter += 1
+            suffix = f" ({counter})"
+            candidate = base[:SHEET_TITLE_MAX_LENGTH - len(suffix)] + suffix
+        self._titles.add(candidate)
+        return candidate
+
+    def add_sheet(
+        self,
+        title,
+        columns,
+        rows,
+        *,
+        number_formats=None,
+        widths=None,
+        heading=None,
+        footer=None,
+        freeze_header=True,
+    ) -> int:
+        """
+        Добавляет лист и потоково записывает в него строки.
+
+        Args:
+            title: название листа
+            columns: список заголовков колонок
+            rows: итерируемое строк - последовательности значений по порядку
+                колонок или словари с ключами-заголовками
+            number_formats: {заголовок: формат Excel} для числовых колонок
+            widths: {заголовок: ширина} - явная ширина колонки
+            heading: заголовок над таблицей (первая строка листа)
+            footer: итоговая строка под таблицей (выделяется жирным)
+            freeze_header: закрепить строку заголовков
+
+        Returns:
+            int: количество записанных строк данных
+        """
+        columns = list(columns)
+        number_formats = number_formats or {}
+        widths = widths or {}
+        sheet = self.workbook.create_sheet(self._sheet_title(title))
+
+        rows = iter(rows)
+        sample = [_row_values(row, columns) for row in islice(rows, WIDTH_SAMPLE_SIZE)]
+
+        # В режиме write_only размеры и закрепление задаются до записи строк
+        for index, column in enumerate(columns):
+            width = widths.get(column)
+            if width is None:
+                longest = max(
+                    [_text_length(column)] + [_text_length(values[index]) for values in sample if index < len(values)]
+                )
+                width = min(longest + 2, MAX_COLUMN_WIDTH)
+            sheet.column_dimensions[get_column_letter(index + 1)].width = width
+
+        header_row = 1
+        if heading:
+            title_cell = WriteOnlyCell(sheet, value=heading)
+            title_cell.font = TITLE_FONT
+            sheet.append([title_cell])
+            header_row = 2
+        if freeze_header:
+            sheet.freeze_panes = f"A{header_row + 1}"
+
+        header = []
+        for column in columns:
+            cell = WriteOnlyCell(sheet, value=column)
+            cell.font = HEADER_FONT
+            cell.fill = HEADER_FILL
+            cell.alignment = Alignment(wrap_text=True, vertical='center')
+            header.append(cell)
+        sheet.append(header)
+
+        formatted = {columns.index(column): fmt for column, fmt in number_formats.items() if column in columns}
+
+        def write(values):
+            if formatted:
+                values = list(values)
+                for index, fmt in formatted.items():
+                    if index < len(values) and values[index] is not None:
+                        cell = WriteOnlyCell(sheet, value=values[index])
+                        cell.number_format = fmt
+                        values[index] = cell
+            sheet.append(values)
+
+        count = 0
+        for values in sample:
+            write(values)
+            count += 1
+        for row in rows:
+            write(_row_values(row, columns))
+            count += 1
+
+        if footer is not None:
+            footer_cells = []
+            for index, value in enumerate(_row_values(footer, columns)):
+                cell = WriteOnlyCell(sheet, value=value)
+                cell.font = HEADER_FONT
+                if index in formatted and value is not None:
+                    cell.number_format = formatted[index]
+                footer_cells.append(cell)
+            sheet.append(footer_cells)
+
+        self.rows_written[sheet.title] = count
+        return count
+
+    def add_dataframe(self, title, df, **kwargs) -> int:
+        """Добавляет лист из DataFrame (для небольших сводных таблиц)."""
+        return self.add_sheet(title, [str(c) for c in df.columns], dataframe_rows(df), **kwargs)
+
+    def add_columns(self, title, data, **kwargs) -> int:
+        """Добавляет лист из словаря {заголовок: список значений} (параметры, пояснения)."""
+        return self.add_sheet(title, list(data), zip(*data.values(), strict=True), **kwargs)
+
+    def save(self):
+        self.workbook.save(self.target)
+
+
+def write_xlsx(target, columns, rows, sheet_title='Данные', **kwargs) -> int:
+    """Однолистовой XLSX из итератора строк."""
+    with ReportWorkbook(target) as workbook:
+        return workbook.add_sheet(sheet_title, columns, rows, **kwargs)
+
+
+def write_csv(target, columns, rows, delimiter=';') -> int:
+    """
+    Потоковая запись CSV.
+
+    Файл открывается в UTF-8 с BOM и разделителем ";", чтобы Excel
+    корректно открывал его двойным кликом.
+
+    Args:
+        target: путь к файлу или бинарный file-like объект
+    """
+    columns = list(columns)
+    if isinstance(target, (str, bytes)) or hasattr(target, '__fspath__'):
+        stream = open(target, 'w', newline='', encoding='utf-8-sig')
+        close_stream = True
+    else:
+        stream = io.TextIOWrapper(target, encoding='utf-8-sig', newline='')
+        close_stream = False
+
+    count = 0
+    try:
+        writer = csv.writer(stream, delimiter=delimiter)
+        writer.writerow(columns)
+        for row in rows:
+            values = _row_values(row, columns)
+            writer.writerow(['' if value is None else value for value in values])
+            count += 1
+    finally:
+        if close_stream:
+            stream.close()
+        else:
+            stream.flush()
+            stream.detach()
+    return count
+
+
+class _ChunkBuffer:
+    """Файлоподобный приемник: накапливает записанные байты до выдачи клиенту."""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class _EchoText:
+    def write(self, value):
+        return value
+
+
+def iter_csv(columns, rows, delimiter=';', chunk_size=1000):
+    """
+    CSV по частям для StreamingHttpResponse (UTF-8 с BOM, как write_csv).
+
+    Yields:
+        bytes: блоки примерно по chunk_size строк
+    """
+    writer = csv.writer(_EchoText(), delimiter=delimiter)
+    columns = list(columns)
+    yield '\ufeff'.encode('utf-8') + writer.writerow(columns).encode('utf-8')
+    rows = iter(rows)
+    while True:
+        lines = [
+            writer.writerow(['' if value is None else value for value in _row_values(row, columns)])
+            for row in islice(rows, chunk_size)
+        ]
+        if not lines:
+            break
+        yield ''.join(lines).encode('utf-8')
+
+
+def iter_parquet(columns, rows, schema, chunk_size=50000):
+    """
+    Parquet по группам строк для StreamingHttpResponse: каждая группа
+    отдается клиенту сразу после записи, в памяти - не больше одной группы.
+
+    Args:
+        schema: схема pyarrow с колонками в порядке columns. Схема задается
+            явно: выведенная из группы строк, она зависит от данных (колонка
+            из одних None, Decimal разной точности) и расходится между группами.
+    """
+    # pyarrow нужен только для Parquet - импорт не замедляет загрузку модуля
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = list(columns)
+    rows = iter(rows)
+    buffer = _ChunkBuffer()
+    writer = pq.ParquetWriter(buffer, schema)
+    try:
+        while True:
+            chunk = [_row_values(row, columns) for row in islice(rows, chunk_size)]
+            if not chunk:
+                break
+            data = {column: [values[index] for values in chunk] for index, column in enumerate(columns)}
+            writer.write_table(pa.Table.from_pydict(data, schema=schema))
+            yield buffer.take()
+    finally:
+        writer.close()
+    # Футер с метаданными пишется при закрытии
+    yield buffer.take()
+
+
+def iter_rows(fmt, columns, rows, schema=None):
+    """
+    Блоки байт файла в формате csv или parquet для потоковой отдачи.
+
+    Args:
+        schema: схема pyarrow, обязательна для parquet
+    """
+    if fmt == 'csv':
+        return iter_csv(columns, rows)
+    if fmt == 'parquet':
+        if schema is None:
+            raise ValueError("Для выгрузки в Parquet нужна схема колонок")
+        return iter_parquet(columns, rows, schema)
+    raise ValueError(f"Неподдерживаемый формат потоковой выгрузки: {fmt}. Доступны: csv, parquet")
+
+
+_END = object()
+
+
+async def aiter_chunks(chunks):
+    """
+    Асинхронный итератор блоков для StreamingHttpResponse под ASGI.
+
+    Синхронный итератор Django под ASGI сначала собирает целиком
+    (sync_to_async(list)) и только потом отдает клиенту. Здесь каждый
+    блок читается отдельно через sync_to_async - в памяти один блок,
+    а запросы к БД идут в одном потоке с одним подключением.
+    """
+    chunks = iter(chunks)
+    next_chunk = sync_to_async(next)
+    try:
+        while True:
+            chunk = await next_chunk(chunks, _END)
+            if chunk is _END:
+                break
+            yield chunk
+    finally:
+        # Клиент отключился - закрываем генератор (курсор, файл)
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            await sync_to_async(close)()
@@ -0,0 +1,45 @@
+"""
+Пакетный импорт без построчных сигналов.
+
+Сигналы сохранения пересчитывают производные данные одной записи (текст
+для поиска, измерения витрины продаж, числовые параметры). Импорт сохраняет
+десятки тысяч записей подряд, поэтому внутри bulk_import() такие сигналы
+пропускаются, а импорт после загрузки пересчитывает данные одним запросом:
+
+    with transaction.atomic(), bulk_import():
+        for item in rows:
+            Product.objects.update_or_create(...)
+        sync_fact_dimensions()
+
+Сигналы, которые копят изменения до коммита (итоги счетов, свертки продаж),
+регистрируют обработчик через on_commit_once - один на транзакцию, а не
+на каждую строку.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+
+_bulk_import = ContextVar('bulk_import', default=False)
+
+
+@contextmanager
+def bulk_import():
+    token = _bulk_import.set(True)
+    try:
+        yield
+    finally:
+        _bulk_import.reset(token)
+
+
+def in_bulk_import() -> bool:
+    """True внутри bulk_import(): построчный пересчет сделает сам импорт."""
+    return _bulk_import.get()
+
+
+def on_commit_once(func, using=None):
+    """transaction.on_commit, если func еще не ждет коммита текущей транзакции."""
+    connection = transaction.get_connection(using)
+    # После отката Django убирает обработчики транзакции - func зарегистрируется заново
+    if not any(callback[1] is func for callback in connection.run_on_commit):
+        transaction.on_commit(func, using=using)
@@ -0,0 +1,12 @@
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+@lru_cache(maxsize=1)
+def get_export_storage():
+    """Хранилище выгрузок по настройке EXPORT_ARTIFACTS_STORAGE (MEDIA_ROOT или S3/MinIO)."""
+    config = settings.EXPORT_ARTIFACTS_STORAGE
+    storage_class = import_string(config["BACKEND"])
+    return storage_class(**config.get("OPTIONS", {}))
@@ -0,0 +1,85 @@
+import logging
+
+from celery import current_app, shared_task
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.utils import timezone
+
+from core.checkpoints import cleanup_report_checkpoints, retry_from_checkpoint
+from core.models import ExportArtifact, ReportCacheEntry
+from core.report_cache import store_report_result
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def cleanup_expired_export_artifacts(batch_size: int = 500):
+    """
+    Удаляет просроченные файлы выгрузок из хранилища и их записи из БД.
+    """
+    deleted = 0
+    errors = 0
+    while True:
+        batch = list(
+            ExportArtifact.objects.filter(expires_at__lte=timezone.now())
+            .order_by('expires_at')[:batch_size]
+        )
+        if not batch:
+            break
+
+        removed_ids = []
+        for artifact in batch:
+            try:
+                if artifact.file:
+                    artifact.file.delete(save=False)
+                removed_ids.append(artifact.pk)
+            except Exception as e:
+                errors += 1
+                logger.error(f"Не удалось удалить файл выгрузки {artifact.pk}: {e}")
+
+        ExportArtifact.objects.filter(pk__in=removed_ids).delete()
+        deleted += len(removed_ids)
+        if len(removed_ids) < len(batch):
+            # Оставшиеся файлы не удалились - не крутимся на них в цикле
+            break
+
+    checkpoints = cleanup_report_checkpoints()
+
+    logger.info(
+        f"Очистка выгрузок завершена: удалено {deleted}, ошибок {errors}, "
+        f"контрольных точек отчетов {checkpoints}"
+    )
+    return {"deleted": deleted, "errors": errors, "checkpoints": checkpoints}
+
+
+@shared_task(bind=True, soft_time_limit=settings.REPORT_SOFT_TIME_LIMIT)
+def run_cached_report(self, entry_id, task_name, user_id=None):
+    """
+    Строит отчет для записи кэша отчетов (см. core.report_cache).
+
+    Задача отчета вызывается в этом же процессе, результат сохраняется
+    в запись кэша и возвращается как результат этой задачи. Отчет,
+    прерванный по лимиту времени, перезапускается и продолжает
+    с контрольной точки (core.checkpoints).
+    """
+    entry = ReportCacheEntry.objects.filter(pk=entry_id, status=ReportCacheEntry.Status.RUNNING).only('params').first()
+    if entry is None:
+        # Запись признана зависшей и заменена новым запуском (или удалена) -
+        # этот запуск больше никому не нужен
+        logger.warning(f"Запись кэша отчета {entry_id} не найдена, задача {task_name} не запускается")
+        return {"error": "Отчет перезапущен другим запросом"}
+    # Отметка (пере)запуска: пока идут перезапуски, запись не считается зависшей
+    ReportCacheEntry.objects.filter(pk=entry_id).update(updated_at=timezone.now())
+    try:
+        result = current_app.tasks[task_name](**entry.params, user_id=user_id)
+    except SoftTimeLimitExceeded as e:
+        try:
+            retry_from_checkpoint(self, e)
+        except SoftTimeLimitExceeded:
+            ReportCacheEntry.objects.filter(pk=entry_id).delete()
+            raise
+    except Exception:
+        ReportCacheEntry.objects.filter(pk=entry_id).delete()
+        raise
+    store_report_result(entry_id, result)
+    return result
@@ -1,3 +1,51 @@
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 
-# Create your views here.
+from core.artifacts import artifact_response, can_download, task_result_artifact
+from core.models import ExportArtifact
+
+
+def _gone_response():
+    return Response(
+        {"status": "failed", "error": "Срок хранения файла истек, сформируйте выгрузку заново"},
+        status=status.HTTP_410_GONE
+    )
+
+
+def _forbidden_response():
+    return Response(
+        {"status": "failed", "error": "Файл выгрузки доступен только запросившему ее пользователю"},
+        status=status.HTTP_403_FORBIDDEN
+    )
+
+
+def task_result_download(request, result):
+    """Ответ со скачиванием файла из результата задачи экспорта (artifact_id)."""
+    artifact = task_result_artifact(result)
+    if artifact is None or artifact.is_expired:
+        return _gone_response()
+    if not can_download(request.user, artifact):
+        return _forbidden_response()
+    return artifact_response(request, artifact)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def download_export_artifact(request, artifact_id):
+    """
+    Скачивание готовой выгрузки/отчета.
+
+    GET /api/exports/<artifact_id>/download/
+
+    Файл отдается потоково, поддерживается заголовок Range для докачки.
+    Доступ - у запросившего выгрузку и у сотрудников (см. can_download).
+    """
+    artifact = get_object_or_404(ExportArtifact, pk=artifact_id)
+    if artifact.is_expired:
+        return _gone_response()
+    if not can_download(request.user, artifact):
+        return _forbidden_response()
+    return artifact_response(request, artifact)
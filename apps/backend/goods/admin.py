@@ -1,6 +1,6 @@
 from django.contrib import admin
 from unfold.admin import ModelAdmin
-from .models import ProductGroup, ProductSubgroup, Brand, Product, FileBlob, ProductFile
+from .models import ProductGroup, ProductSubgroup, Brand, Product, ProductParameter, ProductSearchState, FileBlob, ProductFile
 
 
 class ProductSubgroupInline(admin.TabularInline):
@@ -16,6 +16,18 @@ class ProductInline(admin.TabularInline):
     readonly_fields = ('ext_id',)
 
 
+class ProductParameterInline(admin.TabularInline):
+    # Заполняется разбором tech_params при сохранении товара (goods.params)
+    model = ProductParameter
+    extra = 0
+    can_delete = False
+    fields = ('name', 'raw', 'value', 'value_min', 'value_max', 'unit', 'tolerance')
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(ProductGroup)
 class ProductGroupAdmin(ModelAdmin):
     list_display = ('name', 'ext_id', 'subgroup_count')
@@ -60,6 +72,7 @@ class ProductAdmin(ModelAdmin):
     list_filter = ('subgroup__group', 'subgroup', 'brand', 'product_manager', 'deleted_at')
     search_fields = ('name', 'complex_name', 'description')
     readonly_fields = ('ext_id', 'deleted_at')
+    inlines = [ProductParameterInline]
     
     fieldsets = (
         ('Основная информация', {
@@ -99,6 +112,14 @@ class ProductAdmin(ModelAdmin):
     restore_deleted.short_description = 'Восстановить удалённые товары'
 
 
+@admin.register(ProductSearchState)
+class ProductSearchStateAdmin(ModelAdmin):
+    list_display = ('product_id', 'dirty', 'changed_at', 'synced_at')
+    list_filter = ('dirty',)
+    search_fields = ('product_id',)
+    readonly_fields = ('product_id', 'doc_hash', 'changed_at', 'synced_at')
+
+
 @admin.register(FileBlob)
 class FileBlobAdmin(ModelAdmin):
     list_display = ('sha256', 'size', 'mime_type', 'created_at')
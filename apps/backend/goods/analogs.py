@@ -0,0 +1,278 @@
+"""
+Поиск аналогов товара по техническим параметрам.
+
+Аналог ищется в той же подгруппе: у резисторов и конденсаторов разные
+наборы параметров, поэтому у каждой подгруппы свое пространство признаков.
+Блок подгруппы строится из числовых параметров (ProductParameter,
+goods.params) одним запросом:
+- колонка - ключ параметра (у диапазонов ключ_min/ключ_max, у допуска
+  ключ_tolerance), встречающийся хотя бы у MIN_KEY_SHARE товаров подгруппы;
+- значения, разброс которых больше двух порядков, берутся в логарифме
+  (10 кОм и 100 кОм отличаются так же, как 1 кОм и 10 кОм), затем
+  стандартизуются; маска отмечает заданные значения.
+
+Близость двух товаров - exp(-RMS) разности по общим параметрам, умноженная
+на долю общих параметров; совпадение бренда добавляет BRAND_WEIGHT.
+
+Большие подгруппы (больше IVF_MIN_SIZE товаров) разбиваются k-means на ячейки
+(инвертированный файл, IVF): запрос сравнивается только с товарами NPROBE
+ближайших ячеек - приближенный поиск ближайших соседей.
+
+Блоки хранятся в Redis без срока жизни. Изменение разобранных параметров
+товара удаляет блок его подгруппы после коммита транзакции (до коммита
+запрос аналогов построил бы блок из старых строк и он остался бы в кэше).
+После импорта товаров refresh_product_analogs перестраивает измененные
+подгруппы, ежедневный запуск достраивает недостающие блоки, а запрос
+к подгруппе без блока строит его на месте.
+"""
+import logging
+import math
+from itertools import groupby
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import Product, ProductParameter
+
+logger = logging.getLogger(__name__)
+
+BLOCK_KEY = "goods:analogs:subgroup:{subgroup_id}"
+
+# Параметр входит в признаки, если задан хотя бы у такой доли товаров подгруппы
+MIN_KEY_SHARE = 0.05
+# Значения с отношением максимума к минимуму больше этого берутся в логарифме
+LOG_SCALE_RATIO = 100
+BRAND_WEIGHT = 0.1
+
+IVF_MIN_SIZE = 2000
+IVF_CELL_SIZE = 500
+IVF_ITERATIONS = 10
+NPROBE = 3
+
+
+def _parameter_rows(subgroup_ids=None):
+    """(подгруппа, товар, бренд, ключ, значение, минимум, максимум, допуск) по подгруппам."""
+    queryset = ProductParameter.objects.filter(product__deleted_at__isnull=True)
+    if subgroup_ids is not None:
+        queryset = queryset.filter(product__subgroup_id__in=subgroup_ids)
+    return queryset.order_by('product__subgroup_id', 'product_id').values_list(
+        'product__subgroup_id', 'product_id', 'product__brand_id',
+        'key', 'value', 'value_min', 'value_max', 'tolerance',
+    ).iterator(chunk_size=5000)
+
+
+def _features(rows):
+    """Признаки товаров подгруппы: {id товара: (бренд, {колонка: значение})}."""
+    products = {}
+    for _, product_id, brand_id, key, value, value_min, value_max, tolerance in rows:
+        features = products.setdefault(product_id, (brand_id or -1, {}))[1]
+        if value is not None:
+            features[key] = value
+        else:
+            features[f'{key}_min'] = value_min
+            features[f'{key}_max'] = value_max
+        if tolerance is not None:
+            features[f'{key}_tolerance'] = tolerance
+    return products
+
+
+def _kmeans(X, k, iterations=IVF_ITERATIONS):
+    """Центры и номера ячеек k-means (детерминированная инициализация)."""
+    rng = np.random.default_rng(0)
+    centroids = X[rng.choice(len(X), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (X ** 2).sum(1)[:, None] - 2 * X @ centroids.T + (centroids ** 2).sum(1)[None, :]
+        cells = distances.argmin(1)
+        for cell in range(k):
+            members = X[cells == cell]
+            if len(members):
+                centroids[cell] = members.mean(0)
+    distances = (X ** 2).sum(1)[:, None] - 2 * X @ centroids.T + (centroids ** 2).sum(1)[None, :]
+    return centroids, distances.argmin(1)
+
+
+def build_block(rows):
+    """
+    Блок подгруппы из строк _parameter_rows одной подгруппы.
+
+    Returns:
+        dict: product_ids, brand_ids, columns, X (стандартизованные значения,
+        пропуски - 0), mask, а для IVF - centroids, cell_order, cell_offsets;
+        None - если параметров для сравнения нет
+    """
+    products = _features(rows)
+    if len(products) < 2:
+        return None
+    counts = {}
+    for _, features in products.values():
+        for column in features:
+            counts[column] = counts.get(column, 0) + 1
+    min_count = max(2, math.ceil(len(products) * MIN_KEY_SHARE))
+    columns = sorted(column for column, count in counts.items() if count >= min_count)
+    if not columns:
+        return None
+
+    product_ids = np.fromiter(products, dtype=np.int64, count=len(products))
+    brand_ids = np.array([brand_id for brand_id, _ in products.values()], dtype=np.int64)
+    position = {column: index for index, column in enumerate(columns)}
+    X = np.full((len(products), len(columns)), np.nan)
+    for row, (_, features) in enumerate(products.values()):
+        for column, value in features.items():
+            if column in position:
+                X[row, position[column]] = value
+
+    mask = ~np.isnan(X)
+    for index in range(len(columns)):
+        values = X[mask[:, index], index]
+        if values.min() > 0 and values.max() / values.min() > LOG_SCALE_RATIO:
+            values = np.log10(values)
+        std = values.std()
+        X[mask[:, index], index] = (values - values.mean()) / (std if std > 0 else 1)
+    X = np.where(mask, X, 0).astype(np.float32)
+
+    block = {
+        'product_ids': product_ids,
+        'brand_ids': brand_ids,
+        'columns': columns,
+        'X': X,
+        'mask': mask,
+    }
+    if len(products) > IVF_MIN_SIZE:
+        centroids, cells = _kmeans(X, math.ceil(len(products) / IVF_CELL_SIZE))
+        block['centroids'] = centroids.astype(np.float32)
+        block['cell_order'] = np.argsort(cells, kind='stable')
+        block['cell_offsets'] = np.searchsorted(cells[block['cell_order']], np.arange(len(centroids) + 1))
+    return block
+
+
+def store_blocks(subgroup_ids=None) -> int:
+    """
+    Строит и сохраняет блоки подгрупп одним потоковым запросом.
+
+    Args:
+        subgroup_ids: подгруппы (None - все)
+
+    Returns:
+        int: количество сохраненных блоков
+    """
+    stored = 0
+    seen = set()
+    for subgroup_id, rows in groupby(_parameter_rows(subgroup_ids), key=lambda row: row[0]):
+        seen.add(subgroup_id)
+        # Пустой блок тоже сохраняется: подгруппа без параметров не строится заново на каждый запрос
+        cache.set(BLOCK_KEY.format(subgroup_id=subgroup_id), build_block(rows) or {}, timeout=None)
+        stored += 1
+    for subgroup_id in set(subgroup_ids or ()) - seen:
+        cache.set(BLOCK_KEY.format(subgroup_id=subgroup_id), {}, timeout=None)
+    return stored
+
+
+def invalidate_subgroups(subgroup_ids):
+    """Удаляет блоки подгрупп после коммита транзакции, изменившей параметры их товаров."""
+    keys = [BLOCK_KEY.format(subgroup_id=subgroup_id) for subgroup_id in set(subgroup_ids)]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def missing_subgroups(subgroup_ids) -> list:
+    keys = {BLOCK_KEY.format(subgroup_id=subgroup_id): subgroup_id for subgroup_id in subgroup_ids}
+    found = cache.get_many(list(keys))
+    return [subgroup_id for key, subgroup_id in keys.items() if key not in found]
+
+
+def get_block(subgroup_id):
+    block = cache.get(BLOCK_KEY.format(subgroup_id=subgroup_id))
+    if block is None:
+        store_blocks([subgroup_id])
+        block = cache.get(BLOCK_KEY.format(subgroup_id=subgroup_id))
+    return block or None
+
+
+def _candidates(block, query):
+    """Номера строк блока для сравнения: все или товары NPROBE ближайших ячеек."""
+    if 'centroids' not in block:
+        return np.arange(len(block['product_ids']))
+    distances = ((block['centroids'] - query) ** 2).sum(1)
+    cells = np.argsort(distances)[:NPROBE]
+    offsets = block['cell_offsets']
+    return np.concatenate([block['cell_order'][offsets[cell]:offsets[cell + 1]] for cell in cells])
+
+
+def nearest(block, product_id, limit=10, other_brands=False) -> list:
+    """
+    Ближайшие товары блока.
+
+    Returns:
+        list: [(id товара, близость, число общих параметров)] по убыванию близости
+    """
+    rows = np.flatnonzero(block['product_ids'] == product_id)
+    if not len(rows):
+        return []
+    row = rows[0]
+    query, query_mask = block['X'][row], block['mask'][row]
+    brand_id = block['brand_ids'][row]
+
+    candidates = _candidates(block, query)
+    candidates = candidates[candidates != row]
+    if other_brands and brand_id != -1:
+        candidates = candidates[block['brand_ids'][candidates] != brand_id]
+
+    shared = block['mask'][candidates] & query_mask
+    shared_count = shared.sum(1)
+    union_count = (block['mask'][candidates] | query_mask).sum(1)
+    keep = shared_count > 0
+    candidates, shared, shared_count, union_count = (
+        candidates[keep], shared[keep], shared_count[keep], union_count[keep]
+    )
+    if not len(candidates):
+        return []
+
+    squared = np.where(shared, (block['X'][candidates] - query) ** 2, 0).sum(1)
+    similarity = np.exp(-np.sqrt(squared / shared_count)) * shared_count / union_count
+    same_brand = (block['brand_ids'][candidates] == brand_id) & (brand_id != -1)
+    scores = (1 - BRAND_WEIGHT) * similarity + BRAND_WEIGHT * same_brand
+
+    top = np.argpartition(-scores, min(limit, len(scores)) - 1)[:limit]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return [
+        (int(block['product_ids'][candidates[index]]), round(float(scores[index]), 4), int(shared_count[index]))
+        for index in top
+    ]
+
+
+def find_analogs(product, limit=10, other_brands=False) -> list:
+    """
+    Аналоги товара в его подгруппе.
+
+    Returns:
+        list: [{product_id, name, brand, complex_name, similarity, shared_params}]
+    """
+    block = get_block(product.subgroup_id)
+    if not block:
+        return []
+    # Запас на товары, удаленные или перенесенные в другую подгруппу после построения блока
+    found = nearest(block, product.pk, limit=limit * 2, other_brands=other_brands)
+    products = {
+        item['id']: item
+        for item in Product.objects.filter(
+            pk__in=[product_id for product_id, _, _ in found], subgroup_id=product.subgroup_id
+        ).values('id', 'name', 'complex_name', brand_name=F('brand__name'))
+    }
+    result = []
+    for product_id, similarity, shared_params in found:
+        item = products.get(product_id)
+        if item is None:
+            continue
+        result.append({
+            'product_id': product_id,
+            'name': item['name'],
+            'brand': item['brand_name'] or '',
+            'complex_name': item['complex_name'],
+            'similarity': similarity,
+            'shared_params': shared_params,
+        })
+        if len(result) >= limit:
+            break
+    return result
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class GoodsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'goods'
+
+    def ready(self):
+        # Сигналы текста для поиска по базе, пометки товаров для синхронизации индекса,
+        # версии каталога для автокомплита и числовых техпараметров
+        from . import autocomplete, params, search, search_sync  # noqa: F401
@@ -0,0 +1,255 @@
+"""
+Автокомплит брендов, подгрупп и групп товаров из памяти процесса.
+
+Индекс строится одним запросом (UNION по трем справочникам) при первом
+обращении в процессе и перестраивается, когда меняется версия каталога -
+счетчик в Redis (core.report_cache), который увеличивают сигналы сохранения
+и удаления брендов, подгрупп, групп и менеджеров. Запросы автокомплита
+не обращаются к PostgreSQL.
+
+Поиск ищет вхождение запроса (как icontains) в название и его семантическую
+транслитерацию, запрос проверяется во всех вариантах раскладки
+(TransliterationUtils):
+- запросы от трех символов - пересечение списков триграмм;
+- короткие запросы - начало слова, бинарный поиск по отсортированным словам.
+Сначала идут названия, начинающиеся с запроса, затем совпадения с начала
+слова, затем остальные.
+
+Отпечаток содержимого (digest) одинаков во всех процессах с одинаковыми
+данными и служит ETag ответов.
+"""
+import hashlib
+import json
+import logging
+import threading
+from bisect import bisect_left
+
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.models import User
+from core.report_cache import bump_data_version, get_data_version
+
+from .models import Brand, ProductGroup, ProductSubgroup
+from .utils import TransliterationUtils
+
+logger = logging.getLogger(__name__)
+
+# Пространство версий данных справочников каталога
+CATALOG_DATA_NAMESPACE = 'catalog'
+
+KIND_BRAND = 'brand'
+KIND_SUBGROUP = 'subgroup'
+KIND_GROUP = 'group'
+KINDS = (KIND_BRAND, KIND_SUBGROUP, KIND_GROUP)
+
+# Имя менеджера - как User.get_full_name()
+CATALOG_NAMES_SQL = """
+    SELECT 'brand' AS kind, b.id, b.ext_id, b.name, NULL AS group_name,
+           TRIM(CONCAT(u.first_name, ' ', u.last_name)) AS manager_name
+    FROM {brand} b
+    LEFT JOIN {user} u ON u.id = b.product_manager_id
+    UNION ALL
+    SELECT 'subgroup', sg.id, sg.ext_id, sg.name, g.name, NULL
+    FROM {subgroup} sg
+    JOIN {group} g ON g.id = sg.group_id
+    UNION ALL
+    SELECT 'group', g.id, g.ext_id, g.name, NULL, NULL
+    FROM {group} g
+"""
+
+
+def bump_catalog_version():
+    return bump_data_version(CATALOG_DATA_NAMESPACE)
+
+
+def _tables():
+    return {
+        'brand': Brand._meta.db_table,
+        'subgroup': ProductSubgroup._meta.db_table,
+        'group': ProductGroup._meta.db_table,
+        'user': User._meta.db_table,
+    }
+
+
+def _trigrams(text) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _name_keys(name) -> list:
+    """Название в нижнем регистре и его семантическая транслитерация."""
+    name = name.casefold()
+    keys = [name]
+    if TransliterationUtils.is_cyrillic(name):
+        keys.append(TransliterationUtils.ru_to_en_semantic(name))
+    elif TransliterationUtils.is_latin(name):
+        keys.append(TransliterationUtils.en_to_ru_semantic(name))
+    return list(dict.fromkeys(keys))
+
+
+def _query_variants(query) -> list:
+    query = ' '.join(query.casefold().split())
+    return [variant for variant in TransliterationUtils.get_transliterated_variants(query) if variant]
+
+
+def _payload(row) -> dict:
+    kind, pk, ext_id, name, group_name, manager_name = row
+    if kind == KIND_BRAND:
+        return {
+            "id": pk,
+            "ext_id": ext_id,
+            "name": name,
+            "product_manager": manager_name or None,
+        }
+    if kind == KIND_SUBGROUP:
+        return {
+            "id": pk,
+            "ext_id": ext_id,
+            "name": name,
+            "group_name": group_name,
+            "display_name": f"{name} ({group_name})",
+        }
+    return {"id": pk, "ext_id": ext_id, "name": name}
+
+
+class NameIndex:
+    """Неизменяемый индекс названий одного справочника."""
+
+    def __init__(self, entries):
+        # entries - ответы автокомплита, отсортированные по названию
+        self.entries = entries
+        self.names = list(dict.fromkeys(entry["name"] for entry in entries))
+        self.digest = hashlib.sha256(
+            json.dumps(entries, sort_keys=True, ensure_ascii=False).encode()
+        ).hexdigest()
+        self._keys = []
+        self._trigrams = {}
+        words = []
+        for position, entry in enumerate(entries):
+            keys = _name_keys(entry["name"])
+            self._keys.append(keys)
+            for key in keys:
+                for trigram in _trigrams(key):
+                    self._trigrams.setdefault(trigram, set()).add(position)
+                for word in set(key.split()):
+                    words.append((word, position))
+        words.sort()
+        self._words = [word for word, _ in words]
+        self._word_positions = [position for _, position in words]
+
+    def _word_prefix_matches(self, prefix) -> set:
+        found = set()
+        start = bisect_left(self._words, prefix)
+        for word, position in zip(self._words[start:], self._word_positions[start:], strict=True):
+            if not word.startswith(prefix):
+                break
+            found.add(position)
+        return found
+
+    def _substring_matches(self, variant) -> set:
+        postings = [self._trigrams.get(trigram, ()) for trigram in _trigrams(variant)]
+        if not postings:
+            return set()
+        postings.sort(key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        # Триграммы могут совпасть и без вхождения подстроки целиком
+        return {
+            position for position in candidates
+            if any(variant in key for key in self._keys[position])
+        }
+
+    def _rank(self, position, variants) -> int:
+        rank = 2
+        for key in self._keys[position]:
+            for variant in variants:
+                if key.startswith(variant):
+                    return 0
+                if f' {variant}' in key:
+                    rank = 1
+        return rank
+
+    def search(self, query, limit) -> list:
+        variants = _query_variants(query)
+        if not variants:
+            return self.entries[:limit]
+        found = set()
+        for variant in variants:
+            if len(variant) < 3:
+                found |= self._word_prefix_matches(variant)
+            else:
+                found |= self._substring_matches(variant)
+        # Позиция в entries - порядок по названию внутри одного ранга
+        ranked = sorted(found, key=lambda position: (self._rank(position, variants), position))
+        return [self.entries[position] for position in ranked[:limit]]
+
+
+class CatalogNames:
+    """Индексы брендов, подгрупп и групп для одной версии каталога."""
+
+    def __init__(self, version, rows):
+        self.version = version
+        grouped = {kind: [] for kind in KINDS}
+        for row in rows:
+            grouped[row[0]].append(row)
+        self.indexes = {}
+        for kind, kind_rows in grouped.items():
+            kind_rows.sort(key=lambda row: (row[3].casefold(), row[4] or '', row[1]))
+            self.indexes[kind] = NameIndex([_payload(row) for row in kind_rows])
+
+    def __getitem__(self, kind) -> NameIndex:
+        return self.indexes[kind]
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def load_catalog_names(version) -> CatalogNames:
+    with connection.cursor() as cursor:
+        cursor.execute(CATALOG_NAMES_SQL.format(**_tables()))
+        rows = cursor.fetchall()
+    catalog = CatalogNames(version, rows)
+    logger.info(
+        f"Индекс автокомплита построен (версия {version}): "
+        + ", ".join(f"{kind}: {len(catalog[kind].entries)}" for kind in KINDS)
+    )
+    return catalog
+
+
+def get_catalog_names() -> CatalogNames:
+    """Индекс текущей версии каталога; при изменении версии перестраивается."""
+    global _catalog
+    version = get_data_version(CATALOG_DATA_NAMESPACE)
+    catalog = _catalog
+    if catalog is not None and catalog.version == version:
+        return catalog
+    with _catalog_lock:
+        # Пока ждали блокировку, индекс мог построить другой поток
+        if _catalog is None or _catalog.version != version:
+            _catalog = load_catalog_names(version)
+        return _catalog
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=ProductSubgroup)
+@receiver(post_delete, sender=ProductSubgroup)
+@receiver(post_save, sender=ProductGroup)
+@receiver(post_delete, sender=ProductGroup)
+def _bump_on_catalog_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_catalog_version()
+
+
+@receiver(post_save, sender=User)
+def _bump_on_manager_change(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    # Имя менеджера бренда входит в ответ; вход пользователя меняет только last_login
+    if raw or created or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    bump_catalog_version()
+
+
+@receiver(post_delete, sender=User)
+def _bump_on_manager_delete(sender, instance, **kwargs):
+    bump_catalog_version()
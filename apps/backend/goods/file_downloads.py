@@ -0,0 +1,265 @@
+"""
+Скачивание даташитов и чертежей товаров с zip-2002.ru.
+
+Товары без файла нужного типа выбираются одним запросом; товары, для
+которых сайт недавно ответил 404, пропускаются по отрицательному кэшу
+в Redis (MISSING_TTL).
+
+Запросы идут пачками по batch_size товаров: asyncio ограничивает число
+одновременных запросов к одному хосту, сами запросы выполняет общий
+requests.Session с пулом соединений в пуле потоков. Ошибки соединения,
+429 и 5xx повторяются с экспоненциальной задержкой. Ответ читается потоком
+во временный файл (в памяти остаются только файлы до SPOOL_MAX_SIZE)
+с подсчетом SHA-256, поэтому пачка не держит содержимое файлов в памяти.
+Файлы пачки сохраняются в базу после ее загрузки, в основном потоке.
+
+Адрес загрузки задается настройкой ZIP2002_DOWNLOAD_URL, поэтому
+FileFetcher проверяется на локальном HTTP-сервере.
+"""
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import urlencode, urlsplit
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from requests.adapters import HTTPAdapter
+
+from .models import FileBlob, Product, ProductFile
+
+logger = logging.getLogger(__name__)
+
+FILE_TYPE_PARAMS = {
+    ProductFile.FileType.DATASHEET: "file_p",
+    ProductFile.FileType.DRAWING: "file_i",
+}
+
+# Отрицательный кэш: товар без файла на сайте не запрашивается MISSING_TTL секунд
+MISSING_KEY = "goods:files:missing:{file_type}:{ext_id}"
+MISSING_TTL = 7 * 24 * 3600
+CACHE_CHUNK = 1000
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Файлы больше этого размера скачиваются на диск, а не в память
+SPOOL_MAX_SIZE = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+def file_url(ext_id, file_type, base_url=None) -> str:
+    # Адрес читается при вызове, чтобы его можно было переопределить в настройках теста
+    base_url = base_url or settings.ZIP2002_DOWNLOAD_URL
+    return f"{base_url}?{urlencode({'type': FILE_TYPE_PARAMS[file_type], 'id': ext_id})}"
+
+
+@dataclass
+class FetchResult:
+    product_id: int
+    url: str
+    # None - ошибка соединения после всех попыток
+    status: int | None
+    # Содержимое ответа 200 во временном файле (позиция - в начале)
+    file: tempfile.SpooledTemporaryFile | None = None
+    sha256: str = ""
+    size: int = 0
+    headers: dict = field(default_factory=dict)
+    error: str = ""
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class FileFetcher:
+    """
+    Параллельная загрузка файлов по списку URL.
+
+    Args:
+        concurrency: одновременных запросов к одному хосту
+        retries: повторов после ошибки соединения, 429 или 5xx
+        backoff: задержка перед первым повтором, секунд (далее удваивается)
+        timeout: таймаут запроса, секунд
+    """
+
+    def __init__(self, concurrency=8, retries=3, backoff=1.0, timeout=30):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="file-fetcher")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get(self, url):
+        with self.session.get(url, timeout=self.timeout, stream=True) as resp:
+            headers = dict(resp.headers)
+            if resp.status_code != 200:
+                return resp.status_code, None, "", 0, headers
+            file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            digest = hashlib.sha256()
+            size = 0
+            try:
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    file.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            except BaseException:
+                file.close()
+                raise
+            file.seek(0)
+            return resp.status_code, file, digest.hexdigest(), size, headers
+
+    async def _fetch(self, semaphores, product_id, url) -> FetchResult:
+        loop = asyncio.get_running_loop()
+        semaphore = semaphores.setdefault(urlsplit(url).netloc, asyncio.Semaphore(self.concurrency))
+        for attempt in range(self.retries + 1):
+            # Задержка перед повтором не занимает слот хоста
+            async with semaphore:
+                try:
+                    status, file, sha256, size, headers = await loop.run_in_executor(self._executor, self._get, url)
+                    error = ""
+                except requests.RequestException as e:
+                    status, file, sha256, size, headers, error = None, None, "", 0, {}, str(e)
+            if status is not None and status not in RETRY_STATUSES:
+                break
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        if status is not None and status in RETRY_STATUSES:
+            error = f"HTTP {status}"
+        return FetchResult(product_id, url, status, file, sha256, size, headers, error)
+
+    async def _fetch_all(self, items) -> list:
+        semaphores = {}
+        return await asyncio.gather(*(self._fetch(semaphores, product_id, url) for product_id, url in items))
+
+    def fetch_many(self, items) -> list[FetchResult]:
+        """
+        Загружает пачку файлов.
+
+        Args:
+            items: [(id товара, URL)]
+
+        Returns:
+            list[FetchResult]: в порядке items; временные файлы результатов
+            закрывает вызывающий (FetchResult.close)
+        """
+        return asyncio.run(self._fetch_all(items))
+
+
+def save_blob(result) -> FileBlob:
+    """FileBlob по скачанному файлу; одинаковые файлы хранятся один раз (по SHA-256)."""
+    existing = FileBlob.objects.filter(sha256=result.sha256).first()
+    if existing:
+        return existing
+
+    filename = "file"
+    headers = result.headers
+    cd = headers.get("Content-Disposition")
+    if cd and "filename=" in cd:
+        filename = cd.split("filename=")[-1].strip('"')
+    mime = headers.get("Content-Type") or (mimetypes.guess_type(filename)[0] or "application/octet-stream")
+
+    blob = FileBlob(sha256=result.sha256, size=result.size, mime_type=mime)
+    blob.file.save(name=filename, content=File(result.file), save=True)
+    return blob
+
+
+def products_missing_files(file_type) -> tuple[list, int]:
+    """
+    Товары без файла типа file_type, кроме недавно не найденных на сайте.
+
+    Returns:
+        tuple: ([(id товара, ext_id)], число пропущенных по отрицательному кэшу)
+    """
+    has_file = ProductFile.objects.filter(product=OuterRef("pk"), file_type=file_type)
+    rows = list(
+        Product.objects.exclude(ext_id__isnull=True)
+        .exclude(ext_id__exact="")
+        .filter(~Exists(has_file))
+        .order_by("pk")
+        .values_list("pk", "ext_id")
+    )
+    result = []
+    for start in range(0, len(rows), CACHE_CHUNK):
+        chunk = rows[start:start + CACHE_CHUNK]
+        keys = [MISSING_KEY.format(file_type=file_type, ext_id=ext_id) for _, ext_id in chunk]
+        cached = cache.get_many(keys)
+        result.extend(row for row, key in zip(chunk, keys, strict=True) if key not in cached)
+    return result, len(rows) - len(result)
+
+
+def download_missing_files(file_type, batch_size=200, concurrency=8, base_url=None) -> dict:
+    """
+    Скачивает файлы типа file_type для всех товаров, у которых их нет.
+
+    Ошибка сохранения одного файла учитывается в failed и не прерывает загрузку.
+
+    Returns:
+        dict: processed, created, missing (404), failed, skipped (отрицательный кэш)
+    """
+    products, skipped = products_missing_files(file_type)
+    stats = {"processed": 0, "created": 0, "missing": 0, "failed": 0, "skipped": skipped}
+    with FileFetcher(concurrency=concurrency) as fetcher:
+        for start in range(0, len(products), batch_size):
+            batch = dict(products[start:start + batch_size])
+            results = fetcher.fetch_many(
+                [(product_id, file_url(ext_id, file_type, base_url)) for product_id, ext_id in batch.items()]
+            )
+            missing = {}
+            try:
+                for result in results:
+                    stats["processed"] += 1
+                    if result.status == 404:
+                        missing[MISSING_KEY.format(file_type=file_type, ext_id=batch[result.product_id])] = True
+                        continue
+                    if result.status != 200:
+                        stats["failed"] += 1
+                        logger.warning(
+                            f"Не удалось скачать файл для id={batch[result.product_id]} ({file_type}): "
+                            f"{result.error or f'HTTP {result.status}'}"
+                        )
+                        continue
+                    try:
+                        with transaction.atomic():
+                            blob = save_blob(result)
+                            _, created = ProductFile.objects.get_or_create(
+                                product_id=result.product_id,
+                                file_type=file_type,
+                                defaults={"blob": blob, "source_url": result.url},
+                            )
+                    except Exception as e:
+                        stats["failed"] += 1
+                        logger.error(
+                            f"Не удалось сохранить файл для id={batch[result.product_id]} ({file_type}): {e}"
+                        )
+                        continue
+                    stats["created"] += created
+            finally:
+                # Временные файлы пачки удаляются сразу после сохранения
+                for result in results:
+                    result.close()
+            if missing:
+                cache.set_many(missing, timeout=MISSING_TTL)
+                stats["missing"] += len(missing)
+    logger.info(f"Загрузка файлов {file_type} завершена: {stats}")
+    return stats
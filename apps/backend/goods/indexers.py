@@ -1,10 +1,30 @@
-from typing import Any, Dict
+import json
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List
 
+from django.conf import settings
+from django.db.models import F, Q, QuerySet
+from django.db.models.functions import Coalesce
 from django_meilisearch_indexer.indexers import MeilisearchModelIndexer
+from meilisearch import Client
 
+from api.models import User
 from goods.models import Product
+from goods.params import index_attributes
 from goods.utils import TransliterationUtils
 
+# Клиент MeiliSearch меняет общие заголовки запроса, поэтому у каждого
+# потока загрузки свой клиент
+_upload_clients = threading.local()
+
+
+@lru_cache(maxsize=16384)
+def _search_variants(text: str) -> str:
+    """Варианты транслитерации повторяющихся значений: бренда, подгруппы, группы, менеджера."""
+    return TransliterationUtils.create_search_text(text)
+
 
 class ProductIndexer(MeilisearchModelIndexer[Product]):
     """Индексер для товаров в MeiliSearch."""
@@ -19,7 +39,11 @@ class ProductIndexer(MeilisearchModelIndexer[Product]):
             "group_name",
             "complex_name",
             "description",
-            "ext_id"
+            "ext_id",
+            # Числовые значения техпараметров в базовых единицах (goods.params):
+            # params.<ключ параметра>, units.<единица> - например, units.farad 1e-05 TO 2.2e-05
+            "params",
+            "units",
         ],
         "searchableAttributes": [
             "ext_id", # Высший приоритет - внешний ID
@@ -47,7 +71,8 @@ class ProductIndexer(MeilisearchModelIndexer[Product]):
             "subgroup_name",
             "group_name",
             "complex_name",
-            "ext_id"
+            "ext_id",
+            "params",
         ],
         "displayedAttributes": [
             "ext_id",
@@ -58,6 +83,7 @@ class ProductIndexer(MeilisearchModelIndexer[Product]):
             "group_name",
             "product_manager_name",
             "tech_params",
+            "params",
             "complex_name",
             "description"
         ],
@@ -85,41 +111,174 @@ class ProductIndexer(MeilisearchModelIndexer[Product]):
     def build_object(cls, product: Product) -> Dict[str, Any]:
         # Получаем менеджера товара
         manager = product.get_manager()
-        
-        # Создаем строку для поиска по техническим параметрам
-        tech_params_searchable = ""
-        if product.tech_params:
-            # Собираем все значения из JSON в одну строку для поиска
-            tech_params_searchable = " ".join(
-                str(value) for value in product.tech_params.values()
-                if value is not None
-            )
-        
-        # Создаем поле для транслитерированного поиска
-        # Используем режим без умной фильтрации для индекса, чтобы сохранить все варианты
-        transliterated_search = TransliterationUtils.create_search_text(
-            product.name,
-            product.brand.name if product.brand else "",
-            product.subgroup.name,
-            product.subgroup.group.name,
-            manager.username if manager else "",
-            tech_params_searchable
-        )
-        
-        return {
+        return cls.build_document({
             "id": product.id,
             "name": product.name,
             "brand_name": product.brand.name if product.brand else "",
             "subgroup_name": product.subgroup.name,
             "group_name": product.subgroup.group.name,
-            "product_manager_name": manager.old_db_name if manager else "",
+            "manager_username": manager.username if manager else "",
+            "manager_name": manager.old_db_name if manager else "",
             "tech_params": product.tech_params,
-            "tech_params_searchable": tech_params_searchable,
             "complex_name": product.complex_name,
             "description": product.description,
-            "transliterated_search": transliterated_search,
             "ext_id": product.ext_id,
+        })
+
+    @classmethod
+    def build_document(cls, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Документ индекса из строки document_rows (или полей товара в build_object)."""
+        return cls.build_documents([row])[0]
+
+    @classmethod
+    def build_documents(cls, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Документы индекса для пакета строк: транслитерация названий и техпараметров - пакетом."""
+        # Создаем строки для поиска по техническим параметрам
+        # (все значения из JSON в одну строку)
+        tech_params_searchable = [
+            " ".join(str(value) for value in row["tech_params"].values() if value is not None)
+            if row["tech_params"] else ""
+            for row in rows
+        ]
+        # Поле для транслитерированного поиска (как create_search_text по всем полям
+        # сразу, без умной фильтрации - сохраняются все варианты): названия
+        # и техпараметры преобразуются одним пакетом, а варианты бренда, подгруппы,
+        # группы и менеджера повторяются у тысяч товаров и берутся из кэша
+        name_variants = TransliterationUtils.create_search_texts([row["name"] for row in rows])
+        tech_params_variants = TransliterationUtils.create_search_texts(tech_params_searchable)
+
+        documents = []
+        for row, tech_params, name_text, tech_params_text in zip(
+            rows, tech_params_searchable, name_variants, tech_params_variants, strict=True
+        ):
+            transliterated_search = " ".join(filter(None, [
+                name_text,
+                _search_variants(row["brand_name"]),
+                _search_variants(row["subgroup_name"]),
+                _search_variants(row["group_name"]),
+                _search_variants(row["manager_username"]),
+                tech_params_text,
+            ]))
+            documents.append({
+                "id": row["id"],
+                "name": row["name"],
+                "brand_name": row["brand_name"],
+                "subgroup_name": row["subgroup_name"],
+                "group_name": row["group_name"],
+                "product_manager_name": row["manager_name"],
+                "tech_params": row["tech_params"],
+                "tech_params_searchable": tech_params,
+                **index_attributes(row["tech_params"]),
+                "complex_name": row["complex_name"],
+                "description": row["description"],
+                "transliterated_search": transliterated_search,
+                "ext_id": row["ext_id"],
+            })
+        return documents
+
+    @classmethod
+    def document_rows(cls, queryset: QuerySet = None, chunk_size: int = 2000) -> Iterator[Dict[str, Any]]:
+        """
+        Поля документов одним потоковым запросом со всеми соединениями.
+
+        Менеджер выбирается как в Product.get_manager: товар -> бренд -> подгруппа;
+        пользователи загружаются один раз на весь проход.
+        """
+        if queryset is None:
+            queryset = cls.MODEL_CLASS.objects.all()
+        managers = {
+            pk: (username, old_db_name)
+            for pk, username, old_db_name in User.objects.values_list("pk", "username", "old_db_name")
         }
+        rows = queryset.annotate(
+            manager_id=Coalesce("product_manager", "brand__product_manager", "subgroup__product_manager"),
+        ).values(
+            "id", "name", "tech_params", "complex_name", "description", "ext_id", "manager_id",
+            brand_name=F("brand__name"),
+            subgroup_name=F("subgroup__name"),
+            group_name=F("subgroup__group__name"),
+        )
+        for row in rows.iterator(chunk_size=chunk_size):
+            row["manager_username"], row["manager_name"] = managers.get(row.pop("manager_id"), ("", ""))
+            row["brand_name"] = row["brand_name"] or ""
+            yield row
+
+    @classmethod
+    def iter_documents(cls, queryset: QuerySet = None, chunk_size: int = 2000) -> Iterator[Dict[str, Any]]:
+        """Документы индекса без загрузки моделей (см. document_rows), собираются пакетами."""
+        rows = []
+        for row in cls.document_rows(queryset, chunk_size):
+            rows.append(row)
+            if len(rows) >= chunk_size:
+                yield from cls.build_documents(rows)
+                rows = []
+        if rows:
+            yield from cls.build_documents(rows)
+
+    @staticmethod
+    def serialize(document: Dict[str, Any]) -> bytes:
+        """Строка NDJSON документа; одинаковые документы дают одинаковые байты."""
+        return json.dumps(document, sort_keys=True, ensure_ascii=False, default=str).encode()
+
+    @classmethod
+    def ndjson_batches(cls, documents: Iterable[Dict[str, Any]], batch_size: int = None) -> Iterator[bytes]:
+        """Документы, сериализованные пакетами по batch_size строк NDJSON."""
+        batch_size = batch_size or settings.MEILISEARCH_UPLOAD_BATCH_SIZE
+        lines = []
+        for document in documents:
+            lines.append(cls.serialize(document))
+            if len(lines) >= batch_size:
+                yield b"\n".join(lines)
+                lines = []
+        if lines:
+            yield b"\n".join(lines)
+
+    @classmethod
+    def upload_batches(cls, batches: Iterable[bytes], index_name: str = None) -> List[int]:
+        """
+        Загружает пакеты NDJSON в индекс параллельно (MEILISEARCH_UPLOAD_WORKERS потоков).
+
+        Пакеты собираются в вызывающем потоке (ORM), пока предыдущие отправляются;
+        число пакетов в полете ограничено, чтобы не держать весь индекс в памяти.
+
+        Returns:
+            List[int]: uid задач MeiliSearch - по ним дожидаются индексации
+        """
+        index_name = index_name or cls.index_name()
+        workers = settings.MEILISEARCH_UPLOAD_WORKERS
+        task_uids = []
+        pending = set()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="meili-upload") as executor:
+            for payload in batches:
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    task_uids.extend(future.result() for future in done)
+                pending.add(executor.submit(cls._upload_payload, index_name, payload))
+            task_uids.extend(future.result() for future in pending)
+        return sorted(task_uids)
+
+    @classmethod
+    def upload_documents(cls, documents: Iterable[Dict[str, Any]], index_name: str = None) -> List[int]:
+        return cls.upload_batches(cls.ndjson_batches(documents), index_name)
+
+    @classmethod
+    def _upload_payload(cls, index_name: str, payload: bytes) -> int:
+        client = getattr(_upload_clients, "client", None)
+        if client is None:
+            client = _upload_clients.client = Client(settings.MEILISEARCH_HOST, settings.MEILISEARCH_API_KEY)
+        return client.index(index_name).add_documents_ndjson(payload, primary_key=cls.PRIMARY_KEY).task_uid
+
+    @classmethod
+    def index_all_atomically(cls) -> None:
+        # Перестройка через новую версию индекса со сверкой и обменом (goods.search_sync)
+        from goods.search_sync import rebuild_search_index
+
+        rebuild_search_index()
+
+    @classmethod
+    def _index_from_query(cls, query: Q, index_name: str) -> None:
+        # index_from_query / index_all библиотеки идут через пакетный конвейер
+        cls.upload_documents(cls.iter_documents(cls.MODEL_CLASS.objects.filter(query)), index_name)
 
     @classmethod
     def index_name(cls) -> str:
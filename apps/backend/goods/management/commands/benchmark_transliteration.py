@@ -0,0 +1,109 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from goods.models import Product
+from goods.utils import TransliterationUtils, prepare_search_query
+
+# Образцы для синтетического набора: кириллица, латиница, part number, техпараметры
+SAMPLE_WORDS = [
+    "резистор", "конденсатор", "керамический", "танталовый", "диод", "Шоттки",
+    "стабилизатор", "микросхема", "разъем", "щуп", "жгут", "ёмкость",
+    "STM32F103C8T6", "LM317T/NOPB", "BAV99-TR", "ATmega328P-PU", "Schottky",
+    "zhuk", "capacitor", "SMD", "0805", "10кОм", "1%", "25V", "X7R", "Texas Instruments",
+]
+
+
+def _legacy_convert(mapping, text):
+    # Прежняя реализация: поиск в словаре по каждому символу
+    return ''.join(mapping.get(char, char) for char in text)
+
+
+def _legacy_search_text(text):
+    variants = [text]
+    for mapping in (
+        TransliterationUtils.RU_TO_EN,
+        TransliterationUtils.EN_TO_RU,
+        TransliterationUtils.RU_TO_EN_SEMANTIC,
+        {v: k for k, v in TransliterationUtils.RU_TO_EN_SEMANTIC.items() if len(v) == 1},
+    ):
+        variant = _legacy_convert(mapping, text)
+        if variant != text:
+            variants.append(variant)
+    return ' '.join(dict.fromkeys(variants))
+
+
+class Command(BaseCommand):
+    help = "Микробенчмарк транслитерации: посимвольная реализация, таблицы str.translate и пакетный API"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=50000, help="Количество строк в наборе")
+        parser.add_argument("--repeat", type=int, default=3, help="Повторов каждого замера (берется лучший)")
+        parser.add_argument(
+            "--from-db", action="store_true",
+            help="Взять наименования товаров из базы вместо синтетического набора",
+        )
+
+    def _texts(self, count, from_db):
+        if from_db:
+            texts = list(Product.objects.values_list("complex_name", flat=True)[:count])
+            if texts:
+                return texts
+            self.stdout.write(self.style.WARNING("Товаров в базе нет, используется синтетический набор"))
+        rng = random.Random(42)
+        return [" ".join(rng.choices(SAMPLE_WORDS, k=rng.randint(2, 8))) for _ in range(count)]
+
+    def _measure(self, label, func, count, repeat):
+        best = min(self._timed(func) for _ in range(repeat))
+        self.stdout.write(f"{label:<45} {best * 1000:9.1f} мс  {count / best:12,.0f} строк/с")
+        return best
+
+    @staticmethod
+    def _timed(func):
+        started = time.perf_counter()
+        func()
+        return time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        texts = self._texts(options["count"], options["from_db"])
+        count, repeat = len(texts), options["repeat"]
+        self.stdout.write(f"Строк: {count}, средняя длина: {sum(map(len, texts)) / max(count, 1):.0f} символов")
+
+        legacy = self._measure(
+            "ru_to_en: посимвольно (прежняя реализация)",
+            lambda: [_legacy_convert(TransliterationUtils.RU_TO_EN, text) for text in texts], count, repeat,
+        )
+        single = self._measure(
+            "ru_to_en: str.translate по строке",
+            lambda: [TransliterationUtils.ru_to_en(text) for text in texts], count, repeat,
+        )
+        batch = self._measure(
+            "ru_to_en_many: пакетом",
+            lambda: TransliterationUtils.ru_to_en_many(texts), count, repeat,
+        )
+        self._measure(
+            "en_to_ru_semantic: буквосочетания по строке",
+            lambda: [TransliterationUtils.en_to_ru_semantic(text) for text in texts], count, repeat,
+        )
+        self._measure(
+            "en_to_ru_semantic_many: пакетом",
+            lambda: TransliterationUtils.en_to_ru_semantic_many(texts), count, repeat,
+        )
+        legacy_search = self._measure(
+            "create_search_text: посимвольно (прежняя)",
+            lambda: [_legacy_search_text(text) for text in texts], count, repeat,
+        )
+        search_batch = self._measure(
+            "create_search_texts: пакетом",
+            lambda: TransliterationUtils.create_search_texts(texts), count, repeat,
+        )
+        self._measure(
+            "prepare_search_query",
+            lambda: [prepare_search_query(text) for text in texts[:10000]], min(count, 10000), repeat,
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Ускорение ru_to_en: {legacy / single:.1f}x по строке, {legacy / batch:.1f}x пакетом; "
+            f"create_search_text: {legacy_search / search_batch:.1f}x"
+        ))
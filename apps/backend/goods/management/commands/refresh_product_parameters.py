@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from goods.params import refresh_parameters
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает числовые параметры товаров (ProductParameter) из tech_params"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Товаров в одной пачке")
+
+    def handle(self, *args, **options):
+        subgroups = refresh_parameters(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Параметры товаров пересчитаны, подгрупп с изменениями: {len(subgroups)}"
+        ))
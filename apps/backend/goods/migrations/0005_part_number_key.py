@@ -0,0 +1,27 @@
+# Generated by Django 5.1.15 on 2026-10-19 08:26
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0004_fileblob_productfile'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='part_number_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Part number без регистра, пунктуации и суффиксов упаковки', max_length=200, verbose_name='Ключ part number'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['part_number_key'], name='product_pn_key_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
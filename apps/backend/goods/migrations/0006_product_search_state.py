@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-19 09:09
+
+from django.db import migrations, models
+
+
+def mark_products_for_sync(apps, schema_editor):
+    """Все товары ждут первой синхронизации индекса (хэши документов еще неизвестны)."""
+    schema_editor.execute("""
+        INSERT INTO goods_productsearchstate (product_id, doc_hash, dirty, changed_at)
+        SELECT id, '', TRUE, NOW()
+        FROM goods_product
+    """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0005_part_number_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchState',
+            fields=[
+                ('product_id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID товара')),
+                ('doc_hash', models.CharField(blank=True, help_text='SHA-256 последнего отправленного в индекс документа', max_length=64, verbose_name='Хэш документа')),
+                ('dirty', models.BooleanField(default=True, verbose_name='Требует синхронизации')),
+                ('changed_at', models.DateTimeField(verbose_name='Изменен')),
+                ('synced_at', models.DateTimeField(blank=True, null=True, verbose_name='Синхронизирован')),
+            ],
+            options={
+                'verbose_name': 'Состояние товара в поиске',
+                'verbose_name_plural': 'Состояние товаров в поиске',
+                'indexes': [models.Index(condition=models.Q(('dirty', True)), fields=['product_id'], name='product_search_dirty_idx')],
+            },
+        ),
+        migrations.RunPython(mark_products_for_sync, migrations.RunPython.noop),
+    ]
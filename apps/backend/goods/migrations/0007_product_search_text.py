@@ -0,0 +1,58 @@
+# Generated by Django 5.1.15 on 2026-10-19 09:14
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_search_text(apps, schema_editor):
+    """Текст для поиска существующих товаров (как в goods.search)."""
+    schema_editor.execute("""
+        UPDATE goods_product p
+        SET search_text = d.search_text
+        FROM (
+            SELECT p.id,
+                   LOWER(CONCAT_WS(' ', p.ext_id, p.name, p.complex_name, p.description,
+                                   b.name, sg.name, g.name)) AS search_text
+            FROM goods_product p
+            LEFT JOIN goods_brand b ON b.id = p.brand_id
+            JOIN goods_productsubgroup sg ON sg.id = p.subgroup_id
+            JOIN goods_productgroup g ON g.id = sg.group_id
+        ) d
+        WHERE p.id = d.id
+    """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0006_product_search_state'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_text',
+            field=models.TextField(blank=True, editable=False, verbose_name='Текст для поиска'),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_text'], name='product_search_text_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(django.db.models.functions.comparison.Cast('name', models.TextField())), name='gin_trgm_ops'), name='product_name_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(django.db.models.functions.comparison.Cast('ext_id', models.TextField())), name='gin_trgm_ops'), name='product_ext_id_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(django.db.models.functions.comparison.Cast('complex_name', models.TextField())), name='gin_trgm_ops'), name='product_complex_name_trgm'),
+        ),
+    ]
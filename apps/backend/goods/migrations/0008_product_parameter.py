@@ -0,0 +1,35 @@
+# Generated by Django 5.1.15 on 2026-10-19 09:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0007_product_search_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductParameter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, verbose_name='Параметр')),
+                ('key', models.CharField(help_text='Название параметра латиницей для фильтров поиска', max_length=100, verbose_name='Ключ')),
+                ('raw', models.TextField(verbose_name='Исходное значение')),
+                ('unit', models.CharField(blank=True, help_text='Базовая единица (Ohm, F, V, ...); пусто, если не указана', max_length=10, verbose_name='Единица')),
+                ('value', models.FloatField(blank=True, help_text='Пусто для диапазонов', null=True, verbose_name='Значение')),
+                ('value_min', models.FloatField(verbose_name='Минимум')),
+                ('value_max', models.FloatField(verbose_name='Максимум')),
+                ('tolerance', models.FloatField(blank=True, null=True, verbose_name='Допуск, %')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parameters', to='goods.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Параметр товара',
+                'verbose_name_plural': 'Параметры товаров',
+                'indexes': [models.Index(fields=['key', 'value_min', 'value_max'], name='product_param_key_range_idx'), models.Index(fields=['unit', 'value_min', 'value_max'], name='product_param_unit_range_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'name'), name='uniq_product_parameter')],
+            },
+        ),
+    ]
@@ -1,4 +1,6 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Cast, Upper
 from django.utils.translation import gettext_lazy as _
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
@@ -6,6 +8,7 @@ from api.models import User
 from core.mixins import ExtIdMixin
 from django_softdelete.models import SoftDeleteModel
 from django.conf import settings
+from goods.utils import normalize_part_number
 import os
 
 
@@ -98,6 +101,15 @@ class Product(SoftDeleteModel, ExtIdMixin):
         max_length=200, 
         verbose_name=_('Part number')
     )
+    # Нормализованный part number для сопоставления с конкурентами (см. normalize_part_number)
+    part_number_key = models.CharField(
+        max_length=200,
+        blank=True,
+        db_index=True,
+        editable=False,
+        verbose_name=_('Ключ part number'),
+        help_text=_('Part number без регистра, пунктуации и суффиксов упаковки')
+    )
     # Переопределение менеджера для конкретного товара:
     product_manager = models.ForeignKey(
         User,
@@ -127,14 +139,53 @@ class Product(SoftDeleteModel, ExtIdMixin):
         verbose_name=_('Описание'),
         help_text=_('Описание товара')
     )
+    # Код, наименования, описание, бренд, подгруппа и группа в нижнем регистре
+    # для поиска по базе без MeiliSearch (см. goods.search)
+    search_text = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name=_('Текст для поиска')
+    )
 
     class Meta:
         verbose_name = _('Товар')
         verbose_name_plural = _('Товары')
+        indexes = [
+            GinIndex(
+                fields=['part_number_key'],
+                name='product_pn_key_trgm',
+                opclasses=['gin_trgm_ops'],
+            ),
+            GinIndex(
+                fields=['search_text'],
+                name='product_search_text_trgm',
+                opclasses=['gin_trgm_ops'],
+            ),
+            # Выражения совпадают с SQL фильтров icontains: UPPER("name"::text) LIKE UPPER(...)
+            GinIndex(
+                OpClass(Upper(Cast('name', models.TextField())), name='gin_trgm_ops'),
+                name='product_name_trgm',
+            ),
+            GinIndex(
+                OpClass(Upper(Cast('ext_id', models.TextField())), name='gin_trgm_ops'),
+                name='product_ext_id_trgm',
+            ),
+            GinIndex(
+                OpClass(Upper(Cast('complex_name', models.TextField())), name='gin_trgm_ops'),
+                name='product_complex_name_trgm',
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.part_number_key = normalize_part_number(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'part_number_key'}
+        super().save(*args, **kwargs)
+
     def get_manager(self):
         """
         Определяет менеджера товара по следующему порядку приоритета:
@@ -149,6 +200,90 @@ class Product(SoftDeleteModel, ExtIdMixin):
         return self.subgroup.product_manager
 
 
+class ProductSearchState(models.Model):
+    """
+    Состояние документа товара в поисковом индексе (см. goods.search_sync).
+
+    Строка помечается измененной при сохранении или удалении товара и связанных
+    с ним бренда, подгруппы, группы и менеджеров; инкрементальная синхронизация
+    отправляет в индекс только документы, чей хэш содержимого изменился.
+    """
+    # Без внешнего ключа: строка должна пережить удаление товара до синхронизации
+    product_id = models.BigIntegerField(primary_key=True, verbose_name=_('ID товара'))
+    doc_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        verbose_name=_('Хэш документа'),
+        help_text=_('SHA-256 последнего отправленного в индекс документа')
+    )
+    dirty = models.BooleanField(default=True, verbose_name=_('Требует синхронизации'))
+    changed_at = models.DateTimeField(verbose_name=_('Изменен'))
+    synced_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Синхронизирован'))
+
+    class Meta:
+        verbose_name = _('Состояние товара в поиске')
+        verbose_name_plural = _('Состояние товаров в поиске')
+        indexes = [
+            models.Index(
+                fields=['product_id'],
+                condition=models.Q(dirty=True),
+                name='product_search_dirty_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {'изменен' if self.dirty else 'синхронизирован'}"
+
+
+class ProductParameter(models.Model):
+    """
+    Числовое значение технического параметра товара в базовой единице
+    (разбор Product.tech_params, см. goods.params).
+    """
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='parameters',
+        verbose_name=_('Товар')
+    )
+    name = models.CharField(max_length=200, verbose_name=_('Параметр'))
+    key = models.CharField(
+        max_length=100,
+        verbose_name=_('Ключ'),
+        help_text=_('Название параметра латиницей для фильтров поиска')
+    )
+    raw = models.TextField(verbose_name=_('Исходное значение'))
+    unit = models.CharField(
+        max_length=10,
+        blank=True,
+        verbose_name=_('Единица'),
+        help_text=_('Базовая единица (Ohm, F, V, ...); пусто, если не указана')
+    )
+    value = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name=_('Значение'),
+        help_text=_('Пусто для диапазонов')
+    )
+    value_min = models.FloatField(verbose_name=_('Минимум'))
+    value_max = models.FloatField(verbose_name=_('Максимум'))
+    tolerance = models.FloatField(null=True, blank=True, verbose_name=_('Допуск, %'))
+
+    class Meta:
+        verbose_name = _('Параметр товара')
+        verbose_name_plural = _('Параметры товаров')
+        indexes = [
+            models.Index(fields=['key', 'value_min', 'value_max'], name='product_param_key_range_idx'),
+            models.Index(fields=['unit', 'value_min', 'value_max'], name='product_param_unit_range_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'name'], name='uniq_product_parameter'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.name} = {self.raw}"
+
+
 def file_blob_upload_path(instance, filename):
     sha = instance.sha256
     return f"files/{sha[:2]}/{sha[2:4]}/{sha}/{filename}"
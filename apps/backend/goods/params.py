@@ -0,0 +1,344 @@
+"""
+Числовые значения технических параметров товаров.
+
+Product.tech_params - плоский JSON строк ("10 кОм ±5%", "4.7uF", "-40...+85 °C").
+Разбор приводит значение к базовой единице СИ (Ом, Ф, В, ...):
+- приставки латиницей и кириллицей (p/п, n/н, u/µ/мк, m/м, k/к, M/М, G/Г);
+- единицы латиницей и кириллицей (Ом/Ohm/Ω, Ф/F, В/V, Вт/W, Гц/Hz, ...);
+- маркировка с множителем вместо запятой (4K7, 2R2, 4n7);
+- диапазоны (10...22 мкФ, -40~+85°C, от 3 до 5 В) и допуск в процентах (±5%);
+- единица без обозначения ("10к") берется из названия параметра (сопротивление - Ом).
+Значения, которые не удалось однозначно разобрать, пропускаются.
+
+Разобранные параметры хранятся в ProductParameter (обновляются сигналом при
+сохранении товара, первичное заполнение - команда refresh_product_parameters)
+и попадают в документ индекса как числовые атрибуты: params.<ключ параметра>
+и units.<единица> (см. ProductIndexer).
+"""
+import re
+from collections import defaultdict
+from itertools import islice
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from core.signals import in_bulk_import
+
+from .analogs import invalidate_subgroups
+from .models import Product, ProductParameter
+from .utils import TransliterationUtils
+
+# Обозначения единиц: (каноническая единица, множитель к базовой)
+UNIT_ALIASES = {
+    'Ом': ('Ohm', 1), 'ом': ('Ohm', 1), 'ОМ': ('Ohm', 1), 'Ohm': ('Ohm', 1), 'ohm': ('Ohm', 1),
+    'OHM': ('Ohm', 1), 'Ω': ('Ohm', 1), '\u2126': ('Ohm', 1), 'R': ('Ohm', 1),
+    'Ф': ('F', 1), 'F': ('F', 1),
+    'В': ('V', 1), 'V': ('V', 1), 'v': ('V', 1),
+    'А': ('A', 1), 'A': ('A', 1),
+    'Вт': ('W', 1), 'вт': ('W', 1), 'W': ('W', 1),
+    'Гц': ('Hz', 1), 'гц': ('Hz', 1), 'Hz': ('Hz', 1), 'hz': ('Hz', 1), 'HZ': ('Hz', 1),
+    'Гн': ('H', 1), 'гн': ('H', 1), 'H': ('H', 1),
+    'Ач': ('Ah', 1), 'Ah': ('Ah', 1),
+    'с': ('s', 1), 'сек': ('s', 1), 's': ('s', 1), 'sec': ('s', 1),
+    'г': ('g', 1), 'g': ('g', 1),
+    'дБ': ('dB', 1), 'dB': ('dB', 1),
+    '%': ('%', 1),
+    '°C': ('°C', 1), '°С': ('°C', 1), 'ºC': ('°C', 1), 'ºС': ('°C', 1), '°': ('°C', 1),
+    # Длина - с явными множителями: "м" без единицы означает метр, а не милли
+    'м': ('m', 1), 'm': ('m', 1),
+    'мм': ('m', 1e-3), 'mm': ('m', 1e-3), 'см': ('m', 1e-2), 'cm': ('m', 1e-2),
+    'км': ('m', 1e3), 'km': ('m', 1e3), 'мкм': ('m', 1e-6), 'um': ('m', 1e-6), 'µm': ('m', 1e-6),
+}
+
+PREFIXES = {
+    'p': 1e-12, 'п': 1e-12,
+    'n': 1e-9, 'н': 1e-9,
+    'u': 1e-6, 'µ': 1e-6, 'μ': 1e-6, 'мк': 1e-6,
+    'm': 1e-3, 'м': 1e-3,
+    'k': 1e3, 'K': 1e3, 'к': 1e3, 'К': 1e3,
+    'M': 1e6, 'М': 1e6,
+    'G': 1e9, 'Г': 1e9,
+}
+# Сначала длинные приставки: "мк" раньше "м"
+_PREFIXES_BY_LENGTH = sorted(PREFIXES, key=len, reverse=True)
+
+# Ключ единицы в документе индекса (units.<ключ>)
+UNIT_ATTRIBUTES = {
+    'Ohm': 'ohm', 'F': 'farad', 'V': 'volt', 'A': 'ampere', 'W': 'watt', 'Hz': 'hertz',
+    'H': 'henry', 'Ah': 'ampere_hour', 's': 'second', 'g': 'gram', 'dB': 'decibel',
+    '%': 'percent', '°C': 'celsius', 'm': 'meter',
+}
+
+# Единица по названию параметра, если в значении ее нет ("10к", "100n")
+UNIT_HINTS = (
+    (('сопротивл', 'resist', 'импеданс', 'impedance'), 'Ohm'),
+    (('емкост', 'ёмкост', 'capacit'), 'F'),
+    (('индуктивн', 'inductance'), 'H'),
+    (('напряж', 'voltage'), 'V'),
+    (('мощност', 'power'), 'W'),
+    (('частот', 'frequency'), 'Hz'),
+    (('ток', 'current'), 'A'),
+    (('температур', 'temperature'), '°C'),
+    (('допуск', 'точност', 'tolerance'), '%'),
+)
+
+_NUMBER = r'\d+(?:[.,]\d+)?(?:[eE][-+]?\d+)?|[.,]\d+|\d+/\d+'
+_SUFFIX = r'[A-Za-zА-Яа-яЁёµμΩ\u2126°º%]*'
+_QUANTITY = r'(?P<{name}_num>[-+]?(?:' + _NUMBER + r'))\s*(?P<{name}_suffix>' + _SUFFIX + r')'
+
+VALUE_RE = re.compile(
+    r'^(?:от|from)?\s*' + _QUANTITY.format(name='low')
+    + r'(?:\s*(?:\.{2,3}|~|÷|-|до|to)\s*' + _QUANTITY.format(name='high') + r')?$'
+)
+# Маркировка с множителем на месте запятой: 4K7, 2R2, 4n7, 1M5
+RKM_RE = re.compile(r'^(?P<whole>\d+)(?P<marker>[pnuµμmkKMGRrпнмкКМГ])(?P<fraction>\d+)\s*(?P<suffix>' + _SUFFIX + r')$')
+LEADING_ZERO_RE = re.compile(r'^[-+]?0\d')
+TOLERANCE_RE = re.compile(r'±\s*(?P<num>' + _NUMBER + r')\s*%')
+
+_DASHES = str.maketrans({'−': '-', '–': '-', '—': '-', '\xa0': ' ', '…': '...'})
+
+
+def _number(text) -> float:
+    if '/' in text:
+        numerator, denominator = text.split('/')
+        return int(numerator) / int(denominator)
+    return float(text.replace(',', '.'))
+
+
+def _round(value) -> float:
+    # 4.7 * 1e-6 = 4.699999999999999e-06: фильтры по границам должны совпадать с записанным
+    return float(f'{value:.9g}')
+
+
+def _parse_suffix(suffix):
+    """(множитель, каноническая единица) обозначения после числа или None."""
+    if not suffix:
+        return 1, ''
+    if suffix in UNIT_ALIASES:
+        unit, factor = UNIT_ALIASES[suffix]
+        return factor, unit
+    for prefix in _PREFIXES_BY_LENGTH:
+        if suffix.startswith(prefix):
+            rest = suffix[len(prefix):]
+            if not rest:
+                return PREFIXES[prefix], ''
+            if rest in UNIT_ALIASES:
+                unit, factor = UNIT_ALIASES[rest]
+                return PREFIXES[prefix] * factor, unit
+    return None
+
+
+def unit_hint(name) -> str:
+    """Единица параметра по его названию ('' - если не определяется)."""
+    name = (name or '').casefold()
+    for words, unit in UNIT_HINTS:
+        if any(word in name for word in words):
+            return unit
+    return ''
+
+
+def parse_value(text, name=''):
+    """
+    Разбирает значение параметра.
+
+    Returns:
+        dict: unit, value, value_min, value_max, tolerance (в процентах) или None
+    """
+    if not isinstance(text, str):
+        if isinstance(text, bool) or not isinstance(text, (int, float)):
+            return None
+        text = str(text)
+    text = ' '.join(text.translate(_DASHES).replace('+/-', '±').replace('+-', '±').split())
+    if not text:
+        return None
+
+    tolerance = None
+    if not text.startswith('±'):
+        match = TOLERANCE_RE.search(text)
+        if match:
+            tolerance = _number(match.group('num'))
+            text = (text[:match.start()] + text[match.end():]).strip(' ,;')
+    else:
+        text = text[1:].strip()
+
+    match = RKM_RE.match(text)
+    if match:
+        marker = match.group('marker')
+        parsed = _parse_suffix(match.group('suffix'))
+        if parsed is None:
+            return None
+        factor, unit = parsed
+        if marker in 'Rr' and unit not in ('', 'Ohm'):
+            return None
+        multiplier = 1 if marker in 'Rr' else PREFIXES[marker]
+        value = float(f"{match.group('whole')}.{match.group('fraction')}") * multiplier * factor
+        unit = unit or ('Ohm' if marker in 'Rr' else unit_hint(name))
+        return _result(unit, value, value, value, tolerance)
+
+    match = VALUE_RE.match(text)
+    # Типоразмеры корпусов (0805, 0402) - коды, а не числа
+    if not match or LEADING_ZERO_RE.match(match.group('low_num')):
+        return None
+    low = _parse_suffix(match.group('low_suffix'))
+    if low is None:
+        return None
+    if match.group('high_num') is None:
+        factor, unit = low
+        value = _number(match.group('low_num')) * factor
+        return _result(unit or unit_hint(name), value, value, value, tolerance)
+
+    high = _parse_suffix(match.group('high_suffix'))
+    if high is None:
+        return None
+    # "10...22 мкФ": обозначение указано только у верхней границы
+    if match.group('low_suffix') == '':
+        low = high
+    if low[1] and high[1] and low[1] != high[1]:
+        return None
+    unit = high[1] or low[1] or unit_hint(name)
+    value_min = _number(match.group('low_num')) * low[0]
+    value_max = _number(match.group('high_num')) * high[0]
+    if value_min > value_max:
+        return None
+    return _result(unit, None, value_min, value_max, tolerance)
+
+
+def _result(unit, value, value_min, value_max, tolerance):
+    return {
+        'unit': unit,
+        'value': None if value is None else _round(value),
+        'value_min': _round(value_min),
+        'value_max': _round(value_max),
+        'tolerance': tolerance,
+    }
+
+
+def parameter_key(name) -> str:
+    """Ключ параметра для атрибутов индекса: "Емкость, мкФ" -> "emkost_mkf"."""
+    key = TransliterationUtils.ru_to_en_semantic(str(name).casefold())
+    key = re.sub(r'[^a-z0-9]+', '_', key).strip('_')
+    return key[:100] or 'param'
+
+
+def parse_tech_params(tech_params) -> list:
+    """Разобранные параметры товара: name, key, raw и поля parse_value."""
+    if not isinstance(tech_params, dict):
+        return []
+    parameters = []
+    for name, raw in tech_params.items():
+        parsed = parse_value(raw, name)
+        if parsed is not None:
+            parameters.append({'name': str(name)[:200], 'key': parameter_key(name), 'raw': str(raw), **parsed})
+    return parameters
+
+
+def index_attributes(tech_params) -> dict:
+    """
+    Числовые атрибуты документа индекса.
+
+    Returns:
+        dict: params - {ключ: значение} (у диапазонов ключ_min/ключ_max, у допуска
+        ключ_tolerance), units - {единица: отсортированные значения и границы}
+    """
+    params = {}
+    units = defaultdict(set)
+    for parameter in parse_tech_params(tech_params):
+        key = parameter['key']
+        if parameter['value'] is not None:
+            params[key] = parameter['value']
+        else:
+            params[f'{key}_min'] = parameter['value_min']
+            params[f'{key}_max'] = parameter['value_max']
+        if parameter['tolerance'] is not None:
+            params[f'{key}_tolerance'] = parameter['tolerance']
+        unit = UNIT_ATTRIBUTES.get(parameter['unit'])
+        if unit:
+            units[unit].update({parameter['value_min'], parameter['value_max']})
+    return {
+        'params': params,
+        'units': {unit: sorted(values) for unit, values in sorted(units.items())},
+    }
+
+
+PARAMETER_FIELDS = ('name', 'key', 'raw', 'unit', 'value', 'value_min', 'value_max', 'tolerance')
+
+
+def refresh_product_parameters(products) -> list:
+    """
+    Обновляет ProductParameter для товаров; записи переписываются только
+    у товаров, чьи разобранные параметры изменились.
+
+    Args:
+        products: пары (id товара, tech_params)
+
+    Returns:
+        list: id товаров с измененными параметрами
+    """
+    parsed = {
+        product_id: {parameter['name']: parameter for parameter in parse_tech_params(tech_params)}
+        for product_id, tech_params in products
+    }
+    if not parsed:
+        return []
+    stored = defaultdict(dict)
+    for row in ProductParameter.objects.filter(product_id__in=parsed).values('product_id', *PARAMETER_FIELDS):
+        stored[row.pop('product_id')][row['name']] = row
+    changed = [
+        product_id for product_id, parameters in parsed.items()
+        if stored[product_id] != {
+            name: {field: parameter[field] for field in PARAMETER_FIELDS}
+            for name, parameter in parameters.items()
+        }
+    ]
+    if not changed:
+        return changed
+    with transaction.atomic():
+        ProductParameter.objects.filter(product_id__in=changed).delete()
+        ProductParameter.objects.bulk_create([
+            ProductParameter(product_id=product_id, **{field: parameter[field] for field in PARAMETER_FIELDS})
+            for product_id in changed
+            for parameter in parsed[product_id].values()
+        ])
+    return changed
+
+
+def refresh_parameters(product_ids=None, chunk_size=2000) -> set:
+    """
+    Пересчитывает ProductParameter товаров пачками по chunk_size и удаляет
+    блоки аналогов подгрупп, где параметры изменились.
+
+    Args:
+        product_ids: товары; None - все товары
+
+    Returns:
+        set: id подгрупп с измененными параметрами товаров
+    """
+    queryset = Product.objects.order_by('pk')
+    if product_ids is None:
+        chunks = [queryset]
+    else:
+        product_ids = sorted(set(product_ids))
+        chunks = [
+            queryset.filter(pk__in=product_ids[start:start + chunk_size])
+            for start in range(0, len(product_ids), chunk_size)
+        ]
+    subgroups = set()
+    for chunk in chunks:
+        rows = chunk.values_list('pk', 'subgroup_id', 'tech_params').iterator(chunk_size=chunk_size)
+        while batch := list(islice(rows, chunk_size)):
+            changed = set(refresh_product_parameters([(pk, tech_params) for pk, _, tech_params in batch]))
+            subgroups.update(subgroup_id for pk, subgroup_id, _ in batch if pk in changed)
+    if subgroups:
+        invalidate_subgroups(subgroups)
+    return subgroups
+
+
+@receiver(post_save, sender=Product)
+def _refresh_parameters(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Импорт товаров пересчитывает параметры пачками после загрузки (refresh_parameters)
+    if raw or in_bulk_import() or (update_fields is not None and 'tech_params' not in update_fields):
+        return
+    # Блок аналогов подгруппы устаревает, только если разобранные параметры изменились
+    if refresh_product_parameters([(instance.pk, instance.tech_params)]):
+        invalidate_subgroups([instance.subgroup_id])
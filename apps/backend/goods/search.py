@@ -0,0 +1,243 @@
+"""
+Поиск товаров для API.
+
+Основной путь - индекс MeiliSearch: варианты запроса из prepare_search_query
+(оригинал и семантическая транслитерация, затем раскладка клавиатуры)
+отправляются одним multi-search, берется первый вариант с результатами.
+
+Если MeiliSearch недоступен (ошибка, таймаут, нет индекса), поиск идет
+по PostgreSQL: все слова запроса ищутся в денормализованной колонке
+Product.search_text (код, part number, наименования, описание, бренд,
+подгруппа, группа в нижнем регистре) с триграммным GIN-индексом. Колонка
+обновляется сигналами при сохранении товара и связанных записей, а импорт
+товаров пересчитывает ее одним UPDATE после загрузки.
+
+Результаты MeiliSearch кэшируются в Redis (goods.search_cache).
+"""
+import logging
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from meilisearch import Client
+from meilisearch.errors import MeilisearchError
+
+from core.signals import in_bulk_import
+
+from .indexers import ProductIndexer
+from .models import Brand, Product, ProductGroup, ProductSubgroup
+from .search_cache import KIND_CATALOG, KIND_INDEX, cached_search, normalize_query
+from .utils import TransliterationUtils, prepare_search_query
+
+logger = logging.getLogger(__name__)
+
+ENGINE_MEILISEARCH = 'meilisearch'
+ENGINE_DATABASE = 'database'
+
+
+def _tables():
+    return {
+        'product': Product._meta.db_table,
+        'brand': Brand._meta.db_table,
+        'subgroup': ProductSubgroup._meta.db_table,
+        'group': ProductGroup._meta.db_table,
+    }
+
+
+REFRESH_SEARCH_TEXT_SQL = """
+    UPDATE {product} p
+    SET search_text = d.search_text
+    FROM (
+        SELECT p.id,
+               LOWER(CONCAT_WS(' ', p.ext_id, p.name, p.complex_name, p.description,
+                               b.name, sg.name, g.name)) AS search_text
+        FROM {product} p
+        LEFT JOIN {brand} b ON b.id = p.brand_id
+        JOIN {subgroup} sg ON sg.id = p.subgroup_id
+        JOIN {group} g ON g.id = sg.group_id
+        WHERE {condition}
+    ) d
+    WHERE p.id = d.id AND p.search_text IS DISTINCT FROM d.search_text
+"""
+
+
+def refresh_search_text(condition='TRUE', params=None) -> int:
+    """Пересчитывает Product.search_text товаров, подходящих под условие (алиасы p, b, sg, g)."""
+    with connection.cursor() as cursor:
+        cursor.execute(REFRESH_SEARCH_TEXT_SQL.format(condition=condition, **_tables()), params or {})
+        return cursor.rowcount
+
+
+_search_client = None
+
+
+def _meilisearch_client():
+    # Отдельный клиент с коротким таймаутом: при зависшем MeiliSearch запрос
+    # должен быстро уйти в PostgreSQL, а не ждать индексатор
+    global _search_client
+    if _search_client is None:
+        _search_client = Client(
+            settings.MEILISEARCH_HOST,
+            settings.MEILISEARCH_API_KEY,
+            timeout=settings.MEILISEARCH_SEARCH_TIMEOUT,
+        )
+    return _search_client
+
+
+def query_variants(query) -> list:
+    """Варианты запроса в порядке приоритета без повторов."""
+    prepared = prepare_search_query(query)
+    variants = [query, *sorted(prepared['priority_variants']), *sorted(prepared['fallback_variants'])]
+    return list(dict.fromkeys(variant for variant in variants if variant))
+
+
+def canonical_query(query) -> str:
+    """
+    Запрос с part number-подобными кириллическими словами в латинице
+    (семантическая транслитерация): "стм32" и "stm32" - один запрос.
+    """
+    words = normalize_query(query).split()
+    cyrillic = [
+        word for word in dict.fromkeys(words)
+        if TransliterationUtils.is_cyrillic(word) and TransliterationUtils.looks_like_part_number(word)
+    ]
+    latin = dict(zip(cyrillic, TransliterationUtils.ru_to_en_semantic_many(cyrillic), strict=True))
+    return ' '.join(latin.get(word, word) for word in words)
+
+
+def meilisearch_product_ids(query, offset, limit):
+    """
+    Id товаров из MeiliSearch для первого варианта запроса с результатами.
+
+    Returns:
+        tuple: (ids, total); MeilisearchError - если поиск недоступен
+    """
+    index_name = ProductIndexer.index_name()
+    response = _meilisearch_client().multi_search([
+        {
+            'indexUid': index_name,
+            'q': variant,
+            'offset': offset,
+            'limit': limit,
+            'attributesToRetrieve': ['id'],
+        }
+        for variant in query_variants(query)
+    ])
+    results = response['results']
+    for result in results:
+        if result.get('estimatedTotalHits'):
+            return [hit['id'] for hit in result['hits']], result['estimatedTotalHits']
+    return [], 0
+
+
+def filter_search_text(queryset, query):
+    """
+    Товары, в search_text которых есть все слова запроса (хотя бы для одного
+    варианта транслитерации). LIKE '%слово%' обслуживается триграммным индексом.
+    """
+    condition = Q()
+    for variant in query_variants(query):
+        words = variant.lower().split()
+        if not words:
+            continue
+        variant_condition = Q()
+        for word in words:
+            variant_condition &= Q(search_text__contains=word)
+        condition |= variant_condition
+    return queryset.filter(condition) if condition else queryset
+
+
+def search_products(queryset, query, offset, limit):
+    """
+    Страница товаров по строке запроса.
+
+    Args:
+        queryset: базовый queryset (select_related для сериализатора)
+        query: строка поиска
+        offset, limit: страница
+
+    Returns:
+        tuple: (товары в порядке релевантности, всего найдено, движок поиска)
+    """
+    query = normalize_query(query)
+    params = {'variants': query_variants(query), 'offset': offset, 'limit': limit}
+    try:
+        ids, total = cached_search(KIND_CATALOG, params, lambda: meilisearch_product_ids(query, offset, limit))
+    except MeilisearchError as e:
+        logger.warning(f"MeiliSearch недоступен, поиск товаров по базе: {e}")
+    else:
+        # Товар мог быть удален после последней синхронизации индекса - просто пропускаем
+        products = queryset.in_bulk(ids)
+        return [products[pk] for pk in ids if pk in products], total, ENGINE_MEILISEARCH
+
+    queryset = filter_search_text(queryset, query)
+    return list(queryset[offset:offset + limit]), queryset.count(), ENGINE_DATABASE
+
+
+def index_search(query='', filter=None, sort=None, limit=10, offset=0,
+                 attributes_to_retrieve=None, highlight=True) -> dict:
+    """
+    Поиск по индексу товаров с параметрами MeiliSearch (для инструментов агентов)
+    через общий кэш результатов. Ищется и служит ключом кэша canonical_query(query).
+
+    Returns:
+        dict: hits, limit, offset, estimatedTotalHits, processingTimeMs, query;
+        MeilisearchError - если поиск недоступен
+    """
+    options = {'limit': limit, 'offset': offset}
+    if filter:
+        options['filter'] = filter
+    if sort:
+        options['sort'] = list(sort)
+    if attributes_to_retrieve:
+        options['attributesToRetrieve'] = sorted(attributes_to_retrieve)
+    if highlight:
+        options['attributesToHighlight'] = ['*']
+        options['highlightPreTag'] = '<em>'
+        options['highlightPostTag'] = '</em>'
+    query = canonical_query(query)
+
+    def compute():
+        data = _meilisearch_client().index(ProductIndexer.index_name()).search(query, options)
+        return {
+            'hits': data.get('hits', []),
+            'limit': data.get('limit'),
+            'offset': data.get('offset'),
+            'estimatedTotalHits': data.get('estimatedTotalHits'),
+            'processingTimeMs': data.get('processingTimeMs'),
+            'query': data.get('query', query),
+        }
+
+    return cached_search(KIND_INDEX, {'q': query, **options}, compute)
+
+
+@receiver(post_save, sender=Product)
+def _refresh_product_search_text(sender, instance, raw=False, **kwargs):
+    if not raw and not in_bulk_import():
+        refresh_search_text('p.id = %(pk)s', {'pk': instance.pk})
+
+
+@receiver(post_save, sender=Brand)
+def _refresh_brand_search_text(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created and not in_bulk_import():
+        refresh_search_text('p.brand_id = %(pk)s', {'pk': instance.pk})
+
+
+@receiver(post_delete, sender=Brand)
+def _refresh_unbranded_search_text(sender, instance, **kwargs):
+    # Ссылки на бренд обнулены UPDATE-ом без сигналов товаров
+    refresh_search_text('p.brand_id IS NULL')
+
+
+@receiver(post_save, sender=ProductSubgroup)
+def _refresh_subgroup_search_text(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created and not in_bulk_import():
+        refresh_search_text('p.subgroup_id = %(pk)s', {'pk': instance.pk})
+
+
+@receiver(post_save, sender=ProductGroup)
+def _refresh_group_search_text(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created and not in_bulk_import():
+        refresh_search_text('sg.group_id = %(pk)s', {'pk': instance.pk})
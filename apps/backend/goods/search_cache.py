@@ -0,0 +1,115 @@
+"""
+Общий кэш результатов поиска товаров в Redis.
+
+Одинаковые поиски приходят из каталога на фронтенде и из инструментов
+LangGraph-агента (через /api/products/index-search/). Ключ записи - версия
+индекса, вид поиска и нормализованные параметры: запрос приводится к нижнему
+регистру (casefold) и схлопываются пробелы, а для поиска каталога ключом
+служит упорядоченный список вариантов транслитерации (TransliterationUtils) -
+"Резистор  10К" и "резистор 10к" дают одну запись.
+
+Версия индекса увеличивается после каждой синхронизации, изменившей индекс,
+и после полной перестройки (goods.search_sync), поэтому устаревшие записи
+перестают находиться, а короткий TTL ограничивает память. Счетчики попаданий
+и промахов по видам поиска - в search_cache_stats().
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+INDEX_VERSION_KEY = "search:products:index-version"
+ENTRY_KEY = "search:products:{version}:{kind}:{digest}"
+METRIC_KEY = "search:products:metrics:{kind}:{outcome}"
+
+# Виды поиска, по которым ведутся метрики
+KIND_CATALOG = 'catalog'
+KIND_INDEX = 'index'
+KINDS = (KIND_CATALOG, KIND_INDEX)
+
+
+def get_index_version() -> int:
+    version = cache.get(INDEX_VERSION_KEY)
+    if version is None:
+        # Как в core.report_cache: после сброса Redis версия не вернется к старым значениям
+        cache.add(INDEX_VERSION_KEY, int(time.time()), timeout=None)
+        version = cache.get(INDEX_VERSION_KEY)
+    return version
+
+
+def bump_index_version() -> int:
+    """Делает недействительными закэшированные результаты поиска."""
+    try:
+        return cache.incr(INDEX_VERSION_KEY)
+    except ValueError:
+        cache.add(INDEX_VERSION_KEY, int(time.time()), timeout=None)
+        return cache.get(INDEX_VERSION_KEY)
+
+
+def normalize_query(query) -> str:
+    """Запрос без различий регистра и пробелов (MeiliSearch их тоже не различает)."""
+    return ' '.join(str(query or '').casefold().split())
+
+
+def _count(kind, outcome):
+    key = METRIC_KEY.format(kind=kind, outcome=outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def cached_search(kind, params, compute):
+    """
+    Результат поиска из кэша или вычисленный compute() и сохраненный на SEARCH_CACHE_TTL.
+
+    Args:
+        kind: вид поиска (KIND_CATALOG, KIND_INDEX)
+        params: нормализованные параметры поиска (JSON-сериализуемые)
+        compute: функция без аргументов, выполняющая поиск; исключения не кэшируются
+    """
+    payload = json.dumps(params, sort_keys=True, default=str, ensure_ascii=False)
+    key = ENTRY_KEY.format(
+        version=get_index_version(),
+        kind=kind,
+        digest=hashlib.sha256(payload.encode()).hexdigest(),
+    )
+    result = cache.get(key)
+    if result is not None:
+        _count(kind, 'hits')
+        return result
+    _count(kind, 'misses')
+    result = compute()
+    cache.set(key, result, timeout=settings.SEARCH_CACHE_TTL)
+    return result
+
+
+def search_cache_stats() -> dict:
+    """Попадания, промахи и доля попаданий по видам поиска."""
+    counters = cache.get_many([
+        METRIC_KEY.format(kind=kind, outcome=outcome)
+        for kind in KINDS
+        for outcome in ('hits', 'misses')
+    ])
+    stats = {'index_version': get_index_version(), 'ttl': settings.SEARCH_CACHE_TTL, 'kinds': {}}
+    for kind in KINDS:
+        hits = counters.get(METRIC_KEY.format(kind=kind, outcome='hits'), 0)
+        misses = counters.get(METRIC_KEY.format(kind=kind, outcome='misses'), 0)
+        total = hits + misses
+        stats['kinds'][kind] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else None,
+        }
+    return stats
+
+
+def reset_search_cache_stats():
+    cache.delete_many([
+        METRIC_KEY.format(kind=kind, outcome=outcome)
+        for kind in KINDS
+        for outcome in ('hits', 'misses')
+    ])
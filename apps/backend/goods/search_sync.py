@@ -0,0 +1,368 @@
+"""
+Инкрементальная синхронизация поискового индекса товаров (MeiliSearch).
+
+Документ товара денормализует бренд, подгруппу, группу и менеджеров, поэтому
+изменение любой из этих записей помечает затронутые товары в ProductSearchState
+(сигналы ниже; массовые UPDATE вызывают mark_products_changed явно).
+Синхронизация обходит помеченные товары пакетами:
+- документы строятся заново, в индекс уходят только те, чей хэш содержимого
+  отличается от последнего отправленного (ежедневный импорт сохраняет все
+  товары, но меняет единицы);
+- удаленные (в том числе мягко) товары удаляются из индекса;
+- состояние сбрасывается только после успешной обработки задач MeiliSearch.
+
+Полная перестройка (rebuild_search_index) - еженедельная страховка: строит
+новую версию индекса, сверяет ее с БД, меняет местами с рабочим
+и запоминает хэши документов.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api.models import User
+
+from .indexers import ProductIndexer
+from .models import Brand, Product, ProductGroup, ProductSearchState, ProductSubgroup
+from .search_cache import bump_index_version
+
+logger = logging.getLogger(__name__)
+
+REBUILD_LOCK_KEY = "search:products:rebuild-lock"
+
+
+def _tables():
+    return {
+        'state': ProductSearchState._meta.db_table,
+        'product': Product._meta.db_table,
+        'brand': Brand._meta.db_table,
+        'subgroup': ProductSubgroup._meta.db_table,
+    }
+
+
+MARK_CHANGED_SQL = """
+    INSERT INTO {state} (product_id, doc_hash, dirty, changed_at)
+    SELECT DISTINCT ids.product_id, '', TRUE, %(now)s
+    FROM unnest(%(product_ids)s::bigint[]) AS ids(product_id)
+    ON CONFLICT (product_id) DO UPDATE
+    SET dirty = TRUE, changed_at = EXCLUDED.changed_at
+"""
+
+MARK_RELATED_SQL = """
+    INSERT INTO {state} (product_id, doc_hash, dirty, changed_at)
+    SELECT p.id, '', TRUE, %(now)s
+    FROM {product} p
+    LEFT JOIN {brand} b ON b.id = p.brand_id
+    LEFT JOIN {subgroup} sg ON sg.id = p.subgroup_id
+    WHERE {condition}
+    ON CONFLICT (product_id) DO UPDATE
+    SET dirty = TRUE, changed_at = EXCLUDED.changed_at
+"""
+
+# Пометка, поставленная после начала синхронизации, сохраняется до следующего запуска
+STORE_SYNCED_SQL = """
+    INSERT INTO {state} (product_id, doc_hash, dirty, changed_at, synced_at)
+    SELECT t.product_id, t.doc_hash, FALSE, %(started)s, %(now)s
+    FROM unnest(%(product_ids)s::bigint[], %(hashes)s::varchar[]) AS t(product_id, doc_hash)
+    ON CONFLICT (product_id) DO UPDATE
+    SET doc_hash = EXCLUDED.doc_hash,
+        synced_at = EXCLUDED.synced_at,
+        dirty = {state}.dirty AND {state}.changed_at > %(started)s
+"""
+
+FORGET_DELETED_SQL = """
+    DELETE FROM {state}
+    WHERE product_id = ANY(%(product_ids)s) AND changed_at <= %(started)s
+"""
+
+FORGET_MISSING_SQL = """
+    DELETE FROM {state} s
+    WHERE s.changed_at <= %(started)s
+      AND NOT EXISTS (SELECT 1 FROM {product} p WHERE p.id = s.product_id AND p.deleted_at IS NULL)
+"""
+
+# Условия отбора товаров, зависящих от связанной записи (как в Product.get_manager)
+RELATED_CONDITIONS = {
+    'brand': 'p.brand_id = %(pk)s',
+    'subgroup': 'p.subgroup_id = %(pk)s',
+    'group': 'sg.group_id = %(pk)s',
+    'manager': '(p.product_manager_id = %(pk)s OR b.product_manager_id = %(pk)s OR sg.product_manager_id = %(pk)s)',
+}
+
+
+def mark_products_changed(product_ids) -> int:
+    """Помечает товары для синхронизации с индексом (например, после queryset.update)."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            MARK_CHANGED_SQL.format(**_tables()),
+            {'product_ids': product_ids, 'now': timezone.now()},
+        )
+        return cursor.rowcount
+
+
+def mark_related_changed(relation, pk) -> int:
+    """Помечает товары, чей документ включает бренд, подгруппу, группу или менеджера pk."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            MARK_RELATED_SQL.format(condition=RELATED_CONDITIONS[relation], **_tables()),
+            {'pk': pk, 'now': timezone.now()},
+        )
+        return cursor.rowcount
+
+
+def mark_all_changed() -> int:
+    """Помечает все товары (например, после изменения build_object)."""
+    with connection.cursor() as cursor:
+        cursor.execute(MARK_RELATED_SQL.format(condition='TRUE', **_tables()), {'now': timezone.now()})
+        return cursor.rowcount
+
+
+def document_hash(line: bytes) -> str:
+    """Хэш сериализованного документа (ProductIndexer.serialize)."""
+    return hashlib.sha256(line).hexdigest()
+
+
+def wait_for_tasks(task_uids, check=True):
+    """
+    Ждет обработки задач MeiliSearch; при check=True неуспешная задача - ошибка,
+    и пометки товаров остаются для следующего запуска.
+    """
+    client = ProductIndexer.meilisearch_client()
+    for task_uid in task_uids:
+        task = client.wait_for_task(
+            task_uid, timeout_in_ms=settings.MEILISEARCH_TASK_TIMEOUT_MS, interval_in_ms=200
+        )
+        if check and task.status != 'succeeded':
+            raise RuntimeError(f"Задача MeiliSearch {task_uid} завершилась со статусом {task.status}: {task.error}")
+
+
+def _store_synced(hashes, started):
+    if not hashes:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            STORE_SYNCED_SQL.format(**_tables()),
+            {
+                'product_ids': list(hashes),
+                'hashes': list(hashes.values()),
+                'started': started,
+                'now': timezone.now(),
+            },
+        )
+
+
+def _forget_deleted(product_ids, started):
+    if not product_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            FORGET_DELETED_SQL.format(**_tables()),
+            {'product_ids': list(product_ids), 'started': started},
+        )
+
+
+def sync_search_index(batch_size=None) -> dict:
+    """
+    Отправляет в индекс измененные и удаляет удаленные товары.
+
+    Returns:
+        dict: количество проверенных, отправленных, неизмененных и удаленных товаров
+    """
+    batch_size = batch_size or settings.MEILISEARCH_SYNC_BATCH_SIZE
+    result = {'checked': 0, 'indexed': 0, 'unchanged': 0, 'deleted': 0}
+    # Изменения, отправленные в рабочий индекс во время перестройки, пропали бы
+    # при обмене версий - пометки остаются до следующего запуска
+    if cache.get(REBUILD_LOCK_KEY):
+        logger.info("Синхронизация индекса товаров пропущена: идет полная перестройка")
+        return result
+    started = timezone.now()
+    index = ProductIndexer.meilisearch_client().index(ProductIndexer.index_name())
+
+    pending = ProductSearchState.objects.filter(dirty=True, changed_at__lte=started).order_by('product_id')
+    last_id = 0
+    while True:
+        stored = dict(pending.filter(product_id__gt=last_id).values_list('product_id', 'doc_hash')[:batch_size])
+        if not stored:
+            break
+        last_id = max(stored)
+
+        lines = []
+        hashes = {}
+        for document in ProductIndexer.iter_documents(Product.objects.filter(pk__in=stored)):
+            line = ProductIndexer.serialize(document)
+            hashes[document['id']] = document_hash(line)
+            if hashes[document['id']] != stored[document['id']]:
+                lines.append(line)
+        # Product.objects не возвращает мягко удаленные товары
+        deleted = [product_id for product_id in stored if product_id not in hashes]
+
+        task_uids = []
+        if lines:
+            task_uids.extend(ProductIndexer.upload_batches([b'\n'.join(lines)]))
+        if deleted:
+            task_uids.append(index.delete_documents(deleted).task_uid)
+        wait_for_tasks(task_uids)
+
+        with transaction.atomic():
+            _store_synced(hashes, started)
+            _forget_deleted(deleted, started)
+
+        result['checked'] += len(stored)
+        result['indexed'] += len(lines)
+        result['unchanged'] += len(hashes) - len(lines)
+        result['deleted'] += len(deleted)
+
+    if result['indexed'] or result['deleted']:
+        bump_index_version()
+    if result['checked']:
+        logger.info(
+            f"Синхронизация индекса товаров: проверено {result['checked']}, "
+            f"отправлено {result['indexed']}, без изменений {result['unchanged']}, "
+            f"удалено {result['deleted']}"
+        )
+    return result
+
+
+def _drop_build_indexes(client, index_name, keep=()):
+    """Удаляет версии индекса (products_<ts>), оставшиеся от прерванных перестроек."""
+    prefix = f"{index_name}_"
+    task_uids = [
+        client.delete_index(index.uid).task_uid
+        for index in client.get_indexes({'limit': 1000})['results']
+        if index.uid.startswith(prefix) and index.uid not in keep
+    ]
+    wait_for_tasks(task_uids, check=False)
+
+
+def rebuild_search_index(batch_size=None) -> int:
+    """
+    Полностью перестраивает индекс товаров без простоя поиска (blue/green).
+
+    Документы загружаются в новую версию индекса products_<ts> с примененными
+    настройками; число документов в ней сверяется с выгруженными из БД, и только
+    затем версия атомарно меняется местами с рабочим индексом (swap-indexes),
+    а старые документы удаляются вместе с версией. Любая ошибка до обмена
+    удаляет новую версию - рабочий индекс не затрагивается.
+
+    Returns:
+        int: количество проиндексированных товаров
+    """
+    if not cache.add(REBUILD_LOCK_KEY, True, timeout=settings.MEILISEARCH_REBUILD_LOCK_TIMEOUT):
+        raise RuntimeError("Перестройка индекса товаров уже выполняется")
+    try:
+        return _rebuild_search_index(batch_size or settings.MEILISEARCH_UPLOAD_BATCH_SIZE)
+    finally:
+        cache.delete(REBUILD_LOCK_KEY)
+
+
+def _rebuild_search_index(batch_size) -> int:
+    started = timezone.now()
+    client = ProductIndexer.meilisearch_client()
+    index_name = ProductIndexer.index_name()
+    build_index_name = f"{index_name}_{started:%Y%m%d%H%M%S}"
+
+    _drop_build_indexes(client, index_name)
+    # Рабочий индекс должен существовать, чтобы его можно было обменять
+    ProductIndexer.maybe_create_index()
+    wait_for_tasks([
+        client.create_index(build_index_name, {'primaryKey': ProductIndexer.PRIMARY_KEY}).task_uid,
+        client.index(build_index_name).update_settings(ProductIndexer.SETTINGS).task_uid,
+    ])
+
+    hashes = {}
+
+    def batches():
+        # Документы строятся из одного потокового запроса, пока предыдущие пакеты загружаются
+        lines = []
+        for document in ProductIndexer.iter_documents():
+            line = ProductIndexer.serialize(document)
+            hashes[document['id']] = document_hash(line)
+            lines.append(line)
+            if len(lines) >= batch_size:
+                yield b'\n'.join(lines)
+                lines = []
+        if lines:
+            yield b'\n'.join(lines)
+
+    try:
+        wait_for_tasks(ProductIndexer.upload_batches(batches(), build_index_name))
+        indexed = client.index(build_index_name).get_stats().number_of_documents
+        if indexed != len(hashes):
+            raise RuntimeError(
+                f"В новой версии индекса {indexed} документов вместо {len(hashes)} товаров из БД"
+            )
+        if not hashes and client.index(index_name).get_stats().number_of_documents:
+            raise RuntimeError("Из БД не выгружено ни одного товара, рабочий индекс не заменен")
+        wait_for_tasks([client.swap_indexes([{'indexes': [index_name, build_index_name]}]).task_uid])
+    except Exception:
+        logger.error(f"Перестройка индекса товаров не удалась, версия {build_index_name} удалена")
+        wait_for_tasks([client.delete_index(build_index_name).task_uid], check=False)
+        raise
+    bump_index_version()
+    # После обмена под именем версии лежат старые документы
+    wait_for_tasks([client.delete_index(build_index_name).task_uid], check=False)
+
+    product_ids = list(hashes)
+    for start in range(0, len(product_ids), batch_size):
+        chunk = product_ids[start:start + batch_size]
+        _store_synced({product_id: hashes[product_id] for product_id in chunk}, started)
+    # Товаров нет в новом индексе - их состояние больше не нужно
+    with connection.cursor() as cursor:
+        cursor.execute(FORGET_MISSING_SQL.format(**_tables()), {'started': started})
+
+    logger.info(f"Индекс товаров перестроен: {len(hashes)} документов")
+    return len(hashes)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def _mark_product(sender, instance, raw=False, **kwargs):
+    # Мягкое удаление сохраняет товар (post_save) - синхронизация удалит его из индекса
+    if not raw:
+        mark_products_changed([instance.pk])
+
+
+@receiver(post_save, sender=Brand)
+def _mark_brand_products(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        mark_related_changed('brand', instance.pk)
+
+
+@receiver(post_save, sender=ProductSubgroup)
+def _mark_subgroup_products(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        mark_related_changed('subgroup', instance.pk)
+
+
+@receiver(post_save, sender=ProductGroup)
+def _mark_group_products(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        mark_related_changed('group', instance.pk)
+
+
+@receiver(post_save, sender=User)
+def _mark_manager_products(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    # Вход пользователя сохраняет только last_login - документы не меняются
+    if raw or created or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    mark_related_changed('manager', instance.pk)
+
+
+# Удаление бренда или менеджера обнуляет ссылки UPDATE-ом без сигналов товаров,
+# поэтому товары помечаются до удаления
+@receiver(pre_delete, sender=Brand)
+def _mark_deleted_brand_products(sender, instance, **kwargs):
+    mark_related_changed('brand', instance.pk)
+
+
+@receiver(pre_delete, sender=User)
+def _mark_deleted_manager_products(sender, instance, **kwargs):
+    mark_related_changed('manager', instance.pk)
@@ -2,21 +2,23 @@ import os
 import json
 import logging
 import mysql.connector
-import pandas as pd
-import base64
 from celery import shared_task
 from django.db import transaction
 from django.db.models import Q, Count
 from mysql.connector import Error
 from django.conf import settings
 from api.models import User
+from core.artifacts import ExportArtifactWriter, artifact_result
+from core.reports import ReportWorkbook
+from core.signals import bulk_import
+from goods.analogs import missing_subgroups, store_blocks
+from goods.file_downloads import download_missing_files
 from goods.indexers import ProductIndexer
-from goods.models import Brand, Product, ProductGroup, ProductSubgroup, FileBlob, ProductFile
+from goods.models import Brand, Product, ProductGroup, ProductParameter, ProductSubgroup, ProductFile
+from goods.params import refresh_parameters
+from goods.search import refresh_search_text
+from goods.search_sync import mark_products_changed, rebuild_search_index, sync_search_index
 from datetime import datetime
-from io import BytesIO
-import hashlib
-import mimetypes
-import requests
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +39,8 @@ def update_products_from_mysql():
     Обновляет группы товаров, подгруппы, бренды и сами товары с техническими параметрами.
     Устанавливает product_manager на основе invoice_user из MySQL.
     """
+    from sales.facts import sync_fact_dimensions
+
     connection = None
     try:
         connection = mysql.connector.connect(**mysql_config)
@@ -128,12 +132,14 @@ def update_products_from_mysql():
             pm.old_db_name: pm for pm in User.objects.filter(role=User.Role.PURCHASER)
         }
 
-        # Обновляем данные в Django моделях
-        with transaction.atomic():
+        # Обновляем данные в Django моделях; производные данные товаров
+        # пересчитываются после цикла одним запросом, а не сигналами на каждую строку
+        with transaction.atomic(), bulk_import():
             # Словари для хранения уже обработанных объектов
             processed_groups = {}
             processed_subgroups = {}
             processed_brands = {}
+            imported_ids = []
 
             for item in product_data:
                 # 1. Обработка группы товаров
@@ -215,6 +221,7 @@ def update_products_from_mysql():
                     },
                 )
 
+                imported_ids.append(product.pk)
                 if product_created:
                     products_created += 1
                 else:
@@ -228,6 +235,12 @@ def update_products_from_mysql():
                 if product_manager:
                     managers_linked += 1
 
+            # Текст для поиска по базе, измерения витрины фактов продаж
+            # и числовые параметры (с удалением блоков аналогов их подгрупп)
+            refresh_search_text()
+            sync_fact_dimensions()
+            changed_subgroups = refresh_parameters(imported_ids)
+
         logger.info(
             f"Обновлены данные товаров: группы {groups_updated}/{groups_created}, "
             f"подгруппы {subgroups_updated}/{subgroups_created}, "
@@ -240,6 +253,11 @@ def update_products_from_mysql():
         logger.error(f"Ошибка при обновлении данных в базе Django: {e}")
         return f"Ошибка при обновлении данных: {e}"
 
+    # Блоки аналогов подгрупп с измененными параметрами удалены при коммите;
+    # их перестраиваем явно - запрос во время импорта мог закэшировать блок из старых строк
+    if changed_subgroups:
+        refresh_product_analogs.delay(subgroup_ids=sorted(changed_subgroups))
+
     return (
         f"Обновлено данных:\n"
         f"Группы: {groups_updated} (создано: {groups_created})\n"
@@ -251,125 +269,21 @@ def update_products_from_mysql():
     )
 
 
-def _ensure_blob_from_response(resp, filename_hint: str | None) -> FileBlob:
-    """Читает HTTP-ответ один раз: одновременно считает SHA-256 и накапливает содержимое."""
-    content_type = resp.headers.get("Content-Type", "")
-    buffer = BytesIO()
-    hasher = hashlib.sha256()
-    total = 0
-    for chunk in resp.iter_content(chunk_size=8192):
-        if not chunk:
-            continue
-        hasher.update(chunk)
-        buffer.write(chunk)
-        total += len(chunk)
-    sha = hasher.hexdigest()
-
-    # Дедуп по sha
-    existing = FileBlob.objects.filter(sha256=sha).first()
-    if existing:
-        return existing
-
-    # Вычисление имени и MIME
-    filename = filename_hint or "file"
-    cd = resp.headers.get("Content-Disposition")
-    if cd and "filename=" in cd:
-        filename = cd.split("filename=")[-1].strip('"')
-    mime = content_type or (mimetypes.guess_type(filename)[0] or "application/octet-stream")
-
-    from django.core.files.base import ContentFile
-
-    buffer.seek(0)
-    blob = FileBlob(sha256=sha, size=total, mime_type=mime)
-    blob.file.save(name=filename, content=ContentFile(buffer.read()), save=True)
-    return blob
-
-
-def _fetch_zip2002_file(product_ext_id: str, file_type: str) -> tuple[FileBlob | None, str | None]:
-    # file_type: "datasheet" -> type=file_p, "drawing" -> type=file_i
-    if file_type == ProductFile.FileType.DATASHEET:
-        url = f"https://www.zip-2002.ru/zip-download.php/?type=file_p&id={product_ext_id}"
-    else:
-        url = f"https://www.zip-2002.ru/zip-download.php/?type=file_i&id={product_ext_id}"
-
-    try:
-        resp = requests.get(url, stream=True, timeout=30)
-        if resp.status_code == 404:
-            return None, url
-        resp.raise_for_status()
-        blob = _ensure_blob_from_response(resp, filename_hint=None)
-        return blob, url
-    except Exception as e:
-        logger.warning(f"Не удалось скачать файл для id={product_ext_id} ({file_type}): {e}")
-        return None, url
-
-
 @shared_task
-def download_all_datasheets(batch_size: int = 500):
+def download_all_datasheets(batch_size: int = 200, concurrency: int = 8):
     """
-    Скачивает даташиты для всех товаров, у которых их ещё нет.
+    Скачивает даташиты для всех товаров, у которых их ещё нет (см. goods.file_downloads).
     Дедупликация через FileBlob.sha256 и уникальность ProductFile(product, file_type).
     """
-    qs = (
-        Product.objects.exclude(ext_id__isnull=True)
-        .exclude(ext_id__exact="")
-        .select_related("brand", "subgroup")
-    )
-    processed = 0
-    created = 0
-    skipped = 0
-    for product in qs.iterator(chunk_size=batch_size):
-        # пропускаем, если уже есть датащит
-        if ProductFile.objects.filter(product=product, file_type=ProductFile.FileType.DATASHEET).exists():
-            skipped += 1
-            continue
-        blob, src = _fetch_zip2002_file(product.ext_id, ProductFile.FileType.DATASHEET)
-        if blob:
-            try:
-                ProductFile.objects.create(
-                    product=product,
-                    blob=blob,
-                    file_type=ProductFile.FileType.DATASHEET,
-                    source_url=src or "",
-                )
-                created += 1
-            except Exception as e:
-                logger.info(f"Файл уже привязан или конфликт: {e}")
-        processed += 1
-    return {"processed": processed, "created": created, "skipped": skipped}
+    return download_missing_files(ProductFile.FileType.DATASHEET, batch_size=batch_size, concurrency=concurrency)
 
 
 @shared_task
-def download_all_drawings(batch_size: int = 500):
+def download_all_drawings(batch_size: int = 200, concurrency: int = 8):
     """
-    Скачивает чертежи для всех товаров, у которых их ещё нет.
+    Скачивает чертежи для всех товаров, у которых их ещё нет (см. goods.file_downloads).
     """
-    qs = (
-        Product.objects.exclude(ext_id__isnull=True)
-        .exclude(ext_id__exact="")
-        .select_related("brand", "subgroup")
-    )
-    processed = 0
-    created = 0
-    skipped = 0
-    for product in qs.iterator(chunk_size=batch_size):
-        if ProductFile.objects.filter(product=product, file_type=ProductFile.FileType.DRAWING).exists():
-            skipped += 1
-            continue
-        blob, src = _fetch_zip2002_file(product.ext_id, ProductFile.FileType.DRAWING)
-        if blob:
-            try:
-                ProductFile.objects.create(
-                    product=product,
-                    blob=blob,
-                    file_type=ProductFile.FileType.DRAWING,
-                    source_url=src or "",
-                )
-                created += 1
-            except Exception as e:
-                logger.info(f"Файл уже привязан или конфликт: {e}")
-        processed += 1
-    return {"processed": processed, "created": created, "skipped": skipped}
+    return download_missing_files(ProductFile.FileType.DRAWING, batch_size=batch_size, concurrency=concurrency)
 
 
 @shared_task
@@ -466,19 +380,16 @@ def export_parts_to_csv():
 def index_products_atomically():
     """
     Задача для атомарной индексации всех товаров в MeiliSearch.
-    Очищает индекс и создает его заново.
+    Строит новую версию индекса и подменяет ею рабочий - поиск не прерывается.
     """
     try:
         logger.info("Начинаем полную переиндексацию товаров в MeiliSearch")
         
-        # Получаем все товары
-        products = Product.objects.select_related('brand', 'subgroup__group', 'product_manager').all()
-        
-        # Очищаем индекс и создаем заново
-        ProductIndexer.index_all_atomically()
+        # Строим индекс заново и запоминаем хэши документов для инкрементальной синхронизации
+        indexed_count = rebuild_search_index()
         
-        logger.info(f"Успешно проиндексировано {products.count()} товаров в MeiliSearch")
-        return f"Проиндексировано {products.count()} товаров"
+        logger.info(f"Успешно проиндексировано {indexed_count} товаров в MeiliSearch")
+        return f"Проиндексировано {indexed_count} товаров"
         
     except Exception as e:
         logger.error(f"Ошибка при полной индексации товаров: {e}")
@@ -504,6 +415,48 @@ def index_products(product_ids):
         raise
 
 
+@shared_task
+def sync_products_search_index():
+    """
+    Инкрементальная синхронизация индекса товаров: отправляет в MeiliSearch
+    только измененные документы и удаляет удаленные товары (см. goods.search_sync).
+    """
+    try:
+        return sync_search_index()
+    except Exception as e:
+        logger.error(f"Ошибка при синхронизации индекса товаров: {e}")
+        raise
+
+
+@shared_task
+def refresh_product_analogs(full=False, subgroup_ids=None):
+    """
+    Строит блоки поиска аналогов (см. goods.analogs): по умолчанию только
+    для подгрупп, чьи блоки удалены после изменения параметров;
+    subgroup_ids - перестройка указанных подгрупп (после импорта товаров);
+    full=True - полная перестройка всех подгрупп.
+    """
+    try:
+        if full:
+            stored = store_blocks()
+        elif subgroup_ids is not None:
+            stored = store_blocks(subgroup_ids)
+        else:
+            subgroup_ids = (
+                ProductParameter.objects
+                .filter(product__deleted_at__isnull=True)
+                .values_list('product__subgroup_id', flat=True)
+                .distinct()
+            )
+            missing = missing_subgroups(subgroup_ids)
+            stored = store_blocks(missing) if missing else 0
+        logger.info(f"Блоки аналогов построены: {stored} подгрупп")
+        return f"Построено блоков аналогов: {stored}"
+    except Exception as e:
+        logger.error(f"Ошибка при построении блоков аналогов: {e}")
+        raise
+
+
 @shared_task
 def unindex_products(product_ids):
     """
@@ -627,10 +580,13 @@ def reindex_products_smart():
     Улучшенная задача для переиндексации товаров с настройками для умного поиска.
     
     Эта задача:
-    1. Очищает старый индекс
-    2. Применяет обновленные настройки индексации с улучшенными фильтрами
-    3. Переиндексирует все товары
-    4. Проверяет корректность индексации
+    1. Применяет обновленные настройки индексации с улучшенными фильтрами
+    2. Строит новую версию индекса, сверяет число документов с БД и меняет ее
+       местами с рабочим (при ошибке рабочий индекс не меняется)
+    3. Проверяет корректность индексации
+
+    Изменения товаров попадают в индекс инкрементально (sync_products_search_index),
+    полная переиндексация запускается раз в неделю как страховка.
     """
     try:
         logger.info("🚀 Начинаем улучшенную переиндексацию товаров в MeiliSearch")
@@ -667,17 +623,13 @@ def reindex_products_smart():
         except Exception as e:
             logger.warning(f"   ⚠️  Не удалось обновить настройки: {e}")
         
-        # 2. Очищаем индекс и переиндексируем
-        logger.info("🗑️  Очищаем старый индекс...")
-        ProductIndexer.index_all_atomically()
+        # 2. Строим индекс заново (rebuild_search_index дожидается обработки задач MeiliSearch)
+        logger.info("🗑️  Перестраиваем индекс...")
+        rebuild_search_index()
         
         # 3. Проверяем результат
         logger.info("🔍 Проверяем результат переиндексации...")
         
-        # Ждем немного для завершения индексации
-        import time
-        time.sleep(2)
-        
         try:
             # Проверяем количество документов в индексе
             index_info = index.get_stats()
@@ -707,101 +659,82 @@ def reindex_products_smart():
         raise 
 
 
+def _export_mysql_query_to_excel(query, params, kind, filename, sheet_title='Товары', user_id=None):
+    """
+    Выполняет запрос к MySQL и потоково пишет результат в Excel-файл выгрузки.
+
+    Строки читаются небуферизованным курсором и сразу уходят в write_only
+    книгу, без fetchall() и промежуточного DataFrame.
+
+    Returns:
+        tuple: (ExportArtifact или None, если данных нет; количество строк)
+    """
+    connection = mysql.connector.connect(**mysql_config)
+    cursor = None
+    try:
+        if not connection.is_connected():
+            raise Error("MySQL-соединение не установлено")
+        cursor = connection.cursor(buffered=False)
+        cursor.execute(query, params)
+        with ExportArtifactWriter(kind, filename, created_by_id=user_id) as output:
+            with ReportWorkbook(output.file) as workbook:
+                records = workbook.add_sheet(sheet_title, cursor.column_names, cursor)
+    finally:
+        if cursor is not None:
+            cursor.close()
+        if connection.is_connected():
+            connection.close()
+
+    if not records:
+        # Пустой файл никому не нужен
+        output.artifact.file.delete(save=False)
+        output.artifact.delete()
+        return None, 0
+    return output.artifact, records
+
+
 @shared_task
-def export_products_by_typecode(typecode):
+def export_products_by_typecode(typecode, user_id=None):
     """
     Celery-задача для экспорта описательных свойств товаров по ID подгруппы (typecode) в Excel файл.
-    Возвращает словарь с бинарным содержимым файла вместо пути.
+    Возвращает id файла выгрузки (ExportArtifact) и ссылку на скачивание.
+    user_id - ID пользователя, запросившего экспорт.
     """
-    connection = None
+    # Выполняем SQL запрос с фильтрацией по typecode
+    query = """
+    SELECT
+        mainbase.id AS 'Артикул',
+        CASE 
+            WHEN LEFT(TRIM(REVERSE(gg.tovgroup)), 1) = '*' 
+            THEN TRIM(REVERSE(SUBSTRING(TRIM(REVERSE(gg.tovgroup)), 2))) 
+            ELSE gg.tovgroup 
+        END AS 'Группа',
+        gg.tovmark AS 'Подгруппа',
+        mainwide.head AS 'Тип продукции',
+        mainwide.brand AS 'Брэнд',
+        mainbase.tovmark AS 'Простое название',
+        mainwide.complex AS 'Комплексное название',
+        mainwide.description AS 'Описание',
+        mainwide.keywords AS 'Ключевые слова'
+    FROM groupsb gg
+    JOIN mainbase ON mainbase.mgroup = gg.mgroup
+    LEFT JOIN mainwide ON mainwide.mainbase = mainbase.id
+    WHERE gg.mgroup = %s
+    AND mainbase.ruelsite <> 0
+    ORDER BY 3, 4, 7
+    """
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f"products_typecode_{typecode}_{timestamp}.xlsx"
     try:
-        connection = mysql.connector.connect(**mysql_config)
-        if connection.is_connected():
-            cursor = connection.cursor(dictionary=True)
-           
-            # Выполняем SQL запрос с фильтрацией по typecode
-            query = """
-            SELECT
-                mainbase.id AS 'Артикул',
-                CASE 
-                    WHEN LEFT(TRIM(REVERSE(gg.tovgroup)), 1) = '*' 
-                    THEN TRIM(REVERSE(SUBSTRING(TRIM(REVERSE(gg.tovgroup)), 2))) 
-                    ELSE gg.tovgroup 
-                END AS 'Группа',
-                gg.tovmark AS 'Подгруппа',
-                mainwide.head AS 'Тип продукции',
-                mainwide.brand AS 'Брэнд',
-                mainbase.tovmark AS 'Простое название',
-                mainwide.complex AS 'Комплексное название',
-                mainwide.description AS 'Описание',
-                mainwide.keywords AS 'Ключевые слова'
-            FROM groupsb gg
-            JOIN mainbase ON mainbase.mgroup = gg.mgroup
-            LEFT JOIN mainwide ON mainwide.mainbase = mainbase.id
-            WHERE gg.mgroup = %s
-            AND mainbase.ruelsite <> 0
-            ORDER BY 3, 4, 7
-            """
-            cursor.execute(query, (typecode,))
-            products = cursor.fetchall()
-           
-            if not products:
-                logger.warning(f"Нет данных для typecode={typecode}")
-                return {
-                    'success': False,
-                    'error': f"Нет данных для указанного typecode: {typecode}"
-                }
-        else:
-            logger.error("MySQL-соединение не установлено")
-            return {
-                'success': False,
-                'error': "Ошибка: не удалось подключиться к базе данных"
-            }
+        artifact, records = _export_mysql_query_to_excel(
+            query, (typecode,), 'products_typecode', filename, user_id=user_id
+        )
     except Error as e:
-        logger.error(f"Ошибка при подключении к MySQL: {e}")
+        logger.error(f"Ошибка при работе с MySQL: {e}")
         return {
             'success': False,
             'error': f"Ошибка при работе с базой данных: {str(e)}"
         }
-    finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
-   
-    # Создаем Excel файл в памяти
-    try:
-        # Создаем DataFrame
-        df = pd.DataFrame(products)
-        
-        # Удаляем временную колонку @rev
-        if '@rev' in df.columns:
-            df = df.drop(columns=['@rev'])
-        
-        # Вместо сохранения на диск используем BytesIO
-        excel_buffer = BytesIO()
-        
-        # Сохраняем данные в буфер
-        df.to_excel(excel_buffer, sheet_name='Товары', index=False)
-        
-        # Получаем содержимое буфера
-        excel_buffer.seek(0)
-        file_data = excel_buffer.getvalue()
-        
-        # Преобразуем бинарные данные в base64 для безопасной передачи через JSON
-        encoded_data = base64.b64encode(file_data).decode('utf-8')
-        
-        # Формируем результат
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"products_typecode_{typecode}_{timestamp}.xlsx"
-        
-        logger.info(f"Создан Excel файл в памяти для typecode={typecode} с {len(products)} записями")
-        
-        return {
-            'success': True,
-            'filename': filename,
-            'data': encoded_data,
-            'records': len(products)
-        }
     except Exception as e:
         logger.error(f"Ошибка при создании Excel-файла: {e}")
         return {
@@ -809,9 +742,21 @@ def export_products_by_typecode(typecode):
             'error': f"Ошибка при создании Excel-файла: {str(e)}"
         }
 
+    if not records:
+        logger.warning(f"Нет данных для typecode={typecode}")
+        return {
+            'success': False,
+            'error': f"Нет данных для указанного typecode: {typecode}"
+        }
+
+    logger.info(f"Создан Excel файл для typecode={typecode} с {records} записями")
+    
+    return artifact_result(artifact, records=records)
+
 
 @shared_task
-def export_products_by_filters(subgroup_ids=None, brand_names=None, only_two_params=False, no_description=False):
+def export_products_by_filters(subgroup_ids=None, brand_names=None, only_two_params=False, no_description=False,
+                               user_id=None):
     """
     Celery-задача для экспорта описательных свойств товаров с фильтрацией 
     по подгруппам, брендам, количеству технических параметров и наличию описания в Excel файл.
@@ -821,157 +766,97 @@ def export_products_by_filters(subgroup_ids=None, brand_names=None, only_two_par
         brand_names (list): Список названий брендов для фильтрации (может быть None для всех)  
         only_two_params (bool): Если True, экспортируются только товары с двумя техническими параметрами
         no_description (bool): Если True, экспортируются только товары без описания
+        user_id (int): ID пользователя, запросившего экспорт
     
     Returns:
-        dict: Словарь с результатом экспорта и бинарным содержимым файла
+        dict: Результат экспорта с id файла выгрузки (ExportArtifact) и ссылкой на скачивание
     """
-    connection = None
+    # Базовый SQL запрос
+    base_query = """
+    SELECT
+        mainbase.id AS 'Артикул',
+        CASE 
+            WHEN LEFT(TRIM(REVERSE(gg.tovgroup)), 1) = '*' 
+            THEN TRIM(REVERSE(SUBSTRING(TRIM(REVERSE(gg.tovgroup)), 2))) 
+            ELSE gg.tovgroup 
+        END AS 'Группа',
+        gg.tovmark AS 'Подгруппа',
+        mainwide.head AS 'Тип продукции',
+        mainwide.brand AS 'Брэнд',
+        mainbase.tovmark AS 'Простое название',
+        mainwide.complex AS 'Комплексное название',
+        mainwide.description AS 'Описание',
+        mainwide.keywords AS 'Ключевые слова'
+    FROM groupsb gg
+    JOIN mainbase ON mainbase.mgroup = gg.mgroup
+    LEFT JOIN mainwide ON mainwide.mainbase = mainbase.id
+    WHERE mainbase.ruelsite <> 0
+    """
+    
+    # Добавляем условия фильтрации
+    where_conditions = []
+    query_params = []
+    
+    if subgroup_ids:
+        # Фильтр по подгруппам
+        placeholders = ', '.join(['%s'] * len(subgroup_ids))
+        where_conditions.append(f"gg.mgroup IN ({placeholders})")
+        query_params.extend(subgroup_ids)
+    
+    if brand_names:
+        # Фильтр по брендам
+        placeholders = ', '.join(['%s'] * len(brand_names))
+        where_conditions.append(f"mainwide.brand IN ({placeholders})")
+        query_params.extend(brand_names)
+    
+    if only_two_params:
+        # Фильтр по количеству технических параметров (ровно 2)
+        tech_params_filter = """
+            (SELECT COUNT(*) 
+             FROM metrinfo t 
+             JOIN metrics tp ON t.metrics = tp.id 
+             WHERE t.mainbase = mainbase.id) = 2
+        """
+        where_conditions.append(tech_params_filter)
+    
+    if no_description:
+        # Фильтр для товаров без описания (пустое или NULL описание)
+        no_description_filter = "(mainwide.description IS NULL OR TRIM(mainwide.description) = '')"
+        where_conditions.append(no_description_filter)
+    
+    # Собираем финальный запрос
+    if where_conditions:
+        query = base_query + " AND " + " AND ".join(where_conditions)
+    else:
+        query = base_query
+        
+    query += " ORDER BY 3, 4, 7"
+    
+    logger.info(f"Выполняем SQL запрос с параметрами: subgroups={subgroup_ids}, brands={brand_names}, only_two_params={only_two_params}, no_description={no_description}")
+    # Создаем описательное имя файла
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename_parts = ["products"]
+    if subgroup_ids:
+        filename_parts.append(f"subgroups_{len(subgroup_ids)}")
+    if brand_names:
+        filename_parts.append(f"brands_{len(brand_names)}")
+    if only_two_params:
+        filename_parts.append("2params")
+    if no_description:
+        filename_parts.append("no_desc")
+    filename_parts.append(timestamp)
+    filename = f"{'_'.join(filename_parts)}.xlsx"
+
     try:
-        connection = mysql.connector.connect(**mysql_config)
-        if connection.is_connected():
-            cursor = connection.cursor(dictionary=True)
-           
-            # Базовый SQL запрос
-            base_query = """
-            SELECT
-                mainbase.id AS 'Артикул',
-                CASE 
-                    WHEN LEFT(TRIM(REVERSE(gg.tovgroup)), 1) = '*' 
-                    THEN TRIM(REVERSE(SUBSTRING(TRIM(REVERSE(gg.tovgroup)), 2))) 
-                    ELSE gg.tovgroup 
-                END AS 'Группа',
-                gg.tovmark AS 'Подгруппа',
-                mainwide.head AS 'Тип продукции',
-                mainwide.brand AS 'Брэнд',
-                mainbase.tovmark AS 'Простое название',
-                mainwide.complex AS 'Комплексное название',
-                mainwide.description AS 'Описание',
-                mainwide.keywords AS 'Ключевые слова'
-            FROM groupsb gg
-            JOIN mainbase ON mainbase.mgroup = gg.mgroup
-            LEFT JOIN mainwide ON mainwide.mainbase = mainbase.id
-            WHERE mainbase.ruelsite <> 0
-            """
-            
-            # Добавляем условия фильтрации
-            where_conditions = []
-            query_params = []
-            
-            if subgroup_ids:
-                # Фильтр по подгруппам
-                placeholders = ', '.join(['%s'] * len(subgroup_ids))
-                where_conditions.append(f"gg.mgroup IN ({placeholders})")
-                query_params.extend(subgroup_ids)
-            
-            if brand_names:
-                # Фильтр по брендам
-                placeholders = ', '.join(['%s'] * len(brand_names))
-                where_conditions.append(f"mainwide.brand IN ({placeholders})")
-                query_params.extend(brand_names)
-            
-            if only_two_params:
-                # Фильтр по количеству технических параметров (ровно 2)
-                tech_params_filter = """
-                    (SELECT COUNT(*) 
-                     FROM metrinfo t 
-                     JOIN metrics tp ON t.metrics = tp.id 
-                     WHERE t.mainbase = mainbase.id) = 2
-                """
-                where_conditions.append(tech_params_filter)
-            
-            if no_description:
-                # Фильтр для товаров без описания (пустое или NULL описание)
-                no_description_filter = "(mainwide.description IS NULL OR TRIM(mainwide.description) = '')"
-                where_conditions.append(no_description_filter)
-            
-            # Собираем финальный запрос
-            if where_conditions:
-                query = base_query + " AND " + " AND ".join(where_conditions)
-            else:
-                query = base_query
-                
-            query += " ORDER BY 3, 4, 7"
-            
-            logger.info(f"Выполняем SQL запрос с параметрами: subgroups={subgroup_ids}, brands={brand_names}, only_two_params={only_two_params}, no_description={no_description}")
-            cursor.execute(query, query_params)
-            products = cursor.fetchall()
-           
-            if not products:
-                logger.warning("Нет данных для экспорта с заданными фильтрами")
-                return {
-                    'success': False,
-                    'error': "Нет данных для экспорта с заданными фильтрами"
-                }
-        else:
-            logger.error("MySQL-соединение не установлено")
-            return {
-                'success': False,
-                'error': "Ошибка: не удалось подключиться к базе данных"
-            }
+        artifact, records = _export_mysql_query_to_excel(
+            query, query_params, 'products_by_filters', filename, user_id=user_id
+        )
     except Error as e:
-        logger.error(f"Ошибка при подключении к MySQL: {e}")
+        logger.error(f"Ошибка при работе с MySQL: {e}")
         return {
             'success': False,
             'error': f"Ошибка при работе с базой данных: {str(e)}"
         }
-    finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
-   
-    # Создаем Excel файл в памяти
-    try:
-        # Создаем DataFrame
-        df = pd.DataFrame(products)
-        
-        # Удаляем временную колонку @rev если есть
-        if '@rev' in df.columns:
-            df = df.drop(columns=['@rev'])
-        
-        # Используем BytesIO для создания файла в памяти
-        excel_buffer = BytesIO()
-        
-        # Сохраняем данные в буфер
-        df.to_excel(excel_buffer, sheet_name='Товары', index=False)
-        
-        # Получаем содержимое буфера
-        excel_buffer.seek(0)
-        file_data = excel_buffer.getvalue()
-        
-        # Преобразуем бинарные данные в base64 для безопасной передачи через JSON
-        encoded_data = base64.b64encode(file_data).decode('utf-8')
-        
-        # Формируем результат
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        # Создаем описательное имя файла
-        filename_parts = ["products"]
-        if subgroup_ids:
-            filename_parts.append(f"subgroups_{len(subgroup_ids)}")
-        if brand_names:
-            filename_parts.append(f"brands_{len(brand_names)}")
-        if only_two_params:
-            filename_parts.append("2params")
-        if no_description:
-            filename_parts.append("no_desc")
-        filename_parts.append(timestamp)
-        
-        filename = f"{'_'.join(filename_parts)}.xlsx"
-        
-        logger.info(f"Создан Excel файл в памяти с {len(products)} записями. Фильтры: подгруппы={subgroup_ids}, бренды={brand_names}, only_two_params={only_two_params}, no_description={no_description}")
-        
-        return {
-            'success': True,
-            'filename': filename,
-            'data': encoded_data,
-            'records': len(products),
-            'filters': {
-                'subgroups': subgroup_ids or [],
-                'brands': brand_names or [],
-                'only_two_params': only_two_params,
-                'no_description': no_description
-            }
-        }
     except Exception as e:
         logger.error(f"Ошибка при создании Excel-файла: {e}")
         return {
@@ -979,6 +864,26 @@ def export_products_by_filters(subgroup_ids=None, brand_names=None, only_two_par
             'error': f"Ошибка при создании Excel-файла: {str(e)}"
         }
 
+    if not records:
+        logger.warning("Нет данных для экспорта с заданными фильтрами")
+        return {
+            'success': False,
+            'error': "Нет данных для экспорта с заданными фильтрами"
+        }
+    
+    logger.info(f"Создан Excel файл с {records} записями. Фильтры: подгруппы={subgroup_ids}, бренды={brand_names}, only_two_params={only_two_params}, no_description={no_description}")
+    
+    return artifact_result(
+        artifact,
+        records=records,
+        filters={
+            'subgroups': subgroup_ids or [],
+            'brands': brand_names or [],
+            'only_two_params': only_two_params,
+            'no_description': no_description
+        }
+    )
+
 
 @shared_task
 def assign_product_managers():
@@ -1047,6 +952,7 @@ def assign_product_managers():
                         id__in=product_ids,
                         product_manager__isnull=True
                     ).update(product_manager=top_manager)
+                    mark_products_changed(product_ids)
 
                     assigned_count += updated_count
                     logger.info(f"Подгруппа {subgroup_id}: назначен менеджер {top_manager.username} для {updated_count} товаров")
@@ -3,6 +3,18 @@
 """
 import re
 
+# Плотные таблицы str.translate покрывают латиницу и кириллицу (до U+04FF):
+# символ без замены тоже есть в таблице, и translate не ищет его впустую
+# (промах в таблице-словаре - исключение LookupError на каждый символ)
+_TRANSLATE_TABLE_SIZE = 0x500
+
+
+def _translate_table(mapping) -> list:
+    table = [chr(code) for code in range(_TRANSLATE_TABLE_SIZE)]
+    for char, replacement in mapping.items():
+        table[ord(char)] = replacement
+    return table
+
 
 class TransliterationUtils:
     """Утилита для конвертации между русской и латинской раскладками"""
@@ -38,51 +50,105 @@ class TransliterationUtils:
         'Ы': 'Y', 'Ь': '', 'Э': 'E', 'Ю': 'YU', 'Я': 'YA'
     }
     
-    # Обратная семантическая карта
-    EN_TO_RU_SEMANTIC = {v: k for k, v in RU_TO_EN_SEMANTIC.items() if v}
+    # Обратная семантическая карта: буквосочетания (zh, sch, ...) в том числе
+    # с заглавной первой буквой; при неоднозначности (e - е/э, y - й/ы) берется
+    # первая буква алфавита
+    EN_TO_RU_SEMANTIC = {}
+    for _ru, _en in RU_TO_EN_SEMANTIC.items():
+        if _en:
+            EN_TO_RU_SEMANTIC.setdefault(_en, _ru)
+            if len(_en) > 1 and _en.isupper():
+                EN_TO_RU_SEMANTIC.setdefault(_en.capitalize(), _ru)
+    del _ru, _en
+
+    # Таблицы str.translate - преобразование строки целиком за один вызов
+    _RU_TO_EN_TABLE = _translate_table(RU_TO_EN)
+    _EN_TO_RU_TABLE = _translate_table(EN_TO_RU)
+    _RU_TO_EN_SEMANTIC_TABLE = _translate_table(RU_TO_EN_SEMANTIC)
+    _EN_TO_RU_SEMANTIC_TABLE = _translate_table({k: v for k, v in EN_TO_RU_SEMANTIC.items() if len(k) == 1})
+    # Буквосочетания - самое длинное совпадение: альтернативы от длинных к коротким
+    _EN_TO_RU_SEMANTIC_SEQUENCES_RE = re.compile('|'.join(sorted(
+        (re.escape(k) for k in EN_TO_RU_SEMANTIC if len(k) > 1), key=len, reverse=True
+    )))
+
+    _CYRILLIC_RE = re.compile(r'[а-яёА-ЯЁ]')
+    _LATIN_RE = re.compile(r'[a-zA-Z]')
+    _PART_NUMBER_RE = re.compile(r'[0-9\-_]')
+
+    # Разделитель строк в пакетных преобразованиях: ни одна карта его не меняет
+    # и ни одно буквосочетание через него не проходит
+    _BATCH_SEPARATOR = '\x00'
     
     @classmethod
     def is_cyrillic(cls, text: str) -> bool:
         """Проверяет, содержит ли текст кириллические символы"""
-        return bool(re.search(r'[а-яёА-ЯЁ]', text))
+        return cls._CYRILLIC_RE.search(text) is not None
     
     @classmethod
     def is_latin(cls, text: str) -> bool:
         """Проверяет, содержит ли текст латинские символы"""
-        return bool(re.search(r'[a-zA-Z]', text))
+        return cls._LATIN_RE.search(text) is not None
     
     @classmethod
     def looks_like_part_number(cls, text: str) -> bool:
         """Проверяет, похож ли текст на part number (содержит цифры, дефисы, подчеркивания)"""
-        return bool(re.search(r'[0-9\-_]', text))
+        return cls._PART_NUMBER_RE.search(text) is not None
     
     @classmethod
     def ru_to_en(cls, text: str) -> str:
         """Конвертирует текст с русской раскладки на английскую"""
         if not text:
             return text
-        return ''.join(cls.RU_TO_EN.get(char, char) for char in text)
+        return text.translate(cls._RU_TO_EN_TABLE)
     
     @classmethod
     def en_to_ru(cls, text: str) -> str:
         """Конвертирует текст с английской раскладки на русскую"""
         if not text:
             return text
-        return ''.join(cls.EN_TO_RU.get(char, char) for char in text)
+        return text.translate(cls._EN_TO_RU_TABLE)
     
     @classmethod
     def ru_to_en_semantic(cls, text: str) -> str:
         """Конвертирует текст с русской на английскую семантически"""
         if not text:
             return text
-        return ''.join(cls.RU_TO_EN_SEMANTIC.get(char, char) for char in text)
+        return text.translate(cls._RU_TO_EN_SEMANTIC_TABLE)
     
     @classmethod
     def en_to_ru_semantic(cls, text: str) -> str:
-        """Конвертирует текст с английской на русскую семантически"""
+        """Конвертирует текст с английской на русскую семантически ("zhuk" -> "жук", "sch" -> "щ")"""
         if not text:
             return text
-        return ''.join(cls.EN_TO_RU_SEMANTIC.get(char, char) for char in text)
+        sequences = cls.EN_TO_RU_SEMANTIC
+        text = cls._EN_TO_RU_SEMANTIC_SEQUENCES_RE.sub(lambda match: sequences[match.group()], text)
+        return text.translate(cls._EN_TO_RU_SEMANTIC_TABLE)
+
+    @classmethod
+    def _convert_many(cls, convert, texts) -> list:
+        """Преобразует список строк одним вызовом convert над склеенной строкой."""
+        texts = ['' if text is None else str(text) for text in texts]
+        if not texts:
+            return []
+        if any(cls._BATCH_SEPARATOR in text for text in texts):
+            return [convert(text) for text in texts]
+        return convert(cls._BATCH_SEPARATOR.join(texts)).split(cls._BATCH_SEPARATOR)
+
+    @classmethod
+    def ru_to_en_many(cls, texts) -> list:
+        return cls._convert_many(cls.ru_to_en, texts)
+
+    @classmethod
+    def en_to_ru_many(cls, texts) -> list:
+        return cls._convert_many(cls.en_to_ru, texts)
+
+    @classmethod
+    def ru_to_en_semantic_many(cls, texts) -> list:
+        return cls._convert_many(cls.ru_to_en_semantic, texts)
+
+    @classmethod
+    def en_to_ru_semantic_many(cls, texts) -> list:
+        return cls._convert_many(cls.en_to_ru_semantic, texts)
     
     @classmethod
     def get_transliterated_variants(cls, text: str, smart_filter: bool = True) -> list:
@@ -116,40 +182,45 @@ class TransliterationUtils:
                 # Или если результат не выглядит как чисто латинский текст
                 elif not (cls.is_latin(en_variant) and not cls.is_cyrillic(en_variant)):
                     variants.append(en_variant)
-        else:
-            # Для не-кириллического текста или без умной фильтрации - старая логика
-            # Пробуем конвертировать как русский -> английский (раскладка клавиатуры)
-            en_variant = cls.ru_to_en(text)
-            if en_variant != text:
-                variants.append(en_variant)
-            
-            # Пробуем конвертировать как английский -> русский (раскладка клавиатуры)
-            ru_variant = cls.en_to_ru(text)
-            if ru_variant != text:
-                variants.append(ru_variant)
-            
-            # Пробуем семантическую конвертацию русский -> английский
-            en_semantic_variant = cls.ru_to_en_semantic(text)
-            if en_semantic_variant != text:
-                variants.append(en_semantic_variant)
-            
-            # Пробуем семантическую конвертацию английский -> русский
-            ru_semantic_variant = cls.en_to_ru_semantic(text)
-            if ru_semantic_variant != text:
-                variants.append(ru_semantic_variant)
-        
-        return list(set(variants))  # Убираем дубликаты
+            return list(dict.fromkeys(variants))
+
+        # Для не-кириллического текста или без умной фильтрации - все четыре преобразования
+        # (раскладка и семантика в обе стороны)
+        return cls._all_variants(text, cls.ru_to_en(text), cls.en_to_ru(text),
+                                 cls.ru_to_en_semantic(text), cls.en_to_ru_semantic(text))
+
+    @staticmethod
+    def _all_variants(text, *converted) -> list:
+        # Убираем дубликаты с сохранением порядка: документ индекса должен быть одинаковым
+        # в любом процессе, иначе меняется его хэш (goods.search_sync)
+        return list(dict.fromkeys([text, *(variant for variant in converted if variant != text)]))
     
     @classmethod
     def create_search_text(cls, *texts) -> str:
         """Создает текст для поиска со всеми вариантами транслитерации"""
-        all_variants = []
-        
-        for text in texts:
-            if text:
-                all_variants.extend(cls.get_transliterated_variants(str(text), smart_filter=False))
-        
-        return ' '.join(all_variants)
+        return ' '.join(filter(None, cls.create_search_texts(texts)))
+
+    @classmethod
+    def create_search_texts(cls, texts) -> list:
+        """
+        create_search_text для каждой строки списка: четыре преобразования
+        выполняются над всем пакетом сразу (индексация, поиск по многим словам).
+
+        Returns:
+            list: текст для поиска каждой строки ('' для пустых)
+        """
+        texts = [str(text) if text else '' for text in texts]
+        conversions = zip(
+            cls.ru_to_en_many(texts),
+            cls.en_to_ru_many(texts),
+            cls.ru_to_en_semantic_many(texts),
+            cls.en_to_ru_semantic_many(texts),
+            strict=True,
+        )
+        return [
+            ' '.join(cls._all_variants(text, *converted)) if text else ''
+            for text, converted in zip(texts, conversions, strict=True)
+        ]
 
 
 def prepare_search_query(query: str) -> dict:
@@ -170,32 +241,27 @@ def prepare_search_query(query: str) -> dict:
             'all_variants': [query]
         }
     
-    # Разбиваем запрос на слова
-    words = query.split()
+    # Разбиваем запрос на слова; преобразования кириллических слов - одним пакетом
+    cyrillic_words = [word for word in dict.fromkeys(query.split()) if TransliterationUtils.is_cyrillic(word)]
+    semantic_words = TransliterationUtils.ru_to_en_semantic_many(cyrillic_words)
+    keyboard_words = TransliterationUtils.ru_to_en_many(cyrillic_words)
+    # Для part number-подобных запросов исключаем раскладочную транслитерацию
+    skip_keyboard = TransliterationUtils.looks_like_part_number(query)
+
     priority_variants = [query]  # Всегда включаем оригинал
     fallback_variants = []
+    for word, semantic_variant, keyboard_variant in zip(cyrillic_words, semantic_words, keyboard_words, strict=True):
+        # Для кириллических слов добавляем семантическую транслитерацию в приоритет
+        if semantic_variant != word:
+            # Заменяем слово в оригинальном запросе
+            priority_variants.append(query.replace(word, semantic_variant))
+        # Раскладочную транслитерацию добавляем в запасные варианты
+        if keyboard_variant != word and not skip_keyboard:
+            fallback_variants.append(query.replace(word, keyboard_variant))
     
-    for word in words:
-        if TransliterationUtils.is_cyrillic(word):
-            # Для кириллических слов добавляем семантическую транслитерацию в приоритет
-            semantic_variant = TransliterationUtils.ru_to_en_semantic(word)
-            if semantic_variant != word:
-                # Заменяем слово в оригинальном запросе
-                semantic_query = query.replace(word, semantic_variant)
-                priority_variants.append(semantic_query)
-            
-            # Раскладочную транслитерацию добавляем в запасные варианты
-            keyboard_variant = TransliterationUtils.ru_to_en(word)
-            if keyboard_variant != word and TransliterationUtils.looks_like_part_number(query):
-                # Для part number-подобных запросов исключаем раскладочную транслитерацию
-                pass
-            elif keyboard_variant != word:
-                keyboard_query = query.replace(word, keyboard_variant)
-                fallback_variants.append(keyboard_query)
-    
-    # Убираем дубликаты
-    priority_variants = list(set(priority_variants))
-    fallback_variants = list(set(fallback_variants))
+    # Убираем дубликаты (порядок сохраняется)
+    priority_variants = list(dict.fromkeys(priority_variants))
+    fallback_variants = list(dict.fromkeys(fallback_variants))
     
     # Все варианты для обратной совместимости
     all_variants = priority_variants + fallback_variants
@@ -203,5 +269,39 @@ def prepare_search_query(query: str) -> dict:
     return {
         'priority_variants': priority_variants,
         'fallback_variants': fallback_variants,
-        'all_variants': list(set(all_variants))
-    } 
\ No newline at end of file
+        'all_variants': list(dict.fromkeys(all_variants))
+    }
+
+
+# Кириллические буквы, которые при ручном вводе путают с латинскими
+PART_NUMBER_HOMOGLYPHS = str.maketrans({
+    'А': 'A', 'В': 'B', 'Е': 'E', 'К': 'K', 'М': 'M', 'Н': 'H', 'О': 'O',
+    'Р': 'P', 'С': 'C', 'Т': 'T', 'У': 'Y', 'Х': 'X',
+})
+
+# Суффиксы упаковки/исполнения, которые не меняют сам компонент:
+# LM317T/NOPB, BAV99-TR, LT1086CM#PBF, BZX84C5V1,215, ...
+PART_NUMBER_PACKAGING_SUFFIX_RE = re.compile(
+    r'(?:[\s/#,\-.]+(?:NOPB|TRPBF|PBF|T/R|TR|TRL|REEL7|REEL13|REEL|CT|ND|TUBE|BULK|TAPE|E3|115|215|235))+$'
+)
+
+PART_NUMBER_NOISE_RE = re.compile(r'[\W_]+')
+
+
+def normalize_part_number(value) -> str:
+    """
+    Нормализованный ключ part number для сопоставления товаров.
+
+    Приводит к верхнему регистру, заменяет кириллические двойники латиницей,
+    отрезает суффиксы упаковки (-TR, /NOPB, #PBF, ...) и убирает пробелы
+    и знаки препинания: "lm317t/nopb" и "LM 317-T" дают "LM317T".
+    """
+    if not value:
+        return ''
+
+    key = str(value).strip().upper().translate(PART_NUMBER_HOMOGLYPHS)
+    stripped = PART_NUMBER_PACKAGING_SUFFIX_RE.sub('', key)
+    # Если весь part number состоит из "суффикса" - оставляем как есть
+    if PART_NUMBER_NOISE_RE.sub('', stripped):
+        key = stripped
+    return PART_NUMBER_NOISE_RE.sub('', key)
@@ -8,13 +8,19 @@ from django_filters.rest_framework import DjangoFilterBackend, FilterSet, CharFi
 from django.db.models import Q
 
 from goods.models import Product, ProductGroup, ProductSubgroup, Brand
+from goods.analogs import find_analogs
+from goods.autocomplete import KIND_BRAND, KIND_GROUP, KIND_SUBGROUP, get_catalog_names
+from goods.search import filter_search_text, index_search, search_products
+from goods.search_cache import search_cache_stats
+from meilisearch.errors import MeilisearchApiError, MeilisearchError
 from customers.models import Company
 from rfqs.models import RFQ, RFQItem
 from goods.tasks import export_products_by_typecode, export_products_by_filters
 from celery.result import AsyncResult
-import base64
+from core.views import task_result_download
+from django.utils.http import parse_etags
+import hashlib
 import logging
-from django.http import HttpResponse
 
 logger = logging.getLogger(__name__)
 from .serializers import (
@@ -52,16 +58,8 @@ class ProductFilter(FilterSet):
         )
     
     def filter_search(self, queryset, name, value):
-        """Общий поиск по ключевым полям"""
-        return queryset.filter(
-            Q(ext_id__icontains=value) |
-            Q(name__icontains=value) |
-            Q(complex_name__icontains=value) |
-            Q(description__icontains=value) |
-            Q(brand__name__icontains=value) |
-            Q(subgroup__name__icontains=value) |
-            Q(subgroup__group__name__icontains=value)
-        )
+        """Общий поиск по ключевым полям (денормализованный search_text с триграммным индексом)"""
+        return filter_search_text(queryset, value)
 
 
 # ViewSets для товаров
@@ -71,9 +69,9 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         'brand__product_manager', 'subgroup__product_manager'
     ).all()
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    # Параметр search обрабатывает ProductFilter.filter_search по индексируемому search_text
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_class = ProductFilter
-    search_fields = ["ext_id", "name", "complex_name", "description", "brand__name"]
     ordering_fields = ["name", "ext_id"]
     ordering = ["name"]
     
@@ -87,7 +85,7 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         """Поиск товаров по part number (name) или коду товара (ext_id).
 
         Параметры:
-        - q: строка запроса (поиск по part number и ext_id)
+        - q: строка запроса (поиск через MeiliSearch с вариантами транслитерации)
         - ext_id: точный поиск по коду товара (опционально)
         - page: номер страницы (1..)
         - page_size: элементов на странице
@@ -116,16 +114,15 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
             # Точный поиск по ext_id
             queryset = queryset.filter(ext_id__iexact=ext_id_query)
         elif query:
-            # Общий поиск по нескольким полям
-            queryset = queryset.filter(
-                Q(ext_id__icontains=query) |
-                Q(name__icontains=query) |
-                Q(complex_name__icontains=query) |
-                Q(description__icontains=query) |
-                Q(brand__name__icontains=query) |
-                Q(subgroup__name__icontains=query) |
-                Q(subgroup__group__name__icontains=query)
-            )
+            # Общий поиск: MeiliSearch, при его недоступности - search_text в PostgreSQL
+            products, total, _engine = search_products(queryset, query, offset, page_size)
+            serializer = ProductListSerializer(products, many=True)
+            return Response({
+                "count": total,
+                "results": serializer.data,
+                "page": page,
+                "page_size": page_size,
+            })
         
         # Подсчитываем общее количество результатов
         total = queryset.count()
@@ -180,6 +177,52 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = ProductListSerializer(queryset, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=["get"])
+    def analogs(self, request, pk=None):
+        """
+        Аналоги товара по техническим параметрам (см. goods.analogs).
+
+        Query: limit (1..100, по умолчанию 10), other_brands=true - только другие бренды.
+        """
+        try:
+            limit = max(min(int(request.query_params.get("limit", 10)), 100), 1)
+        except (TypeError, ValueError):
+            return Response({"error": "limit должен быть числом"}, status=status.HTTP_400_BAD_REQUEST)
+        other_brands = request.query_params.get("other_brands", "").lower() in ["true", "1", "yes"]
+
+        product = self.get_object()
+        return Response({
+            "product_id": product.pk,
+            "items": find_analogs(product, limit=limit, other_brands=other_brands),
+        })
+
+
+def _catalog_names_response(request, etag, build_data):
+    """
+    Ответ со списком из индекса автокомплита с ETag: если у клиента та же
+    версия (If-None-Match), возвращается 304 без тела.
+    """
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(build_data())
+    response["ETag"] = etag
+    # Браузер хранит ответ, но перепроверяет его при каждом запросе
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def _autocomplete_response(request, kind):
+    query = request.query_params.get("q", "").strip()
+    limit = min(int(request.query_params.get("limit", 20)), 50)
+    index = get_catalog_names()[kind]
+    params_hash = hashlib.sha256(f"{index.digest}:{query}:{limit}".encode()).hexdigest()[:32]
+    return _catalog_names_response(
+        request,
+        f'"{kind}-autocomplete-{params_hash}"',
+        lambda: index.search(query, limit),
+    )
+
 
 class ProductGroupViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = ProductGroup.objects.all()
@@ -189,6 +232,11 @@ class ProductGroupViewSet(viewsets.ReadOnlyModelViewSet):
     search_fields = ["name", "ext_id"]
     ordering = ["name"]
 
+    @action(detail=False, methods=["get"])
+    def autocomplete(self, request):
+        """Автокомплит для групп товаров по названию (из индекса в памяти, goods.autocomplete)"""
+        return _autocomplete_response(request, KIND_GROUP)
+
 
 class ProductSubgroupViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = ProductSubgroup.objects.select_related('group', 'product_manager').all()
@@ -201,26 +249,8 @@ class ProductSubgroupViewSet(viewsets.ReadOnlyModelViewSet):
     
     @action(detail=False, methods=["get"])
     def autocomplete(self, request):
-        """Автокомплит для подгрупп товаров по названию"""
-        query = request.query_params.get("q", "").strip()
-        limit = min(int(request.query_params.get("limit", 20)), 50)
-        
-        if not query:
-            queryset = self.get_queryset()[:limit]
-        else:
-            queryset = self.get_queryset().filter(name__icontains=query)[:limit]
-        
-        data = []
-        for subgroup in queryset:
-            data.append({
-                "id": subgroup.id,
-                "ext_id": subgroup.ext_id,
-                "name": subgroup.name,
-                "group_name": subgroup.group.name if subgroup.group else None,
-                "display_name": f"{subgroup.name} ({subgroup.group.name})" if subgroup.group else subgroup.name
-            })
-        
-        return Response(data)
+        """Автокомплит для подгрупп товаров по названию (из индекса в памяти, goods.autocomplete)"""
+        return _autocomplete_response(request, KIND_SUBGROUP)
 
 
 class BrandViewSet(viewsets.ReadOnlyModelViewSet):
@@ -233,32 +263,14 @@ class BrandViewSet(viewsets.ReadOnlyModelViewSet):
     
     @action(detail=False, methods=["get"])
     def autocomplete(self, request):
-        """Автокомплит для брендов по названию"""
-        query = request.query_params.get("q", "").strip()
-        limit = min(int(request.query_params.get("limit", 20)), 50)
-        
-        if not query:
-            queryset = self.get_queryset()[:limit]
-        else:
-            queryset = self.get_queryset().filter(name__icontains=query)[:limit]
-        
-        data = []
-        for brand in queryset:
-            data.append({
-                "id": brand.id,
-                "ext_id": brand.ext_id,
-                "name": brand.name,
-                "product_manager": brand.product_manager.full_name if brand.product_manager else None
-            })
-        
-        return Response(data)
+        """Автокомплит для брендов по названию (из индекса в памяти, goods.autocomplete)"""
+        return _autocomplete_response(request, KIND_BRAND)
     
     @action(detail=False, methods=["get"])
     def get_all_names(self, request):
-        """Получить список всех названий брендов для фильтрации"""
-        queryset = self.get_queryset()
-        brands = queryset.values_list('name', flat=True).distinct().order_by('name')
-        return Response(list(brands))
+        """Получить список всех названий брендов для фильтрации (с ETag - фронтенд кэширует список)"""
+        index = get_catalog_names()[KIND_BRAND]
+        return _catalog_names_response(request, f'"{KIND_BRAND}-names-{index.digest[:32]}"', lambda: index.names)
 
 
 @api_view(["POST"])
@@ -324,7 +336,9 @@ def export_products_descriptions(request):
     
     if is_async:
         # Асинхронный запуск новой задачи
-        task = export_products_by_filters.delay(subgroup_ids, brand_names, only_two_params, no_description)
+        task = export_products_by_filters.delay(
+            subgroup_ids, brand_names, only_two_params, no_description, user_id=request.user.id
+        )
         
         # Формируем описание фильтров для ответа
         filters_description = []
@@ -342,19 +356,13 @@ def export_products_descriptions(request):
     else:
         # Синхронный запуск новой задачи
         try:
-            result = export_products_by_filters(subgroup_ids, brand_names, only_two_params, no_description)
+            result = export_products_by_filters(
+                subgroup_ids, brand_names, only_two_params, no_description, user_id=request.user.id
+            )
             
             if result['success']:
-                # Декодируем base64 данные обратно в бинарные
-                file_data = base64.b64decode(result['data'])
-                
-                # Возвращаем файл как HTTP response для скачивания
-                response = HttpResponse(
-                    file_data,
-                    content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                )
-                response['Content-Disposition'] = f'attachment; filename="{result["filename"]}"'
-                return response
+                # Отдаем файл выгрузки потоково из хранилища
+                return task_result_download(request, result)
             else:
                 return Response(
                     {"error": result['error']}, 
@@ -382,16 +390,8 @@ def check_export_task(request, task_id):
             if result.successful():
                 task_result = result.get()
                 if task_result['success']:
-                    # Декодируем base64 данные обратно в бинарные
-                    file_data = base64.b64decode(task_result['data'])
-                    
-                    # Возвращаем файл как HTTP response для скачивания
-                    response = HttpResponse(
-                        file_data,
-                        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                    )
-                    response['Content-Disposition'] = f'attachment; filename="{task_result["filename"]}"'
-                    return response
+                    # Отдаем файл выгрузки потоково из хранилища
+                    return task_result_download(request, task_result)
                 else:
                     return Response(
                         {"status": "failed", "error": task_result['error']}, 
@@ -413,3 +413,63 @@ def check_export_task(request, task_id):
             {"error": f"Ошибка при проверке статуса задачи: {str(e)}"}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def index_search_products(request):
+    """
+    Поиск по индексу товаров MeiliSearch через общий кэш результатов
+    (используется инструментами LangGraph-агента).
+
+    POST /api/products/index-search/
+    {
+        "q": "stm32",                      // строка поиска (опционально при наличии filter)
+        "filter": "brand_name = \"ST\"",   // фильтр MeiliSearch (опционально)
+        "sort": ["name:asc"],              // сортировка (опционально)
+        "limit": 10,                       // 1..100
+        "offset": 0,
+        "attributesToRetrieve": ["name", "brand_name"],
+        "highlight": true
+    }
+    """
+    query = str(request.data.get("q") or "").strip()
+    search_filter = request.data.get("filter") or None
+    if not query and not search_filter:
+        return Response({"error": "Укажите хотя бы q или filter для поиска"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        limit = max(min(int(request.data.get("limit", 10)), 100), 1)
+        offset = max(int(request.data.get("offset", 0)), 0)
+    except (TypeError, ValueError):
+        return Response({"error": "limit и offset должны быть числами"}, status=status.HTTP_400_BAD_REQUEST)
+
+    sort = request.data.get("sort") or []
+    attributes = request.data.get("attributesToRetrieve") or []
+    if not isinstance(sort, list) or not isinstance(attributes, list):
+        return Response({"error": "sort и attributesToRetrieve должны быть списками"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        result = index_search(
+            query,
+            filter=search_filter,
+            sort=[str(rule) for rule in sort if str(rule).strip()],
+            limit=limit,
+            offset=offset,
+            attributes_to_retrieve=[str(attribute) for attribute in attributes if str(attribute).strip()],
+            highlight=bool(request.data.get("highlight", True)),
+        )
+    except MeilisearchApiError as e:
+        # Ошибка запроса (например, неверный фильтр) - возвращаем ее клиенту
+        return Response({"error": e.message, "code": e.code}, status=status.HTTP_400_BAD_REQUEST)
+    except MeilisearchError as e:
+        logger.warning(f"MeiliSearch недоступен для поиска по индексу: {e}")
+        return Response({"error": "Поиск временно недоступен"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response(result)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def search_cache_statistics(request):
+    """Попадания и промахи общего кэша поиска товаров, текущая версия индекса."""
+    return Response(search_cache_stats())
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from unfold.admin import ModelAdmin
-from .models import Invoice, InvoiceLine
+from .models import CustomerMetricsSnapshot, ExchangeRate, Invoice, InvoiceLine
 
 class InvoiceLineInline(admin.TabularInline):
     model = InvoiceLine
@@ -11,18 +11,34 @@ class InvoiceLineInline(admin.TabularInline):
 
 @admin.register(Invoice)
 class InvoiceAdmin(ModelAdmin):
-    list_display = ('invoice_number', 'invoice_date', 'company', 'invoice_type', 'sale_type', 'currency')
+    list_display = ('invoice_number', 'invoice_date', 'company', 'invoice_type', 'sale_type', 'currency', 'total_amount', 'line_count')
     list_filter = ('invoice_type', 'sale_type', 'currency')
     search_fields = ('invoice_number', 'company__name')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('total_amount', 'line_count', 'total_qty', 'created_at', 'updated_at')
     date_hierarchy = 'created_at'
     inlines = [InvoiceLineInline]
 
 
 @admin.register(InvoiceLine)
 class InvoiceLineAdmin(ModelAdmin):
-    list_display = ('invoice', 'product', 'quantity', 'price')
+    list_display = ('invoice', 'product', 'quantity', 'price', 'amount_rub')
     list_filter = ('invoice', 'product')
     search_fields = ('invoice__invoice_number', 'product__name')
+    readonly_fields = ('amount_rub', 'created_at', 'updated_at')
+    date_hierarchy = 'created_at'
+
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(ModelAdmin):
+    list_display = ('currency', 'rate_date', 'rate_to_rub', 'source')
+    list_filter = ('currency', 'source')
+    date_hierarchy = 'rate_date'
+
+
+@admin.register(CustomerMetricsSnapshot)
+class CustomerMetricsSnapshotAdmin(ModelAdmin):
+    list_display = ('company', 'snapshot_date', 'rfm_score', 'rfm_segment', 'ltv_segment', 'activity_status', 'revenue')
+    list_filter = ('snapshot_date', 'rfm_segment', 'ltv_segment', 'activity_status')
+    search_fields = ('company__name',)
     readonly_fields = ('created_at', 'updated_at')
-    date_hierarchy = 'created_at'
\ No newline at end of file
+    date_hierarchy = 'snapshot_date'
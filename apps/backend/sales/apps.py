@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SalesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sales'
+
+    def ready(self):
+        # Сигналы обновления витрины фактов продаж, истории курсов валют и итогов счетов
+        from . import facts, fx, totals  # noqa: F401
@@ -0,0 +1,193 @@
+"""
+RFM- и LTV-метрики клиентов.
+
+Исходные данные (первая/последняя покупка, количество заказов, выручка)
+собираются одним сгруппированным запросом по витрине фактов продаж,
+баллы и сегменты считаются векторно (qcut / np.select). Те же функции
+используют Excel-отчеты и ежедневный снимок CustomerMetricsSnapshot.
+"""
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.models import Count, DecimalField, Max, Min, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import CustomerMetricsSnapshot, SalesFact
+
+BASE_COLUMNS = ['company_id', 'first_purchase_date', 'last_purchase_date', 'total_orders', 'revenue']
+
+# Правила RFM-сегментов проверяются по порядку, первое совпадение выигрывает
+RFM_SEGMENT_RULES = [
+    ('Champions', lambda r, f, m: (r >= 4) & (f >= 4) & (m >= 4)),
+    ('Loyal Customers', lambda r, f, m: (r >= 3) & (f >= 4) & (m >= 3)),
+    ('Potential Loyalists', lambda r, f, m: (r >= 4) & (f >= 2) & (m >= 2)),
+    ('New Customers', lambda r, f, m: (r >= 4) & (f <= 2) & (m <= 2)),
+    ('Promising', lambda r, f, m: (r >= 3) & (f <= 2) & (m <= 2)),
+    ('Need Attention', lambda r, f, m: (r == 3) & (f == 3) & (m == 3)),
+    ('About to Sleep', lambda r, f, m: (r <= 3) & (f <= 3) & (m >= 2)),
+    ('At Risk', lambda r, f, m: (r <= 2) & (f >= 2) & (m >= 2)),
+    ('Cannot Lose Them', lambda r, f, m: (r <= 2) & (f >= 4) & (m >= 4)),
+    ('Hibernating', lambda r, f, m: (r <= 2) & (f <= 2) & (m <= 2)),
+    ('Lost', lambda r, f, m: (r <= 2) & (f >= 2) & (m <= 2)),
+]
+
+
+def customer_sales_frame(date_from=None, date_to=None) -> pd.DataFrame:
+    """
+    Агрегаты продаж по клиентам одним запросом.
+
+    Returns:
+        DataFrame: company_id, first_purchase_date, last_purchase_date,
+        total_orders, revenue (float)
+    """
+    facts = SalesFact.objects.all()
+    if date_from:
+        facts = facts.filter(invoice_date__gte=date_from)
+    if date_to:
+        facts = facts.filter(invoice_date__lte=date_to)
+
+    rows = (
+        facts.values('company_id')
+        .annotate(
+            first_purchase_date=Min('invoice_date'),
+            last_purchase_date=Max('invoice_date'),
+            total_orders=Count('invoice_id', distinct=True),
+            revenue=Coalesce(Sum('amount_rub'), Value(0, output_field=DecimalField())),
+        )
+        .order_by()
+        .values_list(*BASE_COLUMNS)
+    )
+    df = pd.DataFrame.from_records(rows, columns=BASE_COLUMNS)
+    df['revenue'] = df['revenue'].astype(float)
+    return df
+
+
+def _days_between(later, earlier) -> pd.Series:
+    return (pd.to_datetime(later) - pd.to_datetime(earlier)).dt.days
+
+
+def score_quantiles(series: pd.Series, reverse=False) -> pd.Series:
+    """
+    Балл 1-5 по квантилям; при большом числе одинаковых значений
+    квантилей становится меньше, и баллы растягиваются на шкалу 1-5.
+    """
+    try:
+        result = pd.qcut(series, q=5, labels=False, duplicates='drop')
+    except ValueError:
+        try:
+            result = pd.qcut(series, q=3, labels=False, duplicates='drop')
+        except ValueError:
+            result = series.rank(method='dense') - 1
+
+    if result.max() > 0:
+        result = ((result - result.min()) / (result.max() - result.min()) * 4 + 1).round()
+    else:
+        result = pd.Series(3, index=result.index)
+
+    if reverse:
+        result = 6 - result
+    return result.astype(int)
+
+
+def add_rfm_scores(df: pd.DataFrame, ref_date) -> pd.DataFrame:
+    """Добавляет recency/frequency/monetary, R/F/M-баллы, RFM_Score и Segment."""
+    df['recency'] = _days_between(pd.Timestamp(ref_date), df['last_purchase_date'])
+    df['frequency'] = df['total_orders']
+    df['monetary'] = df['revenue']
+
+    # R: чем меньше дней, тем выше балл; F и M: чем больше, тем выше
+    df['R_score'] = score_quantiles(df['recency'], reverse=True)
+    df['F_score'] = score_quantiles(df['frequency'])
+    df['M_score'] = score_quantiles(df['monetary'])
+    df['RFM_Score'] = df['R_score'].astype(str) + df['F_score'].astype(str) + df['M_score'].astype(str)
+
+    r, f, m = df['R_score'], df['F_score'], df['M_score']
+    df['Segment'] = np.select(
+        [rule(r, f, m) for _, rule in RFM_SEGMENT_RULES],
+        [name for name, _ in RFM_SEGMENT_RULES],
+        default='Other',
+    )
+    return df
+
+
+def add_ltv_metrics(df: pd.DataFrame, ref_date) -> pd.DataFrame:
+    """Добавляет историческую и прогнозную LTV, сегмент LTV и статус активности."""
+    df['historical_ltv'] = df['revenue']
+    # Минимум 1 день для клиентов с одной датой покупки
+    df['lifespan_days'] = _days_between(df['last_purchase_date'], df['first_purchase_date']).clip(lower=1)
+    df['aov'] = df['historical_ltv'] / df['total_orders']
+    df['purchase_frequency_monthly'] = df['total_orders'] / (df['lifespan_days'] / 30.0)
+    df['customer_value_monthly'] = df['aov'] * df['purchase_frequency_monthly']
+    # Простая модель: текущая месячная выручка * количество месяцев
+    df['predicted_ltv_12m'] = df['customer_value_monthly'] * 12
+    df['predicted_ltv_24m'] = df['customer_value_monthly'] * 24
+    df['days_since_last_purchase'] = _days_between(pd.Timestamp(ref_date), df['last_purchase_date'])
+
+    ltv = df['historical_ltv']
+    df['ltv_segment'] = np.select(
+        [ltv >= ltv.quantile(0.75), ltv >= ltv.quantile(0.50), ltv >= ltv.quantile(0.25)],
+        ['High Value', 'Medium-High Value', 'Medium Value'],
+        default='Low Value',
+    )
+
+    days = df['days_since_last_purchase']
+    df['activity_status'] = np.select(
+        [days <= 30, days <= 90, days <= 180],
+        ['Active', 'At Risk', 'Inactive'],
+        default='Churned',
+    )
+    return df
+
+
+def _money(value, places='0.01') -> Decimal:
+    return Decimal(str(round(float(value), 4))).quantize(Decimal(places))
+
+
+def refresh_customer_metrics_snapshot(snapshot_date=None) -> int:
+    """
+    Пересчитывает снимок RFM/LTV по всей истории продаж на дату.
+
+    Returns:
+        int: количество клиентов в снимке
+    """
+    snapshot_date = snapshot_date or date.today()
+    df = customer_sales_frame()
+    if df.empty:
+        return 0
+    add_rfm_scores(df, snapshot_date)
+    add_ltv_metrics(df, snapshot_date)
+
+    snapshots = [
+        CustomerMetricsSnapshot(
+            company_id=int(row.company_id),
+            snapshot_date=snapshot_date,
+            first_purchase_date=row.first_purchase_date,
+            last_purchase_date=row.last_purchase_date,
+            orders_count=int(row.total_orders),
+            revenue=_money(row.revenue),
+            recency_days=int(row.recency),
+            r_score=int(row.R_score),
+            f_score=int(row.F_score),
+            m_score=int(row.M_score),
+            rfm_score=row.RFM_Score,
+            rfm_segment=str(row.Segment),
+            lifespan_days=int(row.lifespan_days),
+            average_order_value=_money(row.aov),
+            purchase_frequency_monthly=_money(row.purchase_frequency_monthly, '0.0001'),
+            customer_value_monthly=_money(row.customer_value_monthly),
+            predicted_ltv_12m=_money(row.predicted_ltv_12m),
+            predicted_ltv_24m=_money(row.predicted_ltv_24m),
+            ltv_segment=str(row.ltv_segment),
+            activity_status=str(row.activity_status),
+        )
+        # numpy-типы приводим к int/str: psycopg их не адаптирует
+        for row in df.itertuples(index=False)
+    ]
+
+    with transaction.atomic():
+        CustomerMetricsSnapshot.objects.filter(snapshot_date=snapshot_date).delete()
+        CustomerMetricsSnapshot.objects.bulk_create(snapshots, batch_size=2000)
+    return len(snapshots)
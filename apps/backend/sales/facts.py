@@ -0,0 +1,283 @@
+"""
+Витрина фактов продаж (SalesFact).
+
+Аналитика продаж читает одну денормализованную таблицу вместо соединения
+Invoice -> InvoiceLine -> Product -> Brand/Subgroup/Group -> Company
+с вычислением quantity * price на лету.
+
+Обновление инкрементальное:
+- новые строки счетов продажи (id больше последнего загруженного) добавляются
+  одним INSERT ... SELECT;
+- для явно переданных счетов (изменена шапка) факты пересобираются;
+- измерения товара (бренд, подгруппа, группа, менеджер) синхронизируются
+  одним UPDATE только там, где они изменились (импорт товаров - один раз
+  после загрузки, правка товара через ORM - сигналом);
+- дневные свертки (sales.rollups) пересобираются только за затронутые дни.
+Удаленные строки удаляются из витрины каскадно; правки через ORM (админка)
+подхватываются сигналами. Каждое изменение витрины увеличивает версию данных
+продаж - по ней сбрасывается кэш отчетов (core.report_cache).
+"""
+import logging
+from threading import local
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.report_cache import bump_data_version
+from core.signals import in_bulk_import, on_commit_once
+from goods.models import Brand, Product, ProductSubgroup
+
+from .models import Invoice, InvoiceLine, SalesFact
+from .rollups import drifted_rollup_days, rebuild_rollup_days, refresh_sales_rollups
+
+logger = logging.getLogger(__name__)
+
+# Пространство версий данных для кэша отчетов по продажам
+SALES_DATA_NAMESPACE = 'sales'
+
+
+def bump_sales_data_version():
+    return bump_data_version(SALES_DATA_NAMESPACE)
+
+
+def _tables():
+    return {
+        'fact': SalesFact._meta.db_table,
+        'line': InvoiceLine._meta.db_table,
+        'invoice': Invoice._meta.db_table,
+        'product': Product._meta.db_table,
+        'brand': Brand._meta.db_table,
+        'subgroup': ProductSubgroup._meta.db_table,
+    }
+
+
+# Менеджер товара определяется как в Product.get_manager: товар -> бренд -> подгруппа
+INSERT_FACTS_SQL = """
+    INSERT INTO {fact} (
+        line_id, invoice_id, invoice_date, company_id, product_id,
+        brand_id, subgroup_id, group_id, manager_id,
+        sale_type, currency, quantity, price, amount, amount_rub
+    )
+    SELECT
+        l.id, i.id, i.invoice_date, i.company_id, l.product_id,
+        p.brand_id, p.subgroup_id, sg.group_id,
+        COALESCE(p.product_manager_id, b.product_manager_id, sg.product_manager_id),
+        i.sale_type, i.currency, l.quantity, l.price, l.quantity * l.price, l.amount_rub
+    FROM {line} l
+    JOIN {invoice} i ON i.id = l.invoice_id
+    JOIN {product} p ON p.id = l.product_id
+    LEFT JOIN {brand} b ON b.id = p.brand_id
+    LEFT JOIN {subgroup} sg ON sg.id = p.subgroup_id
+    WHERE i.invoice_type = %(sale)s AND {condition}
+    ON CONFLICT (line_id) DO NOTHING
+"""
+
+SYNC_DIMENSIONS_SQL = """
+    UPDATE {fact} f
+    SET brand_id = d.brand_id,
+        subgroup_id = d.subgroup_id,
+        group_id = d.group_id,
+        manager_id = d.manager_id
+    FROM (
+        SELECT
+            p.id AS product_id,
+            p.brand_id,
+            p.subgroup_id,
+            sg.group_id,
+            COALESCE(p.product_manager_id, b.product_manager_id, sg.product_manager_id) AS manager_id
+        FROM {product} p
+        LEFT JOIN {brand} b ON b.id = p.brand_id
+        LEFT JOIN {subgroup} sg ON sg.id = p.subgroup_id
+        {product_condition}
+    ) d
+    WHERE f.product_id = d.product_id
+      AND (f.brand_id, f.subgroup_id, f.group_id, f.manager_id)
+          IS DISTINCT FROM (d.brand_id, d.subgroup_id, d.group_id, d.manager_id)
+"""
+
+
+def _insert_facts(cursor, condition, params):
+    cursor.execute(
+        INSERT_FACTS_SQL.format(condition=condition, **_tables()),
+        {'sale': Invoice.InvoiceType.SALE.value, **params},
+    )
+    return cursor.rowcount
+
+
+def sync_fact_dimensions(product_ids=None) -> int:
+    """Переносит в витрину текущие бренд/подгруппу/группу/менеджера товаров."""
+    product_condition = ''
+    params = {}
+    if product_ids is not None:
+        product_condition = 'WHERE p.id = ANY(%(product_ids)s)'
+        params['product_ids'] = list(product_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            SYNC_DIMENSIONS_SQL.format(product_condition=product_condition, **_tables()),
+            params,
+        )
+        updated = cursor.rowcount
+    if updated:
+        bump_sales_data_version()
+    return updated
+
+
+def delete_invoice_lines(invoice_ids) -> set:
+    """
+    Удаляет строки счетов и их факты двумя DELETE, без загрузки строк в ORM
+    и построчных сигналов (импорт заменяет строки обновленных счетов).
+    Итоги счетов и свертки пересчитывает вызывающий.
+
+    Returns:
+        set: дни удаленных фактов
+    """
+    invoice_ids = list(invoice_ids)
+    if not invoice_ids:
+        return set()
+    tables = _tables()
+    params = {'invoice_ids': invoice_ids}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH deleted AS (
+                DELETE FROM {tables['fact']} WHERE invoice_id = ANY(%(invoice_ids)s)
+                RETURNING invoice_date
+            )
+            SELECT DISTINCT invoice_date FROM deleted
+            """,
+            params,
+        )
+        days = {row[0] for row in cursor.fetchall()}
+        cursor.execute(f"DELETE FROM {tables['line']} WHERE invoice_id = ANY(%(invoice_ids)s)", params)
+    return days
+
+
+def refresh_invoice_facts(invoice_ids) -> int:
+    """Пересобирает факты указанных счетов (после изменения шапки или строк)."""
+    invoice_ids = list(invoice_ids)
+    if not invoice_ids:
+        return 0
+    facts = SalesFact.objects.filter(invoice_id__in=invoice_ids)
+    # Дата счета могла измениться - сворачиваем и старые, и новые дни
+    days = set(facts.values_list('invoice_date', flat=True).distinct())
+    days |= set(Invoice.objects.filter(id__in=invoice_ids).values_list('invoice_date', flat=True))
+    with transaction.atomic(), connection.cursor() as cursor:
+        facts.delete()
+        inserted = _insert_facts(cursor, 'i.id = ANY(%(invoice_ids)s)', {'invoice_ids': invoice_ids})
+        refresh_sales_rollups(days)
+    bump_sales_data_version()
+    return inserted
+
+
+def refresh_sales_facts(invoice_ids=None, full=False, days=()) -> dict:
+    """
+    Инкрементальное обновление витрины фактов продаж.
+
+    Args:
+        invoice_ids: счета, чьи факты нужно пересобрать (например, обновленные импортом)
+        full: полностью перестроить витрину
+        days: дни, чьи свертки нужно пересобрать помимо дней новых строк
+            (например, дни строк, удаленных импортом)
+
+    Returns:
+        dict: количество добавленных, пересобранных и обновленных по измерениям строк
+        и пересобранных дней дневных сверток
+    """
+    result = {'inserted': 0, 'rebuilt': 0, 'dimensions_updated': 0, 'rollup_days': 0}
+
+    if full:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {SalesFact._meta.db_table}")
+            result['inserted'] = _insert_facts(cursor, 'TRUE', {})
+            rebuild_rollup_days()
+        bump_sales_data_version()
+        logger.info(f"Витрина фактов продаж перестроена: {result['inserted']} строк")
+        return result
+
+    if invoice_ids:
+        result['rebuilt'] = refresh_invoice_facts(invoice_ids)
+
+    # Строки создаются импортом пакетно и только добавляются (при обновлении
+    # счета старые строки удаляются), поэтому водяной знак - максимальный id строки
+    watermark = SalesFact.objects.aggregate(last=Max('line_id'))['last'] or 0
+    days = set(days)
+    with transaction.atomic(), connection.cursor() as cursor:
+        result['inserted'] = _insert_facts(cursor, 'l.id > %(watermark)s', {'watermark': watermark})
+        if result['inserted']:
+            cursor.execute(
+                f"SELECT DISTINCT invoice_date FROM {SalesFact._meta.db_table} WHERE line_id > %(watermark)s",
+                {'watermark': watermark},
+            )
+            days.update(row[0] for row in cursor.fetchall())
+        # Дни с новыми строками и со строками, удаленными импортом
+        result['rollup_days'] = refresh_sales_rollups(days)
+
+    if result['inserted'] or result['rollup_days']:
+        bump_sales_data_version()
+
+    result['dimensions_updated'] = sync_fact_dimensions()
+    logger.info(
+        f"Витрина фактов продаж обновлена: добавлено {result['inserted']}, "
+        f"пересобрано {result['rebuilt']}, изменены измерения {result['dimensions_updated']}"
+    )
+    return result
+
+
+def repair_sales_rollups() -> int:
+    """
+    Сверяет дневные свертки с витриной по контрольной сумме и пересобирает
+    разошедшиеся дни.
+
+    Returns:
+        int: количество пересобранных дней
+    """
+    days = drifted_rollup_days()
+    if days:
+        logger.warning(f"Свертки продаж разошлись с витриной за {len(days)} дн.: {days[:10]}")
+        refresh_sales_rollups(days)
+        bump_sales_data_version()
+    return len(days)
+
+
+@receiver(post_save, sender=InvoiceLine)
+def _refresh_line_fact(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_invoice_facts([instance.invoice_id])
+
+
+@receiver(post_save, sender=Invoice)
+def _refresh_invoice_facts(sender, instance, created=False, raw=False, **kwargs):
+    # У нового счета еще нет строк - факты появятся при сохранении строк
+    if not raw and not created:
+        refresh_invoice_facts([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def _sync_product_dimensions(sender, instance, raw=False, **kwargs):
+    # Импорт товаров синхронизирует измерения одним UPDATE после загрузки
+    if not raw and not in_bulk_import():
+        sync_fact_dimensions([instance.pk])
+
+
+_deleted_lines = local()
+
+
+def _flush_deleted_line_days():
+    days = {day for day in _deleted_lines.__dict__.pop('invoice_days', {}).values() if day is not None}
+    if days:
+        refresh_sales_rollups(days)
+        bump_sales_data_version()
+
+
+@receiver(post_delete, sender=InvoiceLine)
+def _refresh_deleted_line_rollups(sender, instance, **kwargs):
+    # Факт строки удален каскадно; день счета запоминаем сразу - к коммиту
+    # может быть удален и сам счет. Свертки пересобираются один раз после коммита
+    invoice_days = _deleted_lines.__dict__.setdefault('invoice_days', {})
+    if instance.invoice_id not in invoice_days:
+        invoice_days[instance.invoice_id] = (
+            Invoice.objects.filter(pk=instance.invoice_id).values_list('invoice_date', flat=True).first()
+        )
+    on_commit_once(_flush_deleted_line_days)
@@ -0,0 +1,266 @@
+"""
+Курсы валют и рублевые суммы строк счетов.
+
+Курс на дату хранится в ExchangeRate (пополняется при изменении курса
+в справочнике rfqs.Currency и импортом файла курсов). Рублевая сумма строки
+считается один раз - при импорте или сохранении - по последнему курсу
+на дату счета (если более ранних курсов нет - по самому раннему известному),
+поэтому аналитика суммирует одну колонку amount_rub без соединения с курсами.
+
+Если курсов валюты нет вовсе, сумма строки берется в валюте счета (как до
+появления рублевых сумм) - строка не выпадает из выручки, а число таких строк
+пишется в лог. После загрузки курсов суммы пересчитываются.
+"""
+import logging
+from bisect import bisect_right
+from collections import Counter
+from datetime import date, datetime
+from decimal import Decimal
+
+import pandas as pd
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from rfqs.models import Currency
+
+from .facts import bump_sales_data_version
+from .models import ExchangeRate, Invoice, InvoiceLine, SalesFact
+from .rollups import refresh_sales_rollups
+
+logger = logging.getLogger(__name__)
+
+BASE_CURRENCY = Invoice.Currency.RUB.value
+
+CENTS = Decimal('0.01')
+
+
+class RateTable:
+    """
+    Курсы валют в памяти для пересчета большого числа строк.
+
+        rates = RateTable(['USD', 'CNY'])
+        rates.to_rub(Decimal('10.00'), 'USD', date(2024, 5, 1))
+
+    unconverted - число сумм по валютам, для которых курсов нет
+    (они возвращены в валюте счета).
+    """
+
+    def __init__(self, currencies=None):
+        queryset = ExchangeRate.objects.order_by('currency', 'rate_date')
+        if currencies is not None:
+            queryset = queryset.filter(currency__in=set(currencies) - {BASE_CURRENCY})
+        self._dates = {}
+        self._rates = {}
+        for currency, rate_date, rate in queryset.values_list('currency', 'rate_date', 'rate_to_rub'):
+            self._dates.setdefault(currency, []).append(rate_date)
+            self._rates.setdefault(currency, []).append(rate)
+        self.unconverted = Counter()
+
+    def rate(self, currency, on_date):
+        """Курс к рублю на дату или None, если курсов валюты нет."""
+        if currency == BASE_CURRENCY:
+            return Decimal('1')
+        if isinstance(on_date, datetime):
+            on_date = on_date.date()
+        dates = self._dates.get(currency)
+        if not dates:
+            return None
+        position = bisect_right(dates, on_date) - 1
+        return self._rates[currency][max(position, 0)]
+
+    def to_rub(self, amount, currency, on_date):
+        """Сумма в рублях; без курсов валюты - сумма в валюте счета."""
+        if amount is None:
+            return None
+        rate = self.rate(currency, on_date)
+        if rate is None:
+            if not self.unconverted[currency]:
+                logger.warning(f"Нет курсов валюты {currency}: суммы учитываются в валюте счета")
+            self.unconverted[currency] += 1
+            rate = Decimal('1')
+        return (Decimal(amount) * rate).quantize(CENTS)
+
+
+# Тот же выбор курса, что и в RateTable.to_rub: последний на дату, иначе самый
+# ранний, а без курсов валюты - 1 (сумма в валюте счета)
+RATE_ON_INVOICE_DATE_SQL = """
+    COALESCE(
+        (SELECT r.rate_to_rub FROM {rate} r
+          WHERE r.currency = i.currency AND r.rate_date <= i.invoice_date
+          ORDER BY r.rate_date DESC LIMIT 1),
+        (SELECT r.rate_to_rub FROM {rate} r
+          WHERE r.currency = i.currency
+          ORDER BY r.rate_date LIMIT 1),
+        1
+    )
+"""
+
+RECALCULATE_LINES_SQL = """
+    UPDATE {line} l
+    SET amount_rub = ROUND(l.quantity * l.price * CASE
+        WHEN i.currency = %(base)s THEN 1
+        ELSE {rate_expr}
+    END, 2)
+    FROM {invoice} i
+    WHERE i.id = l.invoice_id AND {condition}
+"""
+
+# Строки в валютах без курсов - их суммы остались в валюте счета
+UNCONVERTED_LINES_SQL = """
+    SELECT i.currency, COUNT(*)
+    FROM {line} l
+    JOIN {invoice} i ON i.id = l.invoice_id
+    WHERE i.currency <> %(base)s AND {condition}
+      AND NOT EXISTS (SELECT 1 FROM {rate} r WHERE r.currency = i.currency)
+    GROUP BY i.currency
+"""
+
+# Возвращает дни измененных фактов - за них пересобираются дневные свертки
+SYNC_FACTS_SQL = """
+    WITH synced AS (
+        UPDATE {fact} f
+        SET amount_rub = l.amount_rub
+        FROM {line} l
+        WHERE l.id = f.line_id AND f.amount_rub IS DISTINCT FROM l.amount_rub
+        RETURNING f.invoice_date
+    )
+    SELECT DISTINCT invoice_date FROM synced
+"""
+
+
+def _tables():
+    return {
+        'line': InvoiceLine._meta.db_table,
+        'invoice': Invoice._meta.db_table,
+        'rate': ExchangeRate._meta.db_table,
+        'fact': SalesFact._meta.db_table,
+    }
+
+
+def recalculate_amounts_rub(currencies=None, date_from=None) -> int:
+    """
+    Пересчитывает amount_rub строк счетов (и витрины фактов) после загрузки курсов.
+
+    Args:
+        currencies: пересчитать только счета в этих валютах
+        date_from: пересчитать только счета с этой даты
+
+    Returns:
+        int: количество пересчитанных строк
+    """
+    tables = _tables()
+    conditions = ['TRUE']
+    params = {'base': BASE_CURRENCY}
+    if currencies is not None:
+        conditions.append('i.currency = ANY(%(currencies)s)')
+        params['currencies'] = list(currencies)
+    if date_from is not None:
+        conditions.append('i.invoice_date >= %(date_from)s')
+        params['date_from'] = date_from
+
+    condition = ' AND '.join(conditions)
+    sql = RECALCULATE_LINES_SQL.format(
+        rate_expr=RATE_ON_INVOICE_DATE_SQL.format(**tables),
+        condition=condition,
+        **tables,
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        updated = cursor.rowcount
+        cursor.execute(SYNC_FACTS_SQL.format(**tables))
+        days = [row[0] for row in cursor.fetchall()]
+        cursor.execute(UNCONVERTED_LINES_SQL.format(condition=condition, **tables), params)
+        unconverted = dict(cursor.fetchall())
+    if unconverted:
+        logger.warning(
+            f"Нет курсов валют, суммы строк учтены в валюте счета: "
+            f"{', '.join(f'{currency} - {count}' for currency, count in sorted(unconverted.items()))}"
+        )
+    if updated:
+        refresh_sales_rollups(days)
+        bump_sales_data_version()
+    logger.info(f"Пересчитаны рублевые суммы строк счетов: {updated}")
+    return updated
+
+
+def save_exchange_rates(rates, source=ExchangeRate.Source.FILE) -> int:
+    """
+    Сохраняет курсы (currency, rate_date, rate_to_rub) с заменой существующих
+    и пересчитывает рублевые суммы затронутых счетов.
+    """
+    objects = {
+        (currency, rate_date): ExchangeRate(
+            currency=currency, rate_date=rate_date, rate_to_rub=rate_to_rub, source=source
+        )
+        for currency, rate_date, rate_to_rub in rates
+        if currency != BASE_CURRENCY
+    }
+    if not objects:
+        return 0
+
+    ExchangeRate.objects.bulk_create(
+        objects.values(),
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['currency', 'rate_date'],
+        update_fields=['rate_to_rub', 'source'],
+    )
+    # Курс на дату влияет на счета с этой даты, а самый ранний курс - и на более ранние
+    currencies = {currency for currency, _ in objects}
+    date_from = min(rate_date for _, rate_date in objects)
+    earliest = ExchangeRate.objects.filter(currency__in=currencies).order_by('rate_date').values_list(
+        'rate_date', flat=True
+    ).first()
+    recalculate_amounts_rub(currencies, None if earliest == date_from else date_from)
+    return len(objects)
+
+
+def read_exchange_rates_file(file_path) -> list:
+    """
+    Читает файл курсов (CSV или Excel) с колонками date, currency, rate.
+
+    Returns:
+        list: [(currency, rate_date, rate_to_rub)]
+    """
+    if str(file_path).lower().endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(file_path)
+    else:
+        df = pd.read_csv(file_path, sep=None, engine='python')
+
+    df.columns = [str(column).strip().lower() for column in df.columns]
+    missing = {'date', 'currency', 'rate'} - set(df.columns)
+    if missing:
+        raise ValueError(f"В файле курсов нет колонок: {', '.join(sorted(missing))}")
+
+    df = df.dropna(subset=['date', 'currency', 'rate'])
+    df['currency'] = df['currency'].astype(str).str.strip().str.upper()
+    # Даты в ISO (2024-03-01) или в русском формате (01.03.2024)
+    raw_dates = df['date'].astype(str).str.strip()
+    dates = pd.to_datetime(raw_dates, format='ISO8601', errors='coerce')
+    df['date'] = dates.fillna(pd.to_datetime(raw_dates, format='%d.%m.%Y', errors='coerce'))
+    df = df.dropna(subset=['date'])
+    df['date'] = df['date'].dt.date
+    df['rate'] = df['rate'].astype(str).str.replace(',', '.').str.strip()
+
+    valid = set(Invoice.Currency.values)
+    unknown = set(df['currency']) - valid
+    if unknown:
+        logger.warning(f"Пропущены неизвестные валюты в файле курсов: {', '.join(sorted(unknown))}")
+    df = df[df['currency'].isin(valid)]
+
+    return [
+        (row.currency, row.date, Decimal(row.rate))
+        for row in df.itertuples(index=False)
+    ]
+
+
+@receiver(post_save, sender=Currency)
+def _store_currency_rate(sender, instance, raw=False, **kwargs):
+    """Изменение курса в справочнике валют сохраняется как курс на сегодня."""
+    if raw or instance.code not in Invoice.Currency.values:
+        return
+    save_exchange_rates(
+        [(instance.code, date.today(), instance.exchange_rate_to_rub)],
+        source=ExchangeRate.Source.CURRENCY,
+    )
@@ -0,0 +1,439 @@
+"""
+Анализ корзины (Market Basket Analysis).
+
+Продажи загружаются одним потоковым запросом пар (счет, позиция) из витрины
+фактов продаж в разреженную
+матрицу корзин в формате CSR (строки - счета, колонки - товары, бренды или
+подгруппы). Совместная встречаемость пар считается как произведение XᵀX
+векторно на numpy, наборы из 3+ позиций ищутся алгоритмом FP-growth.
+
+Движок не привязан к Excel-отчету: его используют и задача отчета,
+и API "часто покупают вместе".
+"""
+from collections import Counter
+from itertools import chain, combinations
+
+import numpy as np
+from django.db.models import Count
+
+from goods.models import Brand, Product, ProductSubgroup
+
+from .models import SalesFact
+
+# Уровень корзины -> поле факта продажи
+BASKET_LEVELS = {
+    'product': 'product_id',
+    'brand': 'brand_id',
+    'subgroup': 'subgroup_id',
+}
+
+# Сколько пар разворачивать за один шаг при подсчете совместной встречаемости
+PAIRS_CHUNK_SIZE = 2_000_000
+
+STREAM_CHUNK_SIZE = 20000
+
+
+class BasketMatrix:
+    """
+    Разреженная бинарная матрица корзин в формате CSR.
+
+    - indptr: границы строк (счетов) в indices, длина n_baskets + 1
+    - indices: номера колонок, внутри строки отсортированы по возрастанию
+    - items: id позиции (товара/бренда/подгруппы) для каждой колонки
+    - baskets: id счета для каждой строки
+    """
+
+    def __init__(self, indptr, indices, items, baskets):
+        self.indptr = indptr
+        self.indices = indices
+        self.items = items
+        self.baskets = baskets
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """
+        Строит матрицу из итерируемого пар (id счета, id позиции).
+
+        Пары могут повторяться и идти в любом порядке.
+        """
+        flat = np.fromiter(chain.from_iterable(pairs), dtype=np.int64)
+        return cls.from_array(flat.reshape(-1, 2))
+
+    @classmethod
+    def from_array(cls, data):
+        """Строит матрицу из массива (n, 2) пар (id счета, id позиции)."""
+        if not len(data):
+            empty = np.zeros(0, dtype=np.int64)
+            return cls(np.zeros(1, dtype=np.int64), empty.astype(np.int32), empty, empty)
+
+        invoices = data[:, 0]
+        items, columns = np.unique(data[:, 1], return_inverse=True)
+        columns = columns.astype(np.int32)
+
+        order = np.lexsort((columns, invoices))
+        invoices = invoices[order]
+        columns = columns[order]
+
+        # Убираем повторы товара в одном счете
+        keep = np.ones(len(columns), dtype=bool)
+        keep[1:] = (invoices[1:] != invoices[:-1]) | (columns[1:] != columns[:-1])
+        invoices = invoices[keep]
+        columns = columns[keep]
+
+        starts = np.flatnonzero(np.r_[True, invoices[1:] != invoices[:-1]])
+        indptr = np.r_[starts, len(columns)].astype(np.int64)
+        return cls(indptr, columns, items, invoices[starts])
+
+    @property
+    def n_baskets(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def n_items(self) -> int:
+        return len(self.items)
+
+    @property
+    def basket_sizes(self):
+        return np.diff(self.indptr)
+
+    def item_counts(self):
+        """Количество корзин с каждой позицией (сумма по колонкам)."""
+        return np.bincount(self.indices, minlength=self.n_items)
+
+    def select_baskets(self, mask):
+        """Новая матрица только со строками, отмеченными в mask."""
+        rows = np.flatnonzero(mask)
+        sizes = self.basket_sizes[rows]
+        indptr = np.r_[0, np.cumsum(sizes)].astype(np.int64)
+        # Индексы элементов выбранных строк без цикла по строкам
+        positions = np.repeat(self.indptr[rows] - indptr[:-1], sizes) + np.arange(indptr[-1])
+        return BasketMatrix(indptr, self.indices[positions], self.items, self.baskets[rows])
+
+    def select_items(self, mask):
+        """Новая матрица только с колонками, отмеченными в mask (порядок колонок сохраняется)."""
+        mask = np.asarray(mask, dtype=bool)
+        remap = np.cumsum(mask) - 1
+        keep = mask[self.indices]
+        row_of = np.repeat(np.arange(self.n_baskets), self.basket_sizes)[keep]
+        sizes = np.bincount(row_of, minlength=self.n_baskets)
+        indptr = np.r_[0, np.cumsum(sizes)].astype(np.int64)
+        indices = remap[self.indices[keep]].astype(np.int32)
+        return BasketMatrix(indptr, indices, self.items[mask], self.baskets)
+
+    def cooccurrence(self):
+        """
+        Совместная встречаемость пар - верхний треугольник XᵀX.
+
+        Корзины группируются по размеру: для корзин размера k все пары
+        получаются одной индексацией матрицы (n, k) по triu_indices(k).
+
+        Returns:
+            tuple: (колонка a, колонка b, количество корзин) при a < b
+        """
+        n_items = self.n_items
+        sizes = self.basket_sizes
+        codes_parts = []
+        counts_parts = []
+        for size in np.unique(sizes[sizes >= 2]):
+            size = int(size)
+            left, right = np.triu_indices(size, 1)
+            rows = np.flatnonzero(sizes == size)
+            step = max(PAIRS_CHUNK_SIZE // len(left), 1)
+            for chunk_start in range(0, len(rows), step):
+                starts = self.indptr[rows[chunk_start:chunk_start + step]]
+                block = self.indices[starts[:, None] + np.arange(size)].astype(np.int64)
+                codes = (block[:, left] * n_items + block[:, right]).ravel()
+                codes, counts = np.unique(codes, return_counts=True)
+                codes_parts.append(codes)
+                counts_parts.append(counts)
+
+        if not codes_parts:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+
+        codes = np.concatenate(codes_parts)
+        counts = np.concatenate(counts_parts)
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        counts = counts[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        codes = codes[starts]
+        counts = np.add.reduceat(counts, starts)
+        return codes // n_items, codes % n_items, counts
+
+    def transactions(self):
+        """Уникальные корзины (кортежи колонок) с количеством повторов."""
+        indices = self.indices.tolist()
+        bounds = self.indptr.tolist()
+        return Counter(tuple(indices[bounds[i]:bounds[i + 1]]) for i in range(self.n_baskets))
+
+
+def sale_facts(date_from=None, date_to=None):
+    """Факты продаж за период."""
+    facts = SalesFact.objects.all()
+    if date_from:
+        facts = facts.filter(invoice_date__gte=date_from)
+    if date_to:
+        facts = facts.filter(invoice_date__lte=date_to)
+    return facts
+
+
+def load_basket_pairs(facts, level='product'):
+    """
+    Пары (id счета, id позиции) потоковым запросом.
+
+    Returns:
+        ndarray: массив (n, 2) int64
+    """
+    if level not in BASKET_LEVELS:
+        raise ValueError(f"Неизвестный уровень корзины: {level}. Доступны: {', '.join(BASKET_LEVELS)}")
+    field = BASKET_LEVELS[level]
+    pairs = (
+        facts.filter(**{f'{field}__isnull': False})
+        .values_list('invoice_id', field)
+        .order_by()
+        .iterator(chunk_size=STREAM_CHUNK_SIZE)
+    )
+    return np.fromiter(chain.from_iterable(pairs), dtype=np.int64).reshape(-1, 2)
+
+
+def load_baskets(date_from=None, date_to=None, level='product', facts=None) -> BasketMatrix:
+    """
+    Загружает корзины одним потоковым запросом (id счета, id позиции).
+
+    Args:
+        level: product, brand или subgroup
+        facts: queryset фактов продаж; по умолчанию - продажи за период
+    """
+    if facts is None:
+        facts = sale_facts(date_from, date_to)
+    return BasketMatrix.from_array(load_basket_pairs(facts, level))
+
+
+class _FPNode:
+    __slots__ = ('item', 'count', 'parent', 'children')
+
+    def __init__(self, item, parent):
+        self.item = item
+        self.count = 0
+        self.parent = parent
+        self.children = {}
+
+
+def _build_fp_tree(transactions):
+    """FP-дерево из [(упорядоченные позиции, вес)]; возвращает таблицу заголовков."""
+    root = _FPNode(None, None)
+    header = {}
+    for items, weight in transactions:
+        node = root
+        for item in items:
+            child = node.children.get(item)
+            if child is None:
+                child = _FPNode(item, node)
+                node.children[item] = child
+                header.setdefault(item, []).append(child)
+            child.count += weight
+            node = child
+    return header
+
+
+def _mine_fp_tree(header, item_counts, suffix, min_count, max_len, result):
+    # От редких к частым: условные базы редких позиций меньше
+    for item in sorted(header, key=lambda i: (item_counts[i], i)):
+        itemset = (item,) + suffix
+        result[itemset] = item_counts[item]
+        if len(itemset) >= max_len:
+            continue
+
+        paths = []
+        conditional_counts = Counter()
+        for node in header[item]:
+            path = []
+            parent = node.parent
+            while parent.item is not None:
+                path.append(parent.item)
+                parent = parent.parent
+            if path:
+                path.reverse()
+                paths.append((path, node.count))
+                for path_item in path:
+                    conditional_counts[path_item] += node.count
+
+        frequent = {i: c for i, c in conditional_counts.items() if c >= min_count}
+        if not frequent:
+            continue
+        conditional = [([i for i in path if i in frequent], count) for path, count in paths]
+        conditional_header = _build_fp_tree([(path, count) for path, count in conditional if path])
+        _mine_fp_tree(conditional_header, frequent, itemset, min_count, max_len, result)
+
+
+def fp_growth(transactions, min_count, max_len=None):
+    """
+    FP-growth по взвешенным транзакциям.
+
+    Args:
+        transactions: {кортеж позиций: количество корзин}
+        min_count: минимальное число корзин для частого набора
+        max_len: максимальный размер набора (None - без ограничения)
+
+    Returns:
+        dict: {отсортированный кортеж позиций: количество корзин}
+    """
+    max_len = max_len or float('inf')
+    item_counts = Counter()
+    for items, weight in transactions.items():
+        for item in items:
+            item_counts[item] += weight
+    frequent = {item: count for item, count in item_counts.items() if count >= min_count}
+
+    # Позиции внутри транзакции - по убыванию частоты, чтобы дерево было компактным
+    rank = {item: position for position, item in enumerate(sorted(frequent, key=lambda i: (-frequent[i], i)))}
+    ordered = Counter()
+    for items, weight in transactions.items():
+        kept = tuple(sorted((item for item in items if item in rank), key=rank.__getitem__))
+        if kept:
+            ordered[kept] += weight
+
+    result = {}
+    _mine_fp_tree(_build_fp_tree(ordered.items()), frequent, (), min_count, max_len, result)
+    return {tuple(sorted(itemset)): count for itemset, count in result.items()}
+
+
+def frequent_itemsets(matrix: BasketMatrix, min_support: float, max_len: int = 2) -> dict:
+    """
+    Частые наборы позиций.
+
+    Для пар (max_len=2) используется векторный подсчет XᵀX, для наборов
+    из 3+ позиций - FP-growth по корзинам, очищенным от редких позиций.
+
+    Returns:
+        dict: {кортеж id позиций: количество корзин}
+    """
+    min_count = max(int(np.ceil(min_support * matrix.n_baskets)), 1)
+    counts = matrix.item_counts()
+    frequent_mask = counts >= min_count
+    itemsets = {(int(matrix.items[column]),): int(counts[column]) for column in np.flatnonzero(frequent_mask)}
+    if max_len < 2 or frequent_mask.sum() < 2:
+        return itemsets
+
+    reduced = matrix.select_items(frequent_mask)
+    reduced = reduced.select_baskets(reduced.basket_sizes >= 2)
+
+    if max_len == 2:
+        left, right, pair_counts = reduced.cooccurrence()
+        keep = pair_counts >= min_count
+        items = reduced.items
+        for a, b, count in zip(
+            items[left[keep]].tolist(), items[right[keep]].tolist(), pair_counts[keep].tolist(), strict=True
+        ):
+            itemsets[(a, b)] = count
+        return itemsets
+
+    items = reduced.items.tolist()
+    for columns, count in fp_growth(reduced.transactions(), min_count, max_len).items():
+        if len(columns) >= 2:
+            itemsets[tuple(items[column] for column in columns)] = count
+    return itemsets
+
+
+def association_rules(itemsets: dict, n_baskets: int, min_confidence=0.0, min_lift=0.0) -> list:
+    """
+    Ассоциативные правила A -> B из частых наборов.
+
+    Подмножества частого набора тоже частые, поэтому их количество
+    берется из того же словаря без дополнительных проходов по данным.
+    """
+    rules = []
+    for itemset, count in itemsets.items():
+        if len(itemset) < 2:
+            continue
+        support = count / n_baskets
+        for size in range(1, len(itemset)):
+            for antecedent in combinations(itemset, size):
+                consequent = tuple(item for item in itemset if item not in antecedent)
+                antecedent_count = itemsets.get(antecedent)
+                consequent_count = itemsets.get(consequent)
+                if not antecedent_count or not consequent_count:
+                    continue
+                confidence = count / antecedent_count
+                lift = confidence / (consequent_count / n_baskets)
+                if confidence >= min_confidence and lift >= min_lift:
+                    rules.append({
+                        'antecedent': antecedent,
+                        'consequent': consequent,
+                        'support': support,
+                        'confidence': confidence,
+                        'lift': lift,
+                        'transactions_count': count,
+                    })
+    rules.sort(key=lambda rule: rule['lift'], reverse=True)
+    return rules
+
+
+def item_labels(level: str, ids) -> tuple:
+    """
+    Названия позиций для отчета.
+
+    Returns:
+        tuple: ({id: название}, {id: бренд}) - бренды только для уровня товаров
+    """
+    ids = list(ids)
+    if level == 'brand':
+        return dict(Brand.objects.filter(id__in=ids).values_list('id', 'name')), {}
+    if level == 'subgroup':
+        return dict(ProductSubgroup.objects.filter(id__in=ids).values_list('id', 'name')), {}
+    names = {}
+    brands = {}
+    for product_id, name, brand_name in Product.objects.filter(id__in=ids).values_list('id', 'name', 'brand__name'):
+        names[product_id] = name
+        brands[product_id] = brand_name or 'Без бренда'
+    return names, brands
+
+
+def often_bought_together(product_id, date_from=None, date_to=None, limit=10, min_count=1) -> list:
+    """
+    Товары, которые чаще всего покупают вместе с данным товаром.
+
+    Загружаются только корзины с этим товаром; поддержка найденных товаров
+    по всем продажам периода добирается одним агрегирующим запросом.
+
+    Returns:
+        list: [{product_id, name, brand, together_count, confidence, lift}]
+    """
+    facts = sale_facts(date_from, date_to)
+    with_product = facts.filter(product_id=product_id).values('invoice_id')
+    matrix = load_baskets(facts=facts.filter(invoice_id__in=with_product))
+    if not matrix.n_baskets:
+        return []
+
+    counts = matrix.item_counts()
+    counts[matrix.items == product_id] = 0
+    candidates = np.flatnonzero(counts >= min_count)
+    if not len(candidates):
+        return []
+    candidates = candidates[np.argsort(-counts[candidates], kind='stable')][:limit]
+    candidate_ids = matrix.items[candidates].tolist()
+
+    total_baskets = facts.values('invoice_id').distinct().count()
+    basket_counts = dict(
+        facts.filter(product_id__in=candidate_ids)
+        .values('product_id')
+        .annotate(baskets=Count('invoice_id', distinct=True))
+        .values_list('product_id', 'baskets')
+    )
+    names, brands = item_labels('product', candidate_ids)
+
+    product_baskets = matrix.n_baskets
+    result = []
+    for column, candidate_id in zip(candidates.tolist(), candidate_ids, strict=True):
+        together = int(counts[column])
+        candidate_baskets = basket_counts.get(candidate_id) or together
+        result.append({
+            'product_id': candidate_id,
+            'name': names.get(candidate_id, f'ID:{candidate_id}'),
+            'brand': brands.get(candidate_id, ''),
+            'together_count': together,
+            'confidence': round(together / product_baskets, 4),
+            'lift': round(together * total_baskets / (product_baskets * candidate_baskets), 4),
+        })
+    return result
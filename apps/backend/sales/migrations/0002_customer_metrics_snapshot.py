@@ -0,0 +1,49 @@
+# Generated by Django 5.1.15 on 2026-10-19 08:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0001_initial'),
+        ('sales', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerMetricsSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('snapshot_date', models.DateField(db_index=True, verbose_name='Дата снимка')),
+                ('first_purchase_date', models.DateField(verbose_name='Первая покупка')),
+                ('last_purchase_date', models.DateField(verbose_name='Последняя покупка')),
+                ('orders_count', models.PositiveIntegerField(verbose_name='Количество заказов')),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=16, verbose_name='Выручка')),
+                ('recency_days', models.IntegerField(verbose_name='Давность (дней)')),
+                ('r_score', models.PositiveSmallIntegerField(verbose_name='R-балл')),
+                ('f_score', models.PositiveSmallIntegerField(verbose_name='F-балл')),
+                ('m_score', models.PositiveSmallIntegerField(verbose_name='M-балл')),
+                ('rfm_score', models.CharField(max_length=3, verbose_name='RFM балл')),
+                ('rfm_segment', models.CharField(db_index=True, max_length=32, verbose_name='RFM сегмент')),
+                ('lifespan_days', models.PositiveIntegerField(verbose_name='Продолжительность жизни (дни)')),
+                ('average_order_value', models.DecimalField(decimal_places=2, max_digits=16, verbose_name='Средний чек')),
+                ('purchase_frequency_monthly', models.DecimalField(decimal_places=4, max_digits=12, verbose_name='Частота покупок в месяц')),
+                ('customer_value_monthly', models.DecimalField(decimal_places=2, max_digits=16, verbose_name='Выручка в месяц')),
+                ('predicted_ltv_12m', models.DecimalField(decimal_places=2, max_digits=18, verbose_name='Прогноз LTV 12м')),
+                ('predicted_ltv_24m', models.DecimalField(decimal_places=2, max_digits=18, verbose_name='Прогноз LTV 24м')),
+                ('ltv_segment', models.CharField(db_index=True, max_length=32, verbose_name='Сегмент LTV')),
+                ('activity_status', models.CharField(max_length=16, verbose_name='Статус активности')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metrics_snapshots', to='customers.company', verbose_name='Компания')),
+            ],
+            options={
+                'verbose_name': 'RFM/LTV метрики клиента',
+                'verbose_name_plural': 'RFM/LTV метрики клиентов',
+                'ordering': ['-snapshot_date', '-revenue'],
+                'constraints': [models.UniqueConstraint(fields=('company', 'snapshot_date'), name='uniq_customer_metrics_per_date')],
+            },
+        ),
+    ]
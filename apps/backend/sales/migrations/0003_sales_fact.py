@@ -0,0 +1,42 @@
+# Generated by Django 5.1.15 on 2026-10-19 08:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0001_initial'),
+        ('goods', '0005_part_number_key'),
+        ('sales', '0002_customer_metrics_snapshot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesFact',
+            fields=[
+                ('line', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='fact', serialize=False, to='sales.invoiceline', verbose_name='Строка счета')),
+                ('invoice_date', models.DateField(verbose_name='Дата счета')),
+                ('sale_type', models.CharField(choices=[('stock', 'Со склада'), ('order', 'Под заказ')], max_length=20, null=True, verbose_name='Тип продажи')),
+                ('currency', models.CharField(choices=[('RUB', 'Рубли'), ('USD', 'Доллары США'), ('CNY', 'Китайские юани')], max_length=3, verbose_name='Валюта')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Цена в валюте счета')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=16, verbose_name='Сумма в валюте счета')),
+                ('brand', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='goods.brand', verbose_name='Бренд')),
+                ('company', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='customers.company', verbose_name='Компания')),
+                ('group', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='goods.productgroup', verbose_name='Группа')),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='sales.invoice', verbose_name='Счет')),
+                ('manager', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Менеджер товара')),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='goods.product', verbose_name='Товар')),
+                ('subgroup', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='goods.productsubgroup', verbose_name='Подгруппа')),
+            ],
+            options={
+                'verbose_name': 'Факт продажи',
+                'verbose_name_plural': 'Факты продаж',
+                'indexes': [models.Index(fields=['invoice_date'], include=('invoice_id', 'company_id', 'amount'), name='sales_fact_date_cov'), models.Index(fields=['company', 'invoice_date'], include=('invoice_id', 'amount'), name='sales_fact_company_date_cov'), models.Index(fields=['product', 'invoice_date'], include=('invoice_id', 'company_id', 'quantity', 'amount'), name='sales_fact_product_date_cov'), models.Index(fields=['brand', 'invoice_date'], include=('invoice_id', 'amount'), name='sales_fact_brand_date_cov'), models.Index(fields=['invoice'], include=('product_id', 'brand_id', 'subgroup_id'), name='sales_fact_invoice_items')],
+            },
+        ),
+    ]
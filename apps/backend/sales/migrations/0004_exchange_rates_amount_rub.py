@@ -0,0 +1,120 @@
+# Generated by Django 5.1.15 on 2026-10-19 08:51
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def seed_rates_and_amounts(apps, schema_editor):
+    """Текущие курсы из справочника валют и рублевые суммы существующих строк."""
+    Currency = apps.get_model('rfqs', 'Currency')
+    ExchangeRate = apps.get_model('sales', 'ExchangeRate')
+    today = timezone.localdate()
+    ExchangeRate.objects.bulk_create(
+        [
+            ExchangeRate(currency=currency.code, rate_date=today, rate_to_rub=currency.exchange_rate_to_rub, source='currency')
+            for currency in Currency.objects.filter(code__in=['USD', 'CNY'])
+        ],
+        ignore_conflicts=True,
+    )
+
+    # Последний курс на дату счета, иначе самый ранний, без курсов - 1 (как в sales.fx)
+    schema_editor.execute("""
+        UPDATE sales_invoiceline l
+        SET amount_rub = ROUND(l.quantity * l.price * CASE
+            WHEN i.currency = 'RUB' THEN 1
+            ELSE COALESCE(
+                (SELECT r.rate_to_rub FROM sales_exchangerate r
+                  WHERE r.currency = i.currency AND r.rate_date <= i.invoice_date
+                  ORDER BY r.rate_date DESC LIMIT 1),
+                (SELECT r.rate_to_rub FROM sales_exchangerate r
+                  WHERE r.currency = i.currency
+                  ORDER BY r.rate_date LIMIT 1),
+                1
+            )
+        END, 2)
+        FROM sales_invoice i
+        WHERE i.id = l.invoice_id
+    """)
+    schema_editor.execute("""
+        UPDATE sales_salesfact f
+        SET amount_rub = l.amount_rub
+        FROM sales_invoiceline l
+        WHERE l.id = f.line_id
+    """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0001_initial'),
+        ('goods', '0005_part_number_key'),
+        ('rfqs', '0005_quotationitemfile'),
+        ('sales', '0003_sales_fact'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(choices=[('RUB', 'Рубли'), ('USD', 'Доллары США'), ('CNY', 'Китайские юани')], max_length=3, verbose_name='Валюта')),
+                ('rate_date', models.DateField(verbose_name='Дата курса')),
+                ('rate_to_rub', models.DecimalField(decimal_places=4, max_digits=12, verbose_name='Курс к рублю')),
+                ('source', models.CharField(choices=[('currency', 'Справочник валют'), ('file', 'Импорт из файла'), ('manual', 'Вручную')], default='manual', max_length=16, verbose_name='Источник')),
+            ],
+            options={
+                'verbose_name': 'Курс валюты',
+                'verbose_name_plural': 'Курсы валют',
+                'ordering': ['-rate_date', 'currency'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='salesfact',
+            name='sales_fact_date_cov',
+        ),
+        migrations.RemoveIndex(
+            model_name='salesfact',
+            name='sales_fact_company_date_cov',
+        ),
+        migrations.RemoveIndex(
+            model_name='salesfact',
+            name='sales_fact_product_date_cov',
+        ),
+        migrations.RemoveIndex(
+            model_name='salesfact',
+            name='sales_fact_brand_date_cov',
+        ),
+        migrations.AddField(
+            model_name='invoiceline',
+            name='amount_rub',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=16, null=True, verbose_name='Сумма в рублях'),
+        ),
+        migrations.AddField(
+            model_name='salesfact',
+            name='amount_rub',
+            field=models.DecimalField(decimal_places=2, max_digits=16, null=True, verbose_name='Сумма в рублях'),
+        ),
+        migrations.AddIndex(
+            model_name='salesfact',
+            index=models.Index(fields=['invoice_date'], include=('invoice_id', 'company_id', 'amount_rub'), name='sales_fact_date_cov'),
+        ),
+        migrations.AddIndex(
+            model_name='salesfact',
+            index=models.Index(fields=['company', 'invoice_date'], include=('invoice_id', 'amount_rub'), name='sales_fact_company_date_cov'),
+        ),
+        migrations.AddIndex(
+            model_name='salesfact',
+            index=models.Index(fields=['product', 'invoice_date'], include=('invoice_id', 'company_id', 'quantity', 'amount_rub'), name='sales_fact_product_date_cov'),
+        ),
+        migrations.AddIndex(
+            model_name='salesfact',
+            index=models.Index(fields=['brand', 'invoice_date'], include=('invoice_id', 'amount_rub'), name='sales_fact_brand_date_cov'),
+        ),
+        migrations.AddConstraint(
+            model_name='exchangerate',
+            constraint=models.UniqueConstraint(fields=('currency', 'rate_date'), name='uniq_exchange_rate_per_date'),
+        ),
+        migrations.RunPython(seed_rates_and_amounts, migrations.RunPython.noop),
+    ]
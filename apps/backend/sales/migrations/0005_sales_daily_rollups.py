@@ -0,0 +1,55 @@
+# Generated by Django 5.1.15 on 2026-10-19 08:58
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0001_initial'),
+        ('goods', '0005_part_number_key'),
+        ('sales', '0004_exchange_rates_amount_rub'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesDailyCompany',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('sale_type', models.CharField(choices=[('stock', 'Со склада'), ('order', 'Под заказ')], max_length=20, null=True, verbose_name='Тип продажи')),
+                ('currency', models.CharField(choices=[('RUB', 'Рубли'), ('USD', 'Доллары США'), ('CNY', 'Китайские юани')], max_length=3, verbose_name='Валюта')),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=18, verbose_name='Выручка, руб.')),
+                ('orders', models.PositiveIntegerField(verbose_name='Заказов')),
+                ('lines', models.PositiveIntegerField(verbose_name='Строк')),
+                ('line_id_sum', models.BigIntegerField(verbose_name='Контрольная сумма строк')),
+                ('company', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='customers.company', verbose_name='Компания')),
+            ],
+            options={
+                'verbose_name': 'Продажи за день по клиенту',
+                'verbose_name_plural': 'Продажи за день по клиентам',
+                'indexes': [models.Index(fields=['day'], include=('company_id', 'revenue', 'orders'), name='sales_daily_company_day_cov'), models.Index(fields=['company', 'day'], name='sales_daily_company_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SalesDailyProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('sale_type', models.CharField(choices=[('stock', 'Со склада'), ('order', 'Под заказ')], max_length=20, null=True, verbose_name='Тип продажи')),
+                ('currency', models.CharField(choices=[('RUB', 'Рубли'), ('USD', 'Доллары США'), ('CNY', 'Китайские юани')], max_length=3, verbose_name='Валюта')),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=18, verbose_name='Выручка, руб.')),
+                ('quantity', models.BigIntegerField(verbose_name='Количество')),
+                ('orders', models.PositiveIntegerField(verbose_name='Заказов')),
+                ('company_ids', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), default=list, size=None, verbose_name='Клиенты')),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='goods.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Продажи за день по товару',
+                'verbose_name_plural': 'Продажи за день по товарам',
+                'indexes': [models.Index(fields=['day'], include=('product_id', 'revenue', 'orders'), name='sales_daily_product_day_cov'), models.Index(fields=['product', 'day'], name='sales_daily_product_idx')],
+            },
+        ),
+    ]
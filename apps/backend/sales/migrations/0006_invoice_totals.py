@@ -0,0 +1,48 @@
+# Generated by Django 5.1.15 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+def fill_invoice_totals(apps, schema_editor):
+    """Итоги существующих счетов по их строкам (как в sales.totals)."""
+    schema_editor.execute("""
+        UPDATE sales_invoice i
+        SET total_amount = t.total_amount,
+            line_count = t.line_count,
+            total_qty = t.total_qty
+        FROM (
+            SELECT invoice_id,
+                   SUM(quantity * price) AS total_amount,
+                   COUNT(*) AS line_count,
+                   SUM(quantity) AS total_qty
+            FROM sales_invoiceline
+            GROUP BY invoice_id
+        ) t
+        WHERE i.id = t.invoice_id
+    """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0005_sales_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество строк'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=16, verbose_name='Сумма счета'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='total_qty',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Общее количество'),
+        ),
+        migrations.RunPython(fill_invoice_totals, migrations.RunPython.noop),
+    ]
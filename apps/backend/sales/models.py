@@ -1,4 +1,6 @@
 from django.db import models
+from django.contrib.postgres.fields import ArrayField
+from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
 from core.mixins import ExtIdMixin, TimestampsMixin
@@ -48,6 +50,21 @@ class Invoice(ExtIdMixin, TimestampsMixin, models.Model):
         default=Currency.RUB,
         verbose_name=_("Валюта"),
     )
+    # Итоги по строкам хранятся в счете (см. sales.totals), чтобы списки
+    # сортировались и фильтровались по сумме без загрузки строк
+    total_amount = models.DecimalField(
+        max_digits=16,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        verbose_name=_("Сумма счета"),
+    )
+    line_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name=_("Количество строк")
+    )
+    total_qty = models.PositiveBigIntegerField(
+        default=0, editable=False, verbose_name=_("Общее количество")
+    )
 
     class Meta:
         verbose_name = _("Счет")
@@ -81,11 +98,6 @@ class Invoice(ExtIdMixin, TimestampsMixin, models.Model):
             return f"{base_str} - {self.get_sale_type_display()}"
         return base_str
 
-    @property
-    def total_amount(self):
-        """Общая сумма счета"""
-        return sum(line.total_price for line in self.lines.all())
-
 
 class InvoiceLine(ExtIdMixin, TimestampsMixin, models.Model):
     """Строка счета"""
@@ -100,6 +112,15 @@ class InvoiceLine(ExtIdMixin, TimestampsMixin, models.Model):
     price = models.DecimalField(
         max_digits=10, decimal_places=2, verbose_name=_("Цена в валюте счета")
     )
+    # Сумма строки в рублях по курсу на дату счета (см. sales.fx)
+    amount_rub = models.DecimalField(
+        max_digits=16,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name=_("Сумма в рублях"),
+    )
 
     class Meta:
         verbose_name = _("Строка в счете")
@@ -111,4 +132,307 @@ class InvoiceLine(ExtIdMixin, TimestampsMixin, models.Model):
     @property
     def total_price(self):
         """Общая стоимость строки"""
-        return self.quantity * self.price
\ No newline at end of file
+        return self.quantity * self.price
+
+    def save(self, *args, **kwargs):
+        from .fx import RateTable
+
+        invoice = self.invoice
+        self.amount_rub = RateTable([invoice.currency]).to_rub(
+            self.total_price, invoice.currency, invoice.invoice_date
+        )
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'amount_rub'}
+        super().save(*args, **kwargs)
+
+
+class ExchangeRate(models.Model):
+    """Курс валюты к рублю на дату"""
+
+    class Source(models.TextChoices):
+        CURRENCY = "currency", _("Справочник валют")
+        FILE = "file", _("Импорт из файла")
+        MANUAL = "manual", _("Вручную")
+
+    currency = models.CharField(
+        max_length=3, choices=Invoice.Currency.choices, verbose_name=_("Валюта")
+    )
+    rate_date = models.DateField(verbose_name=_("Дата курса"))
+    rate_to_rub = models.DecimalField(
+        max_digits=12, decimal_places=4, verbose_name=_("Курс к рублю")
+    )
+    source = models.CharField(
+        max_length=16,
+        choices=Source.choices,
+        default=Source.MANUAL,
+        verbose_name=_("Источник"),
+    )
+
+    class Meta:
+        verbose_name = _("Курс валюты")
+        verbose_name_plural = _("Курсы валют")
+        ordering = ["-rate_date", "currency"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['currency', 'rate_date'], name='uniq_exchange_rate_per_date'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.currency} {self.rate_date}: {self.rate_to_rub}"
+
+class CustomerMetricsSnapshot(TimestampsMixin, models.Model):
+    """Снимок RFM/LTV-метрик клиента на дату (по всей истории продаж)"""
+
+    company = models.ForeignKey(
+        'customers.Company',
+        on_delete=models.CASCADE,
+        related_name='metrics_snapshots',
+        verbose_name=_("Компания"),
+    )
+    snapshot_date = models.DateField(verbose_name=_("Дата снимка"), db_index=True)
+
+    first_purchase_date = models.DateField(verbose_name=_("Первая покупка"))
+    last_purchase_date = models.DateField(verbose_name=_("Последняя покупка"))
+    orders_count = models.PositiveIntegerField(verbose_name=_("Количество заказов"))
+    revenue = models.DecimalField(max_digits=16, decimal_places=2, verbose_name=_("Выручка"))
+
+    # RFM
+    recency_days = models.IntegerField(verbose_name=_("Давность (дней)"))
+    r_score = models.PositiveSmallIntegerField(verbose_name=_("R-балл"))
+    f_score = models.PositiveSmallIntegerField(verbose_name=_("F-балл"))
+    m_score = models.PositiveSmallIntegerField(verbose_name=_("M-балл"))
+    rfm_score = models.CharField(max_length=3, verbose_name=_("RFM балл"))
+    rfm_segment = models.CharField(max_length=32, verbose_name=_("RFM сегмент"), db_index=True)
+
+    # LTV
+    lifespan_days = models.PositiveIntegerField(verbose_name=_("Продолжительность жизни (дни)"))
+    average_order_value = models.DecimalField(max_digits=16, decimal_places=2, verbose_name=_("Средний чек"))
+    purchase_frequency_monthly = models.DecimalField(
+        max_digits=12, decimal_places=4, verbose_name=_("Частота покупок в месяц")
+    )
+    customer_value_monthly = models.DecimalField(max_digits=16, decimal_places=2, verbose_name=_("Выручка в месяц"))
+    predicted_ltv_12m = models.DecimalField(max_digits=18, decimal_places=2, verbose_name=_("Прогноз LTV 12м"))
+    predicted_ltv_24m = models.DecimalField(max_digits=18, decimal_places=2, verbose_name=_("Прогноз LTV 24м"))
+    ltv_segment = models.CharField(max_length=32, verbose_name=_("Сегмент LTV"), db_index=True)
+    activity_status = models.CharField(max_length=16, verbose_name=_("Статус активности"))
+
+    class Meta:
+        verbose_name = _("RFM/LTV метрики клиента")
+        verbose_name_plural = _("RFM/LTV метрики клиентов")
+        ordering = ["-snapshot_date", "-revenue"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['company', 'snapshot_date'], name='uniq_customer_metrics_per_date'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.company_id} @ {self.snapshot_date}: {self.rfm_segment} / {self.ltv_segment}"
+
+
+class SalesFact(models.Model):
+    """
+    Денормализованная строка продажи для аналитики.
+
+    Одна запись на строку счета продажи: дата, клиент, товар и его измерения
+    (бренд, подгруппа, группа, менеджер) и готовые суммы: quantity * price
+    в валюте счета и в рублях по курсу на дату счета.
+    Заполняется инкрементально после импорта продаж (см. sales.facts).
+    """
+
+    line = models.OneToOneField(
+        InvoiceLine,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='fact',
+        verbose_name=_("Строка счета"),
+    )
+    invoice = models.ForeignKey(
+        Invoice, on_delete=models.CASCADE, related_name='+', verbose_name=_("Счет")
+    )
+    invoice_date = models.DateField(verbose_name=_("Дата счета"))
+    company = models.ForeignKey(
+        'customers.Company',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name=_("Компания"),
+    )
+    product = models.ForeignKey(
+        'goods.Product',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name=_("Товар"),
+    )
+    brand = models.ForeignKey(
+        'goods.Brand',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        related_name='+',
+        verbose_name=_("Бренд"),
+    )
+    subgroup = models.ForeignKey(
+        'goods.ProductSubgroup',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        related_name='+',
+        verbose_name=_("Подгруппа"),
+    )
+    group = models.ForeignKey(
+        'goods.ProductGroup',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        related_name='+',
+        verbose_name=_("Группа"),
+    )
+    manager = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        related_name='+',
+        verbose_name=_("Менеджер товара"),
+    )
+    sale_type = models.CharField(
+        max_length=20, choices=Invoice.SaleType.choices, null=True, verbose_name=_("Тип продажи")
+    )
+    currency = models.CharField(
+        max_length=3, choices=Invoice.Currency.choices, verbose_name=_("Валюта")
+    )
+    quantity = models.PositiveIntegerField(verbose_name=_("Количество"))
+    price = models.DecimalField(
+        max_digits=10, decimal_places=2, verbose_name=_("Цена в валюте счета")
+    )
+    amount = models.DecimalField(
+        max_digits=16, decimal_places=2, verbose_name=_("Сумма в валюте счета")
+    )
+    amount_rub = models.DecimalField(
+        max_digits=16, decimal_places=2, null=True, verbose_name=_("Сумма в рублях")
+    )
+
+    class Meta:
+        verbose_name = _("Факт продажи")
+        verbose_name_plural = _("Факты продаж")
+        indexes = [
+            # Покрывающие индексы: агрегаты по периоду/клиенту/товару/бренду
+            # читаются из индекса без обращения к таблице
+            models.Index(
+                fields=['invoice_date'],
+                include=['invoice_id', 'company_id', 'amount_rub'],
+                name='sales_fact_date_cov',
+            ),
+            models.Index(
+                fields=['company', 'invoice_date'],
+                include=['invoice_id', 'amount_rub'],
+                name='sales_fact_company_date_cov',
+            ),
+            models.Index(
+                fields=['product', 'invoice_date'],
+                include=['invoice_id', 'company_id', 'quantity', 'amount_rub'],
+                name='sales_fact_product_date_cov',
+            ),
+            models.Index(
+                fields=['brand', 'invoice_date'],
+                include=['invoice_id', 'amount_rub'],
+                name='sales_fact_brand_date_cov',
+            ),
+            models.Index(
+                fields=['invoice'],
+                include=['product_id', 'brand_id', 'subgroup_id'],
+                name='sales_fact_invoice_items',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.invoice_date} {self.company_id}: {self.product_id} x {self.quantity} = {self.amount}"
+
+
+class SalesDailyCompany(models.Model):
+    """
+    Продажи за день по клиенту (свертка SalesFact для дашбордов).
+
+    Счет относится к одному дню и одному клиенту, поэтому заказы складываются
+    по дням и клиентам без повторов, а число клиентов за период - это число
+    различных company_id среди строк свертки.
+    """
+
+    day = models.DateField(verbose_name=_("День"))
+    company = models.ForeignKey(
+        'customers.Company',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name=_("Компания"),
+    )
+    sale_type = models.CharField(
+        max_length=20, choices=Invoice.SaleType.choices, null=True, verbose_name=_("Тип продажи")
+    )
+    currency = models.CharField(max_length=3, choices=Invoice.Currency.choices, verbose_name=_("Валюта"))
+    revenue = models.DecimalField(max_digits=18, decimal_places=2, verbose_name=_("Выручка, руб."))
+    orders = models.PositiveIntegerField(verbose_name=_("Заказов"))
+    lines = models.PositiveIntegerField(verbose_name=_("Строк"))
+    # Сумма id строк - контрольная сумма для поиска дней, разошедшихся с витриной
+    # (sales.rollups.drifted_rollup_days)
+    line_id_sum = models.BigIntegerField(verbose_name=_("Контрольная сумма строк"))
+
+    class Meta:
+        verbose_name = _("Продажи за день по клиенту")
+        verbose_name_plural = _("Продажи за день по клиентам")
+        indexes = [
+            models.Index(
+                fields=['day'],
+                include=['company_id', 'revenue', 'orders'],
+                name='sales_daily_company_day_cov',
+            ),
+            models.Index(fields=['company', 'day'], name='sales_daily_company_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.company_id}: {self.revenue}"
+
+
+class SalesDailyProduct(models.Model):
+    """
+    Продажи за день по товару (свертка SalesFact для дашбордов).
+
+    company_ids - точный набор клиентов за день: число различных клиентов
+    за период считается объединением наборов.
+    """
+
+    day = models.DateField(verbose_name=_("День"))
+    product = models.ForeignKey(
+        'goods.Product',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name=_("Товар"),
+    )
+    sale_type = models.CharField(
+        max_length=20, choices=Invoice.SaleType.choices, null=True, verbose_name=_("Тип продажи")
+    )
+    currency = models.CharField(max_length=3, choices=Invoice.Currency.choices, verbose_name=_("Валюта"))
+    revenue = models.DecimalField(max_digits=18, decimal_places=2, verbose_name=_("Выручка, руб."))
+    quantity = models.BigIntegerField(verbose_name=_("Количество"))
+    orders = models.PositiveIntegerField(verbose_name=_("Заказов"))
+    company_ids = ArrayField(models.BigIntegerField(), default=list, verbose_name=_("Клиенты"))
+
+    class Meta:
+        verbose_name = _("Продажи за день по товару")
+        verbose_name_plural = _("Продажи за день по товарам")
+        indexes = [
+            models.Index(
+                fields=['day'],
+                include=['product_id', 'revenue', 'orders'],
+                name='sales_daily_product_day_cov',
+            ),
+            models.Index(fields=['product', 'day'], name='sales_daily_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.product_id}: {self.revenue}"
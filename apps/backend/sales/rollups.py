@@ -0,0 +1,120 @@
+"""
+Дневные свертки продаж: день x клиент (SalesDailyCompany) и день x товар
+(SalesDailyProduct).
+
+Дашборды продаж читают свертки вместо строк витрины фактов. Свертка
+пересобирается целиком за затронутые дни, которые знает тот, кто менял
+витрину: дни добавленных фактов и удаленных импортом строк, старые и новые
+дни пересобранных счетов, дни строк с пересчитанными рублевыми суммами,
+дни строк, удаленных через ORM (сигнал sales.facts).
+
+line_id_sum свертки по клиентам - контрольная сумма: дни, где число строк
+или сумма их id разошлись с витриной, находит drifted_rollup_days.
+"""
+import logging
+
+from django.db import connection, transaction
+
+from .models import SalesDailyCompany, SalesDailyProduct, SalesFact
+
+logger = logging.getLogger(__name__)
+
+
+def _tables():
+    return {
+        'fact': SalesFact._meta.db_table,
+        'company': SalesDailyCompany._meta.db_table,
+        'product': SalesDailyProduct._meta.db_table,
+    }
+
+
+INSERT_COMPANY_SQL = """
+    INSERT INTO {company} (day, company_id, sale_type, currency, revenue, orders, lines, line_id_sum)
+    SELECT invoice_date, company_id, sale_type, currency,
+           COALESCE(SUM(amount_rub), 0), COUNT(DISTINCT invoice_id), COUNT(*), SUM(line_id)
+    FROM {fact}
+    WHERE {condition}
+    GROUP BY invoice_date, company_id, sale_type, currency
+"""
+
+INSERT_PRODUCT_SQL = """
+    INSERT INTO {product} (day, product_id, sale_type, currency, revenue, quantity, orders, company_ids)
+    SELECT invoice_date, product_id, sale_type, currency,
+           COALESCE(SUM(amount_rub), 0), SUM(quantity), COUNT(DISTINCT invoice_id),
+           ARRAY_AGG(DISTINCT company_id)
+    FROM {fact}
+    WHERE {condition}
+    GROUP BY invoice_date, product_id, sale_type, currency
+"""
+
+# Дни, где свертка по клиентам разошлась с витриной (или есть только в одной из них)
+DRIFTED_DAYS_SQL = """
+    SELECT COALESCE(f.day, r.day) AS day
+    FROM (
+        SELECT invoice_date AS day, COUNT(*) AS lines, SUM(line_id) AS line_id_sum
+        FROM {fact}
+        GROUP BY invoice_date
+    ) f
+    FULL OUTER JOIN (
+        SELECT day, SUM(lines) AS lines, SUM(line_id_sum) AS line_id_sum
+        FROM {company}
+        GROUP BY day
+    ) r ON r.day = f.day
+    WHERE f.day IS NULL OR r.day IS NULL
+       OR f.lines <> r.lines OR f.line_id_sum <> r.line_id_sum
+    ORDER BY day
+"""
+
+
+def rebuild_rollup_days(days=None) -> int:
+    """
+    Пересобирает свертки за указанные дни (None - полностью).
+
+    Returns:
+        int: количество строк свертки по клиентам
+    """
+    tables = _tables()
+    if days is None:
+        condition, params = 'TRUE', {}
+    else:
+        days = sorted(set(days))
+        if not days:
+            return 0
+        condition, params = 'invoice_date = ANY(%(days)s)', {'days': days}
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if days is None:
+            cursor.execute(f"TRUNCATE {tables['company']}, {tables['product']}")
+        else:
+            cursor.execute(f"DELETE FROM {tables['company']} WHERE day = ANY(%(days)s)", params)
+            cursor.execute(f"DELETE FROM {tables['product']} WHERE day = ANY(%(days)s)", params)
+        cursor.execute(INSERT_COMPANY_SQL.format(condition=condition, **tables), params)
+        rows = cursor.rowcount
+        cursor.execute(INSERT_PRODUCT_SQL.format(condition=condition, **tables), params)
+    return rows
+
+
+def refresh_sales_rollups(days) -> int:
+    """
+    Обновляет дневные свертки продаж за затронутые дни.
+
+    Returns:
+        int: количество пересобранных дней
+    """
+    days = sorted(set(days))
+    if days:
+        rebuild_rollup_days(days)
+        logger.info(f"Дневные свертки продаж пересобраны за {len(days)} дн.")
+    return len(days)
+
+
+def drifted_rollup_days() -> list:
+    """
+    Дни, за которые свертки не совпадают с витриной фактов.
+
+    Сравнивает число строк и сумму line_id по дням витрины с lines
+    и line_id_sum свертки по клиентам.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(DRIFTED_DAYS_SQL.format(**_tables()))
+        return [row[0] for row in cursor.fetchall()]
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Invoice, InvoiceLine
+from .models import CustomerMetricsSnapshot, Invoice, InvoiceLine
 from customers.serializers import CompanySerializer
 from goods.serializers import ProductSerializer
 
@@ -17,20 +17,15 @@ class InvoiceLineSerializer(serializers.ModelSerializer):
         model = InvoiceLine
         fields = [
             'id', 'ext_id', 'invoice', 'product', 
-            'quantity', 'price', 'total_price',
+            'quantity', 'price', 'total_price', 'amount_rub',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'ext_id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'ext_id', 'amount_rub', 'created_at', 'updated_at']
 
 
 class InvoiceSerializer(serializers.ModelSerializer):
     """Сериализатор для счетов"""
     company = CompanySerializer(read_only=True)
-    total_amount = serializers.DecimalField(
-        max_digits=15, 
-        decimal_places=2, 
-        read_only=True
-    )
     lines = InvoiceLineSerializer(many=True, read_only=True)
 
     class Meta:
@@ -38,32 +33,43 @@ class InvoiceSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'ext_id', 'invoice_number', 'invoice_date',
             'company', 'invoice_type', 'sale_type', 'currency',
-            'total_amount', 'lines', 'created_at', 'updated_at'
+            'total_amount', 'line_count', 'total_qty', 'lines', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'ext_id', 'total_amount', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'ext_id', 'total_amount', 'line_count', 'total_qty', 'created_at', 'updated_at']
 
 
 class InvoiceListSerializer(serializers.ModelSerializer):
     """Упрощенный сериализатор для списка счетов без строк"""
     company = CompanySerializer(read_only=True)
-    total_amount = serializers.DecimalField(
-        max_digits=15, 
-        decimal_places=2, 
-        read_only=True
-    )
 
     class Meta:
         model = Invoice
         fields = [
             'id', 'ext_id', 'invoice_number', 'invoice_date',
             'company', 'invoice_type', 'sale_type', 'currency',
-            'total_amount', 'created_at', 'updated_at'
+            'total_amount', 'line_count', 'total_qty', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'ext_id', 'total_amount', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'ext_id', 'total_amount', 'line_count', 'total_qty', 'created_at', 'updated_at']
 
 
 # Сериализаторы для аналитики
 
+class CustomerMetricsSnapshotSerializer(serializers.ModelSerializer):
+    """Сериализатор снимка RFM/LTV-метрик клиента"""
+    company_name = serializers.CharField(source='company.name', read_only=True)
+
+    class Meta:
+        model = CustomerMetricsSnapshot
+        fields = [
+            'id', 'company', 'company_name', 'snapshot_date',
+            'first_purchase_date', 'last_purchase_date', 'orders_count', 'revenue',
+            'recency_days', 'r_score', 'f_score', 'm_score', 'rfm_score', 'rfm_segment',
+            'lifespan_days', 'average_order_value', 'purchase_frequency_monthly',
+            'customer_value_monthly', 'predicted_ltv_12m', 'predicted_ltv_24m',
+            'ltv_segment', 'activity_status', 'created_at', 'updated_at'
+        ]
+
+
 class CustomerSalesAnalyticsSerializer(serializers.Serializer):
     """Сериализатор для аналитики продаж по клиентам"""
     company_id = serializers.IntegerField()
@@ -309,6 +315,19 @@ class MarketBasketAnalysisRequestSerializer(serializers.Serializer):
         max_value=100.0,
         help_text='Минимальный lift, по умолчанию 1.0'
     )
+    level = serializers.ChoiceField(
+        choices=['product', 'brand', 'subgroup'],
+        required=False,
+        default='product',
+        help_text='Уровень корзины: product (товары), brand (бренды), subgroup (подгруппы)'
+    )
+    max_itemset_size = serializers.IntegerField(
+        required=False,
+        default=2,
+        min_value=2,
+        max_value=5,
+        help_text='Максимальный размер набора (2 = пары), по умолчанию 2'
+    )
 
 
 class MarketBasketAnalysisResponseSerializer(serializers.Serializer):
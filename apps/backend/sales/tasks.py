@@ -1,5 +1,6 @@
 import logging
 import os
+import numpy as np
 import pandas as pd
 import mysql.connector
 from mysql.connector import Error
@@ -9,9 +10,17 @@ from django.conf import settings
 from django.db import transaction
 from django.core.exceptions import ValidationError
 from celery import shared_task
-from .models import Invoice, InvoiceLine
+from celery.exceptions import SoftTimeLimitExceeded
+from .facts import SALES_DATA_NAMESPACE, delete_invoice_lines, refresh_sales_facts, repair_sales_rollups
+from .fx import RateTable
+from .models import Invoice, InvoiceLine, SalesFact
+from .totals import refresh_invoice_totals
 from customers.models import Company
 from goods.models import Product, ProductSubgroup, ProductGroup, Brand
+from core.artifacts import ExportArtifactWriter, artifact_local_path, artifact_result
+from core.checkpoints import CheckpointedRun, month_partitions
+from core.report_cache import get_data_version
+from core.reports import MONEY_FORMAT, ReportWorkbook, write_xlsx
 
 logger = logging.getLogger(__name__)
 
@@ -167,6 +176,9 @@ def update_sales_from_mysql():
 
     logger.info(f"Загружено {len(existing_invoices)} существующих счетов")
 
+    # Курсы валют для рублевых сумм строк
+    rates = RateTable()
+
     # Логи для диагностики
     if len(existing_invoices) > 0:
         first_keys = list(existing_invoices.keys())[:5]
@@ -398,7 +410,8 @@ def update_sales_from_mysql():
                 'product': product,
                 'ext_id': f"{invoice_id_str}-{tovcode_str}",
                 'quantity': quantity,
-                'price': price
+                'price': price,
+                'amount_rub': rates.to_rub(Decimal(str(price)) * quantity, invoice.currency, invoice_date),
             })
 
         # Добавляем все строки данного счета в словарь по ext_id счета
@@ -441,21 +454,25 @@ def update_sales_from_mysql():
         # ВАЖНОЕ ИЗМЕНЕНИЕ: Вторая транзакция для создания строк
         # К этому моменту первая транзакция уже завершена и счета созданы в базе
         with transaction.atomic():
-            # Удаляем старые строки счетов для обновляемых счетов
+            # Удаляем старые строки счетов для обновляемых счетов (с фактами витрины,
+            # без загрузки строк в ORM); свертки их дней пересоберет refresh_sales_facts
+            deleted_days = set()
             if invoice_objects_to_update:
-                invoice_ext_ids = [str(inv.ext_id) for inv in invoice_objects_to_update]
-                logger.info(f"Удаление старых строк счетов для {len(invoice_ext_ids)} обновляемых счетов")
+                invoice_ids = [inv.id for inv in invoice_objects_to_update]
+                logger.info(f"Удаление старых строк счетов для {len(invoice_ids)} обновляемых счетов")
                 # Делаем удаление небольшими пакетами, если много счетов
                 batch_size = 1000
-                for i in range(0, len(invoice_ext_ids), batch_size):
-                    batch = invoice_ext_ids[i:i+batch_size]
-                    InvoiceLine.objects.filter(invoice__ext_id__in=batch).delete()
+                for i in range(0, len(invoice_ids), batch_size):
+                    batch = invoice_ids[i:i+batch_size]
+                    deleted_days |= delete_invoice_lines(batch)
+                    refresh_invoice_totals(batch)
 
             # Получаем все ext_id из нашего списка счетов
             all_invoice_ext_ids = list(invoice_lines_by_invoice_ext_id.keys())
 
             if not all_invoice_ext_ids:
                 logger.warning("Нет данных о строках счетов для создания")
+                refresh_sales_facts(days=deleted_days)
                 return "Обработка завершена: нет строк счетов для создания"
 
             logger.info(f"Запрашиваем данные о {len(all_invoice_ext_ids)} счетах из базы данных")
@@ -518,7 +535,8 @@ def update_sales_from_mysql():
                             product=line_data['product'],
                             ext_id=line_data['ext_id'],
                             quantity=line_data['quantity'],
-                            price=line_data['price']
+                            price=line_data['price'],
+                            amount_rub=line_data['amount_rub'],
                         )
                         all_invoice_lines.append(invoice_line)
                         lines_created += 1
@@ -535,6 +553,8 @@ def update_sales_from_mysql():
                     batch = all_invoice_lines[i:i+batch_size]
                     logger.info(f"Создаю пакет строк {i+1}-{i+len(batch)} из {len(all_invoice_lines)}")
                     InvoiceLine.objects.bulk_create(batch, batch_size=1000, ignore_conflicts=True)
+                    # bulk_create не шлет сигналов - итоги счетов пакета пересчитываем сразу
+                    refresh_invoice_totals({line.invoice_id for line in batch})
             else:
                 logger.warning("Не создано ни одной строки счета! Проверьте логику создания.")
 
@@ -543,6 +563,11 @@ def update_sales_from_mysql():
             f"строки {lines_created} (создано), "
             f"пропущено: {skipped_items}"
         )
+        if rates.unconverted:
+            logger.warning(f"Строки без курса валюты (суммы в валюте счета): {dict(rates.unconverted)}")
+
+        # Новые строки счетов попадают в витрину фактов продаж
+        refresh_sales_facts(days=deleted_days)
     except Exception as e:
         logger.error(f"Ошибка при обновлении данных о продажах: {e}")
         return f"Ошибка при обновлении данных: {e}"
@@ -569,106 +594,98 @@ def export_sales_to_excel(year_from=2022, exclude_client_id=14783):
     Returns:
     str: Сообщение о результате операции
     """
+    # Выполняем SQL запрос для получения данных о продажах
+    query = """
+    SELECT
+        l.id,
+        l.g1,
+        l.idklient,
+        k.kontr1,
+        l.moment,
+        c.tovmark,
+        c.tovcode,
+        c.prise,
+        cast(c.prise * (1-c.proc4/100) as decimal(15,2)) as discounted_price,
+        c.fost,
+        l.year
+    FROM
+        listdoc l
+    INNER JOIN
+        chek c ON l.id = c.idlist
+    INNER JOIN
+        kontr k ON l.idklient = k.id
+    WHERE
+        l.g1 < 3
+        AND (l.g1 = 1 OR l.cf > 0)
+        AND l.year > %s
+    """
+
+    params = [year_from]
+
+    if exclude_client_id is not None:
+        query += " AND l.idklient != %s"
+        params.append(exclude_client_id)
+
+    # Добавляем сортировку для удобства анализа
+    query += " ORDER BY l.moment DESC"
+
+    columns = [
+        'ID документа', 'Тип документа', 'ID клиента', 'Наименование клиента',
+        'Дата/время', 'Наименование товара', 'Код товара', 'Цена',
+        'Цена со скидкой', 'Количество', 'Год', 'Сумма',
+    ]
+
+    def iter_sales_rows(cursor):
+        for row in cursor:
+            discounted_price, quantity = row[8], row[9]
+            amount = discounted_price * quantity if discounted_price is not None and quantity is not None else None
+            yield row + (amount,)
+
+    # Определяем директорию проекта, где находится manage.py
+    project_dir = settings.BASE_DIR
+
+    # Формируем имя файла с текущей датой и временем
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    excel_filename = os.path.join(project_dir, f'sales_export_{timestamp}.xlsx')
+
     connection = None
+    cursor = None
     try:
         connection = mysql.connector.connect(**mysql_config)
-        if connection.is_connected():
-            cursor = connection.cursor(dictionary=True)
-
-            # Выполняем SQL запрос для получения данных о продажах
-            query = """
-            SELECT
-                l.id,
-                l.g1,
-                l.idklient,
-                k.kontr1,
-                l.moment,
-                c.tovmark,
-                c.tovcode,
-                c.prise,
-                cast(c.prise * (1-c.proc4/100) as decimal(15,2)) as discounted_price,
-                c.fost,
-                l.year
-            FROM
-                listdoc l
-            INNER JOIN
-                chek c ON l.id = c.idlist
-            INNER JOIN
-                kontr k ON l.idklient = k.id
-            WHERE
-                l.g1 < 3
-                AND (l.g1 = 1 OR l.cf > 0)
-                AND l.year > %s
-            """
-
-            params = [year_from]
-
-            if exclude_client_id is not None:
-                query += " AND l.idklient != %s"
-                params.append(exclude_client_id)
-
-            # Добавляем сортировку для удобства анализа
-            query += " ORDER BY l.moment DESC"
-
-            cursor.execute(query, params)
-            sales_data = cursor.fetchall()
-
-            if not sales_data:
-                logger.warning(f"Нет данных о продажах для указанных параметров")
-                return "Данные не найдены"
-        else:
+        if not connection.is_connected():
             logger.error("MySQL-соединение не установлено")
             return "Ошибка соединения с базой данных"
 
+        # Строки идут из небуферизованного курсора прямо в write_only книгу
+        cursor = connection.cursor(buffered=False)
+        cursor.execute(query, params)
+        records = write_xlsx(
+            excel_filename,
+            columns,
+            iter_sales_rows(cursor),
+            sheet_title='Продажи',
+            number_formats={'Цена': MONEY_FORMAT, 'Цена со скидкой': MONEY_FORMAT, 'Сумма': MONEY_FORMAT},
+        )
     except Error as e:
         logger.error(f"Ошибка при подключении к MySQL: {e}")
         return f"Ошибка: {str(e)}"
+    except Exception as e:
+        logger.error(f"Ошибка при создании Excel-файла: {e}")
+        return f"Ошибка экспорта: {str(e)}"
     finally:
-        if connection and connection.is_connected():
+        if cursor is not None:
             cursor.close()
+        if connection and connection.is_connected():
             connection.close()
             logger.info("MySQL соединение закрыто")
 
-    # Обработка данных и создание Excel файла с помощью pandas
-    try:
-        # Создаем DataFrame
-        df = pd.DataFrame(sales_data)
-
-        # Переименовываем колонки для лучшей читаемости
-        column_mapping = {
-            'id': 'ID документа',
-            'g1': 'Тип документа',
-            'idklient': 'ID клиента',
-            'kontr1': 'Наименование клиента',
-            'moment': 'Дата/время',
-            'tovmark': 'Наименование товара',
-            'tovcode': 'Код товара',
-            'prise': 'Цена',
-            'discounted_price': 'Цена со скидкой',
-            'fost': 'Количество',
-            'year': 'Год'
-        }
-        df = df.rename(columns=column_mapping)
-
-        # Добавляем расчетный столбец для суммы
-        df['Сумма'] = df['Цена со скидкой'] * df['Количество']
-
-        # Определяем директорию проекта, где находится manage.py
-        # settings.BASE_DIR обычно указывает на директорию проекта
-        project_dir = settings.BASE_DIR
+    if not records:
+        logger.warning("Нет данных о продажах для указанных параметров")
+        os.remove(excel_filename)
+        return "Данные не найдены"
 
-        # Формируем имя файла с текущей датой и временем
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        excel_filename = os.path.join(project_dir, f'sales_export_{timestamp}.xlsx')
-
-        # Сохраняем данные в Excel файл
-        df.to_excel(excel_filename, sheet_name='Продажи', index=False)
-
-        logger.info(f"Данные о продажах успешно экспортированы в Excel файл: {excel_filename}")
-        return f"Экспортировано {len(sales_data)} записей в файл {os.path.basename(excel_filename)} в директории проекта"
-    except Exception as e:
-        logger.error(f"Ошибка при создании Excel-файла: {e}")
-        return f"Ошибка экспорта: {str(e)}"
+    logger.info(f"Данные о продажах успешно экспортированы в Excel файл: {excel_filename}")
+    return f"Экспортировано {records} записей в файл {os.path.basename(excel_filename)} в директории проекта"
 
 
 @shared_task
@@ -683,46 +700,53 @@ def export_company_sales_to_excel(company_id, date_from=None, date_to=None, user
     user_id (int): ID пользователя, запросившего экспорт
     
     Returns:
-    str: Путь к созданному файлу или сообщение об ошибке
+    dict: id файла выгрузки (ExportArtifact) и ссылка на скачивание или сообщение об ошибке
     """
     try:
         # Получаем компанию
         company = Company.objects.get(id=company_id)
         
-        # Формируем запрос
-        queryset = Invoice.objects.filter(
-            company=company,
-            invoice_type=Invoice.InvoiceType.SALE
-        ).prefetch_related('lines__product')
+        # Формируем запрос по строкам счетов: одна выборка без prefetch
+        lines = InvoiceLine.objects.filter(
+            invoice__company=company,
+            invoice__invoice_type=Invoice.InvoiceType.SALE
+        )
         
         # Применяем фильтры по датам
         if date_from:
-            queryset = queryset.filter(invoice_date__gte=date_from)
+            lines = lines.filter(invoice__invoice_date__gte=date_from)
         if date_to:
-            queryset = queryset.filter(invoice_date__lte=date_to)
-        
-        if not queryset.exists():
-            return "Нет данных для экспорта с указанными параметрами"
-        
-        # Подготавливаем данные
-        data = []
-        for invoice in queryset:
-            for line in invoice.lines.all():
-                data.append({
-                    'Номер счета': invoice.invoice_number,
-                    'Дата счета': invoice.invoice_date,
-                    'Компания': invoice.company.name,
-                    'Тип продажи': invoice.get_sale_type_display() if invoice.sale_type else '',
-                    'Валюта': invoice.currency,
-                    'Товар': line.product.name if line.product else '',
-                    'Артикул': line.product.article if line.product else '',
-                    'Количество': line.quantity,
-                    'Цена': float(line.price),
-                    'Сумма': float(line.total_price),
-                })
-        
-        # Создаем DataFrame
-        df = pd.DataFrame(data)
+            lines = lines.filter(invoice__invoice_date__lte=date_to)
+        
+        if not lines.exists():
+            return {"success": False, "error": "Нет данных для экспорта с указанными параметрами"}
+        
+        sale_types = dict(Invoice.SaleType.choices)
+        
+        def iter_lines():
+            rows = lines.order_by('-invoice__invoice_date', 'invoice__invoice_number', 'id').values_list(
+                'invoice__invoice_number',
+                'invoice__invoice_date',
+                'invoice__sale_type',
+                'invoice__currency',
+                'product__name',
+                'product__ext_id',
+                'quantity',
+                'price',
+            )
+            for number, invoice_date, sale_type, currency, product_name, product_ext_id, quantity, price in rows.iterator(chunk_size=5000):
+                yield (
+                    number,
+                    invoice_date,
+                    company.name,
+                    str(sale_types.get(sale_type, '')) if sale_type else '',
+                    currency,
+                    product_name or '',
+                    product_ext_id or '',
+                    quantity,
+                    price,
+                    quantity * price,
+                )
         
         # Формируем имя файла
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -730,27 +754,31 @@ def export_company_sales_to_excel(company_id, date_from=None, date_to=None, user
         safe_company_name = "".join(c for c in company_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
         filename = f'sales_{safe_company_name}_{timestamp}.xlsx'
         
-        # Определяем путь к файлу
-        export_dir = os.path.join(settings.MEDIA_ROOT, 'exports')
-        os.makedirs(export_dir, exist_ok=True)
-        file_path = os.path.join(export_dir, filename)
-        
-        # Сохраняем Excel файл
-        df.to_excel(file_path, sheet_name='Продажи', index=False)
+        # Потоково сохраняем Excel файл в хранилище выгрузок
+        with ExportArtifactWriter('company_sales', filename, created_by_id=user_id) as output:
+            records = write_xlsx(
+                output.file,
+                ['Номер счета', 'Дата счета', 'Компания', 'Тип продажи', 'Валюта',
+                 'Товар', 'Артикул', 'Количество', 'Цена', 'Сумма'],
+                iter_lines(),
+                sheet_title='Продажи',
+                number_formats={'Цена': MONEY_FORMAT, 'Сумма': MONEY_FORMAT},
+            )
         
-        logger.info(f"Экспорт продаж для компании {company.name} завершен: {file_path}")
-        return file_path
+        logger.info(f"Экспорт продаж для компании {company.name} завершен: {filename}")
+        return artifact_result(output.artifact, file_path=artifact_local_path(output.artifact), records=records)
         
     except Company.DoesNotExist:
         logger.error(f"Компания с ID {company_id} не найдена")
-        return f"Компания с ID {company_id} не найдена"
+        return {"success": False, "error": f"Компания с ID {company_id} не найдена"}
     except Exception as e:
         logger.error(f"Ошибка при экспорте продаж для компании {company_id}: {e}")
-        return f"Ошибка экспорта: {str(e)}"
+        return {"success": False, "error": f"Ошибка экспорта: {str(e)}"}
 
 
 @shared_task
-def generate_customer_sales_dynamics_report(date_from=None, date_to=None, company_ids=None, period_type='month'):
+def generate_customer_sales_dynamics_report(date_from=None, date_to=None, company_ids=None, period_type='month',
+                                            user_id=None):
     """
     Celery-задача для создания Excel отчета по динамике продаж по клиентам.
     
@@ -765,12 +793,13 @@ def generate_customer_sales_dynamics_report(date_from=None, date_to=None, compan
     date_to (str): Конечная дата в формате YYYY-MM-DD
     company_ids (list): Список ID компаний для фильтрации (если None - все компании)
     period_type (str): Тип периодизации: 'day', 'week', 'month', 'year'
+    user_id (int): ID пользователя, запросившего отчет
     
     Returns:
     dict: Информация о созданном файле или сообщение об ошибке
     """
     try:
-        from django.db.models import Sum, Count, Avg, F, DecimalField
+        from django.db.models import Sum, Count, Avg
         from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear
         
         # Выбираем функцию группировки в зависимости от типа периода
@@ -786,10 +815,8 @@ def generate_customer_sales_dynamics_report(date_from=None, date_to=None, compan
         
         trunc_func = period_functions[period_type]
         
-        # Формируем базовый запрос
-        queryset = Invoice.objects.filter(
-            invoice_type=Invoice.InvoiceType.SALE
-        ).select_related('company')
+        # Формируем базовый запрос по витрине фактов продаж
+        queryset = SalesFact.objects.all()
         
         # Применяем фильтры
         if date_from:
@@ -813,18 +840,12 @@ def generate_customer_sales_dynamics_report(date_from=None, date_to=None, compan
             'company__company_type',
             'company__inn'
         ).annotate(
-            # Выручка - сумма всех строк счета
-            total_revenue=Sum(
-                F('lines__quantity') * F('lines__price'),
-                output_field=DecimalField(max_digits=15, decimal_places=2)
-            ),
+            # Выручка в рублях - сумма всех строк счета
+            total_revenue=Sum('amount_rub'),
             # Количество заказов (счетов)
-            order_count=Count('id', distinct=True),
+            order_count=Count('invoice_id', distinct=True),
             # Средний чек
-            average_check=Avg(
-                F('lines__quantity') * F('lines__price'),
-                output_field=DecimalField(max_digits=15, decimal_places=2)
-            )
+            average_check=Avg('amount_rub')
         ).order_by('period', 'company__name')
         
         # Преобразуем QuerySet в список словарей
@@ -876,41 +897,36 @@ def generate_customer_sales_dynamics_report(date_from=None, date_to=None, compan
         period_label = period_labels.get(period_type, period_type)
         filename = f'динамика_продаж_по_клиентам_{period_label}_{timestamp}.xlsx'
         
-        # Определяем путь к файлу
-        export_dir = os.path.join(settings.MEDIA_ROOT, 'exports', 'analytics')
-        os.makedirs(export_dir, exist_ok=True)
-        file_path = os.path.join(export_dir, filename)
-        
         # Сохраняем Excel файл с несколькими листами
-        with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-            # Лист с детальной динамикой
-            df.to_excel(writer, sheet_name='Динамика по периодам', index=False)
-            
-            # Лист со сводной информацией
-            summary_df.to_excel(writer, sheet_name='Сводная по компаниям', index=False)
-            
-            # Лист с параметрами отчета
-            params_data = {
-                'Параметр': ['Дата создания', 'Период с', 'Период по', 'Тип периодизации', 'Количество компаний', 'Всего записей'],
-                'Значение': [
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    date_from or 'Не указано',
-                    date_to or 'Не указано',
-                    period_labels.get(period_type, period_type),
-                    len(summary_data),
-                    len(data)
-                ]
-            }
-            params_df = pd.DataFrame(params_data)
-            params_df.to_excel(writer, sheet_name='Параметры отчета', index=False)
+        with ExportArtifactWriter('customer_sales_dynamics', filename, created_by_id=user_id) as output:
+            with ReportWorkbook(output.file) as workbook:
+                # Лист с детальной динамикой
+                workbook.add_dataframe('Динамика по периодам', df)
+            
+                # Лист со сводной информацией
+                workbook.add_dataframe('Сводная по компаниям', summary_df)
+            
+                # Лист с параметрами отчета
+                params_data = {
+                    'Параметр': ['Дата создания', 'Период с', 'Период по', 'Тип периодизации', 'Количество компаний', 'Всего записей'],
+                    'Значение': [
+                        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        date_from or 'Не указано',
+                        date_to or 'Не указано',
+                        period_labels.get(period_type, period_type),
+                        len(summary_data),
+                        len(data)
+                    ]
+                }
+                workbook.add_columns('Параметры отчета', params_data)
+        file_path = artifact_local_path(output.artifact)
         
-        logger.info(f"Отчет по динамике продаж создан: {file_path}")
+        logger.info(f"Отчет по динамике продаж создан: {filename}")
         logger.info(f"Обработано компаний: {len(summary_data)}, записей: {len(data)}")
         
         return {
-            "success": True,
+            **artifact_result(output.artifact),
             "file_path": file_path,
-            "filename": filename,
             "companies_count": len(summary_data),
             "records_count": len(data),
             "total_revenue": float(summary_df['Общая выручка (₽)'].sum()),
@@ -922,7 +938,8 @@ def generate_customer_sales_dynamics_report(date_from=None, date_to=None, compan
 
 
 @shared_task
-def generate_product_sales_dynamics_report(date_from=None, date_to=None, product_ids=None, period_type='month'):
+def generate_product_sales_dynamics_report(date_from=None, date_to=None, product_ids=None, period_type='month',
+                                           user_id=None):
     """
     Celery-задача для создания Excel отчета по динамике продаж по товарам.
     
@@ -938,13 +955,14 @@ def generate_product_sales_dynamics_report(date_from=None, date_to=None, product
     date_to (str): Конечная дата в формате YYYY-MM-DD
     product_ids (list): Список ID товаров для фильтрации (если None - все товары)
     period_type (str): Тип периодизации: 'day', 'week', 'month', 'year'
+    user_id (int): ID пользователя, запросившего отчет
     
     Returns:
     dict: Информация о созданном файле или сообщение об ошибке
     """
     try:
         from django.db.models import Sum, Count, Avg, F, DecimalField
-        from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear
+        from django.db.models.functions import NullIf, TruncDay, TruncWeek, TruncMonth, TruncYear
         
         # Выбираем функцию группировки в зависимости от типа периода
         period_functions = {
@@ -959,16 +977,14 @@ def generate_product_sales_dynamics_report(date_from=None, date_to=None, product
         
         trunc_func = period_functions[period_type]
         
-        # Формируем базовый запрос через строки счетов
-        queryset = InvoiceLine.objects.filter(
-            invoice__invoice_type=Invoice.InvoiceType.SALE
-        ).select_related('invoice', 'product', 'product__brand', 'product__subgroup')
+        # Формируем базовый запрос по витрине фактов продаж
+        queryset = SalesFact.objects.all()
         
         # Применяем фильтры
         if date_from:
-            queryset = queryset.filter(invoice__invoice_date__gte=date_from)
+            queryset = queryset.filter(invoice_date__gte=date_from)
         if date_to:
-            queryset = queryset.filter(invoice__invoice_date__lte=date_to)
+            queryset = queryset.filter(invoice_date__lte=date_to)
         if product_ids:
             queryset = queryset.filter(product_id__in=product_ids)
         
@@ -977,27 +993,27 @@ def generate_product_sales_dynamics_report(date_from=None, date_to=None, product
         
         # Аннотируем период и собираем агрегированные данные
         analytics = queryset.annotate(
-            period=trunc_func('invoice__invoice_date')
+            period=trunc_func('invoice_date')
         ).values(
             'period',
             'product__id',
             'product__name',
             'product__complex_name',
-            'product__brand__name',
-            'product__subgroup__name',
-            'product__subgroup__group__name'
+            'brand__name',
+            'subgroup__name',
+            'group__name'
         ).annotate(
-            # Выручка - сумма price * quantity
-            total_revenue=Sum(
-                F('quantity') * F('price'),
-                output_field=DecimalField(max_digits=15, decimal_places=2)
-            ),
+            # Выручка в рублях - сумма price * quantity по курсу на дату счета
+            total_revenue=Sum('amount_rub'),
             # Количество заказов (уникальных счетов)
-            order_count=Count('invoice', distinct=True),
+            order_count=Count('invoice_id', distinct=True),
             # Количество проданных единиц
             quantity_sold=Sum('quantity'),
-            # Средняя цена за единицу
-            average_price=Avg('price', output_field=DecimalField(max_digits=15, decimal_places=2))
+            # Средняя цена за единицу в рублях
+            average_price=Avg(
+                F('amount_rub') / NullIf(F('quantity'), 0),
+                output_field=DecimalField(max_digits=15, decimal_places=2)
+            )
         ).order_by('period', 'product__name')
         
         # Преобразуем QuerySet в список словарей
@@ -1012,9 +1028,9 @@ def generate_product_sales_dynamics_report(date_from=None, date_to=None, product
                 'Период': item['period'].strftime('%Y-%m-%d') if item['period'] else '',
                 'ID Товара': item['product__id'],
                 'Part Number': item['product__name'] or '',
-                'Бренд': item['product__brand__name'] or '',
-                'Подгруппа': item['product__subgroup__name'] or '',
-                'Группа': item['product__subgroup__group__name'] or '',
+                'Бренд': item['brand__name'] or '',
+                'Подгруппа': item['subgroup__name'] or '',
+                'Группа': item['group__name'] or '',
                 'Выручка (₽)': float(item['total_revenue']) if item['total_revenue'] else 0,
                 'Количество заказов': item['order_count'],
                 'Продано единиц': item['quantity_sold'] or 0,
@@ -1059,41 +1075,36 @@ def generate_product_sales_dynamics_report(date_from=None, date_to=None, product
         period_label = period_labels.get(period_type, period_type)
         filename = f'динамика_продаж_по_товарам_{period_label}_{timestamp}.xlsx'
         
-        # Определяем путь к файлу
-        export_dir = os.path.join(settings.MEDIA_ROOT, 'exports', 'analytics')
-        os.makedirs(export_dir, exist_ok=True)
-        file_path = os.path.join(export_dir, filename)
-        
         # Сохраняем Excel файл с несколькими листами
-        with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-            # Лист с детальной динамикой
-            df.to_excel(writer, sheet_name='Динамика по периодам', index=False)
-            
-            # Лист со сводной информацией
-            summary_df.to_excel(writer, sheet_name='Сводная по товарам', index=False)
-            
-            # Лист с параметрами отчета
-            params_data = {
-                'Параметр': ['Дата создания', 'Период с', 'Период по', 'Тип периодизации', 'Количество товаров', 'Всего записей'],
-                'Значение': [
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    date_from or 'Не указано',
-                    date_to or 'Не указано',
-                    period_labels.get(period_type, period_type),
-                    len(summary_data),
-                    len(data)
-                ]
-            }
-            params_df = pd.DataFrame(params_data)
-            params_df.to_excel(writer, sheet_name='Параметры отчета', index=False)
+        with ExportArtifactWriter('product_sales_dynamics', filename, created_by_id=user_id) as output:
+            with ReportWorkbook(output.file) as workbook:
+                # Лист с детальной динамикой
+                workbook.add_dataframe('Динамика по периодам', df)
+            
+                # Лист со сводной информацией
+                workbook.add_dataframe('Сводная по товарам', summary_df)
+            
+                # Лист с параметрами отчета
+                params_data = {
+                    'Параметр': ['Дата создания', 'Период с', 'Период по', 'Тип периодизации', 'Количество товаров', 'Всего записей'],
+                    'Значение': [
+                        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        date_from or 'Не указано',
+                        date_to or 'Не указано',
+                        period_labels.get(period_type, period_type),
+                        len(summary_data),
+                        len(data)
+                    ]
+                }
+                workbook.add_columns('Параметры отчета', params_data)
+        file_path = artifact_local_path(output.artifact)
         
         logger.info(f"Отчет по динамике продаж товаров создан: {file_path}")
         logger.info(f"Обработано товаров: {len(summary_data)}, записей: {len(data)}")
         
         return {
-            "success": True,
+            **artifact_result(output.artifact),
             "file_path": file_path,
-            "filename": filename,
             "products_count": len(summary_data),
             "records_count": len(data),
             "total_revenue": float(summary_df['Общая выручка (₽)'].sum()),
@@ -1105,7 +1116,7 @@ def generate_product_sales_dynamics_report(date_from=None, date_to=None, product
 
 
 @shared_task
-def generate_customer_cohort_analysis_report(date_from=None, date_to=None, period_type='month'):
+def generate_customer_cohort_analysis_report(date_from=None, date_to=None, period_type='month', user_id=None):
     """
     Celery-задача для создания Excel отчета когортного анализа клиентов.
     
@@ -1121,298 +1132,193 @@ def generate_customer_cohort_analysis_report(date_from=None, date_to=None, perio
     date_from (str): Начальная дата в формате YYYY-MM-DD (для фильтрации когорт)
     date_to (str): Конечная дата в формате YYYY-MM-DD (для фильтрации когорт)
     period_type (str): Тип периодизации: 'week', 'month' (по умолчанию month)
+    user_id (int): ID пользователя, запросившего отчет
     
     Returns:
     dict: Информация о созданном файле или сообщение об ошибке
     """
     try:
-        from django.db.models import Min
-        from decimal import Decimal
+        from django.db.models import Count, DecimalField, Max, Min, Sum, Value
+        from django.db.models.functions import Coalesce, TruncMonth, TruncWeek
         
         # Определяем метку периода
         if period_type == 'week':
             period_label = 'по_неделям'
         else:
             period_label = 'по_месяцам'
+        trunc = TruncWeek if period_type == 'week' else TruncMonth
+        fact_columns = ['company_id', 'period', 'orders', 'revenue']
+        
+        def load_month(partition):
+            # (компания, период) -> заказы и выручка за один месяц истории
+            month_start, next_month = partition
+            rows = (
+                SalesFact.objects
+                .filter(invoice_date__gte=month_start, invoice_date__lt=next_month)
+                .annotate(period=trunc('invoice_date'))
+                .values('company_id', 'period')
+                .annotate(
+                    orders=Count('invoice_id', distinct=True),
+                    revenue=Coalesce(Sum('amount_rub'), Value(0, output_field=DecimalField())),
+                )
+                .order_by()
+                .values_list(*fact_columns)
+            )
+            frame = pd.DataFrame.from_records(rows, columns=fact_columns)
+            frame['revenue'] = frame['revenue'].astype(float)
+            return frame
+        
+        # Когорты считаются по всей истории - она читается помесячно с контрольными
+        # точками, прерванная по лимиту времени задача продолжит с последнего месяца
+        run = CheckpointedRun(
+            'customer_cohort_analysis',
+            {'date_from': date_from, 'date_to': date_to, 'period_type': period_type},
+            version=get_data_version(SALES_DATA_NAMESPACE),
+        )
+        history = SalesFact.objects.aggregate(first=Min('invoice_date'), last=Max('invoice_date'))
+        frames = run.map('months', month_partitions(history['first'], history['last']), load_month)
         
-        # Функция для вычисления периода из даты
-        def get_period_from_date(date):
-            from datetime import timedelta
-            if period_type == 'week':
-                # Получаем понедельник недели (ISO week)
-                return date - timedelta(days=date.weekday())
-            else:
-                # Получаем первый день месяца
-                return date.replace(day=1)
-        
-        # Получаем все продажи
-        sales_queryset = Invoice.objects.filter(
-            invoice_type=Invoice.InvoiceType.SALE
-        ).select_related('company')
-        
-        if not sales_queryset.exists():
+        if not any(len(frame) for frame in frames):
             return {"error": "Нет данных о продажах для анализа"}
         
-        # Определяем первую покупку каждого клиента (когорту)
-        first_purchases = sales_queryset.values('company_id').annotate(
-            first_purchase_date=Min('invoice_date')
+        # Неделя на стыке месяцев приходит из двух частей - складываем
+        # (счет относится к одному дню, поэтому заказы частей не пересекаются)
+        df = (
+            pd.concat(frames, ignore_index=True)
+            .groupby(['company_id', 'period'], as_index=False)[['orders', 'revenue']]
+            .sum()
         )
+        df['period'] = pd.to_datetime(df['period'])
         
-        # Создаем словарь: company_id -> cohort_period
-        company_cohorts = {
-            item['company_id']: get_period_from_date(item['first_purchase_date'])
-            for item in first_purchases
-        }
+        # Когорта - период первой покупки клиента (по всей истории)
+        df['cohort'] = df.groupby('company_id')['period'].transform('min')
         
         # Фильтруем когорты по датам если указаны
-        if date_from or date_to:
-            filtered_cohorts = {}
-            for company_id, cohort_date in company_cohorts.items():
-                if date_from and cohort_date < datetime.strptime(date_from, '%Y-%m-%d').date():
-                    continue
-                if date_to and cohort_date > datetime.strptime(date_to, '%Y-%m-%d').date():
-                    continue
-                filtered_cohorts[company_id] = cohort_date
-            company_cohorts = filtered_cohorts
+        if date_from:
+            df = df[df['cohort'] >= pd.Timestamp(date_from)]
+        if date_to:
+            df = df[df['cohort'] <= pd.Timestamp(date_to)]
         
-        if not company_cohorts:
+        if df.empty:
             return {"error": "Нет когорт для анализа с указанными параметрами"}
         
-        # Получаем все периоды для анализа
-        all_periods = set()
-        cohort_data = {}  # cohort_period -> {period -> {customers: set, revenue: Decimal, orders: int}}
-        
-        # Инициализируем структуру данных
-        unique_cohorts = sorted(set(company_cohorts.values()))
-        
-        # Собираем данные по всем счетам
-        for invoice in sales_queryset.filter(company_id__in=company_cohorts.keys()):
-            company_id = invoice.company_id
-            cohort_period = company_cohorts[company_id]
-            invoice_period = get_period_from_date(invoice.invoice_date)
-            
-            all_periods.add(invoice_period)
-            
-            # Инициализируем структуру если нужно
-            if cohort_period not in cohort_data:
-                cohort_data[cohort_period] = {}
-            if invoice_period not in cohort_data[cohort_period]:
-                cohort_data[cohort_period][invoice_period] = {
-                    'customers': set(),
-                    'revenue': Decimal('0'),
-                    'orders': 0
-                }
-            
-            # Добавляем данные
-            cohort_data[cohort_period][invoice_period]['customers'].add(company_id)
-            cohort_data[cohort_period][invoice_period]['orders'] += 1
-            
-            # Вычисляем выручку
-            lines = InvoiceLine.objects.filter(invoice=invoice)
-            for line in lines:
-                cohort_data[cohort_period][invoice_period]['revenue'] += line.quantity * line.price
-        
-        all_periods = sorted(all_periods)
-        
-        # Функция для расчета разницы периодов
-        def period_diff(cohort_period, current_period):
-            if period_type == 'week':
-                # Разница в неделях
-                delta = (current_period - cohort_period).days
-                return delta // 7
-            else:
-                # Разница в месяцах
-                return (current_period.year - cohort_period.year) * 12 + (current_period.month - cohort_period.month)
-        
-        # Создаем таблицу retention
-        max_periods = 0
-        for cohort_period in unique_cohorts:
-            for period in all_periods:
-                if period >= cohort_period:
-                    diff = period_diff(cohort_period, period)
-                    max_periods = max(max_periods, diff)
-        
-        # Retention Rate таблица
-        retention_data = []
-        for cohort_period in unique_cohorts:
-            if cohort_period not in cohort_data:
-                continue
-            
-            row = {
-                'Когорта': cohort_period.strftime('%Y-%m-%d'),
-                'Размер когорты': len(cohort_data[cohort_period].get(cohort_period, {}).get('customers', set()))
-            }
-            
-            cohort_size = row['Размер когорты']
-            if cohort_size == 0:
-                continue
-            
-            for period_num in range(max_periods + 1):
-                target_period = None
-                for period in all_periods:
-                    if period >= cohort_period and period_diff(cohort_period, period) == period_num:
-                        target_period = period
-                        break
-                
-                if target_period and target_period in cohort_data[cohort_period]:
-                    active_customers = len(cohort_data[cohort_period][target_period]['customers'])
-                    retention_rate = (active_customers / cohort_size * 100) if cohort_size > 0 else 0
-                    row[f'Период {period_num}'] = f"{retention_rate:.1f}%"
-                else:
-                    row[f'Период {period_num}'] = "0.0%"
-            
-            retention_data.append(row)
-        
-        # Revenue Retention таблица
-        revenue_data = []
-        for cohort_period in unique_cohorts:
-            if cohort_period not in cohort_data:
-                continue
-            
-            row = {
-                'Когорта': cohort_period.strftime('%Y-%m-%d'),
-                'Размер когорты': len(cohort_data[cohort_period].get(cohort_period, {}).get('customers', set()))
-            }
-            
-            if row['Размер когорты'] == 0:
-                continue
-            
-            for period_num in range(max_periods + 1):
-                target_period = None
-                for period in all_periods:
-                    if period >= cohort_period and period_diff(cohort_period, period) == period_num:
-                        target_period = period
-                        break
-                
-                if target_period and target_period in cohort_data[cohort_period]:
-                    revenue = float(cohort_data[cohort_period][target_period]['revenue'])
-                    row[f'Период {period_num}'] = revenue
-                else:
-                    row[f'Период {period_num}'] = 0
-            
-            revenue_data.append(row)
-        
-        # Количество заказов таблица
-        orders_data = []
-        for cohort_period in unique_cohorts:
-            if cohort_period not in cohort_data:
-                continue
-            
-            row = {
-                'Когорта': cohort_period.strftime('%Y-%m-%d'),
-                'Размер когорты': len(cohort_data[cohort_period].get(cohort_period, {}).get('customers', set()))
-            }
-            
-            if row['Размер когорты'] == 0:
-                continue
-            
-            for period_num in range(max_periods + 1):
-                target_period = None
-                for period in all_periods:
-                    if period >= cohort_period and period_diff(cohort_period, period) == period_num:
-                        target_period = period
-                        break
-                
-                if target_period and target_period in cohort_data[cohort_period]:
-                    orders = cohort_data[cohort_period][target_period]['orders']
-                    row[f'Период {period_num}'] = orders
-                else:
-                    row[f'Период {period_num}'] = 0
-            
-            orders_data.append(row)
+        # Номер периода относительно когорты
+        if period_type == 'week':
+            df['period_num'] = (df['period'] - df['cohort']).dt.days // 7
+        else:
+            df['period_num'] = (
+                (df['period'].dt.year - df['cohort'].dt.year) * 12
+                + (df['period'].dt.month - df['cohort'].dt.month)
+            )
         
-        if not retention_data:
+        # Матрицы когорта x номер периода
+        grouped = df.groupby(['cohort', 'period_num'])
+        max_periods = int(df['period_num'].max())
+        columns = range(max_periods + 1)
+        active = grouped['company_id'].nunique().unstack(fill_value=0).reindex(columns=columns, fill_value=0)
+        revenue = grouped['revenue'].sum().unstack(fill_value=0).reindex(columns=columns, fill_value=0)
+        orders = grouped['orders'].sum().unstack(fill_value=0).reindex(columns=columns, fill_value=0)
+        
+        cohort_sizes = active[0]
+        valid = cohort_sizes > 0
+        if not valid.any():
             return {"error": "Недостаточно данных для когортного анализа"}
         
-        # Создаем DataFrames
-        retention_df = pd.DataFrame(retention_data)
-        revenue_df = pd.DataFrame(revenue_data)
-        orders_df = pd.DataFrame(orders_data)
+        def cohort_frame(matrix):
+            frame = matrix[valid].copy()
+            frame.columns = [f'Период {period_num}' for period_num in frame.columns]
+            frame.insert(0, 'Размер когорты', cohort_sizes[valid].astype(int))
+            frame.insert(0, 'Когорта', frame.index.strftime('%Y-%m-%d'))
+            return frame.reset_index(drop=True)
+        
+        retention_rates = active.div(cohort_sizes, axis=0) * 100
+        retention_df = cohort_frame(retention_rates.map(lambda value: f"{value:.1f}%"))
+        revenue_df = cohort_frame(revenue)
+        orders_df = cohort_frame(orders.astype(int))
         
         # Формируем имя файла
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'когортный_анализ_клиентов_{period_label}_{timestamp}.xlsx'
         
-        # Определяем путь к файлу
-        export_dir = os.path.join(settings.MEDIA_ROOT, 'exports', 'analytics')
-        os.makedirs(export_dir, exist_ok=True)
-        file_path = os.path.join(export_dir, filename)
-        
         # Сохраняем Excel файл с несколькими листами
-        with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-            # Лист с Retention Rate
-            retention_df.to_excel(writer, sheet_name='Retention Rate (%)', index=False)
-            
-            # Лист с Revenue Retention
-            revenue_df.to_excel(writer, sheet_name='Выручка по когортам (₽)', index=False)
-            
-            # Лист с количеством заказов
-            orders_df.to_excel(writer, sheet_name='Количество заказов', index=False)
-            
-            # Лист с параметрами отчета
-            params_data = {
-                'Параметр': [
-                    'Дата создания',
-                    'Период с',
-                    'Период по',
-                    'Тип периодизации',
-                    'Количество когорт',
-                    'Максимальный период анализа'
-                ],
-                'Значение': [
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    date_from or 'Не указано',
-                    date_to or 'Не указано',
-                    period_label,
-                    len(retention_data),
-                    max_periods
-                ]
-            }
-            params_df = pd.DataFrame(params_data)
-            params_df.to_excel(writer, sheet_name='Параметры отчета', index=False)
-            
-            # Добавляем лист с пояснениями
-            explanation_data = {
-                'Метрика': [
-                    'Когорта',
-                    'Размер когорты',
-                    'Retention Rate',
-                    'Период 0',
-                    'Период N',
-                    'Выручка по когортам',
-                    'Количество заказов'
-                ],
-                'Описание': [
-                    'Месяц или неделя первой покупки клиентов',
-                    'Количество уникальных клиентов в когорте',
-                    'Процент клиентов из когорты, совершивших покупку в данном периоде',
-                    'Период первой покупки (базовый период когорты)',
-                    'N-й период после первой покупки',
-                    'Сумма выручки от клиентов когорты в каждом периоде',
-                    'Количество заказов от клиентов когорты в каждом периоде'
-                ]
-            }
-            explanation_df = pd.DataFrame(explanation_data)
-            explanation_df.to_excel(writer, sheet_name='Пояснения', index=False)
+        with ExportArtifactWriter('customer_cohort_analysis', filename, created_by_id=user_id) as output:
+            with ReportWorkbook(output.file) as workbook:
+                # Лист с Retention Rate
+                workbook.add_dataframe('Retention Rate (%)', retention_df)
+            
+                # Лист с Revenue Retention
+                workbook.add_dataframe('Выручка по когортам (₽)', revenue_df)
+            
+                # Лист с количеством заказов
+                workbook.add_dataframe('Количество заказов', orders_df)
+            
+                # Лист с параметрами отчета
+                params_data = {
+                    'Параметр': [
+                        'Дата создания',
+                        'Период с',
+                        'Период по',
+                        'Тип периодизации',
+                        'Количество когорт',
+                        'Максимальный период анализа'
+                    ],
+                    'Значение': [
+                        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        date_from or 'Не указано',
+                        date_to or 'Не указано',
+                        period_label,
+                        len(retention_df),
+                        max_periods
+                    ]
+                }
+                workbook.add_columns('Параметры отчета', params_data)
+            
+                # Добавляем лист с пояснениями
+                explanation_data = {
+                    'Метрика': [
+                        'Когорта',
+                        'Размер когорты',
+                        'Retention Rate',
+                        'Период 0',
+                        'Период N',
+                        'Выручка по когортам',
+                        'Количество заказов'
+                    ],
+                    'Описание': [
+                        'Месяц или неделя первой покупки клиентов',
+                        'Количество уникальных клиентов в когорте',
+                        'Процент клиентов из когорты, совершивших покупку в данном периоде',
+                        'Период первой покупки (базовый период когорты)',
+                        'N-й период после первой покупки',
+                        'Сумма выручки от клиентов когорты в каждом периоде',
+                        'Количество заказов от клиентов когорты в каждом периоде'
+                    ]
+                }
+                workbook.add_columns('Пояснения', explanation_data)
+        file_path = artifact_local_path(output.artifact)
+        
+        run.finish()
         
         logger.info(f"Когортный анализ создан: {file_path}")
-        logger.info(f"Обработано когорт: {len(retention_data)}, максимальный период: {max_periods}")
+        logger.info(f"Обработано когорт: {len(retention_df)}, максимальный период: {max_periods}")
         
         return {
-            "success": True,
+            **artifact_result(output.artifact),
             "file_path": file_path,
-            "filename": filename,
-            "cohorts_count": len(retention_data),
+            "cohorts_count": len(retention_df),
             "max_periods": max_periods,
         }
         
+    except SoftTimeLimitExceeded:
+        # Задача перезапустится и продолжит с контрольной точки
+        raise
     except Exception as e:
         logger.error(f"Ошибка при создании когортного анализа: {e}", exc_info=True)
         return {"error": f"Ошибка создания отчета: {str(e)}"}
 
 
 @shared_task
-def generate_rfm_segmentation_report(date_from=None, date_to=None, reference_date=None):
+def generate_rfm_segmentation_report(date_from=None, date_to=None, reference_date=None, user_id=None):
     """
     Celery-задача для создания Excel отчета RFM-сегментации клиентов.
     
@@ -1427,14 +1333,13 @@ def generate_rfm_segmentation_report(date_from=None, date_to=None, reference_dat
     date_from (str): Начальная дата для анализа транзакций (YYYY-MM-DD)
     date_to (str): Конечная дата для анализа транзакций (YYYY-MM-DD)
     reference_date (str): Дата для расчета Recency (по умолчанию - сегодня)
+    user_id (int): ID пользователя, запросившего отчет
     
     Returns:
     dict: Информация о созданном файле или сообщение об ошибке
     """
     try:
-        from django.db.models import Sum, Count, Max, F as DjangoF
-        from decimal import Decimal
-        from datetime import timedelta
+        from .customer_metrics import add_rfm_scores, customer_sales_frame
         
         # Определяем референсную дату (от которой считаем давность)
         if reference_date:
@@ -1442,151 +1347,19 @@ def generate_rfm_segmentation_report(date_from=None, date_to=None, reference_dat
         else:
             ref_date = datetime.now().date()
         
-        # Получаем все продажи
-        sales_queryset = Invoice.objects.filter(
-            invoice_type=Invoice.InvoiceType.SALE
-        ).select_related('company')
-        
-        # Применяем фильтры по датам
-        if date_from:
-            sales_queryset = sales_queryset.filter(invoice_date__gte=date_from)
-        if date_to:
-            sales_queryset = sales_queryset.filter(invoice_date__lte=date_to)
+        # Давность, частота и выручка по клиентам - одним запросом
+        df = customer_sales_frame(date_from, date_to)
         
-        if not sales_queryset.exists():
+        if df.empty:
             return {"error": "Нет данных о продажах для RFM анализа"}
         
-        # Собираем данные по каждому клиенту
-        customer_data = sales_queryset.values('company_id').annotate(
-            last_purchase_date=Max('invoice_date'),
-            total_orders=Count('id'),
-        )
-        
-        # Вычисляем RFM метрики для каждого клиента
-        rfm_data = []
-        company_ids = []
-        
-        for item in customer_data:
-            company_id = item['company_id']
-            company_ids.append(company_id)
-            
-            # R - Recency (дни с последней покупки)
-            days_since_purchase = (ref_date - item['last_purchase_date']).days
-            
-            # F - Frequency (количество заказов)
-            frequency = item['total_orders']
-            
-            # M - Monetary (общая выручка)
-            # Вычисляем выручку через строки счетов
-            company_invoices = sales_queryset.filter(company_id=company_id)
-            invoice_ids = list(company_invoices.values_list('id', flat=True))
-            
-            monetary = Decimal('0')
-            if invoice_ids:
-                lines = InvoiceLine.objects.filter(invoice_id__in=invoice_ids)
-                for line in lines:
-                    monetary += line.quantity * line.price
-            
-            rfm_data.append({
-                'company_id': company_id,
-                'recency': days_since_purchase,
-                'frequency': frequency,
-                'monetary': float(monetary),
-                'last_purchase_date': item['last_purchase_date']
-            })
-        
-        if not rfm_data:
-            return {"error": "Недостаточно данных для RFM анализа"}
-        
-        # Создаем DataFrame для удобства расчетов
-        df = pd.DataFrame(rfm_data)
-        
-        # Вычисляем квантили для каждой метрики (разбиваем на 5 сегментов)
-        # Для Recency: меньше дней = лучше (поэтому используем ascending=False при присвоении баллов)
-        # Для Frequency и Monetary: больше = лучше
-        
-        # Функция для безопасного квантиля с обработкой дубликатов
-        def safe_qcut(series, name, reverse=False):
-            try:
-                # Пробуем разбить на 5 квантилей
-                result = pd.qcut(series, q=5, labels=False, duplicates='drop')
-            except ValueError:
-                # Если не получается на 5, пробуем на 3
-                try:
-                    result = pd.qcut(series, q=3, labels=False, duplicates='drop')
-                except ValueError:
-                    # Если и на 3 не получается, используем ранги
-                    result = series.rank(method='dense') - 1
-            
-            # Нормализуем к диапазону 1-5
-            if result.max() > 0:
-                result = ((result - result.min()) / (result.max() - result.min()) * 4 + 1).round()
-            else:
-                result = pd.Series([3] * len(result), index=result.index)
-            
-            # Для Recency инвертируем (меньше дней = выше балл)
-            if reverse:
-                result = 6 - result
-            
-            return result.astype(int)
-        
-        # R: чем меньше дней, тем выше балл (инверсия)
-        df['R_score'] = safe_qcut(df['recency'], 'recency', reverse=True)
-        
-        # F: чем больше заказов, тем выше балл
-        df['F_score'] = safe_qcut(df['frequency'], 'frequency', reverse=False)
-        
-        # M: чем больше выручка, тем выше балл
-        df['M_score'] = safe_qcut(df['monetary'], 'monetary', reverse=False)
-        
-        # Вычисляем общий RFM балл
-        df['RFM_Score'] = df['R_score'].astype(str) + df['F_score'].astype(str) + df['M_score'].astype(str)
-        
-        # Функция для определения сегмента клиента
-        def get_segment(row):
-            r, f, m = row['R_score'], row['F_score'], row['M_score']
-            
-            # Champions - лучшие клиенты
-            if r >= 4 and f >= 4 and m >= 4:
-                return 'Champions'
-            # Loyal Customers - лояльные клиенты
-            elif r >= 3 and f >= 4 and m >= 3:
-                return 'Loyal Customers'
-            # Potential Loyalists - потенциально лояльные
-            elif r >= 4 and f >= 2 and m >= 2:
-                return 'Potential Loyalists'
-            # New Customers - новые клиенты
-            elif r >= 4 and f <= 2 and m <= 2:
-                return 'New Customers'
-            # Promising - перспективные
-            elif r >= 3 and f <= 2 and m <= 2:
-                return 'Promising'
-            # Need Attention - требуют внимания
-            elif r == 3 and f == 3 and m == 3:
-                return 'Need Attention'
-            # About to Sleep - засыпающие
-            elif r <= 3 and f <= 3 and m >= 2:
-                return 'About to Sleep'
-            # At Risk - в зоне риска
-            elif r <= 2 and f >= 2 and m >= 2:
-                return 'At Risk'
-            # Cannot Lose Them - нельзя терять
-            elif r <= 2 and f >= 4 and m >= 4:
-                return 'Cannot Lose Them'
-            # Hibernating - спящие
-            elif r <= 2 and f <= 2 and m <= 2:
-                return 'Hibernating'
-            # Lost - потерянные
-            elif r <= 2 and f >= 2 and m <= 2:
-                return 'Lost'
-            else:
-                return 'Other'
-        
-        df['Segment'] = df.apply(get_segment, axis=1)
+        # Баллы 1-5 по квантилям и сегменты (векторно)
+        add_rfm_scores(df, ref_date)
         
         # Получаем названия компаний
-        companies = Company.objects.filter(id__in=company_ids)
-        company_names = {c.id: c.name for c in companies}
+        company_names = dict(
+            Company.objects.filter(id__in=df['company_id'].tolist()).values_list('id', 'name')
+        )
         df['company_name'] = df['company_id'].map(company_names)
         
         # Подготавливаем финальный DataFrame
@@ -1630,81 +1403,75 @@ def generate_rfm_segmentation_report(date_from=None, date_to=None, reference_dat
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'rfm_сегментация_клиентов_{timestamp}.xlsx'
         
-        # Определяем путь к файлу
-        export_dir = os.path.join(settings.MEDIA_ROOT, 'exports', 'analytics')
-        os.makedirs(export_dir, exist_ok=True)
-        file_path = os.path.join(export_dir, filename)
-        
         # Сохраняем Excel файл с несколькими листами
-        with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-            # Основной лист с RFM данными
-            result_df.to_excel(writer, sheet_name='RFM Анализ', index=False)
-            
-            # Лист с сводкой по сегментам
-            segment_summary.to_excel(writer, sheet_name='Сводка по сегментам', index=False)
-            
-            # Лист с распределением по RFM баллам
-            rfm_distribution.to_excel(writer, sheet_name='Распределение RFM', index=False)
-            
-            # Лист с параметрами отчета
-            params_data = {
-                'Параметр': [
-                    'Дата создания',
-                    'Референсная дата',
-                    'Период с',
-                    'Период по',
-                    'Всего клиентов',
-                    'Всего сегментов'
-                ],
-                'Значение': [
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    ref_date.strftime('%Y-%m-%d'),
-                    date_from or 'Не указано',
-                    date_to or 'Не указано',
-                    len(result_df),
-                    df['Segment'].nunique()
-                ]
-            }
-            params_df = pd.DataFrame(params_data)
-            params_df.to_excel(writer, sheet_name='Параметры отчета', index=False)
-            
-            # Добавляем лист с пояснениями
-            explanation_data = {
-                'Метрика': [
-                    'R (Recency)',
-                    'F (Frequency)',
-                    'M (Monetary)',
-                    'RFM балл',
-                    'Сегмент Champions',
-                    'Сегмент Loyal Customers',
-                    'Сегмент At Risk',
-                    'Сегмент Cannot Lose Them',
-                    'Сегмент Hibernating',
-                    'Шкала оценки'
-                ],
-                'Описание': [
-                    'Давность последней покупки в днях. Чем меньше дней - тем выше балл',
-                    'Количество заказов клиента. Чем больше заказов - тем выше балл',
-                    'Общая выручка от клиента. Чем больше выручка - тем выше балл',
-                    'Комбинация R, F, M баллов (например, 555 - лучший клиент)',
-                    'Лучшие клиенты. Покупают часто, недавно и много',
-                    'Лояльные клиенты. Регулярно совершают покупки',
-                    'Клиенты в зоне риска. Давно не покупали, но раньше были активны',
-                    'Ценные клиенты, которых нельзя терять. Были очень активны',
-                    'Спящие клиенты. Давно не покупали и покупали мало',
-                    'Каждая метрика оценивается от 1 (худший) до 5 (лучший)'
-                ]
-            }
-            explanation_df = pd.DataFrame(explanation_data)
-            explanation_df.to_excel(writer, sheet_name='Пояснения', index=False)
+        with ExportArtifactWriter('rfm_segmentation', filename, created_by_id=user_id) as output:
+            with ReportWorkbook(output.file) as workbook:
+                # Основной лист с RFM данными
+                workbook.add_dataframe('RFM Анализ', result_df)
+            
+                # Лист с сводкой по сегментам
+                workbook.add_dataframe('Сводка по сегментам', segment_summary)
+            
+                # Лист с распределением по RFM баллам
+                workbook.add_dataframe('Распределение RFM', rfm_distribution)
+            
+                # Лист с параметрами отчета
+                params_data = {
+                    'Параметр': [
+                        'Дата создания',
+                        'Референсная дата',
+                        'Период с',
+                        'Период по',
+                        'Всего клиентов',
+                        'Всего сегментов'
+                    ],
+                    'Значение': [
+                        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        ref_date.strftime('%Y-%m-%d'),
+                        date_from or 'Не указано',
+                        date_to or 'Не указано',
+                        len(result_df),
+                        df['Segment'].nunique()
+                    ]
+                }
+                workbook.add_columns('Параметры отчета', params_data)
+            
+                # Добавляем лист с пояснениями
+                explanation_data = {
+                    'Метрика': [
+                        'R (Recency)',
+                        'F (Frequency)',
+                        'M (Monetary)',
+                        'RFM балл',
+                        'Сегмент Champions',
+                        'Сегмент Loyal Customers',
+                        'Сегмент At Risk',
+                        'Сегмент Cannot Lose Them',
+                        'Сегмент Hibernating',
+                        'Шкала оценки'
+                    ],
+                    'Описание': [
+                        'Давность последней покупки в днях. Чем меньше дней - тем выше балл',
+                        'Количество заказов клиента. Чем больше заказов - тем выше балл',
+                        'Общая выручка от клиента. Чем больше выручка - тем выше балл',
+                        'Комбинация R, F, M баллов (например, 555 - лучший клиент)',
+                        'Лучшие клиенты. Покупают часто, недавно и много',
+                        'Лояльные клиенты. Регулярно совершают покупки',
+                        'Клиенты в зоне риска. Давно не покупали, но раньше были активны',
+                        'Ценные клиенты, которых нельзя терять. Были очень активны',
+                        'Спящие клиенты. Давно не покупали и покупали мало',
+                        'Каждая метрика оценивается от 1 (худший) до 5 (лучший)'
+                    ]
+                }
+                workbook.add_columns('Пояснения', explanation_data)
+        file_path = artifact_local_path(output.artifact)
         
         logger.info(f"RFM сегментация создана: {file_path}")
         logger.info(f"Обработано клиентов: {len(result_df)}, сегментов: {df['Segment'].nunique()}")
         
         return {
-            "success": True,
+            **artifact_result(output.artifact),
             "file_path": file_path,
-            "filename": filename,
             "customers_count": len(result_df),
             "segments_count": int(df['Segment'].nunique()),
             "total_revenue": float(df['monetary'].sum()),
@@ -1716,7 +1483,7 @@ def generate_rfm_segmentation_report(date_from=None, date_to=None, reference_dat
 
 
 @shared_task
-def generate_ltv_analysis_report(date_from=None, date_to=None):
+def generate_ltv_analysis_report(date_from=None, date_to=None, user_id=None):
     """
     Celery-задача для создания Excel отчета по LTV (Customer Lifetime Value) клиентов.
     
@@ -1730,146 +1497,39 @@ def generate_ltv_analysis_report(date_from=None, date_to=None):
     Parameters:
     date_from (str): Начальная дата для анализа (YYYY-MM-DD)
     date_to (str): Конечная дата для анализа (YYYY-MM-DD)
+    user_id (int): ID пользователя, запросившего отчет
     
     Returns:
     dict: Информация о созданном файле или сообщение об ошибке
     """
     try:
-        from django.db.models import Sum, Count, Max, Min, Avg, F as DjangoF
-        from decimal import Decimal
-        from datetime import timedelta
+        from .customer_metrics import add_ltv_metrics, customer_sales_frame
         
-        # Получаем все продажи
-        sales_queryset = Invoice.objects.filter(
-            invoice_type=Invoice.InvoiceType.SALE
-        ).select_related('company')
-        
-        # Применяем фильтры по датам
-        if date_from:
-            sales_queryset = sales_queryset.filter(invoice_date__gte=date_from)
-        if date_to:
-            sales_queryset = sales_queryset.filter(invoice_date__lte=date_to)
+        # Первая/последняя покупка, заказы и выручка по клиентам - одним запросом
+        df = customer_sales_frame(date_from, date_to)
         
-        if not sales_queryset.exists():
+        if df.empty:
             return {"error": "Нет данных о продажах для LTV анализа"}
         
-        # Собираем данные по каждому клиенту
-        customer_data = sales_queryset.values('company_id').annotate(
-            first_purchase_date=Min('invoice_date'),
-            last_purchase_date=Max('invoice_date'),
-            total_orders=Count('id'),
-        )
-        
-        # Вычисляем LTV метрики для каждого клиента
-        ltv_data = []
-        company_ids = []
-        
-        for item in customer_data:
-            company_id = item['company_id']
-            company_ids.append(company_id)
-            
-            # Базовые данные
-            first_purchase = item['first_purchase_date']
-            last_purchase = item['last_purchase_date']
-            total_orders = item['total_orders']
-            
-            # Вычисляем Historical LTV (общая выручка)
-            company_invoices = sales_queryset.filter(company_id=company_id)
-            invoice_ids = list(company_invoices.values_list('id', flat=True))
-            
-            historical_ltv = Decimal('0')
-            if invoice_ids:
-                lines = InvoiceLine.objects.filter(invoice_id__in=invoice_ids)
-                for line in lines:
-                    historical_ltv += line.quantity * line.price
-            
-            # Customer Lifespan (в днях)
-            lifespan_days = (last_purchase - first_purchase).days
-            if lifespan_days == 0:
-                lifespan_days = 1  # Минимум 1 день для новых клиентов
-            
-            # Average Order Value (средний чек)
-            aov = float(historical_ltv) / total_orders if total_orders > 0 else 0
-            
-            # Purchase Frequency (покупок в месяц)
-            purchase_frequency_monthly = (total_orders / (lifespan_days / 30.0)) if lifespan_days > 0 else total_orders
-            
-            # Customer Value (выручка в месяц)
-            customer_value_monthly = aov * purchase_frequency_monthly
-            
-            # Predicted LTV (прогноз на 12 месяцев)
-            # Простая модель: текущая месячная выручка * 12 месяцев
-            predicted_ltv_12m = customer_value_monthly * 12
-            
-            # Predicted LTV (прогноз на 24 месяца)
-            predicted_ltv_24m = customer_value_monthly * 24
-            
-            # Количество дней с последней покупки
-            if date_to:
-                ref_date = datetime.strptime(date_to, '%Y-%m-%d').date()
-            else:
-                ref_date = datetime.now().date()
-            days_since_last_purchase = (ref_date - last_purchase).days
-            
-            ltv_data.append({
-                'company_id': company_id,
-                'first_purchase_date': first_purchase,
-                'last_purchase_date': last_purchase,
-                'total_orders': total_orders,
-                'historical_ltv': float(historical_ltv),
-                'lifespan_days': lifespan_days,
-                'aov': aov,
-                'purchase_frequency_monthly': purchase_frequency_monthly,
-                'customer_value_monthly': customer_value_monthly,
-                'predicted_ltv_12m': predicted_ltv_12m,
-                'predicted_ltv_24m': predicted_ltv_24m,
-                'days_since_last_purchase': days_since_last_purchase
-            })
-        
-        if not ltv_data:
-            return {"error": "Недостаточно данных для LTV анализа"}
+        # Давность последней покупки считаем от конца периода
+        if date_to:
+            ref_date = datetime.strptime(date_to, '%Y-%m-%d').date()
+        else:
+            ref_date = datetime.now().date()
         
-        # Создаем DataFrame
-        df = pd.DataFrame(ltv_data)
+        # LTV, сегменты LTV и статусы активности (векторно)
+        add_ltv_metrics(df, ref_date)
         
         # Получаем названия компаний
-        companies = Company.objects.filter(id__in=company_ids)
-        company_names = {c.id: c.name for c in companies}
-        company_types = {c.id: c.company_type for c in companies}
+        companies = Company.objects.filter(id__in=df['company_id'].tolist()).values_list('id', 'name', 'company_type')
+        company_names = {}
+        company_types = {}
+        for company_id, name, company_type in companies:
+            company_names[company_id] = name
+            company_types[company_id] = company_type
         df['company_name'] = df['company_id'].map(company_names)
         df['company_type'] = df['company_id'].map(company_types)
         
-        # Классификация клиентов по LTV
-        def classify_ltv(row):
-            ltv = row['historical_ltv']
-            percentile_75 = df['historical_ltv'].quantile(0.75)
-            percentile_50 = df['historical_ltv'].quantile(0.50)
-            percentile_25 = df['historical_ltv'].quantile(0.25)
-            
-            if ltv >= percentile_75:
-                return 'High Value'
-            elif ltv >= percentile_50:
-                return 'Medium-High Value'
-            elif ltv >= percentile_25:
-                return 'Medium Value'
-            else:
-                return 'Low Value'
-        
-        df['ltv_segment'] = df.apply(classify_ltv, axis=1)
-        
-        # Классификация по статусу активности
-        def classify_activity(days_since):
-            if days_since <= 30:
-                return 'Active'
-            elif days_since <= 90:
-                return 'At Risk'
-            elif days_since <= 180:
-                return 'Inactive'
-            else:
-                return 'Churned'
-        
-        df['activity_status'] = df['days_since_last_purchase'].apply(classify_activity)
-        
         # Подготавливаем финальный DataFrame
         result_df = df[[
             'company_id', 'company_name', 'company_type',
@@ -1962,88 +1622,82 @@ def generate_ltv_analysis_report(date_from=None, date_to=None):
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'ltv_анализ_клиентов_{timestamp}.xlsx'
         
-        # Определяем путь к файлу
-        export_dir = os.path.join(settings.MEDIA_ROOT, 'exports', 'analytics')
-        os.makedirs(export_dir, exist_ok=True)
-        file_path = os.path.join(export_dir, filename)
-        
         # Сохраняем Excel файл с несколькими листами
-        with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-            # Основной лист с LTV данными
-            result_df.to_excel(writer, sheet_name='LTV Анализ', index=False)
-            
-            # Лист с общей статистикой
-            stats_df.to_excel(writer, sheet_name='Общая статистика', index=False)
-            
-            # Лист с сегментами LTV
-            ltv_segment_summary.to_excel(writer, sheet_name='Сегменты LTV', index=False)
-            
-            # Лист со статусами активности
-            activity_summary.to_excel(writer, sheet_name='Статусы активности', index=False)
-            
-            # Лист с параметрами отчета
-            params_data = {
-                'Параметр': [
-                    'Дата создания',
-                    'Период с',
-                    'Период по',
-                    'Всего клиентов',
-                    'Общая историческая LTV',
-                    'Средняя LTV'
-                ],
-                'Значение': [
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    date_from or 'Не указано',
-                    date_to or 'Не указано',
-                    len(result_df),
-                    f"{df['historical_ltv'].sum():,.2f} ₽",
-                    f"{df['historical_ltv'].mean():,.2f} ₽"
-                ]
-            }
-            params_df = pd.DataFrame(params_data)
-            params_df.to_excel(writer, sheet_name='Параметры отчета', index=False)
-            
-            # Лист с пояснениями
-            explanation_data = {
-                'Метрика': [
-                    'Historical LTV',
-                    'Average Order Value (AOV)',
-                    'Purchase Frequency',
-                    'Customer Lifespan',
-                    'Customer Value Monthly',
-                    'Predicted LTV 12m',
-                    'Predicted LTV 24m',
-                    'Сегмент High Value',
-                    'Сегмент Low Value',
-                    'Статус Active',
-                    'Статус At Risk',
-                    'Статус Churned'
-                ],
-                'Описание': [
-                    'Реальная выручка от клиента за весь период взаимодействия',
-                    'Средний чек клиента (общая выручка / количество заказов)',
-                    'Частота покупок клиента в месяц',
-                    'Продолжительность жизни клиента в днях (от первой до последней покупки)',
-                    'Выручка от клиента в месяц (AOV × частота покупок)',
-                    'Прогнозная выручка от клиента на 12 месяцев вперед',
-                    'Прогнозная выручка от клиента на 24 месяца вперед',
-                    'Клиенты в верхнем квартиле по выручке (топ 25%)',
-                    'Клиенты в нижнем квартиле по выручке',
-                    'Клиенты с покупкой за последние 30 дней',
-                    'Клиенты с покупкой 31-90 дней назад',
-                    'Клиенты без покупок более 180 дней'
-                ]
-            }
-            explanation_df = pd.DataFrame(explanation_data)
-            explanation_df.to_excel(writer, sheet_name='Пояснения', index=False)
+        with ExportArtifactWriter('ltv_analysis', filename, created_by_id=user_id) as output:
+            with ReportWorkbook(output.file) as workbook:
+                # Основной лист с LTV данными
+                workbook.add_dataframe('LTV Анализ', result_df)
+            
+                # Лист с общей статистикой
+                workbook.add_dataframe('Общая статистика', stats_df)
+            
+                # Лист с сегментами LTV
+                workbook.add_dataframe('Сегменты LTV', ltv_segment_summary)
+            
+                # Лист со статусами активности
+                workbook.add_dataframe('Статусы активности', activity_summary)
+            
+                # Лист с параметрами отчета
+                params_data = {
+                    'Параметр': [
+                        'Дата создания',
+                        'Период с',
+                        'Период по',
+                        'Всего клиентов',
+                        'Общая историческая LTV',
+                        'Средняя LTV'
+                    ],
+                    'Значение': [
+                        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        date_from or 'Не указано',
+                        date_to or 'Не указано',
+                        len(result_df),
+                        f"{df['historical_ltv'].sum():,.2f} ₽",
+                        f"{df['historical_ltv'].mean():,.2f} ₽"
+                    ]
+                }
+                workbook.add_columns('Параметры отчета', params_data)
+            
+                # Лист с пояснениями
+                explanation_data = {
+                    'Метрика': [
+                        'Historical LTV',
+                        'Average Order Value (AOV)',
+                        'Purchase Frequency',
+                        'Customer Lifespan',
+                        'Customer Value Monthly',
+                        'Predicted LTV 12m',
+                        'Predicted LTV 24m',
+                        'Сегмент High Value',
+                        'Сегмент Low Value',
+                        'Статус Active',
+                        'Статус At Risk',
+                        'Статус Churned'
+                    ],
+                    'Описание': [
+                        'Реальная выручка от клиента за весь период взаимодействия',
+                        'Средний чек клиента (общая выручка / количество заказов)',
+                        'Частота покупок клиента в месяц',
+                        'Продолжительность жизни клиента в днях (от первой до последней покупки)',
+                        'Выручка от клиента в месяц (AOV × частота покупок)',
+                        'Прогнозная выручка от клиента на 12 месяцев вперед',
+                        'Прогнозная выручка от клиента на 24 месяца вперед',
+                        'Клиенты в верхнем квартиле по выручке (топ 25%)',
+                        'Клиенты в нижнем квартиле по выручке',
+                        'Клиенты с покупкой за последние 30 дней',
+                        'Клиенты с покупкой 31-90 дней назад',
+                        'Клиенты без покупок более 180 дней'
+                    ]
+                }
+                workbook.add_columns('Пояснения', explanation_data)
+        file_path = artifact_local_path(output.artifact)
         
         logger.info(f"LTV анализ создан: {file_path}")
         logger.info(f"Обработано клиентов: {len(result_df)}, общая LTV: {df['historical_ltv'].sum():.2f}")
         
         return {
-            "success": True,
+            **artifact_result(output.artifact),
             "file_path": file_path,
-            "filename": filename,
             "customers_count": len(result_df),
             "total_ltv": float(df['historical_ltv'].sum()),
             "average_ltv": float(df['historical_ltv'].mean()),
@@ -2055,240 +1709,283 @@ def generate_ltv_analysis_report(date_from=None, date_to=None):
 
 
 @shared_task
-def generate_market_basket_analysis_report(date_from=None, date_to=None, min_support=0.005, min_confidence=0.1, min_lift=1.0):
+def refresh_sales_facts_task(full=False):
+    """
+    Celery-задача обновления витрины фактов продаж.
+
+    Ежедневно подтягивает изменения измерений товаров (бренд, подгруппа, менеджер)
+    после импорта товаров; full=True перестраивает витрину целиком.
+    """
+    try:
+        return {'success': True, **refresh_sales_facts(full=full)}
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении витрины фактов продаж: {e}", exc_info=True)
+        return {'success': False, 'error': str(e)}
+
+
+@shared_task
+def repair_sales_rollups_task():
+    """
+    Celery-задача сверки дневных сверток продаж с витриной фактов.
+
+    Дни, где число строк или контрольная сумма line_id_sum разошлись
+    с витриной, пересобираются.
+    """
+    try:
+        return {'success': True, 'repaired_days': repair_sales_rollups()}
+    except Exception as e:
+        logger.error(f"Ошибка при сверке сверток продаж: {e}", exc_info=True)
+        return {'success': False, 'error': str(e)}
+
+
+@shared_task
+def import_exchange_rates_from_file(file_path):
+    """
+    Celery-задача импорта курсов валют из файла (CSV или Excel).
+
+    Файл должен содержать колонки date, currency, rate (курс к рублю).
+    После загрузки пересчитываются рублевые суммы строк затронутых счетов.
+    """
+    from .fx import read_exchange_rates_file, save_exchange_rates
+
+    try:
+        rates = read_exchange_rates_file(file_path)
+        saved = save_exchange_rates(rates)
+        logger.info(f"Импортировано курсов валют: {saved}")
+        return {'success': True, 'rates_imported': saved}
+    except Exception as e:
+        logger.error(f"Ошибка при импорте курсов валют из {file_path}: {e}", exc_info=True)
+        return {'success': False, 'error': str(e)}
+
+
+@shared_task
+def refresh_customer_metrics_snapshot_task():
+    """
+    Celery-задача: ежедневный снимок RFM/LTV-метрик клиентов (CustomerMetricsSnapshot).
+    
+    Снимок считается по всей истории продаж на текущую дату и читается
+    CRM-экранами и агентом без перезапуска отчетов.
+    """
+    from .customer_metrics import refresh_customer_metrics_snapshot
+    
+    try:
+        customers = refresh_customer_metrics_snapshot()
+        logger.info(f"Снимок RFM/LTV обновлен: клиентов {customers}")
+        return {"success": True, "customers_count": customers}
+    except Exception as e:
+        logger.error(f"Ошибка обновления снимка RFM/LTV: {e}", exc_info=True)
+        return {"success": False, "error": str(e)}
+
+
+@shared_task
+def generate_market_basket_analysis_report(date_from=None, date_to=None, min_support=0.005, min_confidence=0.1, min_lift=1.0,
+                                           level='product', max_itemset_size=2, user_id=None):
     """
     Celery-задача для создания Excel отчета по Market Basket Analysis (Анализ корзины).
     
     Анализирует, какие товары покупаются вместе:
-    - Часто встречающиеся комбинации товаров
+    - Часто встречающиеся комбинации товаров (пары и наборы из 3+ позиций)
     - Ассоциативные правила (если купил A, то купит B)
     - Метрики: Support, Confidence, Lift
     
+    Расчет выполняется движком sales.market_basket (CSR-матрица корзин, FP-growth).
+    
     Parameters:
     date_from (str): Начальная дата для анализа (YYYY-MM-DD)
     date_to (str): Конечная дата для анализа (YYYY-MM-DD)
     min_support (float): Минимальная поддержка (доля транзакций), по умолчанию 0.005 (0.5%)
     min_confidence (float): Минимальная уверенность, по умолчанию 0.1 (10%)
     min_lift (float): Минимальный lift, по умолчанию 1.0
+    level (str): Уровень корзины: product (товары), brand (бренды), subgroup (подгруппы)
+    max_itemset_size (int): Максимальный размер набора, по умолчанию 2 (пары)
+    user_id (int): ID пользователя, запросившего отчет
     
     Returns:
     dict: Информация о созданном файле или сообщение об ошибке
     """
     try:
-        from itertools import combinations
-        from collections import defaultdict, Counter
-        
-        # Получаем все продажи
-        sales_queryset = Invoice.objects.filter(
-            invoice_type=Invoice.InvoiceType.SALE
+        from django.db.models import Max, Min
+
+        from .market_basket import (
+            BasketMatrix, association_rules, frequent_itemsets, item_labels, load_basket_pairs, sale_facts,
+        )
+
+        # Прерванная по лимиту времени задача продолжит с контрольной точки:
+        # загруженных месяцев или уже найденных частых наборов
+        run = CheckpointedRun(
+            'market_basket_analysis',
+            {
+                'date_from': date_from, 'date_to': date_to, 'min_support': min_support,
+                'level': level, 'max_itemset_size': max_itemset_size,
+            },
+            version=get_data_version(SALES_DATA_NAMESPACE),
         )
         
-        # Применяем фильтры по датам
-        if date_from:
-            sales_queryset = sales_queryset.filter(invoice_date__gte=date_from)
-        if date_to:
-            sales_queryset = sales_queryset.filter(invoice_date__lte=date_to)
+        # Собираем транзакции (каждый заказ = транзакция) потоковыми запросами по месяцам;
+        # счет относится к одному дню, поэтому корзины месяцев не пересекаются
+        logger.info("Сбор транзакций для анализа корзины...")
+        facts = sale_facts(date_from, date_to)
+        bounds = facts.aggregate(first=Min('invoice_date'), last=Max('invoice_date'))
+        pair_parts = run.map(
+            'months',
+            month_partitions(bounds['first'], bounds['last']),
+            lambda month: load_basket_pairs(
+                facts.filter(invoice_date__gte=month[0], invoice_date__lt=month[1]), level
+            ),
+        )
+        matrix = BasketMatrix.from_array(
+            np.concatenate(pair_parts) if pair_parts else np.zeros((0, 2), dtype=np.int64)
+        )
         
-        if not sales_queryset.exists():
+        if not matrix.n_baskets:
             return {"error": "Нет данных о продажах для анализа корзины"}
         
-        # Собираем транзакции (каждый заказ = транзакция)
-        logger.info("Сбор транзакций для анализа корзины...")
-        transactions = []
-        transaction_details = []
+        all_baskets_count = matrix.n_baskets
+        # Только заказы с 2+ уникальными позициями
+        matrix = matrix.select_baskets(matrix.basket_sizes >= 2)
         
-        for invoice in sales_queryset.select_related('company'):
-            lines = InvoiceLine.objects.filter(invoice=invoice).select_related('product')
-            
-            if lines.count() < 2:  # Пропускаем заказы с одним товаром
-                continue
-            
-            products = set()
-            for line in lines:
-                if line.product:
-                    products.add(line.product.id)
-            
-            if len(products) >= 2:  # Только заказы с 2+ уникальными товарами
-                transactions.append(products)
-                transaction_details.append({
-                    'invoice_id': invoice.id,
-                    'invoice_date': invoice.invoice_date,
-                    'company_name': invoice.company.name if invoice.company else 'Неизвестно',
-                    'products': products,
-                    'products_count': len(products)
-                })
-        
-        if len(transactions) < 10:
+        if matrix.n_baskets < 10:
             return {"error": "Недостаточно транзакций для анализа корзины (нужно минимум 10 заказов с 2+ товарами)"}
         
-        total_transactions = len(transactions)
+        total_transactions = matrix.n_baskets
+        basket_sizes = matrix.basket_sizes
+        item_counts = matrix.item_counts()
         logger.info(f"Найдено транзакций: {total_transactions}")
         
-        # Получаем названия товаров
-        all_product_ids = set()
-        for trans in transactions:
-            all_product_ids.update(trans)
-        
-        products = Product.objects.filter(id__in=all_product_ids).select_related('brand')
-        product_part_numbers = {p.id: p.name for p in products}
-        product_brands = {p.id: p.brand.name if p.brand else 'Без бренда' for p in products}
-        
-        # 1. Вычисляем поддержку для отдельных товаров (1-itemsets)
-        logger.info("Вычисление поддержки товаров...")
-        item_counts = Counter()
-        for trans in transactions:
-            for item in trans:
-                item_counts[item] += 1
-        
-        item_support = {item: count / total_transactions for item, count in item_counts.items()}
-        
-        # Фильтруем товары с достаточной поддержкой
-        frequent_items = {item for item, support in item_support.items() if support >= min_support}
+        # 1-2. Частые позиции и наборы (пары - через XᵀX, 3+ - через FP-growth)
+        logger.info("Поиск частых наборов...")
+        itemsets = run.step('itemsets', lambda: frequent_itemsets(matrix, min_support, max_len=max_itemset_size))
+        frequent_items = [itemset for itemset in itemsets if len(itemset) == 1]
+        frequent_sets = {itemset: count for itemset, count in itemsets.items() if len(itemset) >= 2}
         
         if len(frequent_items) < 2:
             return {"error": f"Недостаточно популярных товаров с поддержкой >= {min_support*100}%"}
         
-        logger.info(f"Товаров с поддержкой >= {min_support}: {len(frequent_items)}")
-        
-        # 2. Вычисляем поддержку для пар товаров (2-itemsets)
-        logger.info("Вычисление поддержки пар товаров...")
-        pair_counts = Counter()
-        transactions_with_frequent_pairs = 0
-        
-        for trans in transactions:
-            # Только частые товары
-            frequent_in_trans = trans & frequent_items
-            if len(frequent_in_trans) >= 2:
-                transactions_with_frequent_pairs += 1
-                for pair in combinations(sorted(frequent_in_trans), 2):
-                    pair_counts[pair] += 1
+        logger.info(f"Позиций с поддержкой >= {min_support}: {len(frequent_items)}")
         
-        logger.info(f"Транзакций с 2+ частыми товарами: {transactions_with_frequent_pairs}")
-        logger.info(f"Всего уникальных пар найдено: {len(pair_counts)}")
+        if not frequent_sets:
+            return {"error": f"Не найдено частых наборов с поддержкой >= {min_support*100:.2f}%. Попробуйте уменьшить min_support."}
         
-        if len(pair_counts) == 0:
-            return {"error": f"Не найдено транзакций с 2+ частыми товарами. Попробуйте уменьшить min_support (сейчас {min_support*100}%)"}
-        
-        pair_support = {pair: count / total_transactions for pair, count in pair_counts.items()}
-        
-        # Фильтруем пары с достаточной поддержкой
-        frequent_pairs = {pair for pair, support in pair_support.items() if support >= min_support}
-        
-        if len(frequent_pairs) < 1:
-            # Найдем максимальную поддержку среди пар
-            max_pair_support = max(pair_support.values()) if pair_support else 0
-            return {"error": f"Не найдено частых пар товаров с поддержкой >= {min_support*100:.2f}%. Найдено {len(pair_counts)} уникальных пар, максимальная поддержка: {max_pair_support*100:.2f}%. Попробуйте уменьшить min_support."}
-        
-        logger.info(f"Пар товаров с поддержкой >= {min_support}: {len(frequent_pairs)}")
+        logger.info(f"Частых наборов из 2+ позиций: {len(frequent_sets)}")
         
         # 3. Генерируем ассоциативные правила A -> B
         logger.info("Генерация ассоциативных правил...")
-        rules = []
-        
-        for pair in frequent_pairs:
-            item_a, item_b = pair
-            support_ab = pair_support[pair]
-            support_a = item_support[item_a]
-            support_b = item_support[item_b]
-            
-            # Правило A -> B
-            confidence_a_to_b = support_ab / support_a if support_a > 0 else 0
-            lift_a_to_b = confidence_a_to_b / support_b if support_b > 0 else 0
-            
-            if confidence_a_to_b >= min_confidence and lift_a_to_b >= min_lift:
-                rules.append({
-                    'antecedent_id': item_a,
-                    'antecedent_part_number': product_part_numbers.get(item_a, f'ID:{item_a}'),
-                    'antecedent_brand': product_brands.get(item_a, ''),
-                    'consequent_id': item_b,
-                    'consequent_part_number': product_part_numbers.get(item_b, f'ID:{item_b}'),
-                    'consequent_brand': product_brands.get(item_b, ''),
-                    'support': support_ab,
-                    'confidence': confidence_a_to_b,
-                    'lift': lift_a_to_b,
-                    'transactions_count': pair_counts[pair]
-                })
-            
-            # Правило B -> A
-            confidence_b_to_a = support_ab / support_b if support_b > 0 else 0
-            lift_b_to_a = confidence_b_to_a / support_a if support_a > 0 else 0
-            
-            if confidence_b_to_a >= min_confidence and lift_b_to_a >= min_lift:
-                rules.append({
-                    'antecedent_id': item_b,
-                    'antecedent_part_number': product_part_numbers.get(item_b, f'ID:{item_b}'),
-                    'antecedent_brand': product_brands.get(item_b, ''),
-                    'consequent_id': item_a,
-                    'consequent_part_number': product_part_numbers.get(item_a, f'ID:{item_a}'),
-                    'consequent_brand': product_brands.get(item_a, ''),
-                    'support': support_ab,
-                    'confidence': confidence_b_to_a,
-                    'lift': lift_b_to_a,
-                    'transactions_count': pair_counts[pair]
-                })
+        rules = association_rules(itemsets, total_transactions, min_confidence, min_lift)
         
         if len(rules) == 0:
             return {"error": f"Не найдено правил с confidence >= {min_confidence*100}% и lift >= {min_lift}"}
         
         logger.info(f"Найдено ассоциативных правил: {len(rules)}")
         
-        # Создаем DataFrame с правилами
-        rules_df = pd.DataFrame(rules)
-        rules_df = rules_df.sort_values('lift', ascending=False)
-        
-        # Форматируем для отчета
-        rules_report = rules_df[[
-            'antecedent_part_number', 'antecedent_brand', 'consequent_part_number', 'consequent_brand',
-            'support', 'confidence', 'lift', 'transactions_count'
-        ]].copy()
-        
-        rules_report.columns = [
-            'Part Number A (Если купил)', 'Бренд A', 'Part Number B (То купит)', 'Бренд B',
-            'Support (Поддержка)', 'Confidence (Уверенность)', 'Lift (Подъем)', 'Количество заказов'
-        ]
-        
-        # Форматируем проценты
-        rules_report['Support (Поддержка)'] = rules_report['Support (Поддержка)'].apply(lambda x: f"{x*100:.2f}%")
-        rules_report['Confidence (Уверенность)'] = rules_report['Confidence (Уверенность)'].apply(lambda x: f"{x*100:.2f}%")
-        rules_report['Lift (Подъем)'] = rules_report['Lift (Подъем)'].apply(lambda x: f"{x:.2f}")
-        
-        # Топ товарных пар по поддержке
-        top_pairs = []
-        for pair, support in sorted(pair_support.items(), key=lambda x: x[1], reverse=True)[:50]:
-            item_a, item_b = pair
-            top_pairs.append({
-                'Part Number A': product_part_numbers.get(item_a, f'ID:{item_a}'),
-                'Бренд A': product_brands.get(item_a, ''),
-                'Part Number B': product_part_numbers.get(item_b, f'ID:{item_b}'),
-                'Бренд B': product_brands.get(item_b, ''),
-                'Support (Поддержка)': f"{support*100:.2f}%",
-                'Количество заказов': pair_counts[pair],
-                'Доля от всех заказов': f"{support*100:.2f}%"
-            })
+        # Названия позиций
+        top_item_columns = np.argsort(-item_counts, kind='stable')[:50]
+        top_item_columns = top_item_columns[item_counts[top_item_columns] > 0]
+        label_ids = {item for itemset in itemsets for item in itemset}
+        label_ids.update(matrix.items[top_item_columns].tolist())
+        names, brands = item_labels(level, label_ids)
+        
+        item_title = {'product': 'Part Number', 'brand': 'Бренд', 'subgroup': 'Подгруппа'}[level]
+        with_brand = level == 'product'
+        
+        def label(itemset):
+            return ' + '.join(names.get(item, f'ID:{item}') for item in itemset)
+        
+        def brand_label(itemset):
+            return ' + '.join(brands.get(item, '') for item in itemset)
+        
+        def pair_columns(a, b, a_title, b_title):
+            row = {a_title: label(a)}
+            if with_brand:
+                row['Бренд A'] = brand_label(a)
+            row[b_title] = label(b)
+            if with_brand:
+                row['Бренд B'] = brand_label(b)
+            return row
+        
+        # Форматируем правила для отчета (уже отсортированы по lift)
+        rules_report = pd.DataFrame([
+            {
+                **pair_columns(rule['antecedent'], rule['consequent'], f'{item_title} A (Если купил)', f'{item_title} B (То купит)'),
+                'Support (Поддержка)': f"{rule['support']*100:.2f}%",
+                'Confidence (Уверенность)': f"{rule['confidence']*100:.2f}%",
+                'Lift (Подъем)': f"{rule['lift']:.2f}",
+                'Количество заказов': rule['transactions_count'],
+            }
+            for rule in rules
+        ])
         
-        top_pairs_df = pd.DataFrame(top_pairs)
+        # Топ правил по Lift
+        top_lift_rules = pd.DataFrame([
+            {
+                **pair_columns(rule['antecedent'], rule['consequent'], f'{item_title} A', f'{item_title} B'),
+                'Lift': f"{rule['lift']:.2f}",
+                'Confidence': f"{rule['confidence']*100:.2f}%",
+                'Support': f"{rule['support']*100:.2f}%",
+            }
+            for rule in rules[:20]
+        ])
+        
+        # Топ пар по поддержке
+        frequent_pairs = sorted(
+            ((itemset, count) for itemset, count in frequent_sets.items() if len(itemset) == 2),
+            key=lambda x: x[1],
+            reverse=True,
+        )
+        top_pairs_df = pd.DataFrame([
+            {
+                **pair_columns(itemset[:1], itemset[1:], f'{item_title} A', f'{item_title} B'),
+                'Support (Поддержка)': f"{count / total_transactions*100:.2f}%",
+                'Количество заказов': count,
+                'Доля от всех заказов': f"{count / total_transactions*100:.2f}%"
+            }
+            for itemset, count in frequent_pairs[:50]
+        ])
+        
+        # Частые наборы из 3+ позиций
+        large_sets = sorted(
+            ((itemset, count) for itemset, count in frequent_sets.items() if len(itemset) >= 3),
+            key=lambda x: (x[1], len(x[0])),
+            reverse=True,
+        )
+        large_sets_df = pd.DataFrame([
+            {
+                'Набор': label(itemset),
+                'Размер набора': len(itemset),
+                'Support (Поддержка)': f"{count / total_transactions*100:.2f}%",
+                'Количество заказов': count,
+            }
+            for itemset, count in large_sets[:100]
+        ])
         
-        # Топ отдельных товаров
+        # Топ отдельных позиций
         top_items = []
-        for item, support in sorted(item_support.items(), key=lambda x: x[1], reverse=True)[:50]:
-            top_items.append({
-                'Part Number': product_part_numbers.get(item, f'ID:{item}'),
-                'Бренд': product_brands.get(item, ''),
-                'Support (Поддержка)': f"{support*100:.2f}%",
-                'Количество заказов': item_counts[item],
-                'Доля от всех заказов': f"{support*100:.2f}%"
+        for column in top_item_columns.tolist():
+            item = int(matrix.items[column])
+            count = int(item_counts[column])
+            row = {item_title: names.get(item, f'ID:{item}')}
+            if with_brand:
+                row['Бренд'] = brands.get(item, '')
+            row.update({
+                'Support (Поддержка)': f"{count / total_transactions*100:.2f}%",
+                'Количество заказов': count,
+                'Доля от всех заказов': f"{count / total_transactions*100:.2f}%"
             })
+            top_items.append(row)
         
         top_items_df = pd.DataFrame(top_items)
         
+        level_labels = {'product': 'Товары', 'brand': 'Бренды', 'subgroup': 'Подгруппы'}
+        
         # Общая статистика
         stats_data = {
             'Метрика': [
                 'Всего транзакций (заказов)',
                 'Заказов с 2+ товарами',
-                'Уникальных товаров',
-                'Товаров с поддержкой >= min_support',
-                'Частых пар товаров',
+                'Уровень корзины',
+                'Уникальных позиций',
+                'Позиций с поддержкой >= min_support',
+                'Частых пар',
+                'Частых наборов из 3+ позиций',
                 'Ассоциативных правил',
                 'Средний размер корзины',
                 'Медианный размер корзины',
@@ -2298,15 +1995,17 @@ def generate_market_basket_analysis_report(date_from=None, date_to=None, min_sup
                 'Мин Lift'
             ],
             'Значение': [
+                all_baskets_count,
                 total_transactions,
-                len(transactions),
-                len(all_product_ids),
+                level_labels[level],
+                int((item_counts > 0).sum()),
                 len(frequent_items),
                 len(frequent_pairs),
+                len(large_sets),
                 len(rules),
-                f"{sum(len(t) for t in transactions) / len(transactions):.2f}",
-                f"{sorted([len(t) for t in transactions])[len(transactions)//2]}",
-                max(len(t) for t in transactions),
+                f"{basket_sizes.mean():.2f}",
+                f"{np.median(basket_sizes):g}",
+                int(basket_sizes.max()),
                 f"{min_support*100:.2f}%",
                 f"{min_confidence*100:.2f}%",
                 f"{min_lift:.2f}"
@@ -2314,112 +2013,113 @@ def generate_market_basket_analysis_report(date_from=None, date_to=None, min_sup
         }
         stats_df = pd.DataFrame(stats_data)
         
-        # Топ правил по Lift
-        top_lift_rules = rules_df.nlargest(20, 'lift')[[
-            'antecedent_part_number', 'antecedent_brand', 'consequent_part_number', 'consequent_brand', 'lift', 'confidence', 'support'
-        ]].copy()
-        top_lift_rules.columns = ['Part Number A', 'Бренд A', 'Part Number B', 'Бренд B', 'Lift', 'Confidence', 'Support']
-        top_lift_rules['Lift'] = top_lift_rules['Lift'].apply(lambda x: f"{x:.2f}")
-        top_lift_rules['Confidence'] = top_lift_rules['Confidence'].apply(lambda x: f"{x*100:.2f}%")
-        top_lift_rules['Support'] = top_lift_rules['Support'].apply(lambda x: f"{x*100:.2f}%")
-        
         # Формируем имя файла
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'market_basket_analysis_{timestamp}.xlsx'
         
-        # Определяем путь к файлу
-        export_dir = os.path.join(settings.MEDIA_ROOT, 'exports', 'analytics')
-        os.makedirs(export_dir, exist_ok=True)
-        file_path = os.path.join(export_dir, filename)
-        
         # Сохраняем Excel файл с несколькими листами
-        with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-            # Основной лист с ассоциативными правилами
-            rules_report.to_excel(writer, sheet_name='Ассоциативные правила', index=False)
-            
-            # Топ правил по Lift
-            top_lift_rules.to_excel(writer, sheet_name='Топ правил (Lift)', index=False)
-            
-            # Топ товарных пар
-            top_pairs_df.to_excel(writer, sheet_name='Топ товарных пар', index=False)
-            
-            # Топ отдельных товаров
-            top_items_df.to_excel(writer, sheet_name='Топ товаров', index=False)
-            
-            # Общая статистика
-            stats_df.to_excel(writer, sheet_name='Статистика', index=False)
-            
-            # Параметры отчета
-            params_data = {
-                'Параметр': [
-                    'Дата создания',
-                    'Период с',
-                    'Период по',
-                    'Всего транзакций',
-                    'Найдено правил',
-                    'Min Support',
-                    'Min Confidence',
-                    'Min Lift'
-                ],
-                'Значение': [
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    date_from or 'Не указано',
-                    date_to or 'Не указано',
-                    total_transactions,
-                    len(rules),
-                    f"{min_support*100:.2f}%",
-                    f"{min_confidence*100:.2f}%",
-                    f"{min_lift:.2f}"
-                ]
-            }
-            params_df = pd.DataFrame(params_data)
-            params_df.to_excel(writer, sheet_name='Параметры', index=False)
-            
-            # Пояснения
-            explanation_data = {
-                'Термин': [
-                    'Market Basket Analysis',
-                    'Транзакция',
-                    'Support (Поддержка)',
-                    'Confidence (Уверенность)',
-                    'Lift (Подъем)',
-                    'Правило A → B',
-                    'Интерпретация Lift > 1',
-                    'Интерпретация Lift = 1',
-                    'Интерпретация Lift < 1',
-                    'Частый товар',
-                    'Частая пара'
-                ],
-                'Описание': [
-                    'Анализ корзины покупателя - метод поиска товаров, которые покупаются вместе',
-                    'Один заказ (Invoice) с несколькими товарами',
-                    'Доля транзакций, содержащих товар или набор товаров. Support(A,B) = количество заказов с A и B / всего заказов',
-                    'Вероятность покупки товара B при условии покупки товара A. Confidence(A→B) = Support(A,B) / Support(A)',
-                    'Показывает, насколько вероятнее покупка B при покупке A по сравнению со случайной покупкой B. Lift(A→B) = Confidence(A→B) / Support(B)',
-                    'Ассоциативное правило: если клиент купил товар A, то с определенной вероятностью купит товар B',
-                    'Товары A и B покупаются вместе чаще, чем случайно. Сильная положительная связь',
-                    'Товары A и B независимы, нет связи',
-                    'Товары A и B редко покупаются вместе. Отрицательная связь (возможно, товары-заменители)',
-                    'Товар с поддержкой >= min_support (встречается достаточно часто)',
-                    'Пара товаров с поддержкой >= min_support (покупаются вместе достаточно часто)'
-                ]
-            }
-            explanation_df = pd.DataFrame(explanation_data)
-            explanation_df.to_excel(writer, sheet_name='Пояснения', index=False)
+        with ExportArtifactWriter('market_basket_analysis', filename, created_by_id=user_id) as output:
+            with ReportWorkbook(output.file) as workbook:
+                # Основной лист с ассоциативными правилами
+                workbook.add_dataframe('Ассоциативные правила', rules_report)
+            
+                # Топ правил по Lift
+                workbook.add_dataframe('Топ правил (Lift)', top_lift_rules)
+            
+                # Топ товарных пар
+                workbook.add_dataframe('Топ товарных пар', top_pairs_df)
+            
+                # Частые наборы из 3+ позиций
+                if not large_sets_df.empty:
+                    workbook.add_dataframe('Частые наборы (3+)', large_sets_df)
+            
+                # Топ отдельных товаров
+                workbook.add_dataframe('Топ товаров', top_items_df)
+            
+                # Общая статистика
+                workbook.add_dataframe('Статистика', stats_df)
+            
+                # Параметры отчета
+                params_data = {
+                    'Параметр': [
+                        'Дата создания',
+                        'Период с',
+                        'Период по',
+                        'Уровень корзины',
+                        'Макс. размер набора',
+                        'Всего транзакций',
+                        'Найдено правил',
+                        'Min Support',
+                        'Min Confidence',
+                        'Min Lift'
+                    ],
+                    'Значение': [
+                        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        date_from or 'Не указано',
+                        date_to or 'Не указано',
+                        level_labels[level],
+                        max_itemset_size,
+                        total_transactions,
+                        len(rules),
+                        f"{min_support*100:.2f}%",
+                        f"{min_confidence*100:.2f}%",
+                        f"{min_lift:.2f}"
+                    ]
+                }
+                workbook.add_columns('Параметры', params_data)
+            
+                # Пояснения
+                explanation_data = {
+                    'Термин': [
+                        'Market Basket Analysis',
+                        'Транзакция',
+                        'Support (Поддержка)',
+                        'Confidence (Уверенность)',
+                        'Lift (Подъем)',
+                        'Правило A → B',
+                        'Интерпретация Lift > 1',
+                        'Интерпретация Lift = 1',
+                        'Интерпретация Lift < 1',
+                        'Частый товар',
+                        'Частая пара',
+                        'Частый набор'
+                    ],
+                    'Описание': [
+                        'Анализ корзины покупателя - метод поиска товаров, которые покупаются вместе',
+                        'Один заказ (Invoice) с несколькими товарами',
+                        'Доля транзакций, содержащих товар или набор товаров. Support(A,B) = количество заказов с A и B / всего заказов',
+                        'Вероятность покупки товара B при условии покупки товара A. Confidence(A→B) = Support(A,B) / Support(A)',
+                        'Показывает, насколько вероятнее покупка B при покупке A по сравнению со случайной покупкой B. Lift(A→B) = Confidence(A→B) / Support(B)',
+                        'Ассоциативное правило: если клиент купил товар A, то с определенной вероятностью купит товар B',
+                        'Товары A и B покупаются вместе чаще, чем случайно. Сильная положительная связь',
+                        'Товары A и B независимы, нет связи',
+                        'Товары A и B редко покупаются вместе. Отрицательная связь (возможно, товары-заменители)',
+                        'Товар с поддержкой >= min_support (встречается достаточно часто)',
+                        'Пара товаров с поддержкой >= min_support (покупаются вместе достаточно часто)',
+                        'Набор из 3+ позиций с поддержкой >= min_support (ищется алгоритмом FP-growth)'
+                    ]
+                }
+                workbook.add_columns('Пояснения', explanation_data)
+        file_path = artifact_local_path(output.artifact)
+        
+        run.finish()
         
         logger.info(f"Market Basket Analysis создан: {file_path}")
         logger.info(f"Транзакций: {total_transactions}, Правил: {len(rules)}")
         
         return {
-            "success": True,
+            **artifact_result(output.artifact),
             "file_path": file_path,
-            "filename": filename,
             "transactions_count": total_transactions,
             "rules_count": len(rules),
             "frequent_items_count": len(frequent_items),
             "frequent_pairs_count": len(frequent_pairs),
+            "frequent_itemsets_count": len(frequent_sets),
         }
         
+    except SoftTimeLimitExceeded:
+        # Задача перезапустится и продолжит с контрольной точки
+        raise
     except Exception as e:
         logger.error(f"Ошибка при создании Market Basket Analysis: {e}", exc_info=True)
         return {"error": f"Ошибка создания отчета: {str(e)}"}
\ No newline at end of file
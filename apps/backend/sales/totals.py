@@ -0,0 +1,96 @@
+"""
+Хранимые итоги счетов: сумма (в валюте счета), количество строк и общее
+количество товара.
+
+Итоги пересчитываются одним UPDATE по затронутым счетам - при импорте
+после удаления старых строк и после каждого пакета новых, а при создании,
+изменении и удалении строки через ORM - сигналами. Сигналы копят счета
+до коммита транзакции и регистрируют один обработчик на транзакцию.
+"""
+import logging
+from threading import local
+
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.signals import on_commit_once
+
+from .models import Invoice, InvoiceLine
+
+logger = logging.getLogger(__name__)
+
+
+REFRESH_TOTALS_SQL = """
+    UPDATE {invoice} i
+    SET total_amount = t.total_amount,
+        line_count = t.line_count,
+        total_qty = t.total_qty
+    FROM (
+        SELECT inv.id AS invoice_id,
+               COALESCE(SUM(l.quantity * l.price), 0) AS total_amount,
+               COUNT(l.id) AS line_count,
+               COALESCE(SUM(l.quantity), 0) AS total_qty
+        FROM {invoice} inv
+        LEFT JOIN {line} l ON l.invoice_id = inv.id
+        WHERE {condition}
+        GROUP BY inv.id
+    ) t
+    WHERE i.id = t.invoice_id
+      AND (i.total_amount, i.line_count, i.total_qty)
+          IS DISTINCT FROM (t.total_amount, t.line_count, t.total_qty)
+"""
+
+
+def refresh_invoice_totals(invoice_ids=None) -> int:
+    """
+    Пересчитывает итоги счетов по их строкам.
+
+    Args:
+        invoice_ids: счета для пересчета; None - все счета
+
+    Returns:
+        int: количество счетов с измененными итогами
+    """
+    if invoice_ids is None:
+        condition, params = 'TRUE', {}
+    else:
+        invoice_ids = list(invoice_ids)
+        if not invoice_ids:
+            return 0
+        condition, params = 'inv.id = ANY(%(invoice_ids)s)', {'invoice_ids': invoice_ids}
+
+    sql = REFRESH_TOTALS_SQL.format(
+        invoice=Invoice._meta.db_table,
+        line=InvoiceLine._meta.db_table,
+        condition=condition,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+_pending = local()
+
+
+def _flush_pending_totals():
+    invoice_ids = _pending.__dict__.pop('invoice_ids', None)
+    if invoice_ids:
+        refresh_invoice_totals(invoice_ids)
+
+
+def _refresh_totals_on_commit(invoice_id):
+    # После отката в наборе могут остаться счета - их повторный пересчет безвреден
+    _pending.__dict__.setdefault('invoice_ids', set()).add(invoice_id)
+    on_commit_once(_flush_pending_totals)
+
+
+@receiver(post_save, sender=InvoiceLine)
+def _refresh_totals_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _refresh_totals_on_commit(instance.invoice_id)
+
+
+@receiver(post_delete, sender=InvoiceLine)
+def _refresh_totals_on_delete(sender, instance, **kwargs):
+    _refresh_totals_on_commit(instance.invoice_id)
@@ -1,14 +1,25 @@
-from django.db.models import Sum, Count, F, DecimalField
-from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear, Coalesce
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Count
+from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncQuarter, TruncYear, Coalesce
+from datetime import date
 from decimal import Decimal
+import pyarrow as pa
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.utils.http import content_disposition_header
 from rest_framework import viewsets, filters
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend, FilterSet, DateFilter, NumberFilter, CharFilter
 
-from .models import Invoice, InvoiceLine
+from core.checkpoints import PROGRESS_STATE
+from core.reports import CONTENT_TYPES, aiter_chunks, iter_rows
+from core.report_cache import cached_report_by_task, start_cached_report
+
+from .facts import SALES_DATA_NAMESPACE
+from .models import CustomerMetricsSnapshot, Invoice, InvoiceLine, SalesDailyCompany, SalesDailyProduct, SalesFact
 from .serializers import (
+    CustomerMetricsSnapshotSerializer,
     InvoiceSerializer,
     InvoiceListSerializer,
     SalesSummarySerializer,
@@ -16,6 +27,46 @@ from .serializers import (
     TopItemSerializer,
 )
 
+# Время жизни кэша "часто покупают вместе", секунд
+OFTEN_BOUGHT_TOGETHER_CACHE_TTL = 60 * 60
+
+# Строк за одно чтение серверного курсора при потоковой выгрузке
+EXPORT_CURSOR_CHUNK_SIZE = 5000
+
+# Колонки потоковой выгрузки строк счетов: (заголовок, поле строки счета)
+SALES_LINES_EXPORT_COLUMNS = [
+    ('invoice_number', 'invoice__invoice_number'),
+    ('invoice_date', 'invoice__invoice_date'),
+    ('company_id', 'invoice__company_id'),
+    ('company_name', 'invoice__company__name'),
+    ('sale_type', 'invoice__sale_type'),
+    ('currency', 'invoice__currency'),
+    ('product_id', 'product_id'),
+    ('product_name', 'product__name'),
+    ('brand_name', 'product__brand__name'),
+    ('quantity', 'quantity'),
+    ('price', 'price'),
+    ('amount', 'amount'),
+    ('amount_rub', 'amount_rub'),
+]
+
+# Типы колонок Parquet-выгрузки (порядок как в SALES_LINES_EXPORT_COLUMNS)
+SALES_LINES_PARQUET_SCHEMA = pa.schema([
+    ('invoice_number', pa.string()),
+    ('invoice_date', pa.date32()),
+    ('company_id', pa.int64()),
+    ('company_name', pa.string()),
+    ('sale_type', pa.string()),
+    ('currency', pa.string()),
+    ('product_id', pa.int64()),
+    ('product_name', pa.string()),
+    ('brand_name', pa.string()),
+    ('quantity', pa.int64()),
+    ('price', pa.decimal128(16, 2)),
+    ('amount', pa.decimal128(16, 2)),
+    ('amount_rub', pa.decimal128(16, 2)),
+])
+
 
 class InvoiceFilter(FilterSet):
     """Фильтр для счетов"""
@@ -26,34 +77,83 @@ class InvoiceFilter(FilterSet):
     invoice_type = CharFilter(field_name='invoice_type')
     sale_type = CharFilter(field_name='sale_type')
     currency = CharFilter(field_name='currency')
+    total_min = NumberFilter(field_name='total_amount', lookup_expr='gte')
+    total_max = NumberFilter(field_name='total_amount', lookup_expr='lte')
 
     class Meta:
         model = Invoice
-        fields = ['date_from', 'date_to', 'company_id', 'company_name', 'invoice_type', 'sale_type', 'currency']
+        fields = [
+            'date_from', 'date_to', 'company_id', 'company_name', 'invoice_type', 'sale_type', 'currency',
+            'total_min', 'total_max',
+        ]
 
 
 class InvoiceViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet для просмотра счетов"""
-    queryset = Invoice.objects.select_related('company').prefetch_related('lines__product').all()
+    queryset = Invoice.objects.select_related('company').all()
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_class = InvoiceFilter
     search_fields = ['invoice_number', 'company__name', 'company__short_name']
-    ordering_fields = ['id', 'invoice_date', 'invoice_number', 'created_at']
+    ordering_fields = ['id', 'invoice_date', 'invoice_number', 'total_amount', 'line_count', 'total_qty', 'created_at']
     ordering = ['-invoice_date']
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # Строки нужны только карточке счета, список берет хранимые итоги
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related('lines__product')
+        return queryset
+
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return InvoiceSerializer
         return InvoiceListSerializer
 
 
+class CustomerMetricsSnapshotFilter(FilterSet):
+    """Фильтр для снимков RFM/LTV-метрик"""
+    company_id = NumberFilter(field_name='company_id')
+    snapshot_date = DateFilter(field_name='snapshot_date')
+    rfm_segment = CharFilter(field_name='rfm_segment')
+    ltv_segment = CharFilter(field_name='ltv_segment')
+    activity_status = CharFilter(field_name='activity_status')
+
+    class Meta:
+        model = CustomerMetricsSnapshot
+        fields = ['company_id', 'snapshot_date', 'rfm_segment', 'ltv_segment', 'activity_status']
+
+
+class CustomerMetricsSnapshotViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    RFM/LTV-метрики клиентов из ежедневного снимка.
+    
+    Без параметра snapshot_date возвращается последний снимок.
+    """
+    serializer_class = CustomerMetricsSnapshotSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filterset_class = CustomerMetricsSnapshotFilter
+    search_fields = ['company__name', 'company__short_name']
+    ordering_fields = ['revenue', 'recency_days', 'orders_count', 'rfm_score', 'predicted_ltv_12m']
+    ordering = ['-revenue']
+
+    def get_queryset(self):
+        queryset = CustomerMetricsSnapshot.objects.select_related('company')
+        if self.action == 'list' and not self.request.query_params.get('snapshot_date'):
+            latest_date = queryset.order_by('-snapshot_date').values_list('snapshot_date', flat=True).first()
+            queryset = queryset.filter(snapshot_date=latest_date)
+        return queryset
+
+
 def get_period_trunc(period_type):
     """Возвращает функцию для группировки по периоду"""
     if period_type == 'day':
         return TruncDay
     elif period_type == 'week':
         return TruncWeek
+    elif period_type == 'quarter':
+        return TruncQuarter
     elif period_type == 'year':
         return TruncYear
     else:  # по умолчанию month
@@ -93,6 +193,116 @@ def parse_filters(request):
     return filters, product_id
 
 
+def filter_sales_facts(filters, product_id=None, whole_invoices=False):
+    """
+    Факты продаж с фильтрами из parse_filters.
+
+    При фильтре по товару по умолчанию остаются только его строки; с whole_invoices
+    остаются все строки счетов, в которых есть этот товар.
+    """
+    facts = SalesFact.objects.filter(**filters)
+    if product_id:
+        if whole_invoices:
+            facts = facts.filter(
+                invoice_id__in=facts.filter(product_id=product_id).values('invoice_id')
+            )
+        else:
+            facts = facts.filter(product_id=product_id)
+    return facts
+
+
+def _rollup_filters(filters):
+    """Фильтры parse_filters для дневных сверток (дата счета -> день)."""
+    return {key.replace('invoice_date', 'day'): value for key, value in filters.items()}
+
+
+def _revenue(field='amount_rub'):
+    return Coalesce(Sum(field), Decimal('0'))
+
+
+def _facts_timeseries(facts, period_trunc):
+    return facts.annotate(
+        period=period_trunc('invoice_date')
+    ).values('period').annotate(
+        revenue=_revenue(),
+        orders=Count('invoice_id', distinct=True),
+        customers=Count('company_id', distinct=True)
+    ).order_by('period')
+
+
+def _company_rollup_timeseries(filters, period_trunc):
+    # Счет относится к одному клиенту и дню - заказы суммируются без повторов
+    return SalesDailyCompany.objects.filter(**_rollup_filters(filters)).annotate(
+        period=period_trunc('day')
+    ).values('period').annotate(
+        revenue=_revenue('revenue'),
+        orders=Sum('orders'),
+        customers=Count('company_id', distinct=True)
+    ).order_by('period')
+
+
+def _product_rollup_timeseries(filters, product_id, period_trunc):
+    rows = SalesDailyProduct.objects.filter(
+        product_id=product_id, **_rollup_filters(filters)
+    ).annotate(
+        period=period_trunc('day')
+    ).values_list('period', 'revenue', 'orders', 'company_ids').order_by('period')
+
+    # Клиенты за период - объединение дневных наборов клиентов
+    periods = {}
+    for period, revenue, orders, company_ids in rows:
+        item = periods.setdefault(period, {'period': period, 'revenue': Decimal('0'), 'orders': 0, 'customers': set()})
+        item['revenue'] += revenue
+        item['orders'] += orders
+        item['customers'].update(company_ids)
+    for item in periods.values():
+        item['customers'] = len(item['customers'])
+    return list(periods.values())
+
+
+def _timeseries_results(timeseries):
+    results = []
+    for item in timeseries:
+        avg_check = Decimal('0')
+        if item['orders'] > 0:
+            avg_check = item['revenue'] / item['orders']
+
+        results.append({
+            'period': item['period'].strftime('%Y-%m-%d'),
+            'revenue': float(item['revenue']),
+            'orders': item['orders'],
+            'customers': item['customers'],
+            'average_check': float(avg_check)
+        })
+    return results
+
+
+def _parse_limit(request, default=20):
+    limit_param = request.query_params.get('limit')
+    try:
+        return max(1, int(limit_param)) if limit_param is not None else default
+    except (TypeError, ValueError):
+        return default
+
+
+def _top_results(queryset, group_fields, limit, revenue, orders):
+    """Топ групп по выручке с долей от общей выручки."""
+    total_revenue = queryset.aggregate(total_revenue=revenue)['total_revenue'] or Decimal('0')
+    top = list(
+        queryset.values(*group_fields)
+        .annotate(revenue=revenue, orders=orders)
+        .order_by('-revenue')[:limit]
+    )
+    for item in top:
+        item['revenue'] = item['revenue'] or Decimal('0')
+        item['percentage'] = float(
+            (item['revenue'] / total_revenue * Decimal('100'))
+            if total_revenue > 0
+            else Decimal('0')
+        )
+    return top
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def sales_summary(request):
@@ -101,26 +311,21 @@ def sales_summary(request):
     """
     filters, product_id = parse_filters(request)
     
-    # Базовый queryset
-    queryset = Invoice.objects.filter(invoice_type=Invoice.InvoiceType.SALE, **filters)
-    
     if product_id:
-        queryset = queryset.filter(lines__product_id=product_id).distinct()
-    
-    # Получаем все строки счетов
-    lines = InvoiceLine.objects.filter(invoice__in=queryset)
-    
-    # Агрегированная статистика
-    stats = lines.aggregate(
-        total_revenue=Coalesce(
-            Sum(F('quantity') * F('price'), output_field=DecimalField()),
-            Decimal('0')
+        # Фильтр по товару оставляет счета с этим товаром целиком - считаем по витрине
+        stats = filter_sales_facts(filters, product_id, whole_invoices=True).aggregate(
+            total_revenue=_revenue(),
+            total_orders=Count('invoice_id', distinct=True),
+            total_customers=Count('company_id', distinct=True),
+        )
+    else:
+        stats = SalesDailyCompany.objects.filter(**_rollup_filters(filters)).aggregate(
+            total_revenue=_revenue('revenue'),
+            total_orders=Coalesce(Sum('orders'), 0),
+            total_customers=Count('company_id', distinct=True),
         )
-    )
-    
-    total_orders = queryset.count()
-    total_customers = queryset.values('company').distinct().count()
     
+    total_orders = stats['total_orders']
     average_check = Decimal('0')
     if total_orders > 0:
         average_check = stats['total_revenue'] / total_orders
@@ -128,7 +333,7 @@ def sales_summary(request):
     result = {
         'total_revenue': float(stats['total_revenue']),
         'total_orders': total_orders,
-        'total_customers': total_customers,
+        'total_customers': stats['total_customers'],
         'average_check': float(average_check),
         'growth_rate': None
     }
@@ -144,49 +349,16 @@ def customer_sales_timeseries(request):
     Временной ряд продаж по клиенту или всем клиентам
     """
     filters, product_id = parse_filters(request)
-    period_type = request.query_params.get('period_type', 'month')
-    
-    # Базовый queryset
-    queryset = Invoice.objects.filter(invoice_type=Invoice.InvoiceType.SALE, **filters)
+    period_trunc = get_period_trunc(request.query_params.get('period_type', 'month'))
     
     if product_id:
-        queryset = queryset.filter(lines__product_id=product_id).distinct()
-    
-    # Группировка по периоду
-    period_trunc = get_period_trunc(period_type)
-    
-    # Получаем ID всех счетов
-    invoice_ids = list(queryset.values_list('id', flat=True))
-    
-    # Агрегируем через строки счетов
-    timeseries_data = InvoiceLine.objects.filter(
-        invoice_id__in=invoice_ids
-    ).annotate(
-        period=period_trunc('invoice__invoice_date')
-    ).values('period').annotate(
-        revenue=Coalesce(
-            Sum(F('quantity') * F('price'), output_field=DecimalField()),
-            Decimal('0')
-        ),
-        orders=Count('invoice', distinct=True),
-        customers=Count('invoice__company', distinct=True)
-    ).order_by('period')
-    
-    results = []
-    for item in timeseries_data:
-        avg_check = Decimal('0')
-        if item['orders'] > 0:
-            avg_check = item['revenue'] / item['orders']
-        
-        results.append({
-            'period': item['period'].strftime('%Y-%m-%d'),
-            'revenue': float(item['revenue']),
-            'orders': item['orders'],
-            'customers': item['customers'],
-            'average_check': float(avg_check)
-        })
+        timeseries = _facts_timeseries(
+            filter_sales_facts(filters, product_id, whole_invoices=True), period_trunc
+        )
+    else:
+        timeseries = _company_rollup_timeseries(filters, period_trunc)
     
-    serializer = TimeSeriesDataSerializer(results, many=True)
+    serializer = TimeSeriesDataSerializer(_timeseries_results(timeseries), many=True)
     return Response(serializer.data)
 
 
@@ -197,72 +369,33 @@ def customer_sales_top(request):
     Топ клиентов по объему продаж
     """
     filters, product_id = parse_filters(request)
-
-    limit_param = request.query_params.get('limit')
-    try:
-        limit = max(1, int(limit_param)) if limit_param is not None else 20
-    except (TypeError, ValueError):
-        limit = 20
-
-    invoice_queryset = Invoice.objects.filter(
-        invoice_type=Invoice.InvoiceType.SALE,
-        **filters
-    )
-
-    if product_id:
-        invoice_queryset = invoice_queryset.filter(
-            lines__product_id=product_id
-        ).distinct()
-
-    invoice_ids = list(invoice_queryset.values_list('id', flat=True))
-
-    if not invoice_ids:
-        serializer = TopItemSerializer([], many=True)
-        return Response(serializer.data)
-
-    lines_queryset = InvoiceLine.objects.filter(invoice_id__in=invoice_ids)
+    limit = _parse_limit(request)
 
     if product_id:
-        lines_queryset = lines_queryset.filter(product_id=product_id)
-
-    totals = lines_queryset.aggregate(
-        total_revenue=Coalesce(
-            Sum(F('quantity') * F('price'), output_field=DecimalField()),
-            Decimal('0')
+        top_customers = _top_results(
+            filter_sales_facts(filters, product_id),
+            ['company_id', 'company__name'],
+            limit,
+            revenue=_revenue(),
+            orders=Count('invoice_id', distinct=True),
         )
-    )
-
-    total_revenue = totals['total_revenue'] or Decimal('0')
-
-    top_customers_query = (
-        lines_queryset.values('invoice__company_id', 'invoice__company__name')
-        .annotate(
-            revenue=Coalesce(
-                Sum(F('quantity') * F('price'), output_field=DecimalField()),
-                Decimal('0')
-            ),
-            orders=Count('invoice', distinct=True)
+    else:
+        top_customers = _top_results(
+            SalesDailyCompany.objects.filter(**_rollup_filters(filters)),
+            ['company_id', 'company__name'],
+            limit,
+            revenue=_revenue('revenue'),
+            orders=Sum('orders'),
         )
-        .order_by('-revenue')
-    )
-
-    top_customers = list(top_customers_query[:limit])
 
     results = []
     for item in top_customers:
-        revenue = item['revenue'] or Decimal('0')
-        percentage = float(
-            (revenue / total_revenue * Decimal('100'))
-            if total_revenue > 0
-            else Decimal('0')
-        )
-
         results.append({
-            'id': item['invoice__company_id'],
-            'name': item['invoice__company__name'] or 'Без названия',
-            'total_revenue': float(revenue),
+            'id': item['company_id'],
+            'name': item['company__name'] or 'Без названия',
+            'total_revenue': float(item['revenue']),
             'order_count': item['orders'],
-            'percentage': percentage,
+            'percentage': item['percentage'],
         })
 
     serializer = TopItemSerializer(results, many=True)
@@ -274,66 +407,29 @@ def customer_sales_top(request):
 def product_sales_top(request):
     """Топ товаров по объему продаж"""
     filters, product_id = parse_filters(request)
-
-    limit_param = request.query_params.get('limit')
-    try:
-        limit = max(1, int(limit_param)) if limit_param is not None else 20
-    except (TypeError, ValueError):
-        limit = 20
-
-    invoice_queryset = Invoice.objects.filter(
-        invoice_type=Invoice.InvoiceType.SALE,
-        **filters
-    )
-
-    if product_id:
-        invoice_queryset = invoice_queryset.filter(
-            lines__product_id=product_id
-        ).distinct()
-
-    invoice_ids = list(invoice_queryset.values_list('id', flat=True))
-
-    if not invoice_ids:
-        serializer = TopItemSerializer([], many=True)
-        return Response(serializer.data)
-
-    lines_queryset = InvoiceLine.objects.filter(invoice_id__in=invoice_ids)
-
-    if product_id:
-        lines_queryset = lines_queryset.filter(product_id=product_id)
-
-    totals = lines_queryset.aggregate(
-        total_revenue=Coalesce(
-            Sum(F('quantity') * F('price'), output_field=DecimalField()),
-            Decimal('0')
+    limit = _parse_limit(request)
+    group_fields = ['product_id', 'product__name', 'product__complex_name']
+
+    if 'company_id' in filters:
+        # В свертке по товарам нет клиента - считаем по витрине
+        top_products = _top_results(
+            filter_sales_facts(filters, product_id),
+            group_fields,
+            limit,
+            revenue=_revenue(),
+            orders=Count('invoice_id', distinct=True),
         )
-    )
-
-    total_revenue = totals['total_revenue'] or Decimal('0')
-
-    top_products_query = (
-        lines_queryset.values('product_id', 'product__name', 'product__complex_name')
-        .annotate(
-            revenue=Coalesce(
-                Sum(F('quantity') * F('price'), output_field=DecimalField()),
-                Decimal('0')
-            ),
-            orders=Count('invoice', distinct=True)
+    else:
+        rollup = SalesDailyProduct.objects.filter(**_rollup_filters(filters))
+        if product_id:
+            rollup = rollup.filter(product_id=product_id)
+        # Заказы с товаром суммируются по дням: счет относится к одному дню
+        top_products = _top_results(
+            rollup, group_fields, limit, revenue=_revenue('revenue'), orders=Sum('orders')
         )
-        .order_by('-revenue')
-    )
-
-    top_products = list(top_products_query[:limit])
 
     results = []
     for item in top_products:
-        revenue = item['revenue'] or Decimal('0')
-        percentage = float(
-            (revenue / total_revenue * Decimal('100'))
-            if total_revenue > 0
-            else Decimal('0')
-        )
-
         name = item['product__complex_name'] or item['product__name'] or 'Без названия'
         if item['product__name'] and item['product__complex_name']:
             name = f"{item['product__name']} — {item['product__complex_name']}"
@@ -341,9 +437,9 @@ def product_sales_top(request):
         results.append({
             'id': item['product_id'],
             'name': name,
-            'total_revenue': float(revenue),
+            'total_revenue': float(item['revenue']),
             'order_count': item['orders'],
-            'percentage': percentage,
+            'percentage': item['percentage'],
         })
 
     serializer = TopItemSerializer(results, many=True)
@@ -357,50 +453,51 @@ def product_sales_timeseries(request):
     Временной ряд продаж по товару или всем товарам
     """
     filters, product_id = parse_filters(request)
-    period_type = request.query_params.get('period_type', 'month')
-    
-    # Базовый queryset счетов
-    invoice_queryset = Invoice.objects.filter(invoice_type=Invoice.InvoiceType.SALE, **filters)
-    invoice_ids = list(invoice_queryset.values_list('id', flat=True))
-    
-    # Работаем через строки счета
-    queryset = InvoiceLine.objects.filter(invoice_id__in=invoice_ids)
-    
-    if product_id:
-        queryset = queryset.filter(product_id=product_id)
+    period_trunc = get_period_trunc(request.query_params.get('period_type', 'month'))
     
-    # Группировка по периоду
-    period_trunc = get_period_trunc(period_type)
-    
-    timeseries = queryset.annotate(
-        period=period_trunc('invoice__invoice_date')
-    ).values('period').annotate(
-        revenue=Coalesce(
-            Sum(F('quantity') * F('price'), output_field=DecimalField()),
-            Decimal('0')
-        ),
-        orders=Count('invoice', distinct=True),
-        customers=Count('invoice__company', distinct=True)
-    ).order_by('period')
-    
-    results = []
-    for item in timeseries:
-        avg_check = Decimal('0')
-        if item['orders'] > 0:
-            avg_check = item['revenue'] / item['orders']
-        
-        results.append({
-            'period': item['period'].strftime('%Y-%m-%d'),
-            'revenue': float(item['revenue']),
-            'orders': item['orders'],
-            'customers': item['customers'],
-            'average_check': float(avg_check)
-        })
+    if 'company_id' in filters:
+        # Фильтр по товару оставляет только его строки
+        timeseries = _facts_timeseries(filter_sales_facts(filters, product_id), period_trunc)
+    elif product_id:
+        timeseries = _product_rollup_timeseries(filters, product_id, period_trunc)
+    else:
+        # По всем товарам - те же строки, что и по всем клиентам
+        timeseries = _company_rollup_timeseries(filters, period_trunc)
     
-    serializer = TimeSeriesDataSerializer(results, many=True)
+    serializer = TimeSeriesDataSerializer(_timeseries_results(timeseries), many=True)
     return Response(serializer.data)
 
 
+def start_sales_report(request, report_type, task, params, key_extra=None):
+    """
+    Отчет по продажам через кэш отчетов: готовый файл для тех же параметров
+    и версии данных продаж или задача построения (общая для одинаковых запросов).
+    """
+    return start_cached_report(
+        report_type, task, params, namespace=SALES_DATA_NAMESPACE, key_extra=key_extra,
+        user_id=request.user.id,
+    )
+
+
+def report_started_response(entry, cached, message, serializer_class):
+    """Ответ на запуск отчета: 200 для готового отчета из кэша, 202 для задачи."""
+    status_url = f'/api/sales/report-status/{entry.task_id}/'
+    if cached:
+        response_data = {
+            'task_id': entry.task_id,
+            'status': 'success',
+            'message': f'Отчет с такими параметрами уже построен. ID задачи: {entry.task_id}. Результат: GET {status_url}',
+        }
+        return Response(serializer_class(response_data).data, status=200)
+
+    response_data = {
+        'task_id': entry.task_id,
+        'status': 'pending',
+        'message': f'{message} ID задачи: {entry.task_id}. Используйте GET {status_url} для проверки статуса.',
+    }
+    return Response(serializer_class(response_data).data, status=202)
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def generate_customer_sales_dynamics_report_view(request):
@@ -453,23 +550,15 @@ def generate_customer_sales_dynamics_report_view(request):
     if date_to:
         date_to = date_to.strftime('%Y-%m-%d')
     
-    # Запускаем Celery задачу
-    task = generate_customer_sales_dynamics_report.delay(
-        date_from=date_from,
-        date_to=date_to,
-        company_ids=company_ids,
-        period_type=period_type
-    )
+    # Запускаем Celery задачу (или берем готовый отчет из кэша)
+    entry, cached = start_sales_report(request, 'customer_sales_dynamics', generate_customer_sales_dynamics_report, {
+        'date_from': date_from,
+        'date_to': date_to,
+        'company_ids': company_ids,
+        'period_type': period_type,
+    })
     
-    # Формируем ответ
-    response_data = {
-        'task_id': task.id,
-        'status': 'pending',
-        'message': f'Задача создания отчета по динамике продаж запущена. ID задачи: {task.id}. Используйте GET /api/sales/report-status/{task.id}/ для проверки статуса.'
-    }
-    
-    response_serializer = CustomerSalesDynamicsResponseSerializer(response_data)
-    return Response(response_serializer.data, status=202)
+    return report_started_response(entry, cached, 'Задача создания отчета по динамике продаж запущена.', CustomerSalesDynamicsResponseSerializer)
 
 
 @api_view(['GET'])
@@ -482,25 +571,38 @@ def check_report_task_status(request, task_id):
     - task_id: ID Celery задачи
     
     Возвращает:
-    - state: Статус задачи (PENDING, STARTED, SUCCESS, FAILURE, etc.)
+    - state: Статус задачи (PENDING, STARTED, PROGRESS, RETRY, SUCCESS, FAILURE, etc.)
+    - progress: Прогресс долгого отчета (current, total, percent)
     - result: Результат выполнения задачи (если завершена успешно)
     - error: Ошибка (если завершена с ошибкой)
     """
     from celery.result import AsyncResult
     
     task_result = AsyncResult(task_id)
+    state = task_result.state
+    result = task_result.result if state == 'SUCCESS' else None
+    
+    if state == 'PENDING':
+        # Результат в Celery мог истечь - готовый отчет берем из кэша отчетов
+        entry = cached_report_by_task(task_id)
+        if entry is not None:
+            state, result = 'SUCCESS', entry.result
     
     response_data = {
         'task_id': task_id,
-        'state': task_result.state,
+        'state': state,
     }
     
-    if task_result.state == 'PENDING':
+    if state == 'PENDING':
         response_data['message'] = 'Задача ожидает выполнения или еще не начата'
-    elif task_result.state == 'STARTED':
+    elif state == 'STARTED':
+        response_data['message'] = 'Задача выполняется'
+    elif state == PROGRESS_STATE:
         response_data['message'] = 'Задача выполняется'
-    elif task_result.state == 'SUCCESS':
-        result = task_result.result
+        response_data['progress'] = task_result.info
+    elif state == 'RETRY':
+        response_data['message'] = 'Задача продолжится с сохраненного шага'
+    elif state == 'SUCCESS':
         if isinstance(result, dict):
             if 'error' in result:
                 response_data['status'] = 'error'
@@ -513,12 +615,12 @@ def check_report_task_status(request, task_id):
             response_data['status'] = 'success'
             response_data['message'] = 'Задача выполнена'
             response_data['result'] = str(result)
-    elif task_result.state == 'FAILURE':
+    elif state == 'FAILURE':
         response_data['status'] = 'error'
         response_data['message'] = 'Ошибка при выполнении задачи'
         response_data['error'] = str(task_result.info)
     else:
-        response_data['message'] = f'Неизвестный статус: {task_result.state}'
+        response_data['message'] = f'Неизвестный статус: {state}'
     
     return Response(response_data)
 
@@ -576,23 +678,15 @@ def generate_product_sales_dynamics_report_view(request):
     if date_to:
         date_to = date_to.strftime('%Y-%m-%d')
     
-    # Запускаем Celery задачу
-    task = generate_product_sales_dynamics_report.delay(
-        date_from=date_from,
-        date_to=date_to,
-        product_ids=product_ids,
-        period_type=period_type
-    )
+    # Запускаем Celery задачу (или берем готовый отчет из кэша)
+    entry, cached = start_sales_report(request, 'product_sales_dynamics', generate_product_sales_dynamics_report, {
+        'date_from': date_from,
+        'date_to': date_to,
+        'product_ids': product_ids,
+        'period_type': period_type,
+    })
     
-    # Формируем ответ
-    response_data = {
-        'task_id': task.id,
-        'status': 'pending',
-        'message': f'Задача создания отчета по динамике продаж товаров запущена. ID задачи: {task.id}. Используйте GET /api/sales/report-status/{task.id}/ для проверки статуса.'
-    }
-    
-    response_serializer = ProductSalesDynamicsResponseSerializer(response_data)
-    return Response(response_serializer.data, status=202)
+    return report_started_response(entry, cached, 'Задача создания отчета по динамике продаж товаров запущена.', ProductSalesDynamicsResponseSerializer)
 
 
 @api_view(['POST'])
@@ -647,22 +741,14 @@ def generate_customer_cohort_analysis_report_view(request):
     if date_to:
         date_to = date_to.strftime('%Y-%m-%d')
     
-    # Запускаем Celery задачу
-    task = generate_customer_cohort_analysis_report.delay(
-        date_from=date_from,
-        date_to=date_to,
-        period_type=period_type
-    )
-    
-    # Формируем ответ
-    response_data = {
-        'task_id': task.id,
-        'status': 'pending',
-        'message': f'Задача создания когортного анализа клиентов запущена. ID задачи: {task.id}. Используйте GET /api/sales/report-status/{task.id}/ для проверки статуса.'
-    }
+    # Запускаем Celery задачу (или берем готовый отчет из кэша)
+    entry, cached = start_sales_report(request, 'customer_cohort_analysis', generate_customer_cohort_analysis_report, {
+        'date_from': date_from,
+        'date_to': date_to,
+        'period_type': period_type,
+    })
     
-    response_serializer = CustomerCohortAnalysisResponseSerializer(response_data)
-    return Response(response_serializer.data, status=202)
+    return report_started_response(entry, cached, 'Задача создания когортного анализа клиентов запущена.', CustomerCohortAnalysisResponseSerializer)
 
 
 @api_view(['POST'])
@@ -715,25 +801,17 @@ def generate_rfm_segmentation_report_view(request):
         date_from = date_from.strftime('%Y-%m-%d')
     if date_to:
         date_to = date_to.strftime('%Y-%m-%d')
-    if reference_date:
-        reference_date = reference_date.strftime('%Y-%m-%d')
-    
-    # Запускаем Celery задачу
-    task = generate_rfm_segmentation_report.delay(
-        date_from=date_from,
-        date_to=date_to,
-        reference_date=reference_date
-    )
+    # Без даты отсчета отчет считается на сегодня - дата входит в ключ кэша
+    reference_date = (reference_date or date.today()).strftime('%Y-%m-%d')
     
-    # Формируем ответ
-    response_data = {
-        'task_id': task.id,
-        'status': 'pending',
-        'message': f'Задача создания RFM-сегментации клиентов запущена. ID задачи: {task.id}. Используйте GET /api/sales/report-status/{task.id}/ для проверки статуса.'
-    }
+    # Запускаем Celery задачу (или берем готовый отчет из кэша)
+    entry, cached = start_sales_report(request, 'rfm_segmentation', generate_rfm_segmentation_report, {
+        'date_from': date_from,
+        'date_to': date_to,
+        'reference_date': reference_date,
+    })
     
-    response_serializer = RFMSegmentationResponseSerializer(response_data)
-    return Response(response_serializer.data, status=202)
+    return report_started_response(entry, cached, 'Задача создания RFM-сегментации клиентов запущена.', RFMSegmentationResponseSerializer)
 
 
 @api_view(['POST'])
@@ -784,21 +862,13 @@ def generate_ltv_analysis_report_view(request):
     if date_to:
         date_to = date_to.strftime('%Y-%m-%d')
     
-    # Запускаем Celery задачу
-    task = generate_ltv_analysis_report.delay(
-        date_from=date_from,
-        date_to=date_to
-    )
+    # Запускаем Celery задачу (или берем готовый отчет из кэша)
+    entry, cached = start_sales_report(request, 'ltv_analysis', generate_ltv_analysis_report, {
+        'date_from': date_from,
+        'date_to': date_to,
+    }, key_extra={'as_of': date.today().isoformat()})
     
-    # Формируем ответ
-    response_data = {
-        'task_id': task.id,
-        'status': 'pending',
-        'message': f'Задача создания LTV анализа клиентов запущена. ID задачи: {task.id}. Используйте GET /api/sales/report-status/{task.id}/ для проверки статуса.'
-    }
-    
-    response_serializer = LTVAnalysisResponseSerializer(response_data)
-    return Response(response_serializer.data, status=202)
+    return report_started_response(entry, cached, 'Задача создания LTV анализа клиентов запущена.', LTVAnalysisResponseSerializer)
 
 
 @api_view(['POST'])
@@ -819,6 +889,8 @@ def generate_market_basket_analysis_report_view(request):
     - min_support: Минимальная поддержка (0.005 = 0.5%), по умолчанию 0.005
     - min_confidence: Минимальная уверенность (0.1 = 10%), по умолчанию 0.1
     - min_lift: Минимальный lift, по умолчанию 1.0
+    - level: Уровень корзины (product, brand, subgroup), по умолчанию product
+    - max_itemset_size: Максимальный размер набора (2-5), по умолчанию 2
     
     Возвращает:
     - task_id: ID Celery задачи для отслеживания статуса
@@ -848,6 +920,8 @@ def generate_market_basket_analysis_report_view(request):
     min_support = validated_data.get('min_support', 0.005)
     min_confidence = validated_data.get('min_confidence', 0.1)
     min_lift = validated_data.get('min_lift', 1.0)
+    level = validated_data.get('level', 'product')
+    max_itemset_size = validated_data.get('max_itemset_size', 2)
     
     # Преобразуем даты в строки
     if date_from:
@@ -855,21 +929,96 @@ def generate_market_basket_analysis_report_view(request):
     if date_to:
         date_to = date_to.strftime('%Y-%m-%d')
     
-    # Запускаем Celery задачу
-    task = generate_market_basket_analysis_report.delay(
-        date_from=date_from,
-        date_to=date_to,
-        min_support=min_support,
-        min_confidence=min_confidence,
-        min_lift=min_lift
-    )
+    # Запускаем Celery задачу (или берем готовый отчет из кэша)
+    entry, cached = start_sales_report(request, 'market_basket_analysis', generate_market_basket_analysis_report, {
+        'date_from': date_from,
+        'date_to': date_to,
+        'min_support': min_support,
+        'min_confidence': min_confidence,
+        'min_lift': min_lift,
+        'level': level,
+        'max_itemset_size': max_itemset_size,
+    })
     
-    # Формируем ответ
-    response_data = {
-        'task_id': task.id,
-        'status': 'pending',
-        'message': f'Задача создания Market Basket Analysis запущена. ID задачи: {task.id}. Используйте GET /api/sales/report-status/{task.id}/ для проверки статуса.'
-    }
+    return report_started_response(entry, cached, 'Задача создания Market Basket Analysis запущена.', MarketBasketAnalysisResponseSerializer)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def often_bought_together_view(request, product_id):
+    """
+    Товары, которые часто покупают вместе с данным товаром.
+    
+    Параметры (query):
+    - date_from, date_to: период продаж (YYYY-MM-DD), опционально
+    - limit: количество товаров (по умолчанию 10, максимум 100)
+    - min_count: минимальное число совместных заказов (по умолчанию 2)
+    
+    Результат кэшируется на час.
+    """
+    from .market_basket import often_bought_together
+    
+    date_from = request.query_params.get('date_from') or None
+    date_to = request.query_params.get('date_to') or None
+    try:
+        limit = min(max(int(request.query_params.get('limit', 10)), 1), 100)
+        min_count = max(int(request.query_params.get('min_count', 2)), 1)
+    except ValueError:
+        return Response({'error': 'limit и min_count должны быть целыми числами'}, status=400)
+    
+    cache_key = f'sales:bought-together:{product_id}:{date_from}:{date_to}:{limit}:{min_count}'
+    items = cache.get(cache_key)
+    if items is None:
+        items = often_bought_together(product_id, date_from, date_to, limit=limit, min_count=min_count)
+        cache.set(cache_key, items, timeout=OFTEN_BOUGHT_TOGETHER_CACHE_TTL)
+    
+    return Response({
+        'product_id': product_id,
+        'items': items,
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_sales_lines(request):
+    """
+    Потоковая выгрузка строк счетов продажи в CSV или Parquet.
+    
+    Строки читаются серверным курсором и сразу отдаются клиенту
+    (Parquet - группами строк), без задачи Celery и без файла в памяти.
+    Итератор асинхронный, чтобы под ASGI ответ не собирался целиком.
+    
+    Параметры (query):
+    - file_format: csv (по умолчанию) или parquet
+    - date_from, date_to: период счетов (YYYY-MM-DD)
+    - company_id, product_id, currency, sale_type: фильтры
+    """
+    file_format = request.query_params.get('file_format', 'csv')
+    if file_format not in ('csv', 'parquet'):
+        return Response({'error': 'file_format должен быть csv или parquet'}, status=400)
     
-    response_serializer = MarketBasketAnalysisResponseSerializer(response_data)
-    return Response(response_serializer.data, status=202)
+    filters, product_id = parse_filters(request)
+    lines = InvoiceLine.objects.filter(
+        invoice__invoice_type=Invoice.InvoiceType.SALE,
+        **{f'invoice__{key}': value for key, value in filters.items()}
+    )
+    if product_id:
+        lines = lines.filter(product_id=product_id)
+    
+    rows = (
+        lines.annotate(amount=ExpressionWrapper(
+            F('quantity') * F('price'), output_field=DecimalField(max_digits=16, decimal_places=2)
+        ))
+        .order_by('invoice__invoice_date', 'invoice_id', 'id')
+        .values_list(*[field for _, field in SALES_LINES_EXPORT_COLUMNS])
+        .iterator(chunk_size=EXPORT_CURSOR_CHUNK_SIZE)
+    )
+    columns = [title for title, _ in SALES_LINES_EXPORT_COLUMNS]
+    
+    response = StreamingHttpResponse(
+        aiter_chunks(iter_rows(file_format, columns, rows, schema=SALES_LINES_PARQUET_SCHEMA)),
+        content_type=CONTENT_TYPES[file_format],
+    )
+    filename = f'sales_lines_{date.today():%Y%m%d}.{file_format}'
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class StockConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stock'
+
+    def ready(self):
+        # Сигналы сброса кэша сравнения цен
+        from . import comparison  # noqa: F401
@@ -0,0 +1,199 @@
+"""
+Пакетное сравнение наших цен с ценами конкурентов.
+
+Данные для любого количества товаров собираются фиксированным набором
+запросов (товары, последняя наша цена, последний наш склад, сопоставления,
+последние снимки конкурентов), а результат по каждому товару кэшируется
+в Redis на короткое время. Ключ кэша включает версию данных, которая
+увеличивается после импортов и при изменении цен/сопоставлений - так
+устаревшие записи просто перестают читаться.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from goods.models import Product
+
+from .models import (
+    CompetitorPriceStockSnapshot,
+    CompetitorProductMatch,
+    OurPriceHistory,
+    OurStockSnapshot,
+)
+
+PRICE_DATA_VERSION_KEY = "stock:price-data-version"
+PRICE_COMPARISON_CACHE_PREFIX = "stock:price-comparison"
+
+# Максимум товаров в одном запросе пакетного сравнения
+PRICE_COMPARISON_MAX_PRODUCTS = 500
+
+
+def get_price_data_version() -> int:
+    """Текущая версия данных о ценах и складах."""
+    version = cache.get(PRICE_DATA_VERSION_KEY)
+    if version is None:
+        cache.add(PRICE_DATA_VERSION_KEY, 1, timeout=None)
+        version = cache.get(PRICE_DATA_VERSION_KEY, 1)
+    return version
+
+
+def bump_price_data_version() -> int:
+    """Делает недействительным кэш сравнения цен (после импорта или изменения данных)."""
+    try:
+        return cache.incr(PRICE_DATA_VERSION_KEY)
+    except ValueError:
+        # Ключа ещё нет - начинаем со второй версии, первая могла попасть в кэш
+        cache.add(PRICE_DATA_VERSION_KEY, 2, timeout=None)
+        return cache.get(PRICE_DATA_VERSION_KEY, 2)
+
+
+def _cache_key(version: int, product_id: int) -> str:
+    return f"{PRICE_COMPARISON_CACHE_PREFIX}:{version}:{product_id}"
+
+
+def build_price_comparisons(product_ids) -> dict:
+    """
+    Сравнение цен для набора товаров без кэша.
+
+    Returns:
+        dict: {product_id: данные сравнения} только для существующих товаров
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+
+    products = Product.objects.filter(id__in=product_ids).values(
+        "id", "name", "ext_id", "brand__name"
+    )
+
+    # Последние значения берём через DISTINCT ON по индексам (product, moment)
+    our_prices = {
+        row["product_id"]: row
+        for row in OurPriceHistory.objects.filter(product_id__in=product_ids)
+        .order_by("product_id", "-moment")
+        .distinct("product_id")
+        .values("product_id", "moment", "price_ex_vat", "vat_rate")
+    }
+    our_stock = {
+        row["product_id"]: row
+        for row in OurStockSnapshot.objects.filter(product_id__in=product_ids)
+        .order_by("product_id", "-moment")
+        .distinct("product_id")
+        .values("product_id", "moment", "stock_qty")
+    }
+
+    matches = list(
+        CompetitorProductMatch.objects.filter(product_id__in=product_ids).values(
+            "product_id",
+            "competitor_product_id",
+            "match_type",
+            "confidence",
+            "competitor_product__part_number",
+            "competitor_product__name",
+            "competitor_product__brand__name",
+            "competitor_product__competitor_id",
+            "competitor_product__competitor__name",
+        )
+    )
+
+    snapshots = {}
+    competitor_product_ids = {match["competitor_product_id"] for match in matches}
+    if competitor_product_ids:
+        snapshots = {
+            row["competitor_product_id"]: row
+            for row in CompetitorPriceStockSnapshot.objects.filter(
+                competitor_product_id__in=competitor_product_ids
+            )
+            .order_by("competitor_product_id", "-collected_at")
+            .distinct("competitor_product_id")
+            .values(
+                "competitor_product_id",
+                "collected_at",
+                "price_ex_vat",
+                "price_inc_vat",
+                "currency",
+                "stock_qty",
+                "stock_status",
+                "delivery_days_min",
+                "delivery_days_max",
+            )
+        }
+
+    competitor_prices = {}
+    for match in matches:
+        snapshot = snapshots.get(match["competitor_product_id"])
+        competitor_prices.setdefault(match["product_id"], []).append({
+            "competitor_product_id": match["competitor_product_id"],
+            "competitor_id": match["competitor_product__competitor_id"],
+            "competitor_name": match["competitor_product__competitor__name"],
+            "part_number": match["competitor_product__part_number"],
+            "name": match["competitor_product__name"],
+            "brand_name": match["competitor_product__brand__name"],
+            "match_type": match["match_type"],
+            "confidence": match["confidence"],
+            "collected_at": snapshot["collected_at"] if snapshot else None,
+            "price_ex_vat": snapshot["price_ex_vat"] if snapshot else None,
+            "price_inc_vat": snapshot["price_inc_vat"] if snapshot else None,
+            "currency": snapshot["currency"] if snapshot else None,
+            "stock_qty": snapshot["stock_qty"] if snapshot else None,
+            "stock_status": snapshot["stock_status"] if snapshot else None,
+            "delivery_days_min": snapshot["delivery_days_min"] if snapshot else None,
+            "delivery_days_max": snapshot["delivery_days_max"] if snapshot else None,
+        })
+
+    result = {}
+    for product in products:
+        price = our_prices.get(product["id"])
+        stock = our_stock.get(product["id"])
+        offers = competitor_prices.get(product["id"], [])
+        # Сначала позиции с ценой, по возрастанию цены
+        offers.sort(key=lambda offer: (offer["price_ex_vat"] is None, offer["price_ex_vat"] or 0))
+        result[product["id"]] = {
+            "our_product_id": product["id"],
+            "our_product_name": product["name"],
+            "our_product_ext_id": product["ext_id"],
+            "brand_name": product["brand__name"],
+            "our_current_price": price["price_ex_vat"] if price else None,
+            "our_vat_rate": price["vat_rate"] if price else None,
+            "our_price_moment": price["moment"] if price else None,
+            "our_stock_qty": stock["stock_qty"] if stock else None,
+            "our_stock_moment": stock["moment"] if stock else None,
+            "competitor_prices": offers,
+        }
+    return result
+
+
+def get_price_comparisons(product_ids) -> dict:
+    """
+    Сравнение цен для набора товаров с кэшированием по (версия данных, id товара).
+
+    Returns:
+        dict: {product_id: данные сравнения}; отсутствующих товаров в ответе нет
+    """
+    product_ids = list(dict.fromkeys(product_ids))
+    version = get_price_data_version()
+    keys = {product_id: _cache_key(version, product_id) for product_id in product_ids}
+
+    cached = cache.get_many(list(keys.values()))
+    result = {
+        product_id: cached[key] for product_id, key in keys.items() if key in cached
+    }
+
+    missing = [product_id for product_id in product_ids if product_id not in result]
+    if missing:
+        fresh = build_price_comparisons(missing)
+        cache.set_many(
+            {keys[product_id]: data for product_id, data in fresh.items()},
+            timeout=settings.PRICE_COMPARISON_CACHE_TTL,
+        )
+        result.update(fresh)
+    return result
+
+
+@receiver([post_save, post_delete], sender=CompetitorProductMatch)
+@receiver([post_save, post_delete], sender=CompetitorPriceStockSnapshot)
+@receiver([post_save, post_delete], sender=OurPriceHistory)
+@receiver([post_save, post_delete], sender=OurStockSnapshot)
+def _invalidate_price_comparisons(sender, **kwargs):
+    bump_price_data_version()
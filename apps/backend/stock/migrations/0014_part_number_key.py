@@ -0,0 +1,24 @@
+# Generated by Django 5.1.15 on 2026-10-19 08:26
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0005_part_number_key'),
+        ('stock', '0013_ourstocksnapshot_rmb_rate_ourstocksnapshot_usd_rate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='competitorproduct',
+            name='part_number_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Part number без регистра, пунктуации и суффиксов упаковки', max_length=512, verbose_name='Ключ part number'),
+        ),
+        migrations.AddIndex(
+            model_name='competitorproduct',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['part_number_key'], name='comp_product_pn_key_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
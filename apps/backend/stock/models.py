@@ -1,7 +1,9 @@
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator, MaxValueValidator
 from core.mixins import TimestampsMixin
+from goods.utils import normalize_part_number
 
 
 class Competitor(TimestampsMixin, models.Model):
@@ -120,6 +122,15 @@ class CompetitorProduct(TimestampsMixin, models.Model):
         verbose_name=_("Part number / SKU"),
         help_text=_("Обозначение позиции у конкурента"),
     )
+    # Нормализованный part number, по нему ищем соответствия нашим товарам
+    part_number_key = models.CharField(
+        max_length=512,
+        blank=True,
+        db_index=True,
+        editable=False,
+        verbose_name=_("Ключ part number"),
+        help_text=_("Part number без регистра, пунктуации и суффиксов упаковки"),
+    )
     brand = models.ForeignKey(
         CompetitorBrand,
         on_delete=models.CASCADE,
@@ -154,6 +165,11 @@ class CompetitorProduct(TimestampsMixin, models.Model):
         verbose_name_plural = _("Позиции конкурентов")
         indexes = [
             models.Index(fields=["competitor", "part_number"]),
+            GinIndex(
+                fields=["part_number_key"],
+                name="comp_product_pn_key_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
         ]
         constraints = [
             models.UniqueConstraint(
@@ -164,6 +180,13 @@ class CompetitorProduct(TimestampsMixin, models.Model):
     def __str__(self) -> str:  # pragma: no cover
         return f"{self.competitor.name}:{self.part_number}"
 
+    def save(self, *args, **kwargs):
+        self.part_number_key = normalize_part_number(self.part_number)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "part_number" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "part_number_key"}
+        super().save(*args, **kwargs)
+
 
 class CompetitorProductMatch(TimestampsMixin, models.Model):
     class MatchType(models.TextChoices):
@@ -6,21 +6,26 @@ import asyncio
 from ftplib import FTP
 from pathlib import Path
 from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
-import base64
-from io import BytesIO
 import zipfile
 
 import mysql.connector
 import pandas as pd
 import requests
 from celery import shared_task
-from django.db import transaction
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.db import connection as db_connection, transaction
 from django.utils import timezone
 from mysql.connector import Error
 from asgiref.sync import sync_to_async
 from simpledbf import Dbf5
 
-from goods.models import Product
+from goods.models import Brand, Product
+from goods.utils import normalize_part_number
+from core.artifacts import ExportArtifactWriter, artifact_result
+from core.checkpoints import CheckpointedRun, chunked, retry_from_checkpoint
+from core.reports import MONEY_FORMAT, ReportWorkbook
+from .comparison import bump_price_data_version
 from .models import (
     OurPriceHistory,
     OurStockSnapshot,
@@ -28,6 +33,7 @@ from .models import (
     CompetitorBrand,
     CompetitorCategory,
     CompetitorProduct,
+    CompetitorProductMatch,
     CompetitorPriceStockSnapshot,
 )
 
@@ -360,6 +366,8 @@ def import_our_stock_from_mysql():
             skipped,
         )
 
+        bump_price_data_version()
+
         return {
             "success": True,
             "total": total_rows,
@@ -542,6 +550,7 @@ def import_histprice_from_mysql(batch_size: int = 5000, from_date=None, limit=No
             updated,
             skipped,
         )
+        bump_price_data_version()
         return {
             "success": True,
             "total": total_rows,
@@ -899,6 +908,7 @@ def import_prom_from_ftp():
                             new_product = CompetitorProduct(
                                 competitor=competitor,
                                 part_number=parsed['part_number'],
+                                part_number_key=normalize_part_number(parsed['part_number']),
                                 ext_id=parsed['item_id'],
                                 name=parsed['part_number'],
                                 brand=brand,
@@ -998,6 +1008,8 @@ def import_prom_from_ftp():
                 f"обновлено={products_updated}, брендов={brands_created}, снимков={snapshots_created}"
             )
         
+        bump_price_data_version()
+
         result = {
             "success": True,
             "total_rows": total_rows,
@@ -1347,6 +1359,7 @@ def import_rct_from_https():
                             # Обновляем существующий продукт
                             existing_product.ext_id = parsed['code']
                             existing_product.part_number = parsed['part_number']
+                            existing_product.part_number_key = normalize_part_number(parsed['part_number'])
                             existing_product.name = parsed['description'] or parsed['part_number']
                             existing_product.brand = brand
                             existing_product.tech_params = {
@@ -1362,6 +1375,7 @@ def import_rct_from_https():
                             new_product = CompetitorProduct(
                                 competitor=competitor,
                                 part_number=parsed['part_number'],
+                                part_number_key=normalize_part_number(parsed['part_number']),
                                 ext_id=parsed['code'],
                                 name=parsed['description'] or parsed['part_number'],
                                 brand=brand,
@@ -1402,7 +1416,7 @@ def import_rct_from_https():
                 if products_to_update:
                     CompetitorProduct.objects.bulk_update(
                         products_to_update,
-                        ['ext_id', 'part_number', 'name', 'brand', 'tech_params', 'updated_at'],
+                        ['ext_id', 'part_number', 'part_number_key', 'name', 'brand', 'tech_params', 'updated_at'],
                         batch_size=1000
                     )
                     products_updated += len(products_to_update)
@@ -1453,6 +1467,8 @@ def import_rct_from_https():
                 f"обновлено={products_updated}, брендов={brands_created}, снимков={snapshots_created}"
             )
         
+        bump_price_data_version()
+
         result = {
             "success": True,
             "total_rows": total_rows,
@@ -1823,6 +1839,7 @@ def import_compel_from_https():
                             # Обновляем существующий продукт
                             existing_product.ext_id = parsed['code']
                             existing_product.part_number = parsed['name']
+                            existing_product.part_number_key = normalize_part_number(parsed['name'])
                             existing_product.name = parsed['name']
                             existing_product.brand = brand
                             existing_product.tech_params = {
@@ -1843,6 +1860,7 @@ def import_compel_from_https():
                             new_product = CompetitorProduct(
                                 competitor=competitor,
                                 part_number=parsed['name'],
+                                part_number_key=normalize_part_number(parsed['name']),
                                 ext_id=parsed['code'],
                                 name=parsed['name'],
                                 brand=brand,
@@ -1888,7 +1906,7 @@ def import_compel_from_https():
                 if products_to_update:
                     CompetitorProduct.objects.bulk_update(
                         products_to_update,
-                        ['ext_id', 'part_number', 'name', 'brand', 'tech_params', 'updated_at'],
+                        ['ext_id', 'part_number', 'part_number_key', 'name', 'brand', 'tech_params', 'updated_at'],
                         batch_size=1000
                     )
                     products_updated += len(products_to_update)
@@ -1947,6 +1965,8 @@ def import_compel_from_https():
                 f"обновлено={products_updated}, брендов={brands_created}, снимков={snapshots_created}"
             )
         
+        bump_price_data_version()
+
         result = {
             "success": True,
             "total_rows": total_rows,
@@ -1978,17 +1998,167 @@ def import_compel_from_https():
         return {"success": False, "error": error_msg}
 
 
+def _fill_part_number_keys(queryset, source_field: str, batch_size: int = 2000) -> int:
+    """Заполняет пустой part_number_key у строк, созданных до появления колонки."""
+    updated = 0
+    batch = []
+    for obj in queryset.filter(part_number_key='').only('id', source_field).iterator(chunk_size=batch_size):
+        obj.part_number_key = normalize_part_number(getattr(obj, source_field))
+        if not obj.part_number_key:
+            continue
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            queryset.model.objects.bulk_update(batch, ['part_number_key'], batch_size=batch_size)
+            updated += len(batch)
+            batch = []
+    if batch:
+        queryset.model.objects.bulk_update(batch, ['part_number_key'], batch_size=batch_size)
+        updated += len(batch)
+    return updated
+
+
+@shared_task
+def auto_match_competitor_products(with_similar: bool = True, similarity_threshold: float = 0.8):
+    """
+    Пакетное сопоставление позиций конкурентов с нашими товарами по нормализованному part number.
+
+    Все кандидаты вставляются одним INSERT ... SELECT, ручные сопоставления
+    не перезаписываются (ON CONFLICT DO NOTHING):
+    - EXACT (1.00): part number совпадает без учёта регистра и пробелов;
+    - EQUIVALENT (0.90): совпадает ключ, отличается упаковка/пунктуация (-TR, /NOPB, ...);
+    - ANALOG (0.70): ключ совпадает, но бренды разные (второй источник);
+    - SIMILAR: лучший кандидат по триграммному сходству ключей (pg_trgm)
+      для позиций, у которых точных совпадений нет.
+    """
+    match_table = CompetitorProductMatch._meta.db_table
+    comp_product_table = CompetitorProduct._meta.db_table
+    comp_brand_table = CompetitorBrand._meta.db_table
+    product_table = Product._meta.db_table
+    brand_table = Brand._meta.db_table
+
+    # Бренды сравниваем без регистра и пунктуации; пустой бренд конфликтом не считается
+    brand_conflict = (
+        "(cb.name IS NOT NULL AND b.name IS NOT NULL "
+        "AND regexp_replace(upper(cb.name), '[^[:alnum:]]', '', 'g') "
+        "<> regexp_replace(upper(b.name), '[^[:alnum:]]', '', 'g'))"
+    )
+    raw_equal = "upper(btrim(cp.part_number)) = upper(btrim(p.name))"
+
+    key_match_sql = f"""
+        INSERT INTO {match_table}
+            (competitor_product_id, product_id, match_type, confidence, notes, created_at, updated_at)
+        SELECT
+            cp.id,
+            p.id,
+            CASE
+                WHEN {brand_conflict} THEN %(analog)s
+                WHEN {raw_equal} THEN %(exact)s
+                ELSE %(equivalent)s
+            END,
+            CASE
+                WHEN {brand_conflict} THEN 0.70
+                WHEN {raw_equal} THEN 1.00
+                ELSE 0.90
+            END,
+            %(notes)s,
+            now(),
+            now()
+        FROM {comp_product_table} cp
+        JOIN {product_table} p
+            ON p.part_number_key = cp.part_number_key AND p.deleted_at IS NULL
+        LEFT JOIN {comp_brand_table} cb ON cb.id = cp.brand_id
+        LEFT JOIN {brand_table} b ON b.id = p.brand_id
+        WHERE cp.part_number_key <> ''
+        ON CONFLICT (competitor_product_id, product_id) DO NOTHING
+    """
+
+    # Для каждой позиции без сопоставлений берём одного лучшего кандидата;
+    # оператор % использует GIN-индекс gin_trgm_ops по part_number_key
+    similar_sql = f"""
+        INSERT INTO {match_table}
+            (competitor_product_id, product_id, match_type, confidence, notes, created_at, updated_at)
+        SELECT DISTINCT ON (cp.id)
+            cp.id,
+            p.id,
+            %(similar)s,
+            round((similarity(p.part_number_key, cp.part_number_key) * 0.8)::numeric, 2),
+            %(notes)s,
+            now(),
+            now()
+        FROM {comp_product_table} cp
+        JOIN {product_table} p
+            ON p.part_number_key %% cp.part_number_key AND p.deleted_at IS NULL
+        WHERE length(cp.part_number_key) >= 5
+          AND NOT EXISTS (
+              SELECT 1 FROM {match_table} m WHERE m.competitor_product_id = cp.id
+          )
+        ORDER BY cp.id, similarity(p.part_number_key, cp.part_number_key) DESC, p.id
+        ON CONFLICT (competitor_product_id, product_id) DO NOTHING
+    """
+
+    params = {
+        'exact': CompetitorProductMatch.MatchType.EXACT.value,
+        'equivalent': CompetitorProductMatch.MatchType.EQUIVALENT.value,
+        'analog': CompetitorProductMatch.MatchType.ANALOG.value,
+        'similar': CompetitorProductMatch.MatchType.SIMILAR.value,
+        'notes': 'Автосопоставление по part number',
+    }
+
+    try:
+        logger.info("Начинаем автосопоставление товаров конкурентов")
+
+        products_keys = _fill_part_number_keys(Product.global_objects.all(), 'name')
+        comp_keys = _fill_part_number_keys(CompetitorProduct.objects.all(), 'part_number')
+        if products_keys or comp_keys:
+            logger.info(f"Заполнены ключи part number: наших товаров {products_keys}, товаров конкурентов {comp_keys}")
+
+        with transaction.atomic(), db_connection.cursor() as cursor:
+            cursor.execute(key_match_sql, params)
+            key_matches = cursor.rowcount
+
+            similar_matches = 0
+            if with_similar:
+                cursor.execute(
+                    "SELECT set_config('pg_trgm.similarity_threshold', %s, true)",
+                    [str(similarity_threshold)],
+                )
+                cursor.execute(similar_sql, params)
+                similar_matches = cursor.rowcount
+
+        logger.info(
+            f"✅ Автосопоставление завершено: по ключу {key_matches}, похожих {similar_matches}"
+        )
+        bump_price_data_version()
+        return {
+            'success': True,
+            'product_keys_filled': products_keys,
+            'competitor_keys_filled': comp_keys,
+            'key_matches_created': key_matches,
+            'similar_matches_created': similar_matches,
+        }
+    except Exception as e:
+        logger.error(f"❌ Ошибка автосопоставления товаров конкурентов: {str(e)}", exc_info=True)
+        return {
+            'success': False,
+            'error': f"Ошибка автосопоставления: {str(e)}"
+        }
+
+
 @shared_task
-def export_competitor_price_comparison_task():
+def export_competitor_price_comparison_task(user_id=None):
     """
     Celery-задача для экспорта сравнения цен с конкурентами в Excel файл.
     ОПТИМИЗИРОВАННАЯ ВЕРСИЯ с предзагрузкой данных.
     
-    Берёт все наши товары (part number) и находит точные совпадения
-    по part_number у конкурентов, затем формирует таблицу сравнения цен.
+    Берёт все наши товары (part number) и находит совпадения у конкурентов
+    по нормализованному ключу part number (без регистра, пунктуации и суффиксов
+    упаковки), затем формирует таблицу сравнения цен.
+    
+    Parameters:
+        user_id (int): ID пользователя, запросившего экспорт
     
     Returns:
-        dict: Словарь с результатом экспорта и бинарным содержимым файла в base64
+        dict: Результат экспорта с id файла выгрузки (ExportArtifact) и ссылкой на скачивание
     """
     from collections import defaultdict
     from django.db.models import Prefetch, OuterRef, Subquery
@@ -2046,12 +2216,14 @@ def export_competitor_price_comparison_task():
             'competitor', 'brand'
         ).all()
         
-        # Группируем по part_number (нижний регистр для сравнения)
+        # Группируем по нормализованному ключу part number
         comp_products_by_part = defaultdict(list)
         for comp_prod in competitor_products:
-            comp_products_by_part[comp_prod.part_number.lower()].append(comp_prod)
+            key = comp_prod.part_number_key or normalize_part_number(comp_prod.part_number)
+            if key:
+                comp_products_by_part[key].append(comp_prod)
         
-        logger.info(f"Загружено {len(competitor_products)} товаров конкурентов, уникальных part_number: {len(comp_products_by_part)}")
+        logger.info(f"Загружено {len(competitor_products)} товаров конкурентов, уникальных ключей part number: {len(comp_products_by_part)}")
         
         # ШАГ 5: Загружаем все последние snapshots для товаров конкурентов
         logger.info("Загружаем последние snapshots цен конкурентов...")
@@ -2072,56 +2244,73 @@ def export_competitor_price_comparison_task():
         
         logger.info(f"Загружено {len(snapshots_dict)} последних snapshots")
         
-        # ШАГ 6: Обрабатываем данные (теперь все данные в памяти!)
+        # ШАГ 6: Обрабатываем данные и сразу пишем строки в Excel (без DataFrame)
         logger.info("Начинаем обработку товаров...")
-        comparison_data = []
-        processed = 0
-        matches_found = 0
-        
-        for product in our_products:
-            processed += 1
-            if processed % 1000 == 0:  # Увеличили до 1000 т.к. теперь быстро
-                logger.info(f"Обработано {processed}/{total_products} товаров...")
-            
-            part_number = product.name
-            
-            # Получаем цену из предзагруженного словаря
-            our_latest_price = our_prices_dict.get(product.id)
-            
-            our_price_inc_vat = None
-            our_price_date = None
-            our_stock_qty = None
-            our_markup_percent = None
-            our_cost_percent = None
-            our_rmb_rate = None
-            our_usd_rate = None
-            
-            if our_latest_price:
-                # Рассчитываем цену с НДС
-                if our_latest_price.price_ex_vat:
-                    vat_multiplier = 1 + (float(our_latest_price.vat_rate) if our_latest_price.vat_rate else 0)
-                    our_price_inc_vat = float(our_latest_price.price_ex_vat) * vat_multiplier
-                our_price_date = our_latest_price.moment
-
-            our_stock_snapshot = our_stock_dict.get(product.id)
-            if our_stock_snapshot:
-                if our_stock_snapshot.stock_qty is not None:
-                    our_stock_qty = int(our_stock_snapshot.stock_qty)
-                if our_stock_snapshot.markup_percent is not None:
-                    our_markup_percent = round(float(our_stock_snapshot.markup_percent), 2)
-                if our_stock_snapshot.cost_percent is not None:
-                    our_cost_percent = round(float(our_stock_snapshot.cost_percent), 2)
-                if our_stock_snapshot.rmb_rate is not None:
-                    our_rmb_rate = round(float(our_stock_snapshot.rmb_rate), 4)
-                if our_stock_snapshot.usd_rate is not None:
-                    our_usd_rate = round(float(our_stock_snapshot.usd_rate), 4)
-            
-            # Ищем совпадения в предзагруженном словаре
-            comp_products = comp_products_by_part.get(part_number.lower(), [])
-            
-            if comp_products:
-                matches_found += 1
-                # Обрабатываем каждый товар конкурента
+        stats = {'processed': 0, 'matches_found': 0, 'records': 0}
+        
+        def iter_comparison_rows():
+            for product in our_products:
+                stats['processed'] += 1
+                if stats['processed'] % 1000 == 0:
+                    logger.info(f"Обработано {stats['processed']}/{total_products} товаров...")
+                
+                part_number = product.name
+                
+                # Получаем цену из предзагруженного словаря
+                our_latest_price = our_prices_dict.get(product.id)
+                
+                our_price_inc_vat = None
+                our_price_date = None
+                our_stock_qty = None
+                our_markup_percent = None
+                our_cost_percent = None
+                our_rmb_rate = None
+                our_usd_rate = None
+                
+                if our_latest_price:
+                    # Рассчитываем цену с НДС
+                    if our_latest_price.price_ex_vat:
+                        vat_multiplier = 1 + (float(our_latest_price.vat_rate) if our_latest_price.vat_rate else 0)
+                        our_price_inc_vat = float(our_latest_price.price_ex_vat) * vat_multiplier
+                    our_price_date = our_latest_price.moment
+
+                our_stock_snapshot = our_stock_dict.get(product.id)
+                if our_stock_snapshot:
+                    if our_stock_snapshot.stock_qty is not None:
+                        our_stock_qty = int(our_stock_snapshot.stock_qty)
+                    if our_stock_snapshot.markup_percent is not None:
+                        our_markup_percent = round(float(our_stock_snapshot.markup_percent), 2)
+                    if our_stock_snapshot.cost_percent is not None:
+                        our_cost_percent = round(float(our_stock_snapshot.cost_percent), 2)
+                    if our_stock_snapshot.rmb_rate is not None:
+                        our_rmb_rate = round(float(our_stock_snapshot.rmb_rate), 4)
+                    if our_stock_snapshot.usd_rate is not None:
+                        our_usd_rate = round(float(our_stock_snapshot.usd_rate), 4)
+                
+                our_columns = (
+                    part_number,
+                    product.brand.name if product.brand else '',
+                    our_price_inc_vat,
+                    our_rmb_rate,
+                    our_usd_rate,
+                    our_price_date.strftime('%Y-%m-%d %H:%M') if our_price_date else '',
+                    our_stock_qty,
+                    our_markup_percent,
+                    our_cost_percent,
+                )
+                
+                # Ищем совпадения в предзагруженном словаре
+                comp_products = comp_products_by_part.get(
+                    product.part_number_key or normalize_part_number(part_number), []
+                )
+                
+                if not comp_products:
+                    # Товар без совпадений у конкурентов
+                    stats['records'] += 1
+                    yield our_columns + ('Нет совпадений', '', '', None, '', None, None, None)
+                    continue
+                
+                stats['matches_found'] += 1
                 for comp_product in comp_products:
                     # Получаем snapshot из предзагруженного словаря
                     latest_snapshot = snapshots_dict.get(comp_product.id)
@@ -2142,96 +2331,52 @@ def export_competitor_price_comparison_task():
                             price_difference = our_price_inc_vat - comp_price_ex_vat
                             price_difference_pct = (price_difference / comp_price_ex_vat) * 100
                     
-                    comparison_data.append({
-                        'Part Number': part_number,
-                        'Наш бренд': product.brand.name if product.brand else '',
-                        'Наша цена': our_price_inc_vat,
-                        'Курс юаня': our_rmb_rate,
-                        'Курс доллара': our_usd_rate,
-                        'Дата нашей цены': our_price_date.strftime('%Y-%m-%d %H:%M') if our_price_date else '',
-                        'Наш остаток': our_stock_qty,
-                        'Наша наценка (%)': our_markup_percent,
-                        'Наши затраты (%)': our_cost_percent,
-                        'Конкурент': comp_product.competitor.name,
-                        'Бренд конкурента': comp_product.brand.name if comp_product.brand else '',
-                        'Цена конкурента': comp_price_ex_vat,
-                        'Дата цены конкурента': comp_price_date.strftime('%Y-%m-%d %H:%M') if comp_price_date else '',
-                        'Остаток у конкурента': comp_stock_qty,
-                        'Разница в цене': round(price_difference, 2) if price_difference is not None else None,
-                        'Разница в цене (%)': round(price_difference_pct, 2) if price_difference_pct is not None else None,
-                    })
-            else:
-                # Товар без совпадений у конкурентов
-                comparison_data.append({
-                    'Part Number': part_number,
-                    'Наш бренд': product.brand.name if product.brand else '',
-                    'Наша цена': our_price_inc_vat,
-                    'Курс юаня': our_rmb_rate,
-                    'Курс доллара': our_usd_rate,
-                    'Дата нашей цены': our_price_date.strftime('%Y-%m-%d %H:%M') if our_price_date else '',
-                    'Наш остаток': our_stock_qty,
-                    'Наша наценка (%)': our_markup_percent,
-                    'Наши затраты (%)': our_cost_percent,
-                    'Конкурент': 'Нет совпадений',
-                    'Бренд конкурента': '',
-                    'Цена конкурента': None,
-                    'Дата цены конкурента': '',
-                    'Остаток у конкурента': None,
-                    'Разница в цене': None,
-                    'Разница в цене (%)': None,
-                })
-        
-        logger.info(f"Обработка завершена. Всего товаров: {total_products}, найдено совпадений: {matches_found}")
-        
-        # Создаём DataFrame
-        df = pd.DataFrame(comparison_data)
-        
-        # Создаём Excel файл в памяти
-        excel_buffer = BytesIO()
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Сравнение цен', index=False)
-            
-            # Получаем workbook и worksheet для форматирования
-            workbook = writer.book
-            worksheet = writer.sheets['Сравнение цен']
-            
-            # Автоподбор ширины столбцов
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)  # Максимум 50 символов
-                worksheet.column_dimensions[column_letter].width = adjusted_width
-            
-            # Закрепляем первую строку (заголовки)
-            worksheet.freeze_panes = 'A2'
-        
-        # Получаем содержимое буфера
-        excel_buffer.seek(0)
-        file_data = excel_buffer.getvalue()
+                    stats['records'] += 1
+                    yield our_columns + (
+                        comp_product.competitor.name,
+                        comp_product.part_number,
+                        comp_product.brand.name if comp_product.brand else '',
+                        comp_price_ex_vat,
+                        comp_price_date.strftime('%Y-%m-%d %H:%M') if comp_price_date else '',
+                        comp_stock_qty,
+                        round(price_difference, 2) if price_difference is not None else None,
+                        round(price_difference_pct, 2) if price_difference_pct is not None else None,
+                    )
         
-        # Преобразуем бинарные данные в base64 для безопасной передачи через JSON
-        encoded_data = base64.b64encode(file_data).decode('utf-8')
+        columns = [
+            'Part Number', 'Наш бренд', 'Наша цена', 'Курс юаня', 'Курс доллара',
+            'Дата нашей цены', 'Наш остаток', 'Наша наценка (%)', 'Наши затраты (%)',
+            'Конкурент', 'Part Number конкурента', 'Бренд конкурента', 'Цена конкурента',
+            'Дата цены конкурента', 'Остаток у конкурента', 'Разница в цене', 'Разница в цене (%)',
+        ]
         
-        # Формируем результат
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"price_comparison_{timestamp}.xlsx"
         
-        logger.info(f"✅ Excel файл создан успешно: {filename}, записей: {len(comparison_data)}")
+        # Потоково пишем Excel файл в хранилище выгрузок
+        with ExportArtifactWriter('price_comparison', filename, created_by_id=user_id) as output:
+            with ReportWorkbook(output.file) as workbook:
+                workbook.add_sheet(
+                    'Сравнение цен',
+                    columns,
+                    iter_comparison_rows(),
+                    number_formats={
+                        'Наша цена': MONEY_FORMAT,
+                        'Цена конкурента': MONEY_FORMAT,
+                        'Разница в цене': MONEY_FORMAT,
+                    },
+                )
         
-        return {
-            'success': True,
-            'filename': filename,
-            'data': encoded_data,
-            'records': len(comparison_data),
-            'total_products': total_products,
-            'matches_found': matches_found
-        }
+        matches_found = stats['matches_found']
+        logger.info(f"Обработка завершена. Всего товаров: {total_products}, найдено совпадений: {matches_found}")
+        logger.info(f"✅ Excel файл создан успешно: {filename}, записей: {stats['records']}")
+        
+        return artifact_result(
+            output.artifact,
+            records=stats['records'],
+            total_products=total_products,
+            matches_found=matches_found,
+        )
         
     except Exception as e:
         logger.error(f"❌ Ошибка при экспорте сравнения цен: {str(e)}", exc_info=True)
@@ -2241,8 +2386,8 @@ def export_competitor_price_comparison_task():
         }
 
 
-@shared_task
-def export_competitor_sales_task(date_from=None, date_to=None, competitor_ids=None):
+@shared_task(bind=True, soft_time_limit=settings.REPORT_SOFT_TIME_LIMIT)
+def export_competitor_sales_task(self, date_from=None, date_to=None, competitor_ids=None, user_id=None):
     """
     Celery-задача для экспорта продаж конкурентов в Excel файл.
     ОПТИМИЗИРОВАННАЯ ВЕРСИЯ с использованием агрегации Django ORM.
@@ -2254,9 +2399,10 @@ def export_competitor_sales_task(date_from=None, date_to=None, competitor_ids=No
         date_from (str): Начальная дата в формате YYYY-MM-DD (по умолчанию: 30 дней назад)
         date_to (str): Конечная дата в формате YYYY-MM-DD (по умолчанию: сегодня)
         competitor_ids (list): Список ID конкурентов для анализа (по умолчанию: все конкуренты)
+        user_id (int): ID пользователя, запросившего экспорт
     
     Returns:
-        dict: Словарь с результатом экспорта и бинарным содержимым файла в base64
+        dict: Результат экспорта с id файла выгрузки (ExportArtifact) и ссылкой на скачивание
     """
     from datetime import datetime, timedelta
     from django.utils import timezone
@@ -2289,20 +2435,36 @@ def export_competitor_sales_task(date_from=None, date_to=None, competitor_ids=No
             logger.info("Анализ всех конкурентов")
             competitors_info = "Все конкуренты"
         
-        # ШАГ 1: Получаем уникальные товары конкурентов, у которых есть снимки за период
-        logger.info("Получаем список товаров с данными за период...")
-        snapshots_query = CompetitorPriceStockSnapshot.objects.filter(
-            collected_at__gte=start_date,
-            collected_at__lte=end_date
+        # Прерванная по лимиту времени задача продолжит с последнего пакета товаров;
+        # без дат период отсчитывается от сегодняшнего дня - он входит в ключ запуска
+        run = CheckpointedRun(
+            'competitor_sales',
+            {'date_from': date_from, 'date_to': date_to, 'competitor_ids': competitor_ids},
+            version=None if date_from and date_to else timezone.localdate().isoformat(),
         )
+        # Период без явных дат тоже фиксируется при первом запуске
+        start_date, end_date = run.step('period', lambda: (start_date, end_date))
         
-        # Применяем фильтр по конкурентам если указан
-        if competitor_ids:
-            snapshots_query = snapshots_query.filter(competitor_id__in=competitor_ids)
-        
-        products_with_snapshots = snapshots_query.values('competitor_product_id').distinct()
+        # ШАГ 1: Получаем уникальные товары конкурентов, у которых есть снимки за период
+        def load_product_ids():
+            logger.info("Получаем список товаров с данными за период...")
+            snapshots_query = CompetitorPriceStockSnapshot.objects.filter(
+                collected_at__gte=start_date,
+                collected_at__lte=end_date
+            )
+            
+            # Применяем фильтр по конкурентам если указан
+            if competitor_ids:
+                snapshots_query = snapshots_query.filter(competitor_id__in=competitor_ids)
+            
+            return list(
+                snapshots_query.order_by('competitor_product_id')
+                .values_list('competitor_product_id', flat=True)
+                .distinct()
+            )
         
-        product_ids = [p['competitor_product_id'] for p in products_with_snapshots]
+        # Список товаров фиксируется при первом запуске, чтобы пакеты не сдвинулись
+        product_ids = run.step('product_ids', load_product_ids)
         total_products = len(product_ids)
         
         logger.info(f"Найдено {total_products} уникальных товаров конкурентов")
@@ -2316,13 +2478,10 @@ def export_competitor_sales_task(date_from=None, date_to=None, competitor_ids=No
         
         # ШАГ 2: Обрабатываем товары пакетами для экономии памяти
         logger.info("Начинаем обработку товаров пакетами...")
-        sales_data = []
         BATCH_SIZE = 100  # Обрабатываем по 100 товаров за раз
-        processed = 0
         
-        for i in range(0, total_products, BATCH_SIZE):
-            batch_ids = product_ids[i:i + BATCH_SIZE]
-            logger.info(f"Обработка пакета {i // BATCH_SIZE + 1}/{(total_products + BATCH_SIZE - 1) // BATCH_SIZE}...")
+        def analyze_batch(batch_ids):
+            rows = []
             
             # Базовый queryset для подзапросов
             base_snapshot_filter = {
@@ -2365,8 +2524,6 @@ def export_competitor_sales_task(date_from=None, date_to=None, competitor_ids=No
             
             # Анализируем каждый товар в пакете
             for product_id, snapshots_list in product_snapshots_batch.items():
-                processed += 1
-                
                 if len(snapshots_list) < 2:
                     # Нужно минимум 2 снимка для сравнения
                     continue
@@ -2405,105 +2562,83 @@ def export_competitor_sales_task(date_from=None, date_to=None, competitor_ids=No
                     sales_amount = sold_qty * float(avg_price)
                 
                 # Добавляем запись
-                sales_data.append({
-                    'Конкурент': competitor_name,
-                    'Part Number': part_number,
-                    'Бренд': brand_name,
-                    'Остаток на начало': first_stock,
-                    'Остаток на конец': last_stock,
-                    'Продано (шт)': sold_qty,
-                    'Средняя цена': round(float(avg_price), 2) if avg_price else None,
-                    'Цена актуальная': round(float(last_price), 2) if last_price else None,
-                    'Сумма продаж': round(sales_amount, 2) if sales_amount else None,
-                    'Дата первого снимка': first_snapshot.collected_at.strftime('%Y-%m-%d'),
-                    'Дата последнего снимка': last_snapshot.collected_at.strftime('%Y-%m-%d'),
-                    'Количество снимков': len(snapshots_list),
-                })
+                rows.append((
+                    competitor_name,
+                    part_number,
+                    brand_name,
+                    first_stock,
+                    last_stock,
+                    sold_qty,
+                    round(float(avg_price), 2) if avg_price else None,
+                    round(float(last_price), 2) if last_price else None,
+                    round(sales_amount, 2) if sales_amount else None,
+                    first_snapshot.collected_at.strftime('%Y-%m-%d'),
+                    last_snapshot.collected_at.strftime('%Y-%m-%d'),
+                    len(snapshots_list),
+                ))
             
-            # Очищаем память после обработки пакета
-            del batch_snapshots
-            del product_snapshots_batch
+            return rows
+        
+        batches = run.map('products', chunked(product_ids, BATCH_SIZE), analyze_batch)
+        sales_data = [row for batch_rows in batches for row in batch_rows]
         
         logger.info(f"Анализ завершен. Обработано товаров: {total_products}")
         
         # Сортируем по сумме продаж (по убыванию)
-        sales_data.sort(key=lambda x: x['Сумма продаж'] if x['Сумма продаж'] else 0, reverse=True)
-        
-        # Создаём DataFrame
-        df = pd.DataFrame(sales_data)
+        sales_data.sort(key=lambda row: row[8] or 0, reverse=True)
         
-        # Добавляем итоговые строки
-        total_sold = df['Продано (шт)'].sum()
-        total_sales_amount = df['Сумма продаж'].sum()
-        
-        # Создаём Excel файл в памяти
-        excel_buffer = BytesIO()
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Продажи конкурентов', index=False, startrow=1)
-            
-            # Получаем workbook и worksheet для форматирования
-            workbook = writer.book
-            worksheet = writer.sheets['Продажи конкурентов']
-            
-            # Добавляем заголовок с периодом и фильтрами
-            header_text = f"Анализ продаж конкурентов за период: {start_date.strftime('%Y-%m-%d')} - {end_date.strftime('%Y-%m-%d')}"
-            if competitor_ids:
-                header_text += f" | Конкуренты: {competitors_info}"
-            worksheet.cell(row=1, column=1).value = header_text
-            
-            # Автоподбор ширины столбцов
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if cell.value and len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column_letter].width = adjusted_width
-            
-            # Закрепляем первые две строки (заголовок + названия столбцов)
-            worksheet.freeze_panes = 'A3'
-            
-            # Добавляем итоговую строку
-            last_row = len(df) + 3
-            worksheet.cell(row=last_row, column=1).value = "ИТОГО:"
-            worksheet.cell(row=last_row, column=6).value = total_sold
-            worksheet.cell(row=last_row, column=9).value = round(total_sales_amount, 2) if total_sales_amount else 0
-            
-            # Делаем итоговую строку жирной
-            from openpyxl.styles import Font
-            for col in range(1, 13):
-                cell = worksheet.cell(row=last_row, column=col)
-                cell.font = Font(bold=True)
+        # Итоги
+        total_sold = sum(row[5] for row in sales_data)
+        total_sales_amount = sum(row[8] or 0 for row in sales_data)
         
-        # Получаем содержимое буфера
-        excel_buffer.seek(0)
-        file_data = excel_buffer.getvalue()
+        columns = [
+            'Конкурент', 'Part Number', 'Бренд', 'Остаток на начало', 'Остаток на конец',
+            'Продано (шт)', 'Средняя цена', 'Цена актуальная', 'Сумма продаж',
+            'Дата первого снимка', 'Дата последнего снимка', 'Количество снимков',
+        ]
         
-        # Преобразуем бинарные данные в base64
-        encoded_data = base64.b64encode(file_data).decode('utf-8')
+        # Заголовок с периодом и фильтрами
+        header_text = f"Анализ продаж конкурентов за период: {start_date.strftime('%Y-%m-%d')} - {end_date.strftime('%Y-%m-%d')}"
+        if competitor_ids:
+            header_text += f" | Конкуренты: {competitors_info}"
         
-        # Формируем результат
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"competitor_sales_{timestamp}.xlsx"
         
+        # Потоково пишем Excel файл в хранилище выгрузок
+        with ExportArtifactWriter('competitor_sales', filename, created_by_id=user_id) as output:
+            with ReportWorkbook(output.file) as workbook:
+                workbook.add_sheet(
+                    'Продажи конкурентов',
+                    columns,
+                    sales_data,
+                    heading=header_text,
+                    footer=['ИТОГО:', None, None, None, None, total_sold, None, None,
+                            round(total_sales_amount, 2), None, None, None],
+                    number_formats={
+                        'Средняя цена': MONEY_FORMAT,
+                        'Цена актуальная': MONEY_FORMAT,
+                        'Сумма продаж': MONEY_FORMAT,
+                    },
+                )
+        
+        run.finish()
+        
         logger.info(f"✅ Excel файл создан успешно: {filename}, записей: {len(sales_data)}")
         logger.info(f"   Всего продано единиц: {total_sold}, на сумму: {round(total_sales_amount, 2) if total_sales_amount else 0}")
         
-        return {
-            'success': True,
-            'filename': filename,
-            'data': encoded_data,
-            'records': len(sales_data),
-            'total_sold': int(total_sold),
-            'total_sales_amount': round(float(total_sales_amount), 2) if total_sales_amount else 0,
-            'period_from': start_date.strftime('%Y-%m-%d'),
-            'period_to': end_date.strftime('%Y-%m-%d')
-        }
+        return artifact_result(
+            output.artifact,
+            records=len(sales_data),
+            total_sold=int(total_sold),
+            total_sales_amount=round(float(total_sales_amount), 2) if total_sales_amount else 0,
+            period_from=start_date.strftime('%Y-%m-%d'),
+            period_to=end_date.strftime('%Y-%m-%d'),
+        )
         
+    except SoftTimeLimitExceeded as e:
+        # Перезапуск с контрольной точки (пакеты товаров уже сохранены)
+        retry_from_checkpoint(self, e)
     except Exception as e:
         logger.error(f"❌ Ошибка при экспорте продаж конкурентов: {str(e)}", exc_info=True)
         return {
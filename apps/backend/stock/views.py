@@ -1,6 +1,5 @@
 from django.contrib.auth import get_user_model
-from django.db.models import Q, Prefetch
-from django.http import HttpResponse
+from django.db.models import OuterRef, Q, Prefetch, Subquery
 from django_filters.rest_framework import DjangoFilterBackend, FilterSet, CharFilter, NumberFilter, DateFilter
 from drf_spectacular.utils import extend_schema
 from rest_framework import filters, mixins, status, viewsets
@@ -28,11 +27,16 @@ from .serializers import (
     OurPriceHistorySerializer,
     PriceComparisonSerializer,
 )
+from core.checkpoints import PROGRESS_STATE
+from core.views import task_result_download
+from .comparison import PRICE_COMPARISON_MAX_PRODUCTS, get_price_comparisons
 from .tasks import import_histprice_from_mysql, export_competitor_price_comparison_task
-import base64
 
 User = get_user_model()
 
+LATEST_SNAPSHOTS_PAGE_SIZE = 100
+LATEST_SNAPSHOTS_MAX_PAGE_SIZE = 1000
+
 
 # Фильтры для конкурентов
 class CompetitorFilter(FilterSet):
@@ -163,26 +167,92 @@ class CompetitorPriceStockSnapshotViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=["get"], url_path="latest")
     def get_latest_snapshots(self, request):
-        """Получить последние снимки для каждого продукта конкурента"""
-        competitor_id = request.query_params.get("competitor_id")
+        """
+        Последний снимок по каждой позиции конкурента с keyset-пагинацией.
+
+        Параметры:
+        - competitor_id, brand_id, brand_name - фильтры по позиции конкурента
+        - stock_status (можно несколько через запятую), has_stock,
+          min_price, max_price - фильтры по последнему снимку (цена без НДС)
+        - cursor - id последней позиции предыдущей страницы (next_cursor)
+        - page_size - размер страницы (по умолчанию 100, максимум 1000)
+
+        Позиции перебираются по первичному ключу, а последний снимок каждой
+        берётся коррелированным подзапросом по индексу
+        (competitor_product, collected_at) - время ответа не зависит
+        от глубины истории снимков.
+        """
+        params = request.query_params
+        try:
+            cursor = int(params.get("cursor") or 0)
+            page_size = min(max(int(params.get("page_size") or LATEST_SNAPSHOTS_PAGE_SIZE), 1), LATEST_SNAPSHOTS_MAX_PAGE_SIZE)
+            min_price = Decimal(params["min_price"]) if params.get("min_price") else None
+            max_price = Decimal(params["max_price"]) if params.get("max_price") else None
+        except (ValueError, ArithmeticError):
+            return Response(
+                {"error": "cursor, page_size, min_price и max_price должны быть числами"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        queryset = self.get_queryset()
-        if competitor_id:
-            queryset = queryset.filter(competitor_id=competitor_id)
+        products = CompetitorProduct.objects.filter(pk__gt=cursor)
+        if params.get("competitor_id"):
+            products = products.filter(competitor_id=params["competitor_id"])
+        if params.get("brand_id"):
+            products = products.filter(brand_id=params["brand_id"])
+        if params.get("brand_name"):
+            products = products.filter(brand__name__icontains=params["brand_name"])
+
+        latest = CompetitorPriceStockSnapshot.objects.filter(
+            competitor_product=OuterRef("pk")
+        ).order_by("-collected_at")
+        products = products.annotate(latest_snapshot_id=Subquery(latest.values("pk")[:1])).filter(
+            latest_snapshot_id__isnull=False
+        )
+
+        # Фильтры по последнему снимку: подзапрос нужен только для используемых полей
+        stock_statuses = [value for value in params.get("stock_status", "").split(",") if value]
+        if stock_statuses:
+            products = products.annotate(
+                latest_stock_status=Subquery(latest.values("stock_status")[:1])
+            ).filter(latest_stock_status__in=stock_statuses)
+        has_stock = params.get("has_stock", "").lower()
+        if has_stock in ["true", "1", "yes", "false", "0", "no"]:
+            products = products.annotate(latest_stock_qty=Subquery(latest.values("stock_qty")[:1]))
+            if has_stock in ["true", "1", "yes"]:
+                products = products.filter(latest_stock_qty__gt=0)
+            else:
+                products = products.filter(Q(latest_stock_qty__isnull=True) | Q(latest_stock_qty=0))
+        if min_price is not None or max_price is not None:
+            products = products.annotate(latest_price=Subquery(latest.values("price_ex_vat")[:1]))
+            if min_price is not None:
+                products = products.filter(latest_price__gte=min_price)
+            if max_price is not None:
+                products = products.filter(latest_price__lte=max_price)
+
+        page = list(
+            products.order_by("pk").values_list("pk", "latest_snapshot_id")[: page_size + 1]
+        )
+        has_next = len(page) > page_size
+        page = page[:page_size]
 
-        # Получаем последние снимки для каждого competitor_product
-        latest_snapshots = []
-        competitor_products = set()
+        snapshots = self.get_queryset().select_related(
+            "competitor_product__competitor", "competitor_product__brand", "competitor_product__mapped_product"
+        ).in_bulk([snapshot_id for _, snapshot_id in page])
+        ordered = [snapshots[snapshot_id] for _, snapshot_id in page if snapshot_id in snapshots]
 
-        for snapshot in queryset.order_by("-collected_at"):
-            if snapshot.competitor_product_id not in competitor_products:
-                latest_snapshots.append(snapshot)
-                competitor_products.add(snapshot.competitor_product_id)
-                if len(latest_snapshots) >= 100:  # Ограничение для производительности
-                    break
+        next_cursor = page[-1][0] if has_next else None
+        next_url = None
+        if next_cursor is not None:
+            query = params.copy()
+            query["cursor"] = next_cursor
+            next_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
 
-        serializer = self.get_serializer(latest_snapshots, many=True)
-        return Response(serializer.data)
+        serializer = self.get_serializer(ordered, many=True)
+        return Response({
+            "next": next_url,
+            "next_cursor": next_cursor,
+            "results": serializer.data,
+        })
 
 
 # ViewSets для истории наших цен
@@ -252,6 +322,42 @@ def get_price_comparison(request, product_id):
     return Response(data)
 
 
+@api_view(["GET", "POST"])
+@permission_classes([IsAuthenticated])
+def get_bulk_price_comparison(request):
+    """
+    Пакетное сравнение цен: наша цена и склад + последние цены конкурентов.
+
+    GET ?product_ids=1,2,3 или POST {"product_ids": [1, 2, 3]}.
+    Не более PRICE_COMPARISON_MAX_PRODUCTS товаров за запрос.
+    """
+    if request.method == "POST":
+        raw_ids = request.data.get("product_ids") or []
+    else:
+        raw_ids = [value for value in request.query_params.get("product_ids", "").split(",") if value.strip()]
+
+    if not isinstance(raw_ids, list):
+        return Response({"error": "product_ids должен быть списком"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        product_ids = list(dict.fromkeys(int(value) for value in raw_ids))
+    except (TypeError, ValueError):
+        return Response({"error": "product_ids должны быть целыми числами"}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not product_ids:
+        return Response({"error": "Не указаны product_ids"}, status=status.HTTP_400_BAD_REQUEST)
+    if len(product_ids) > PRICE_COMPARISON_MAX_PRODUCTS:
+        return Response(
+            {"error": f"Не более {PRICE_COMPARISON_MAX_PRODUCTS} товаров за запрос"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    comparisons = get_price_comparisons(product_ids)
+    return Response({
+        "results": [comparisons[product_id] for product_id in product_ids if product_id in comparisons],
+        "not_found": [product_id for product_id in product_ids if product_id not in comparisons],
+    })
+
+
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def export_competitor_price_comparison(request):
@@ -264,7 +370,7 @@ def export_competitor_price_comparison(request):
     Возвращает task_id для отслеживания прогресса.
     """
     # Запускаем асинхронную задачу
-    task = export_competitor_price_comparison_task.delay()
+    task = export_competitor_price_comparison_task.delay(user_id=request.user.id)
     
     return Response({
         "task_id": task.id,
@@ -299,16 +405,8 @@ def check_price_comparison_export_task(request, task_id):
                 logger.info(f"Задача {task_id} завершена, успех: {result.get('success') if isinstance(result, dict) else False}")
                 
                 if isinstance(result, dict) and result.get('success'):
-                    # Декодируем base64 данные обратно в бинарные
-                    file_data = base64.b64decode(result['data'])
-                    
-                    # Возвращаем файл как HTTP response для скачивания
-                    response = HttpResponse(
-                        file_data,
-                        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                    )
-                    response['Content-Disposition'] = f'attachment; filename="{result["filename"]}"'
-                    return response
+                    # Отдаем файл выгрузки потоково из хранилища
+                    return task_result_download(request, result)
                 else:
                     error_message = result.get('error', 'Неизвестная ошибка') if isinstance(result, dict) else str(result)
                     logger.error(f"Задача {task_id} завершилась с ошибкой: {error_message}")
@@ -380,7 +478,8 @@ def export_competitor_sales(request):
     task = export_competitor_sales_task.delay(
         date_from=date_from, 
         date_to=date_to,
-        competitor_ids=competitor_ids
+        competitor_ids=competitor_ids,
+        user_id=request.user.id,
     )
     
     return Response({
@@ -419,16 +518,8 @@ def check_competitor_sales_export_task(request, task_id):
                 logger.info(f"Задача {task_id} завершена, успех: {result.get('success') if isinstance(result, dict) else False}")
                 
                 if isinstance(result, dict) and result.get('success'):
-                    # Декодируем base64 данные обратно в бинарные
-                    file_data = base64.b64decode(result['data'])
-                    
-                    # Возвращаем файл как HTTP response для скачивания
-                    response = HttpResponse(
-                        file_data,
-                        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                    )
-                    response['Content-Disposition'] = f'attachment; filename="{result["filename"]}"'
-                    return response
+                    # Отдаем файл выгрузки потоково из хранилища
+                    return task_result_download(request, result)
                 else:
                     error_message = result.get('error', 'Неизвестная ошибка') if isinstance(result, dict) else str(result)
                     logger.error(f"Задача {task_id} завершилась с ошибкой: {error_message}")
@@ -445,11 +536,14 @@ def check_competitor_sales_export_task(request, task_id):
         else:
             # Задача ещё выполняется
             logger.debug(f"Задача {task_id} ещё выполняется, state: {task.state}")
-            return Response({
+            response_data = {
                 "status": "processing",
                 "message": "Экспорт продаж конкурентов в процессе выполнения...",
                 "state": task.state
-            })
+            }
+            if task.state == PROGRESS_STATE:
+                response_data["progress"] = task.info
+            return Response(response_data)
     except Exception as e:
         logger.error(f"Ошибка при проверке статуса задачи {task_id}: {str(e)}", exc_info=True)
         return Response(
@@ -132,7 +132,8 @@ export async function fetchLatestCompetitorSnapshotsClient(params: { competitor_
   if (!resp.ok) {
     throw new Error(`Backend error: ${resp.status}`);
   }
-  return resp.json();
+  const data: { results: CompetitorPriceStockSnapshot[] } = await resp.json();
+  return data.results;
 }
 
 // === Utils (safe for client) ===
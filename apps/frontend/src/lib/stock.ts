@@ -265,7 +265,8 @@ export async function fetchLatestCompetitorSnapshots(params: { competitor_id?: n
     throw new Error(`Backend error: ${resp.status}`);
   }
 
-  return resp.json();
+  const data: { results: CompetitorPriceStockSnapshot[] } = await resp.json();
+  return data.results;
 }
 
 export async function createCompetitorPriceStockSnapshot(data: Omit<CompetitorPriceStockSnapshot, 'id' | 'created_at' | 'updated_at' | 'competitor_name' | 'product_part_number'>): Promise<CompetitorPriceStockSnapshot> {
@@ -16,6 +16,8 @@ export interface Invoice {
   sale_type?: 'stock' | 'order';
   currency: 'RUB' | 'USD' | 'CNY';
   total_amount?: number;
+  line_count?: number;
+  total_qty?: number;
   created_at: string;
   updated_at: string;
 }
@@ -96,7 +98,7 @@ export interface GeographySalesAnalytics {
 export interface SalesFilters {
   date_from?: string;
   date_to?: string;
-  period_type?: 'day' | 'week' | 'month' | 'year';
+  period_type?: 'day' | 'week' | 'month' | 'quarter' | 'year';
   company_id?: number;
   product_id?: number;
   channel_type?: 'vip' | 'regular';
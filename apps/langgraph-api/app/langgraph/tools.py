@@ -523,12 +523,15 @@ def _execute_meilisearch_query(
     attributes_to_retrieve: Optional[List[str]] = None,
     highlight: bool = True,
 ):
-    """Базовая функция для выполнения запросов к Meilisearch."""
+    """Базовая функция для выполнения запросов к Meilisearch.
+
+    Сначала запрос идет через бэкенд (/api/products/index-search/) - там результаты
+    кэшируются общим кэшем поиска. Если бэкенд недоступен, запрос уходит в Meilisearch напрямую.
+    """
     q = (query or "").strip()
     if not q and not filters:
         raise ValueError("Укажите хотя бы query или filters для поиска")
 
-    url = f"{MEILISEARCH_URL.rstrip('/')}/indexes/products/search"
     body: Dict[str, object] = {"q": q, "limit": max(1, int(limit)), "offset": max(0, int(offset))}
 
     if filters:
@@ -542,6 +545,16 @@ def _execute_meilisearch_query(
         body["highlightPreTag"] = "<em>"
         body["highlightPostTag"] = "</em>"
 
+    cached = _make_authenticated_request(
+        f"{BACKEND_API_BASE_URL}/api/products/index-search/",
+        method="POST",
+        data={**body, "highlight": highlight},
+    )
+    # HTTP 400 - ошибка самого запроса (например, фильтра), Meilisearch ответит так же
+    if "error" not in cached or cached.get("error") == "HTTP 400":
+        return cached
+
+    url = f"{MEILISEARCH_URL.rstrip('/')}/indexes/products/search"
     req = urllib.request.Request(url, data=json.dumps(body).encode("utf-8"), method="POST")
     req.add_header("Content-Type", "application/json")
     # Поддержим оба варианта заголовков ключа API
@@ -584,6 +597,14 @@ def search_products_meilisearch(
     """Базовый поиск товаров в Meilisearch (для обратной совместимости).
     
     Рекомендуется использовать search_products_smart для более умного поиска.
+
+    Параметрический поиск выполняется фильтром прямо в Meilisearch - числовые
+    значения техпараметров хранятся в базовых единицах СИ (Ом, Ф, В, А, Вт, Гц, Гн, °C):
+    - units.<единица>: ohm, farad, volt, ampere, watt, hertz, henry, celsius, percent, meter, gram;
+    - params.<ключ>: название параметра латиницей ("Емкость" -> params.emkost),
+      у диапазонов - params.<ключ>_min / params.<ключ>_max, у допуска - params.<ключ>_tolerance.
+    Пример: конденсаторы 10-22 мкФ от 25 В -
+    filters='units.farad 0.00001 TO 0.000022 AND units.volt >= 25'.
     """
     return _execute_meilisearch_query(
         query=query,